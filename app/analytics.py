@@ -0,0 +1,392 @@
+"""Columnar in-memory snapshots for ad-hoc shop analytics.
+
+Each shop's receipts and lines are copied once into typed columns
+(``array.array``: 8 bytes per value, no per-row Python objects) and then
+topped up on every request with only the receipts written since, read from
+the ``receipts (shop_id, change_seq)`` index. Columns are append-only: when
+that read finds a receipt the snapshot may already hold (an id not above the
+highest one loaded: a modified receipt, or rarely one that committed late)
+the snapshot is rebuilt, and so is it when the shop's timezone changes.
+Aggregations run over the columns without touching the OLTP tables:
+
+- ``basket``: receipts, average items / distinct lines / value per receipt;
+- ``hour_of_week``: receipts and revenue per local (shop timezone) weekday
+  and hour;
+- ``co_occurrence``: product pairs bought in the same receipt, most frequent
+  first.
+
+With NumPy installed (``pip install -e ".[analytics]"``) the columns are
+viewed as NumPy arrays and every aggregation is vectorized; without it the
+same results come from plain loops.
+
+Snapshots are kept LRU within ``ANALYTICS_MAX_MB`` (default 256): the least
+recently queried shops are dropped first and reloaded on their next request.
+``GET /metrics/analytics`` reports the memory used per shop.
+"""
+
+import os
+import threading
+from array import array
+from collections import Counter, OrderedDict
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from itertools import combinations
+from zoneinfo import ZoneInfo
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from .instrumentation import span
+from .models import Receipt, ReceiptLine, Shop
+
+try:
+    import numpy
+except ImportError:  # pragma: no cover - optional dependency
+    numpy = None
+
+ANALYTICS_MAX_MB = float(os.getenv("ANALYTICS_MAX_MB", "256"))
+LOAD_BATCH_SIZE = 10_000
+
+_EPOCH = datetime(1970, 1, 1)
+
+
+def _epoch_seconds(value: datetime) -> int:
+    return int((value - _EPOCH).total_seconds())
+
+
+@dataclass(frozen=True)
+class TimeRange:
+    """``start <= created_at < end`` in naive UTC epoch seconds; None = open."""
+
+    start: int | None = None
+    end: int | None = None
+
+    @classmethod
+    def from_datetimes(cls, start: datetime | None, end: datetime | None):
+        return cls(
+            _epoch_seconds(start) if start is not None else None,
+            _epoch_seconds(end) if end is not None else None,
+        )
+
+    def __contains__(self, ts: int) -> bool:
+        return (self.start is None or ts >= self.start) and (
+            self.end is None or ts < self.end
+        )
+
+
+class ShopSnapshot:
+    """Receipt-level and line-level columns of one shop."""
+
+    def __init__(self, shop_id: int, tz_name: str) -> None:
+        self.shop_id = shop_id
+        self.tz = ZoneInfo(tz_name)
+        self.last_change_seq = 0
+        self.max_receipt_id = 0
+        self.rebuilds = 0
+        # Receipt columns
+        self.created = array("q")
+        self.hour_of_week = array("q")
+        self.total = array("d")
+        self.items = array("q")
+        # Line columns; ``line_receipt`` indexes the receipt columns
+        self.line_receipt = array("q")
+        self.line_product = array("q")
+        self.line_qty = array("q")
+        self.line_revenue = array("d")
+        # Held while refreshing or computing: NumPy views pin the buffers
+        self.lock = threading.Lock()
+
+    @property
+    def receipts(self) -> int:
+        return len(self.created)
+
+    @property
+    def nbytes(self) -> int:
+        columns = (
+            self.created,
+            self.hour_of_week,
+            self.total,
+            self.items,
+            self.line_receipt,
+            self.line_product,
+            self.line_qty,
+            self.line_revenue,
+        )
+        return sum(col.itemsize * len(col) for col in columns)
+
+    def _reset(self) -> None:
+        self.last_change_seq = 0
+        self.max_receipt_id = 0
+        for column in (
+            self.created,
+            self.hour_of_week,
+            self.total,
+            self.items,
+            self.line_receipt,
+            self.line_product,
+            self.line_qty,
+            self.line_revenue,
+        ):
+            del column[:]
+
+    def _rewritten(self, db: Session) -> bool:
+        """Whether receipts written since the last refresh include one with
+        an id already covered (modified, or committed after a higher id)."""
+        stmt = (
+            select(Receipt.id)
+            .where(
+                Receipt.shop_id == self.shop_id,
+                Receipt.change_seq > self.last_change_seq,
+                Receipt.id <= self.max_receipt_id,
+            )
+            .limit(1)
+        )
+        return db.execute(stmt).first() is not None
+
+    def refresh(self, db: Session) -> int:
+        """Append receipts written since the last refresh; returns how many.
+
+        Rebuilds the columns first if an earlier receipt was rewritten.
+        """
+        added = 0
+        with self.lock:
+            if self.max_receipt_id and self._rewritten(db):
+                self._reset()
+                self.rebuilds += 1
+            stmt = (
+                select(
+                    Receipt.change_seq,
+                    Receipt.id,
+                    Receipt.created_at,
+                    Receipt.total,
+                    ReceiptLine.product_id,
+                    ReceiptLine.qty,
+                    ReceiptLine.unit_price,
+                )
+                .select_from(Receipt)
+                .outerjoin(ReceiptLine, ReceiptLine.receipt_id == Receipt.id)
+                .where(
+                    Receipt.shop_id == self.shop_id,
+                    Receipt.change_seq > self.last_change_seq,
+                )
+                .order_by(Receipt.change_seq, ReceiptLine.id)
+                .execution_options(yield_per=LOAD_BATCH_SIZE)
+            )
+            current_seq = None
+            for row in db.execute(stmt):
+                seq, receipt_id, created_at, total, product_id, qty, unit_price = row
+                if seq != current_seq:
+                    current_seq = seq
+                    self.max_receipt_id = max(self.max_receipt_id, receipt_id)
+                    local = created_at.replace(tzinfo=timezone.utc).astimezone(self.tz)
+                    self.created.append(_epoch_seconds(created_at))
+                    self.hour_of_week.append(local.weekday() * 24 + local.hour)
+                    self.total.append(float(total))
+                    self.items.append(0)
+                    added += 1
+                if product_id is not None:
+                    receipt = len(self.created) - 1
+                    self.items[receipt] += qty
+                    self.line_receipt.append(receipt)
+                    self.line_product.append(product_id)
+                    self.line_qty.append(qty)
+                    self.line_revenue.append(qty * float(unit_price))
+            if current_seq is not None:
+                self.last_change_seq = current_seq
+        return added
+
+
+def _view(column: array):
+    return numpy.frombuffer(column, dtype=column.typecode)
+
+
+def _mask(snapshot: ShopSnapshot, rng: TimeRange):
+    created = _view(snapshot.created)
+    mask = numpy.ones(len(created), dtype=bool)
+    if rng.start is not None:
+        mask &= created >= rng.start
+    if rng.end is not None:
+        mask &= created < rng.end
+    return mask
+
+
+def basket(snapshot: ShopSnapshot, rng: TimeRange) -> dict:
+    """Receipt count and average items, distinct lines and value per receipt."""
+    with snapshot.lock:
+        if numpy is not None:
+            mask = _mask(snapshot, rng)
+            receipts = int(mask.sum())
+            items = int(_view(snapshot.items)[mask].sum())
+            value = float(_view(snapshot.total)[mask].sum())
+            lines = int(mask[_view(snapshot.line_receipt)].sum())
+        else:
+            selected = [ts in rng for ts in snapshot.created]
+            receipts = sum(selected)
+            items = sum(n for n, keep in zip(snapshot.items, selected) if keep)
+            value = sum(t for t, keep in zip(snapshot.total, selected) if keep)
+            lines = sum(selected[r] for r in snapshot.line_receipt)
+    per = max(receipts, 1)
+    return {
+        "receipts": receipts,
+        "avg_items": items / per,
+        "avg_lines": lines / per,
+        "avg_value": round(value / per, 2),
+    }
+
+
+def hour_of_week(snapshot: ShopSnapshot, rng: TimeRange) -> list[dict]:
+    """168 points, Monday 00:00 first: receipts and revenue per local hour."""
+    with snapshot.lock:
+        if numpy is not None:
+            mask = _mask(snapshot, rng)
+            buckets = _view(snapshot.hour_of_week)[mask]
+            receipts = numpy.bincount(buckets, minlength=168).tolist()
+            revenue = numpy.bincount(
+                buckets, weights=_view(snapshot.total)[mask], minlength=168
+            ).tolist()
+        else:
+            receipts, revenue = [0] * 168, [0.0] * 168
+            for ts, bucket, total in zip(
+                snapshot.created, snapshot.hour_of_week, snapshot.total
+            ):
+                if ts in rng:
+                    receipts[bucket] += 1
+                    revenue[bucket] += total
+    return [
+        {
+            "weekday": bucket // 24,
+            "hour": bucket % 24,
+            "receipts": receipts[bucket],
+            "revenue": round(revenue[bucket], 2),
+        }
+        for bucket in range(168)
+    ]
+
+
+def co_occurrence(
+    snapshot: ShopSnapshot, rng: TimeRange, top_n: int = 10
+) -> list[tuple[int, int, int]]:
+    """``(product_a, product_b, receipts)`` for the most frequent pairs."""
+    with snapshot.lock:
+        if numpy is not None:
+            pairs = _pairs_vectorized(snapshot, rng)
+        else:
+            pairs = Counter()
+            lines_by_receipt: dict[int, set[int]] = {}
+            for receipt, product in zip(snapshot.line_receipt, snapshot.line_product):
+                if snapshot.created[receipt] in rng:
+                    lines_by_receipt.setdefault(receipt, set()).add(product)
+            for products in lines_by_receipt.values():
+                pairs.update(combinations(sorted(products), 2))
+    ranked = sorted(pairs.items(), key=lambda kv: (-kv[1], kv[0]))[:top_n]
+    return [(a, b, count) for (a, b), count in ranked]
+
+
+def _pairs_vectorized(snapshot: ShopSnapshot, rng: TimeRange) -> Counter:
+    receipt = _view(snapshot.line_receipt)
+    product = _view(snapshot.line_product)
+    keep = _mask(snapshot, rng)[receipt]
+    receipt, product = receipt[keep], product[keep]
+    if not len(receipt):
+        return Counter()
+    # Lines of a receipt are contiguous: pair each line with the ones
+    # ``offset`` positions later, for every offset up to the widest receipt
+    width = int(numpy.bincount(receipt).max())
+    if width < 2:
+        return Counter()
+    receipts, keys = [], []
+    for offset in range(1, width):
+        a, b = product[:-offset], product[offset:]
+        paired = (receipt[:-offset] == receipt[offset:]) & (a != b)
+        a, b = a[paired], b[paired]
+        receipts.append(receipt[:-offset][paired])
+        keys.append(numpy.minimum(a, b) << 32 | numpy.maximum(a, b))
+    rows = numpy.stack([numpy.concatenate(receipts), numpy.concatenate(keys)])
+    if not rows.shape[1]:
+        return Counter()
+    # Unique (receipt, pair) rows, so a SKU repeated in a receipt counts once
+    rows = numpy.unique(rows, axis=1)
+    values, counts = numpy.unique(rows[1], return_counts=True)
+    return Counter(
+        {
+            (int(key >> 32), int(key & 0xFFFFFFFF)): int(count)
+            for key, count in zip(values, counts)
+        }
+    )
+
+
+class AnalyticsStore:
+    """LRU of shop snapshots within a memory budget."""
+
+    def __init__(self, max_bytes: float) -> None:
+        self.max_bytes = max_bytes
+        self._snapshots: OrderedDict[int, ShopSnapshot] = OrderedDict()
+        self._lock = threading.Lock()
+        self.loads = 0
+        self.evictions = 0
+
+    def snapshot(self, db: Session, shop_id: int) -> ShopSnapshot:
+        """The shop's snapshot, loaded or topped up to the latest receipt.
+
+        A snapshot built for another timezone than the shop's is replaced.
+        """
+        tz_name = db.execute(
+            select(Shop.timezone).where(Shop.id == shop_id)
+        ).scalar_one()
+        with self._lock:
+            snap = self._snapshots.get(shop_id)
+            if snap is not None and snap.tz.key != tz_name:
+                del self._snapshots[shop_id]
+                snap = None
+            if snap is not None:
+                self._snapshots.move_to_end(shop_id)
+        if snap is None:
+            snap = ShopSnapshot(shop_id, tz_name)
+            with self._lock:
+                # Another request may have created it meanwhile
+                current = self._snapshots.get(shop_id)
+                if current is not None and current.tz.key == tz_name:
+                    snap = current
+                else:
+                    self._snapshots[shop_id] = snap
+                    self.loads += 1
+        with span("analytics_refresh"):
+            snap.refresh(db)
+        self._evict(keep=shop_id)
+        return snap
+
+    def _evict(self, keep: int) -> None:
+        with self._lock:
+            while (
+                sum(s.nbytes for s in self._snapshots.values()) > self.max_bytes
+                and len(self._snapshots) > 1
+            ):
+                shop_id = next(iter(self._snapshots))
+                if shop_id == keep:
+                    self._snapshots.move_to_end(shop_id)
+                    continue
+                del self._snapshots[shop_id]
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._snapshots.clear()
+
+    def stats(self) -> dict:
+        """Totals only: which shops are loaded, and their sizes, is tenant
+        data and the metrics endpoints are not authenticated.
+        """
+        with self._lock:
+            snapshots = len(self._snapshots)
+            nbytes = sum(s.nbytes for s in self._snapshots.values())
+        return {
+            "backend": "numpy" if numpy is not None else "array",
+            "bytes": nbytes,
+            "max_bytes": int(self.max_bytes),
+            "snapshots": snapshots,
+            "loads": self.loads,
+            "evictions": self.evictions,
+        }
+
+
+store = AnalyticsStore(ANALYTICS_MAX_MB * 1024 * 1024)
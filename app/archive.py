@@ -0,0 +1,261 @@
+"""Move closed months of receipts out of the hot tables.
+
+Receipts older than ``ARCHIVE_AFTER_MONTHS`` whole months (default 13) are
+copied, with their lines, into one SQLite file per month under
+``ARCHIVE_DIR`` (default ``./archive``): ``receipts-YYYY-MM.sqlite``, rows in
+``(shop_id, created_at)`` order with matching indexes, vacuumed. The file
+can be queried directly or attached to a SQLite session::
+
+    ATTACH 'archive/receipts-2024-01.sqlite' AS jan;
+    SELECT COUNT(*) FROM jan.receipts WHERE shop_id = 1;
+
+The rows are then deleted from ``receipts``, ``receipt_lines`` and
+``idempotency_keys`` in the same transaction that records the month in
+``receipt_archives`` (the file is renamed into place just before it
+commits, so re-running after a crash rewrites it). On MySQL the emptied
+``receipts`` partition is dropped afterwards (see ``app.partitions``).
+
+The daily rollups and sketches are the summary tables of archived months:
+they are kept, so ``/kpis`` (exact and ``approx``) still covers them, and
+``rollups.rebuild`` leaves archived months alone. Receipt listings, series,
+device sync and the analytics endpoints only see the hot tables.
+
+Receipts imported later into an archived month are appended to its file on
+the next run.
+
+CLI::
+
+    python -m app.archive run                 # archive + add partitions
+    python -m app.archive run --before 2024-01
+"""
+
+import argparse
+import os
+import shutil
+import sqlite3
+import sys
+from datetime import date, datetime, time, timezone
+from pathlib import Path
+
+from sqlalchemy import delete, func, select
+from sqlalchemy.orm import Session
+
+from . import partitions
+from .instrumentation import span
+from .models import IdempotencyKey, Product, Receipt, ReceiptArchive, ReceiptLine
+
+ARCHIVE_AFTER_MONTHS = int(os.getenv("ARCHIVE_AFTER_MONTHS", "13"))
+ARCHIVE_DIR = Path(os.getenv("ARCHIVE_DIR", "./archive"))
+WRITE_BATCH_SIZE = 5000
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS receipts (
+    id INTEGER PRIMARY KEY,
+    shop_id INTEGER NOT NULL,
+    created_at TEXT NOT NULL,
+    total TEXT NOT NULL,
+    change_seq INTEGER
+);
+CREATE TABLE IF NOT EXISTS receipt_lines (
+    id INTEGER PRIMARY KEY,
+    receipt_id INTEGER NOT NULL,
+    product_id INTEGER NOT NULL,
+    sku TEXT NOT NULL,
+    qty INTEGER NOT NULL,
+    unit_price TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_receipts_shop_created ON receipts (shop_id, created_at);
+CREATE INDEX IF NOT EXISTS ix_lines_receipt ON receipt_lines (receipt_id);
+"""
+
+
+def cutoff(today: date, keep_months: int = ARCHIVE_AFTER_MONTHS) -> date:
+    """First month kept hot: everything before it is archived."""
+    return partitions.add_months(partitions.month_start(today), -keep_months)
+
+
+def _bounds(month: date) -> tuple[datetime, datetime]:
+    return (
+        datetime.combine(month, time.min),
+        datetime.combine(partitions.add_months(month, 1), time.min),
+    )
+
+
+def pending_months(db: Session, before: date) -> list[date]:
+    """Months before ``before`` that still have receipts in the hot table."""
+    oldest = db.scalar(
+        select(func.min(Receipt.created_at)).where(
+            Receipt.created_at < datetime.combine(before, time.min)
+        )
+    )
+    if oldest is None:
+        return []
+    return partitions.months(oldest.date(), partitions.add_months(before, -1))
+
+
+def archive_path(directory: Path, month: date) -> Path:
+    return directory / f"receipts-{month:%Y-%m}.sqlite"
+
+
+def _column_value(value):
+    # Datetimes and Decimals as text, so no precision is lost
+    return value if value is None or isinstance(value, int) else str(value)
+
+
+def _write(db: Session, path: Path, month: date) -> tuple[int, int, int]:
+    """Append the month's receipts and lines to the file at ``path``.
+
+    Returns the receipts written and the receipts and lines the file holds.
+    """
+    start, end = _bounds(month)
+    in_month = (Receipt.created_at >= start, Receipt.created_at < end)
+    receipts_stmt = (
+        select(
+            Receipt.id,
+            Receipt.shop_id,
+            Receipt.created_at,
+            Receipt.total,
+            Receipt.change_seq,
+        )
+        .where(*in_month)
+        .order_by(Receipt.shop_id, Receipt.created_at, Receipt.id)
+        .execution_options(yield_per=WRITE_BATCH_SIZE)
+    )
+    lines_stmt = (
+        select(
+            ReceiptLine.id,
+            ReceiptLine.receipt_id,
+            ReceiptLine.product_id,
+            Product.sku,
+            ReceiptLine.qty,
+            ReceiptLine.unit_price,
+        )
+        .join(Receipt, ReceiptLine.receipt_id == Receipt.id)
+        .join(Product, ReceiptLine.product_id == Product.id)
+        .where(*in_month)
+        .order_by(ReceiptLine.receipt_id, ReceiptLine.id)
+        .execution_options(yield_per=WRITE_BATCH_SIZE)
+    )
+
+    written = 0
+    target = sqlite3.connect(path)
+    try:
+        target.executescript(_SCHEMA)
+        for table, stmt in (("receipts", receipts_stmt), ("receipt_lines", lines_stmt)):
+            for batch in db.execute(stmt).partitions():
+                rows = [tuple(map(_column_value, row)) for row in batch]
+                placeholders = ", ".join("?" * len(rows[0]))
+                target.executemany(
+                    f"INSERT OR REPLACE INTO {table} VALUES ({placeholders})", rows
+                )
+                if table == "receipts":
+                    written += len(rows)
+        target.commit()
+        target.execute("VACUUM")
+        receipts, lines = (
+            target.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+            for table in ("receipts", "receipt_lines")
+        )
+    finally:
+        target.close()
+    return written, receipts, lines
+
+
+def archive_month(db: Session, month: date, directory: Path = ARCHIVE_DIR) -> int:
+    """Move one month out of the hot tables; returns the receipts moved.
+
+    Does not commit; the caller's commit makes the move visible.
+    """
+    directory.mkdir(parents=True, exist_ok=True)
+    path = archive_path(directory, month)
+    staging = path.with_suffix(".tmp")
+    if path.exists():
+        shutil.copyfile(path, staging)
+    else:
+        staging.unlink(missing_ok=True)
+
+    with span("archive_write"):
+        moved, receipts, lines = _write(db, staging, month)
+    if not moved:
+        staging.unlink()
+        return 0
+
+    start, end = _bounds(month)
+    in_month = select(Receipt.id).where(
+        Receipt.created_at >= start, Receipt.created_at < end
+    )
+    with span("archive_delete"):
+        db.execute(
+            delete(IdempotencyKey).where(IdempotencyKey.receipt_id.in_(in_month))
+        )
+        db.execute(delete(ReceiptLine).where(ReceiptLine.receipt_id.in_(in_month)))
+        db.execute(
+            delete(Receipt).where(Receipt.created_at >= start, Receipt.created_at < end)
+        )
+
+    # The file may also hold earlier runs' rows for the month
+    record = db.get(ReceiptArchive, month) or ReceiptArchive(month=month)
+    record.path = str(path)
+    record.receipts, record.lines = receipts, lines
+    record.archived_at = datetime.now(timezone.utc).replace(tzinfo=None)
+    db.add(record)
+    db.flush()
+    os.replace(staging, path)
+    return moved
+
+
+def archived_until(db: Session) -> date | None:
+    """End (exclusive) of the newest archived month, if any."""
+    newest = db.scalar(select(func.max(ReceiptArchive.month)))
+    return partitions.add_months(newest, 1) if newest is not None else None
+
+
+def run(
+    session_factory,
+    today: date,
+    before: date | None = None,
+    directory: Path = ARCHIVE_DIR,
+) -> dict[date, int]:
+    """Archive every pending month (one transaction each), then top up the
+    MySQL partitions. Returns the receipts moved per month."""
+    before = before or cutoff(today)
+    moved: dict[date, int] = {}
+    with session_factory() as db:
+        for month in pending_months(db, before):
+            moved[month] = archive_month(db, month, directory)
+            db.commit()
+            if moved[month]:
+                partitions.drop_month(db.connection(), "receipts", month)
+                db.commit()
+        partitions.ensure_partitions(db.connection(), today)
+        db.commit()
+    return moved
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m app.archive")
+    sub = parser.add_subparsers(dest="command", required=True)
+    run_cmd = sub.add_parser("run", help="Archive closed months of receipts")
+    run_cmd.add_argument(
+        "--before",
+        type=lambda s: date.fromisoformat(f"{s}-01"),
+        default=None,
+        help="YYYY-MM: archive months before this one "
+        f"(default: keep {ARCHIVE_AFTER_MONTHS} months)",
+    )
+    run_cmd.add_argument("--dir", type=Path, default=ARCHIVE_DIR)
+    args = parser.parse_args(argv)
+
+    from .database import SessionLocal, engine
+    from .migrate import upgrade_to_head
+
+    upgrade_to_head(engine)
+    moved = run(SessionLocal, date.today(), args.before, args.dir)
+    for month, count in moved.items():
+        sys.stdout.write(f"{month:%Y-%m}: archived {count} receipts\n")
+    sys.stdout.write(f"Archived {sum(moved.values())} receipts\n")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
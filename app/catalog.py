@@ -0,0 +1,122 @@
+"""In-process product catalog cache: SKU -> id, name and price.
+
+SKUs are unique and never change their id, so ingest resolves the SKUs of
+a batch from this cache and only queries the misses (``ingest.
+resolve_products``). ``POST /products`` and ``GET /products?skus=`` are
+served from it as well.
+
+The cache is warmed with the newest ``CATALOG_CACHE_SIZE`` products
+(default 100000) at startup and keeps at most that many, least recently
+used first out. Rows read or written in a transaction enter the cache when
+it commits (never on rollback), including products created on-the-fly by
+ingest. Name and price changes made by another process are picked up after
+``CATALOG_CACHE_TTL`` seconds (default 3600); ids are always exact.
+"""
+
+import os
+from dataclasses import dataclass
+from typing import Callable, Iterable
+
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session
+
+from .models import Product
+from .utils.cache import TTLCache
+
+CATALOG_CACHE_SIZE = int(os.getenv("CATALOG_CACHE_SIZE", "100000"))
+CATALOG_CACHE_TTL = float(os.getenv("CATALOG_CACHE_TTL", "3600"))
+
+
+@dataclass(frozen=True)
+class CachedProduct:
+    id: int
+    sku: str
+    name: str
+    price: float
+
+
+cache: TTLCache[CachedProduct] = TTLCache(
+    "products", CATALOG_CACHE_SIZE, CATALOG_CACHE_TTL
+)
+
+_COLUMNS = (Product.id, Product.sku, Product.name, Product.price)
+
+
+def _remember(db: Session, products: Iterable[CachedProduct]) -> None:
+    db.info.setdefault(_PENDING_KEY, []).extend(products)
+
+
+def products(db: Session, skus: Iterable[str]) -> dict[str, CachedProduct]:
+    """The existing products among ``skus``: cached ones, then one ``IN`` query."""
+    found: dict[str, CachedProduct] = {}
+    missing: list[str] = []
+    for sku in dict.fromkeys(skus):
+        cached = cache.get(sku)
+        if cached is not None:
+            found[sku] = cached
+        else:
+            missing.append(sku)
+    if missing:
+        loaded = [
+            CachedProduct(*row)
+            for row in db.execute(select(*_COLUMNS).where(Product.sku.in_(missing)))
+        ]
+        _remember(db, loaded)
+        found.update((p.sku, p) for p in loaded)
+    return found
+
+
+def product_ids(db: Session, skus: Iterable[str]) -> dict[str, int]:
+    return {sku: p.id for sku, p in products(db, skus).items()}
+
+
+def warm(
+    session_factory: Callable[[], Session], limit: int = CATALOG_CACHE_SIZE
+) -> int:
+    """Load the newest ``limit`` products into the cache; returns how many."""
+    if not cache.enabled:
+        return 0
+    with session_factory() as db:
+        rows = db.execute(select(*_COLUMNS).order_by(Product.id.desc()).limit(limit))
+        loaded = [CachedProduct(*row) for row in rows]
+    # Oldest first, so the newest products are the last to be evicted
+    for product in reversed(loaded):
+        cache.set(product.sku, product)
+    return len(loaded)
+
+
+# ---------- Coherence: fill on commit ----------
+
+_PENDING_KEY = "catalog_to_cache"
+_DELETED_KEY = "catalog_to_forget"
+
+
+@event.listens_for(Session, "after_flush")
+def _collect_orm_writes(session: Session, flush_context) -> None:
+    # Still the pre-flush new/dirty/deleted sets, with ids assigned
+    written = [
+        obj
+        for obj in (*session.new, *session.dirty)
+        if isinstance(obj, Product) and obj.id is not None
+    ]
+    if written:
+        _remember(
+            session, (CachedProduct(p.id, p.sku, p.name, p.price) for p in written)
+        )
+    deleted = [obj.sku for obj in session.deleted if isinstance(obj, Product)]
+    if deleted:
+        session.info.setdefault(_DELETED_KEY, []).extend(deleted)
+
+
+@event.listens_for(Session, "after_commit")
+def _cache_committed(session: Session) -> None:
+    for product in session.info.pop(_PENDING_KEY, ()):
+        cache.set(product.sku, product)
+    for sku in session.info.pop(_DELETED_KEY, ()):
+        cache.pop(sku)
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _forget_rolled_back(session: Session, previous_transaction) -> None:
+    session.info.pop(_PENDING_KEY, None)
+    session.info.pop(_DELETED_KEY, None)
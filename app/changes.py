@@ -0,0 +1,160 @@
+"""Change sequences: the watermarks behind ``GET /devices/sync``.
+
+Every synced row carries a ``change_seq`` handed out by a counter:
+
+- a shop and its receipts: the shop's own ``shops.last_change_seq``, bumped
+  in the writing transaction. The row stays locked until it commits, so a
+  shop's rows become visible in ``change_seq`` order: a reader that has
+  seen every row up to N never later finds a new row at or below N.
+- products: the global ``change_counters`` row ``"products"``. Holding that
+  lock until commit would serialize every ingest that creates a product,
+  whatever the shop, so the numbers are reserved in their own short
+  transaction, committed at once. It runs on a small pool of its own
+  (``CHANGE_SEQ_POOL_SIZE``, default 2, per process): the writer still holds
+  its request connection, so taking a second one from the request pool
+  would deadlock once every request connection is held by a writer. Size
+  the server's connection limit for ``DB_POOL_SIZE + DB_MAX_OVERFLOW +
+  CHANGE_SEQ_POOL_SIZE`` per process. Two effects on sync: numbers of writes
+  that roll back are never used (gaps, harmless), and a product can become
+  visible after one with a higher number. ``device_sync`` only moves a
+  product cursor past rows older than ``PRODUCT_SEQ_SETTLE_SECONDS``
+  (default 60), which must exceed the longest writing transaction plus the
+  replica lag; newer rows are sent again by the next sync. On SQLite
+  (one writer at a time, nothing to gain) the reservation stays in the
+  writing transaction and the settle time is 0.
+
+ORM writes are stamped automatically on flush (new or modified products,
+shops and receipts); Core inserts call ``allocate_products`` /
+``allocate_shop`` themselves.
+
+Shops whose scope was bumped are collected in ``session.info[CHANGED_SHOPS]``
+(read on commit by ``app.replicas`` for read-your-writes).
+"""
+
+import os
+import threading
+from collections import defaultdict
+
+from sqlalchemy import Connection, create_engine, event, select, update
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+from . import db_pool
+from .models import ChangeCounter, Product, Receipt, Shop
+
+PRODUCTS = "products"
+CHANGED_SHOPS = "changed_shops"
+
+PRODUCT_SEQ_SETTLE_SECONDS = float(os.getenv("PRODUCT_SEQ_SETTLE_SECONDS", "60"))
+CHANGE_SEQ_POOL_SIZE = int(os.getenv("CHANGE_SEQ_POOL_SIZE", "2"))
+
+# Writing engine -> the engine the product numbers are reserved on
+_seq_engines: dict[Engine, Engine] = {}
+_seq_engines_lock = threading.Lock()
+
+
+def _bump(db: Session | Connection, column, where, n: int) -> int:
+    """Add ``n`` to a counter column; returns the first reserved number."""
+    stmt = update(column.table).where(where).values({column.name: column + n})
+    dialect = db.dialect if isinstance(db, Connection) else db.get_bind().dialect
+    if dialect.update_returning:
+        last = db.execute(stmt.returning(column)).scalar_one()
+    else:
+        db.execute(stmt)
+        last = db.execute(select(column).where(where)).scalar_one()
+    return last - n + 1
+
+
+def separate_product_seqs(db: Session) -> bool:
+    # A second SQLite connection would wait for the session's own write lock
+    return db.get_bind().dialect.name != "sqlite"
+
+
+def product_settle_seconds(db: Session) -> float:
+    """How long a product can stay invisible behind higher numbers."""
+    return PRODUCT_SEQ_SETTLE_SECONDS if separate_product_seqs(db) else 0.0
+
+
+def _seq_engine(db: Session) -> Engine:
+    """The reservation pool for ``db``'s database, created on first use.
+
+    Its connections are only ever held for one short transaction that waits
+    on nothing but other reservations, so a writer always gets one.
+    """
+    bind = db.get_bind()
+    engine = bind.engine if isinstance(bind, Connection) else bind
+    with _seq_engines_lock:
+        seq_engine = _seq_engines.get(engine)
+        if seq_engine is not None:
+            return seq_engine
+        url = engine.url.render_as_string(hide_password=False)
+        is_async = engine.dialect.is_async
+        kwargs = {
+            **db_pool.engine_kwargs(url, is_async=is_async),
+            "pool_size": CHANGE_SEQ_POOL_SIZE,
+            "max_overflow": 0,
+        }
+        if is_async:
+            from sqlalchemy.ext.asyncio import create_async_engine
+
+            # Used from run_sync / the flush, like the async session's own
+            seq_engine = create_async_engine(url, **kwargs).sync_engine
+        else:
+            seq_engine = create_engine(url, future=True, **kwargs)
+        db_pool.configure_sqlite(seq_engine)
+        suffix = f"-{len(_seq_engines)}" if _seq_engines else ""
+        db_pool.register_engine(f"change-seq{suffix}", seq_engine)
+        _seq_engines[engine] = seq_engine
+        return seq_engine
+
+
+def allocate_products(db: Session, n: int = 1) -> int:
+    """Reserve ``n`` product sequence numbers; returns the first.
+
+    Committed on a connection of its own (see module doc), so the counter
+    row is locked for one statement, not for ``db``'s transaction.
+    """
+    counters = ChangeCounter.__table__
+    where = counters.c.name == PRODUCTS
+    if not separate_product_seqs(db):
+        return _bump(db, counters.c.value, where, n)
+    with _seq_engine(db).begin() as conn:
+        return _bump(conn, counters.c.value, where, n)
+
+
+def allocate_shop(db: Session, shop_id: int, n: int = 1) -> int:
+    """Reserve ``n`` sequence numbers in ``shop_id``'s scope; returns the first."""
+    shops = Shop.__table__
+    db.info.setdefault(CHANGED_SHOPS, set()).add(shop_id)
+    return _bump(db, shops.c.last_change_seq, shops.c.id == shop_id, n)
+
+
+def _changed(session: Session, cls: type) -> list:
+    """New and modified instances of ``cls`` in this flush."""
+    return [obj for obj in session.new if isinstance(obj, cls)] + [
+        obj
+        for obj in session.dirty
+        if isinstance(obj, cls) and session.is_modified(obj)
+    ]
+
+
+@event.listens_for(Session, "before_flush")
+def _stamp(session: Session, flush_context, instances) -> None:
+    products = _changed(session, Product)
+    if products:
+        first = allocate_products(session, len(products))
+        for i, product in enumerate(products):
+            product.change_seq = first + i
+
+    by_shop: dict[int, list] = defaultdict(list)
+    for receipt in _changed(session, Receipt):
+        by_shop[receipt.shop_id].append(receipt)
+    for shop in _changed(session, Shop):
+        # New shops start at 1, the column default
+        if shop not in session.new:
+            by_shop[shop.id].append(shop)
+    for shop_id in sorted(by_shop):
+        rows = by_shop[shop_id]
+        first = allocate_shop(session, shop_id, len(rows))
+        for i, row in enumerate(rows):
+            row.change_seq = first + i
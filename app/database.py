@@ -1,14 +1,91 @@
 import os
 
 from sqlalchemy import create_engine
+from sqlalchemy.engine import Engine
 from sqlalchemy.orm import DeclarativeBase, sessionmaker
 
-DB_URL = os.getenv("DB_URL", "sqlite:///./dev.db")
+from . import db_pool
+
+DB_URL = db_pool.sqlite_url(os.getenv("DB_URL", "sqlite:///./dev.db"))
+
+# Opt-in async path: routers use AsyncSession on an async driver
+# (aiosqlite / aiomysql). Needs the "async" extra.
+ASYNC_DB = os.getenv("ASYNC_DB", "false").lower() in ("1", "true", "yes")
+ASYNC_DB_URL = os.getenv("ASYNC_DB_URL")
+
+# Read replicas (comma-separated URLs) behind get_read_db; see app.replicas
+DB_READ_URLS = [
+    url.strip() for url in os.getenv("DB_READ_URLS", "").split(",") if url.strip()
+]
+
+_ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "sqlite+pysqlite": "sqlite+aiosqlite",
+    "mysql": "mysql+aiomysql",
+    "mysql+pymysql": "mysql+aiomysql",
+}
+
+
+def to_async_url(url: str) -> str:
+    """Map a sync DB_URL to the equivalent async driver URL."""
+    scheme, sep, rest = url.partition("://")
+    return f"{_ASYNC_DRIVERS.get(scheme, scheme)}{sep}{rest}"
 
 
 class Base(DeclarativeBase):
     pass
 
 
-engine = create_engine(DB_URL, future=True)
-SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False)
+def create_read_engine(url: str, name: str) -> Engine:
+    """Engine for a read replica, pooled and instrumented like the primary."""
+    url = db_pool.sqlite_url(url)
+    read_engine = create_engine(url, future=True, **db_pool.engine_kwargs(url))
+    db_pool.configure_sqlite(read_engine)
+    db_pool.register_engine(name, read_engine)
+    return read_engine
+
+
+def session_factory(bind: Engine) -> sessionmaker:
+    # Objects stay loaded after commit, so a request can end its transaction
+    # (and hand the connection back to the pool) without re-reading them.
+    return sessionmaker(
+        bind=bind, autoflush=False, autocommit=False, expire_on_commit=False
+    )
+
+
+engine = create_engine(DB_URL, future=True, **db_pool.engine_kwargs(DB_URL))
+db_pool.configure_sqlite(engine)
+db_pool.register_engine("primary", engine)
+
+SessionLocal = session_factory(engine)
+ReadSessionLocals = [
+    session_factory(create_read_engine(url, f"replica-{i}"))
+    for i, url in enumerate(DB_READ_URLS)
+]
+
+async_engine = None
+AsyncSessionLocal = None
+AsyncReadSessionLocals: list = []
+if ASYNC_DB:
+    from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+    _async_url = ASYNC_DB_URL or to_async_url(DB_URL)
+    async_engine = create_async_engine(
+        _async_url, **db_pool.engine_kwargs(_async_url, is_async=True)
+    )
+    db_pool.configure_sqlite(async_engine.sync_engine)
+    db_pool.register_engine("async", async_engine.sync_engine)
+    AsyncSessionLocal = async_sessionmaker(
+        async_engine, autoflush=False, expire_on_commit=False
+    )
+    for i, url in enumerate(DB_READ_URLS):
+        _async_read_engine = create_async_engine(
+            to_async_url(url), **db_pool.engine_kwargs(url, is_async=True)
+        )
+        db_pool.configure_sqlite(_async_read_engine.sync_engine)
+        db_pool.register_engine(f"async-replica-{i}", _async_read_engine.sync_engine)
+        AsyncReadSessionLocals.append(
+            async_sessionmaker(
+                _async_read_engine, autoflush=False, expire_on_commit=False
+            )
+        )
@@ -0,0 +1,194 @@
+"""Engine/pool options from the environment, SQLite pragmas and pool metrics.
+
+Pool settings (all optional, MySQL presets in brackets):
+
+- ``DB_POOL_SIZE`` [10], ``DB_MAX_OVERFLOW`` [20], ``DB_POOL_TIMEOUT`` [10s]
+- ``DB_POOL_RECYCLE`` [1800s, below MySQL's wait_timeout and most proxies']
+- ``DB_POOL_PRE_PING`` [true]
+
+SQLite (dev/edge deployments):
+
+- ``SQLITE_WAL`` [true]: ``journal_mode=WAL`` so readers don't block the writer
+- ``SQLITE_SYNCHRONOUS`` [NORMAL]: safe with WAL, one fsync per checkpoint
+- ``SQLITE_SHARED_CACHE`` [false]: open the file with ``cache=shared``
+- connections may be used across threads (``check_same_thread=False``),
+  FastAPI runs sync dependencies and handlers on different workers.
+
+Every engine created here uses an instrumented pool; ``pool_metrics()``
+returns checkouts, overflow and the time spent waiting for a connection.
+"""
+
+import os
+import threading
+import time
+import weakref
+from urllib.parse import urlencode
+from dataclasses import asdict, dataclass
+
+from sqlalchemy import event, exc
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+MYSQL_PRESETS = {
+    "pool_size": 10,
+    "max_overflow": 20,
+    "pool_timeout": 10,
+    "pool_recycle": 1800,
+    "pool_pre_ping": True,
+}
+
+
+def _env_bool(name: str, default: bool) -> bool:
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.lower() in ("1", "true", "yes")
+
+
+def _pool_overrides() -> dict:
+    overrides: dict = {}
+    for key, env, cast in (
+        ("pool_size", "DB_POOL_SIZE", int),
+        ("max_overflow", "DB_MAX_OVERFLOW", int),
+        ("pool_timeout", "DB_POOL_TIMEOUT", float),
+        ("pool_recycle", "DB_POOL_RECYCLE", int),
+    ):
+        if os.getenv(env):
+            overrides[key] = cast(os.environ[env])
+    if os.getenv("DB_POOL_PRE_PING"):
+        overrides["pool_pre_ping"] = _env_bool("DB_POOL_PRE_PING", False)
+    return overrides
+
+
+def _is_memory_sqlite(url: str) -> bool:
+    database = make_url(url).database
+    return database in (None, "", ":memory:") or "mode=memory" in url
+
+
+def sqlite_url(url: str) -> str:
+    """Apply SQLITE_SHARED_CACHE to a SQLite URL (file databases only)."""
+    if not _env_bool("SQLITE_SHARED_CACHE", False) or _is_memory_sqlite(url):
+        return url
+    parsed = make_url(url)
+    database = parsed.database
+    if not database.startswith("file:"):
+        database = f"file:{database}"
+    query = urlencode({**parsed.query, "cache": "shared", "uri": "true"})
+    return f"{parsed.drivername}:///{database}?{query}"
+
+
+def engine_kwargs(url: str, is_async: bool = False) -> dict:
+    """Keyword arguments for ``create_engine`` / ``create_async_engine``."""
+    backend = make_url(url).get_backend_name()
+    kwargs: dict = {}
+
+    if backend == "sqlite":
+        kwargs["connect_args"] = {"check_same_thread": False}
+        if _is_memory_sqlite(url):
+            return kwargs
+        kwargs.update(_pool_overrides())
+    else:
+        kwargs.update(MYSQL_PRESETS if backend in ("mysql", "mariadb") else {})
+        kwargs.update(_pool_overrides())
+
+    kwargs["poolclass"] = (
+        InstrumentedAsyncQueuePool if is_async else InstrumentedQueuePool
+    )
+    return kwargs
+
+
+def configure_sqlite(engine: Engine) -> None:
+    """Set the WAL / synchronous pragmas on every new SQLite connection."""
+    if engine.dialect.name != "sqlite":
+        return
+    wal = _env_bool("SQLITE_WAL", True) and not _is_memory_sqlite(str(engine.url))
+    synchronous = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL").upper()
+
+    @event.listens_for(engine, "connect")
+    def _set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        if wal:
+            cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute(f"PRAGMA synchronous={synchronous}")
+        cursor.close()
+
+
+# ---------- Pool metrics ----------
+
+
+@dataclass
+class PoolStats:
+    checkouts: int = 0
+    timeouts: int = 0
+    wait_seconds_total: float = 0.0
+    wait_seconds_max: float = 0.0
+
+
+_stats: "weakref.WeakKeyDictionary[object, PoolStats]" = weakref.WeakKeyDictionary()
+_stats_lock = threading.Lock()
+_engines: dict[str, Engine] = {}
+
+
+def _stats_for(pool) -> PoolStats:
+    with _stats_lock:
+        stats = _stats.get(pool)
+        if stats is None:
+            stats = _stats[pool] = PoolStats()
+        return stats
+
+
+class _WaitTimingMixin:
+    """Times how long ``checkout`` waits for a connection from the queue."""
+
+    def _do_get(self):
+        stats = _stats_for(self)
+        started = time.perf_counter()
+        try:
+            conn = super()._do_get()
+        except exc.TimeoutError:
+            with _stats_lock:
+                stats.timeouts += 1
+            raise
+        waited = time.perf_counter() - started
+        with _stats_lock:
+            stats.checkouts += 1
+            stats.wait_seconds_total += waited
+            stats.wait_seconds_max = max(stats.wait_seconds_max, waited)
+        return conn
+
+
+class InstrumentedQueuePool(_WaitTimingMixin, QueuePool):
+    pass
+
+
+class InstrumentedAsyncQueuePool(_WaitTimingMixin, AsyncAdaptedQueuePool):
+    pass
+
+
+def register_engine(name: str, engine: Engine) -> None:
+    """Expose ``engine``'s pool in ``pool_metrics()`` under ``name``."""
+    _engines[name] = engine
+
+
+def pool_metrics() -> dict[str, dict]:
+    metrics = {}
+    for name, engine in _engines.items():
+        pool = engine.pool
+        entry: dict = {"pool": type(pool).__name__}
+        if isinstance(pool, QueuePool):
+            entry.update(
+                size=pool.size(),
+                checked_out=pool.checkedout(),
+                checked_in=pool.checkedin(),
+                overflow=pool.overflow(),
+                max_overflow=pool._max_overflow,
+            )
+        stats = asdict(_stats_for(pool))
+        stats["wait_seconds_avg"] = (
+            stats["wait_seconds_total"] / stats["checkouts"]
+            if stats["checkouts"]
+            else 0.0
+        )
+        entry.update(stats)
+        metrics[name] = entry
+    return metrics
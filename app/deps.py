@@ -1,13 +1,18 @@
-from typing import Generator
+from typing import AsyncGenerator, Generator
 
-from fastapi import Depends, HTTPException, status
+from fastapi import Depends, HTTPException, Request, status
 from fastapi.security import OAuth2PasswordBearer
-from jose import JWTError, jwt
+from jose import JWTError
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
+from . import database, principals, replicas, tokens
 from .database import SessionLocal
-from .models import User
-from .utils.security import SECRET_KEY, ALGORITHM
+from .instrumentation import span
+from .models import Shop
+from .principals import Principal
+from .utils.security import decode_token
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/login")
 
@@ -20,26 +25,181 @@ def get_db() -> Generator[Session, None, None]:
         db.close()
 
 
-def get_current_user(
-    token: str = Depends(oauth2_scheme),
-    db: Session = Depends(get_db),
-) -> User:
-    credentials_exception = HTTPException(
+async def get_async_db() -> AsyncGenerator[AsyncSession, None]:
+    if database.AsyncSessionLocal is None:
+        raise RuntimeError("Async DB path is disabled, set ASYNC_DB=1")
+    async with database.AsyncSessionLocal() as db:
+        yield db
+
+
+def _credentials_exception() -> HTTPException:
+    return HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
 
+
+def get_access_claims(token: str = Depends(oauth2_scheme)) -> dict:
+    """Verified access-token claims (``sub``, ``uid``, ``act``, ``ver``, ``jti``)."""
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        email: str | None = payload.get("sub")
-        if email is None:
-            raise credentials_exception
+        claims = decode_token(token, "access")
     except JWTError:
-        raise credentials_exception
+        raise _credentials_exception()
+    if not claims.get("sub") or not claims.get("act"):
+        raise _credentials_exception()
+    return claims
+
+
+def _authenticated(principal: Principal | None, claims: dict) -> Principal:
+    # Tokens issued before the user's last revoke-all carry an older version
+    if (
+        principal is None
+        or not principal.is_active
+        or principal.id != claims.get("uid")
+        or principal.token_version != claims.get("ver")
+    ):
+        raise _credentials_exception()
+    return principal
+
+
+def _stale(principal: Principal | None, claims: dict) -> bool:
+    """A newer token version than cached: revoked-all via another process."""
+    return principal is not None and claims.get("ver", 0) > principal.token_version
+
+
+def get_current_user(
+    claims: dict = Depends(get_access_claims),
+    db: Session = Depends(get_db),
+) -> Principal:
+    # Steady state: claims + cached principal + Bloom filter, no queries
+    email = claims["sub"]
+    with span("auth"):
+        if tokens.revocations.might_be_revoked(claims["jti"]) and tokens.is_revoked(
+            db, claims["jti"]
+        ):
+            raise _credentials_exception()
+
+        principal = principals.load(db, email)
+        if _stale(principal, claims):
+            principals.cache.pop(email)
+            principal = principals.load(db, email)
+        principal = _authenticated(principal, claims)
+
+    # End the read transaction (a no-op on a cache hit): the connection goes
+    # back to the pool while the request waits for a worker thread.
+    db.commit()
+
+    return principal
+
+
+async def _load_principal_async(db: AsyncSession, email: str) -> Principal | None:
+    principal = principals.cache.get(email)
+    if principal is None:
+        rows = (await db.execute(principals.load_statement(email))).all()
+        principal = principals.from_rows(rows)
+        if principal is not None:
+            principals.cache.set(email, principal)
+    return principal
+
+
+async def get_current_user_async(
+    claims: dict = Depends(get_access_claims),
+    db: AsyncSession = Depends(get_async_db),
+) -> Principal:
+    email = claims["sub"]
+    with span("auth"):
+        if tokens.revocations.might_be_revoked(claims["jti"]) and await db.run_sync(
+            tokens.is_revoked, claims["jti"]
+        ):
+            raise _credentials_exception()
+
+        principal = await _load_principal_async(db, email)
+        if _stale(principal, claims):
+            principals.cache.pop(email)
+            principal = await _load_principal_async(db, email)
+        return _authenticated(principal, claims)
+
+
+def _read_shop_ids(request: Request, principal: Principal) -> list[int]:
+    """Shops a read request touches: ``shop_id`` / ``shop_ids``, else all owned."""
+    raw = request.path_params.get("shop_id") or request.query_params.get("shop_id")
+    if raw is None:
+        raw = request.query_params.get("shop_ids")
+    if not raw:
+        return sorted(principal.shop_ids)
+    # Malformed ids are rejected by the endpoint's own validation
+    return [int(part) for part in raw.split(",") if part.strip().isdigit()]
+
+
+def get_read_db(
+    request: Request,
+    current_user: Principal = Depends(get_current_user),
+    db: Session = Depends(get_db),
+) -> Generator[Session, None, None]:
+    """Session on a read replica, or the request's primary session for
+    recently written shops (``app.replicas``)."""
+    factory = replicas.replica_for(
+        _read_shop_ids(request, current_user), replicas.readers
+    )
+    if factory is None:
+        yield db
+        return
+    with factory() as replica:
+        replica.info[replicas.REPLICA_KEY] = True
+        yield replica
+
+
+async def get_async_read_db(
+    request: Request,
+    current_user: Principal = Depends(get_current_user_async),
+    db: AsyncSession = Depends(get_async_db),
+) -> AsyncGenerator[AsyncSession, None]:
+    factory = replicas.replica_for(
+        _read_shop_ids(request, current_user), replicas.async_readers
+    )
+    if factory is None:
+        yield db
+        return
+    async with factory() as replica:
+        replica.info[replicas.REPLICA_KEY] = True
+        yield replica
+
+
+def _shop_lookup_error(owner_id: int | None, principal: Principal) -> None:
+    """Fallback for shops missing from the cached principal."""
+    if owner_id is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Shop not found",
+        )
+    if owner_id != principal.id:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="You are not the owner of this shop",
+        )
+    # Owned but created after the principal was cached (e.g. by another worker)
+    principals.invalidate_user(principal.id)
+
+
+def ensure_shop_owner(db: Session, shop_id: int, principal: Principal) -> None:
+    """404/403 unless ``principal`` owns ``shop_id``; no query for owned shops."""
+    if principal.owns(shop_id):
+        return
+    with span("owner"):
+        owner_id = db.execute(
+            select(Shop.owner_id).where(Shop.id == shop_id)
+        ).scalar_one_or_none()
+    _shop_lookup_error(owner_id, principal)
 
-    user = db.query(User).filter(User.email == email).first()
-    if user is None or not user.is_active:
-        raise credentials_exception
 
-    return user
+async def ensure_shop_owner_async(
+    db: AsyncSession, shop_id: int, principal: Principal
+) -> None:
+    if principal.owns(shop_id):
+        return
+    with span("owner"):
+        owner_id = (
+            await db.execute(select(Shop.owner_id).where(Shop.id == shop_id))
+        ).scalar_one_or_none()
+    _shop_lookup_error(owner_id, principal)
@@ -0,0 +1,168 @@
+"""Incremental device sync: what changed for a shop since the device's cursor.
+
+A POS keeps the opaque cursor of its last sync and asks for everything with
+a higher change sequence (``app.changes``): the shop row, products (a global
+catalog) and the shop's receipts. Each stream is read in sequence order from
+its own index, so a sync costs O(changes), not O(rows):
+
+    SELECT ... FROM products WHERE change_seq > ? ORDER BY change_seq LIMIT ?
+    SELECT ... FROM receipts WHERE shop_id = ? AND change_seq > ?
+        ORDER BY change_seq LIMIT ?
+
+At most ``limit`` products and ``limit`` receipts come back per call; while
+``has_more`` is true the device calls again with ``next_cursor``. Rows can
+be re-sent after a partial batch, so devices upsert by id.
+
+Product numbers can become visible out of order (``app.changes``): the
+product cursor only moves past rows updated more than
+``changes.product_settle_seconds`` ago, so the products of the last
+seconds are sent again by the next sync instead of being skipped.
+"""
+
+import base64
+import binascii
+import json
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Any
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session, selectinload
+
+from . import changes
+from .models import Product, Receipt, ReceiptLine, Shop
+
+DEFAULT_BATCH_SIZE = 500
+# selectinload batches 500 ids per IN list: one lines query per batch
+MAX_BATCH_SIZE = 500
+
+
+class CursorError(ValueError):
+    pass
+
+
+@dataclass(frozen=True)
+class SyncCursor:
+    """Highest change sequence seen per scope."""
+
+    products: int = 0
+    shop: int = 0
+
+    def encode(self) -> str:
+        raw = json.dumps([self.products, self.shop], separators=(",", ":"))
+        return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+    @classmethod
+    def decode(cls, token: str | None) -> "SyncCursor":
+        if not token:
+            return cls()
+        try:
+            raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+            products, shop = json.loads(raw)
+            return cls(int(products), int(shop))
+        except (binascii.Error, ValueError, TypeError) as exc:
+            raise CursorError("Invalid cursor") from exc
+
+
+@dataclass
+class SyncBatch:
+    shop: dict[str, Any] | None
+    products: list[dict[str, Any]]
+    receipts: list[dict[str, Any]]
+    next_cursor: str
+    has_more: bool
+
+
+def products_statement(after: int, limit: int):
+    return (
+        select(
+            Product.id,
+            Product.sku,
+            Product.name,
+            Product.price,
+            Product.change_seq,
+            Product.updated_at,
+        )
+        .where(Product.change_seq > after)
+        .order_by(Product.change_seq)
+        .limit(limit)
+    )
+
+
+def receipts_statement(shop_id: int, after: int, limit: int):
+    return (
+        select(Receipt)
+        .where(Receipt.shop_id == shop_id, Receipt.change_seq > after)
+        .order_by(Receipt.change_seq)
+        .limit(limit)
+    )
+
+
+def _settled_products_cursor(db: Session, products: list, after: int) -> int:
+    """Last ``change_seq`` before the first product that may still have
+    lower-numbered rows committing behind it."""
+    settle = changes.product_settle_seconds(db)
+    if settle <= 0:
+        return products[-1].change_seq if products else after
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    cutoff = now - timedelta(seconds=settle)
+    for product in products:
+        if product.updated_at is not None and product.updated_at > cutoff:
+            break
+        after = product.change_seq
+    return after
+
+
+def changes_since(
+    db: Session, shop_id: int, cursor: SyncCursor, limit: int = DEFAULT_BATCH_SIZE
+) -> SyncBatch:
+    """Rows changed after ``cursor``: three range reads plus one lines query."""
+    products = db.execute(products_statement(cursor.products, limit + 1)).all()
+    receipts = db.scalars(
+        receipts_statement(shop_id, cursor.shop, limit + 1).options(
+            selectinload(Receipt.lines).joinedload(ReceiptLine.product)
+        )
+    ).all()
+    shop = db.execute(
+        select(Shop.id, Shop.name, Shop.timezone, Shop.change_seq).where(
+            Shop.id == shop_id, Shop.change_seq > cursor.shop
+        )
+    ).first()
+
+    more_products = len(products) > limit
+    more_receipts = len(receipts) > limit
+    products, receipts = products[:limit], receipts[:limit]
+
+    next_products = _settled_products_cursor(db, products, cursor.products)
+    # Unsettled rows only: the next call would send them again
+    more_products = more_products and next_products > cursor.products
+    # While receipts remain, stop at the last one sent; the shop row may be
+    # sent again next time, which is harmless for an upsert
+    seqs = [cursor.shop] + [r.change_seq for r in receipts]
+    if shop is not None and not more_receipts:
+        seqs.append(shop.change_seq)
+    return SyncBatch(
+        shop=(
+            {"id": shop.id, "name": shop.name, "timezone": shop.timezone}
+            if shop is not None
+            else None
+        ),
+        products=[
+            {"id": p.id, "sku": p.sku, "name": p.name, "price": float(p.price)}
+            for p in products
+        ],
+        receipts=[
+            {
+                "id": r.id,
+                "created_at": r.created_at,
+                "total": float(r.total),
+                "lines": [
+                    (line.product.sku, line.qty, float(line.unit_price))
+                    for line in sorted(r.lines, key=lambda line: line.id)
+                ],
+            }
+            for r in receipts
+        ],
+        next_cursor=SyncCursor(next_products, max(seqs)).encode(),
+        has_more=more_products or more_receipts,
+    )
@@ -0,0 +1,343 @@
+"""Idempotency keys: scoped per shop, hashed, cached and expiring.
+
+A key is unique per ``(shop_id, key)`` and stores the sha256 of the request
+payload and the response that was sent, so a replay is answered from the
+``idempotency_keys`` row (or the in-process hot-key cache) without reading
+the receipts. Reusing a key with a different payload is a conflict.
+
+Concurrent duplicates are resolved by the database, insert-first: ``claim``
+inserts the keys with ``ON CONFLICT DO NOTHING`` / ``INSERT IGNORE`` before
+anything else is written. A second request with the same key blocks on the
+first one's uncommitted row and, once it commits, sees the key as used
+instead of failing on the unique constraint. A claimed row has no
+``receipt_id`` until ``record`` fills it in the same transaction, so rows
+with a ``NULL`` receipt are always the caller's own claims.
+
+Keys expire ``IDEMPOTENCY_TTL_HOURS`` (default 24) after first use; expired
+keys can be reused and are deleted in batches by ``purge_expired``, which the
+app runs every ``IDEMPOTENCY_PURGE_SECONDS`` (default 3600, 0 disables):
+
+    python -m app.idempotency purge
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+import sys
+import threading
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Sequence
+
+from sqlalchemy import bindparam, delete, event, insert, select, update
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+
+from .models import IdempotencyKey
+from .utils.cache import TTLCache
+
+IDEMPOTENCY_TTL_HOURS = float(os.getenv("IDEMPOTENCY_TTL_HOURS", "24"))
+IDEMPOTENCY_CACHE_SIZE = int(os.getenv("IDEMPOTENCY_CACHE_SIZE", "10000"))
+IDEMPOTENCY_CACHE_TTL = float(os.getenv("IDEMPOTENCY_CACHE_TTL", "600"))
+IDEMPOTENCY_PURGE_SECONDS = float(os.getenv("IDEMPOTENCY_PURGE_SECONDS", "3600"))
+IDEMPOTENCY_PURGE_BATCH = int(os.getenv("IDEMPOTENCY_PURGE_BATCH", "1000"))
+
+log = logging.getLogger("sync_kpis.idempotency")
+
+
+@dataclass(frozen=True)
+class StoredKey:
+    """A used key: the payload hash and the response to replay."""
+
+    request_hash: str | None
+    response: dict
+    # The row's expiry: a cached copy must not outlive it
+    expires_at: datetime | None = None
+
+    def matches(self, request_hash: str) -> bool:
+        # Keys stored before payload hashing match any payload
+        return self.request_hash is None or self.request_hash == request_hash
+
+
+# Hot keys: (shop_id, key) -> StoredKey. Entries are immutable once
+# committed; they are dropped after the cache TTL or the key's own expiry,
+# whichever comes first (see ``cached``).
+cache: TTLCache[StoredKey] = TTLCache(
+    "idempotency",
+    IDEMPOTENCY_CACHE_SIZE,
+    min(IDEMPOTENCY_CACHE_TTL, IDEMPOTENCY_TTL_HOURS * 3600),
+)
+
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def cached(shop_id: int, key: str) -> StoredKey | None:
+    """The hot-key cache entry of an unexpired key."""
+    stored = cache.get((shop_id, key))
+    if stored is None:
+        return None
+    if stored.expires_at is not None and stored.expires_at <= _utcnow():
+        cache.pop((shop_id, key))
+        return None
+    return stored
+
+
+def payload_hash(lines: Sequence, created_at: datetime | None = None) -> str:
+    """sha256 of the receipt payload (lines in order, plus ``created_at``)."""
+    payload = [
+        [[line.sku, line.qty, line.unit_price] for line in lines],
+        created_at.isoformat() if created_at is not None else None,
+    ]
+    return hashlib.sha256(
+        json.dumps(payload, separators=(",", ":")).encode()
+    ).hexdigest()
+
+
+def _insert_ignore(db: Session):
+    dialect = db.get_bind().dialect.name
+    if dialect == "sqlite":
+        return sqlite_insert(IdempotencyKey).on_conflict_do_nothing()
+    if dialect in ("mysql", "mariadb"):
+        return mysql_insert(IdempotencyKey).prefix_with("IGNORE")
+    if dialect == "postgresql":
+        return pg_insert(IdempotencyKey).on_conflict_do_nothing()
+    # Concurrent duplicates fail on the unique constraint instead
+    return insert(IdempotencyKey)
+
+
+def claim(db: Session, shop_id: int, hashes: dict[str, str]) -> dict[str, StoredKey]:
+    """Claim the unused keys of ``hashes`` (key -> payload hash). Does not commit.
+
+    Returns the keys that were already used (and have not expired); every
+    other key now belongs to this transaction and must be ``record``-ed.
+    """
+    if not hashes:
+        return {}
+    now = _utcnow()
+    expires_at = now + timedelta(hours=IDEMPOTENCY_TTL_HOURS)
+
+    def _rows(keys):
+        return [
+            {
+                "shop_id": shop_id,
+                "key": key,
+                "request_hash": hashes[key],
+                "expires_at": expires_at,
+            }
+            for key in keys
+        ]
+
+    db.execute(_insert_ignore(db), _rows(hashes))
+    used = db.execute(
+        select(
+            IdempotencyKey.key,
+            IdempotencyKey.request_hash,
+            IdempotencyKey.response,
+            IdempotencyKey.expires_at,
+        ).where(
+            IdempotencyKey.shop_id == shop_id,
+            IdempotencyKey.key.in_(list(hashes)),
+            IdempotencyKey.receipt_id.is_not(None),
+        )
+        # Locking read: sees rows committed while the insert was waiting
+        .with_for_update()
+    ).all()
+
+    stored: dict[str, StoredKey] = {}
+    expired: list[str] = []
+    for key, request_hash, response, key_expires_at in used:
+        if key_expires_at <= now:
+            expired.append(key)
+        else:
+            stored[key] = StoredKey(request_hash, response, key_expires_at)
+            cache.set((shop_id, key), stored[key])
+    if expired:
+        # Expired but not purged yet: the key can be used again
+        db.execute(
+            delete(IdempotencyKey).where(
+                IdempotencyKey.shop_id == shop_id, IdempotencyKey.key.in_(expired)
+            )
+        )
+        db.execute(_insert_ignore(db), _rows(expired))
+    return stored
+
+
+def lookup(db: Session, shop_id: int, key: str) -> StoredKey | None:
+    """The key's stored response if it was used and has not expired.
+
+    Unlike ``claim`` this takes no lock and writes nothing.
+    """
+    stored = cached(shop_id, key)
+    if stored is not None:
+        return stored
+    row = db.execute(
+        select(
+            IdempotencyKey.request_hash,
+            IdempotencyKey.response,
+            IdempotencyKey.expires_at,
+        ).where(
+            IdempotencyKey.shop_id == shop_id,
+            IdempotencyKey.key == key,
+            IdempotencyKey.receipt_id.is_not(None),
+            IdempotencyKey.expires_at > _utcnow(),
+        )
+    ).one_or_none()
+    return StoredKey(*row) if row is not None else None
+
+
+def record(
+    db: Session,
+    shop_id: int,
+    hashes: dict[str, str],
+    responses: dict[str, tuple[int, dict]],
+) -> None:
+    """Attach ``key -> (receipt_id, response)`` to keys claimed by ``claim``.
+
+    The key's lifetime starts now. The hot-key cache is filled once the
+    transaction commits.
+    """
+    if not responses:
+        return
+    expires_at = _utcnow() + timedelta(hours=IDEMPOTENCY_TTL_HOURS)
+    table = IdempotencyKey.__table__
+    # Core executemany: one statement for every key of the batch
+    db.execute(
+        update(table)
+        .where(
+            table.c.shop_id == bindparam("b_shop_id"),
+            table.c.key == bindparam("b_key"),
+        )
+        .values(
+            receipt_id=bindparam("b_receipt_id"),
+            response=bindparam("b_response"),
+            expires_at=expires_at,
+        ),
+        [
+            {
+                "b_shop_id": shop_id,
+                "b_key": key,
+                "b_receipt_id": receipt_id,
+                "b_response": response,
+            }
+            for key, (receipt_id, response) in responses.items()
+        ],
+    )
+    db.info.setdefault(_PENDING_KEY, []).extend(
+        ((shop_id, key), StoredKey(hashes[key], response, expires_at))
+        for key, (_, response) in responses.items()
+    )
+
+
+def purge_expired(
+    session_factory: Callable[[], Session],
+    batch_size: int = IDEMPOTENCY_PURGE_BATCH,
+    now: datetime | None = None,
+) -> int:
+    """Delete expired keys, ``batch_size`` rows per transaction. Returns the count.
+
+    Small batches keep each delete's locks short on a busy table.
+    """
+    now = now or _utcnow()
+    purged = 0
+    while True:
+        with session_factory() as db:
+            ids = (
+                db.execute(
+                    select(IdempotencyKey.id)
+                    .where(IdempotencyKey.expires_at <= now)
+                    .order_by(IdempotencyKey.expires_at)
+                    .limit(batch_size)
+                )
+                .scalars()
+                .all()
+            )
+            if not ids:
+                return purged
+            db.execute(delete(IdempotencyKey).where(IdempotencyKey.id.in_(ids)))
+            db.commit()
+        purged += len(ids)
+
+
+class Purger:
+    """Daemon thread running ``purge`` (``purge_expired`` by default) every
+    ``interval`` seconds; ``what`` names the purged rows in the log.
+    """
+
+    def __init__(
+        self,
+        session_factory: Callable[[], Session],
+        interval: float,
+        purge: Callable[[Callable[[], Session]], int] = purge_expired,
+        what: str = "expired idempotency keys",
+    ) -> None:
+        self.session_factory = session_factory
+        self.interval = interval
+        self.purge = purge
+        self.what = what
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def start(self) -> None:
+        if self.interval <= 0 or self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, name=f"purge {self.what}", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            try:
+                purged = self.purge(self.session_factory)
+            except Exception:
+                log.exception("Purging %s failed", self.what)
+            else:
+                if purged:
+                    log.info("Purged %s %s", purged, self.what)
+
+
+# ---------- Hot-key cache fill on commit ----------
+
+_PENDING_KEY = "idempotency_to_cache"
+
+
+@event.listens_for(Session, "after_commit")
+def _cache_committed(session: Session) -> None:
+    for cache_key, stored in session.info.pop(_PENDING_KEY, ()):
+        cache.set(cache_key, stored)
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _forget_rolled_back(session: Session, previous_transaction) -> None:
+    session.info.pop(_PENDING_KEY, None)
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m app.idempotency")
+    sub = parser.add_subparsers(dest="command", required=True)
+    purge_cmd = sub.add_parser("purge", help="Delete expired idempotency keys")
+    purge_cmd.add_argument("--batch-size", type=int, default=IDEMPOTENCY_PURGE_BATCH)
+    args = parser.parse_args(argv)
+
+    from .database import SessionLocal
+
+    purged = purge_expired(SessionLocal, batch_size=args.batch_size)
+    sys.stdout.write(f"Purged {purged} expired idempotency keys\n")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
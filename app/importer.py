@@ -0,0 +1,302 @@
+"""Streaming receipt import (NDJSON or CSV) with bounded memory.
+
+Input is consumed as an iterator of text lines and turned into receipts by a
+generator, so only one chunk of ``chunk_size`` receipts is ever held in
+memory. Lines are checked against ``schemas.ReceiptLineIn`` (a qty of 2.7 is
+an error, not 2) and a receipt needs at least one; each chunk is then
+written with ``ingest.ingest_receipts`` (same rules as ``create_receipt``:
+qty > 0, unit_price >= 0) and committed on its own. Errors report the
+receipt's number and the input line (``row``) they come from.
+
+Formats:
+
+- NDJSON, one receipt per line:
+  ``{"lines": [{"sku": "A", "qty": 1, "unit_price": 2.5}],
+  "idempotency_key": "...", "created_at": "2024-01-31T10:00:00"}``
+- CSV with a header and one row per receipt line; consecutive rows sharing a
+  ``receipt_ref`` form one receipt:
+  ``receipt_ref,sku,qty,unit_price[,created_at][,idempotency_key]``
+  (quoted fields must not contain newlines).
+
+``offset`` counts receipts from the start of the input: an import stopped
+after the chunk that ended at offset N can be resumed with ``--offset N``.
+Receipts carrying an ``idempotency_key`` are replayed, not duplicated, if a
+chunk is sent twice.
+
+CLI:
+
+    python -m app.importer receipts.ndjson --shop-id 1 [--format csv]
+        [--chunk-size 500] [--offset 0]
+"""
+
+import argparse
+import codecs
+import csv
+import json
+import logging
+import sys
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Callable, Iterable, Iterator, NamedTuple
+
+from pydantic import ValidationError
+from sqlalchemy.orm import Session
+
+from . import ingest, schemas
+
+log = logging.getLogger("sync_kpis_import")
+
+FORMATS = ("ndjson", "csv")
+DEFAULT_CHUNK_SIZE = 500
+MAX_REPORTED_ERRORS = 100
+
+
+class ImportedLine(NamedTuple):
+    sku: str
+    qty: int
+    unit_price: float
+
+
+@dataclass
+class _Record:
+    """One parsed input receipt, or the reason it could not be parsed."""
+
+    number: int
+    # Input line the receipt (or its error) starts at, 1-based
+    row: int | None = None
+    draft: ingest.ReceiptDraft | None = None
+    error: str | None = None
+
+
+@dataclass
+class ImportReport:
+    processed: int = 0
+    created: int = 0
+    replayed: int = 0
+    rejected: int = 0
+    next_offset: int = 0
+    errors: list[dict] = field(default_factory=list)
+
+    def reject(self, record: int, detail: str, row: int | None = None) -> None:
+        self.rejected += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({"record": record, "row": row, "detail": detail})
+
+
+def _parse_created_at(value: str | None) -> datetime | None:
+    if not value:
+        return None
+    dt = datetime.fromisoformat(value)
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(timezone.utc).replace(tzinfo=None)
+    return dt
+
+
+def _line(raw: dict) -> ImportedLine:
+    """One receipt line, validated like the API's ``ReceiptLineIn``."""
+    line = schemas.ReceiptLineIn.model_validate(raw)
+    return ImportedLine(line.sku, line.qty, line.unit_price)
+
+
+def _invalid(exc: Exception) -> str:
+    if isinstance(exc, ValidationError):
+        exc = "; ".join(
+            f"{'.'.join(str(part) for part in error['loc'])}: {error['msg']}"
+            for error in exc.errors()
+        )
+    return f"Invalid record: {exc}"
+
+
+def iter_lines(chunks: Iterable[bytes]) -> Iterator[str]:
+    """Split a stream of byte chunks into text lines (UTF-8) lazily."""
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    pending = ""
+    for chunk in chunks:
+        pending += decoder.decode(chunk)
+        *lines, pending = pending.split("\n")
+        yield from lines
+    pending += decoder.decode(b"", final=True)
+    if pending:
+        yield pending
+
+
+def _iter_ndjson(lines: Iterable[str]) -> Iterator[_Record]:
+    number = 0
+    for row, raw in enumerate(lines, 1):
+        raw = raw.strip()
+        if not raw:
+            continue
+        try:
+            data = json.loads(raw)
+            if not data["lines"]:
+                raise ValueError("receipt has no lines")
+            draft = ingest.ReceiptDraft(
+                lines=[_line(line) for line in data["lines"]],
+                idempotency_key=data.get("idempotency_key"),
+                created_at=_parse_created_at(data.get("created_at")),
+            )
+        except (ValueError, KeyError, TypeError) as exc:
+            yield _Record(number=number, row=row, error=_invalid(exc))
+        else:
+            yield _Record(number=number, row=row, draft=draft)
+        number += 1
+
+
+def _iter_csv(lines: Iterable[str]) -> Iterator[_Record]:
+    line_number = 0
+
+    def _non_blank() -> Iterator[str]:
+        nonlocal line_number
+        for line_number, line in enumerate(lines, 1):
+            if line.strip():
+                yield line
+
+    # Rows are read one input line at a time, so line_number is the row's
+    reader = csv.DictReader(_non_blank())
+    number = 0
+    ref: str | None = None
+    current: dict | None = None
+    first_row = error_row = None
+    error: str | None = None
+
+    def _flush() -> _Record:
+        if error is not None:
+            return _Record(number=number, row=error_row, error=error)
+        return _Record(
+            number=number, row=first_row, draft=ingest.ReceiptDraft(**current)
+        )
+
+    for row in reader:
+        if row.get("receipt_ref") != ref or current is None:
+            if current is not None:
+                yield _flush()
+                number += 1
+            ref = row.get("receipt_ref")
+            first_row, error = line_number, None
+            try:
+                current = {
+                    "lines": [],
+                    "idempotency_key": row.get("idempotency_key") or None,
+                    "created_at": _parse_created_at(row.get("created_at")),
+                }
+            except ValueError as exc:
+                current = {"lines": []}
+                error, error_row = _invalid(exc), line_number
+        try:
+            current["lines"].append(
+                _line(
+                    {
+                        "sku": row["sku"],
+                        "qty": row["qty"],
+                        "unit_price": row["unit_price"],
+                    }
+                )
+            )
+        except (ValueError, KeyError, TypeError) as exc:
+            if error is None:
+                error, error_row = _invalid(exc), line_number
+
+    if current is not None:
+        yield _flush()
+
+
+def iter_records(lines: Iterable[str], fmt: str) -> Iterator[_Record]:
+    if fmt == "ndjson":
+        return _iter_ndjson(lines)
+    if fmt == "csv":
+        return _iter_csv(lines)
+    raise ValueError(f"Unsupported format {fmt!r}, expected one of {FORMATS}")
+
+
+def import_receipts(
+    session_factory: Callable[[], Session],
+    shop_id: int,
+    lines: Iterable[str],
+    fmt: str = "ndjson",
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    offset: int = 0,
+    progress: Callable[[ImportReport], None] | None = None,
+) -> ImportReport:
+    """Import receipts for ``shop_id`` in chunked transactions.
+
+    Records before ``offset`` are parsed but skipped. ``progress`` is called
+    after every committed chunk.
+    """
+    report = ImportReport(next_offset=offset)
+    chunk: list[_Record] = []
+
+    def _write() -> None:
+        drafts = [r.draft for r in chunk if r.draft is not None]
+        with session_factory() as db:
+            results = ingest.ingest_receipts(db, shop_id, drafts)
+            db.commit()
+
+        outcomes = iter(results)
+        for record in chunk:
+            if record.draft is None:
+                report.reject(record.number, record.error, record.row)
+                continue
+            result = next(outcomes)
+            if result.status == ingest.CREATED:
+                report.created += 1
+            elif result.status == ingest.REPLAYED:
+                report.replayed += 1
+            else:
+                report.reject(record.number, result.detail, record.row)
+        report.processed += len(chunk)
+        report.next_offset = chunk[-1].number + 1
+        chunk.clear()
+        if progress is not None:
+            progress(report)
+
+    for record in iter_records(lines, fmt):
+        if record.number < offset:
+            continue
+        chunk.append(record)
+        if len(chunk) >= chunk_size:
+            _write()
+    if chunk:
+        _write()
+    return report
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m app.importer")
+    parser.add_argument("path", help="NDJSON/CSV file, or - for stdin")
+    parser.add_argument("--shop-id", type=int, required=True)
+    parser.add_argument("--format", choices=FORMATS, default=None)
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument("--offset", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    fmt = args.format or ("csv" if args.path.endswith(".csv") else "ndjson")
+
+    from .database import SessionLocal
+
+    def _progress(report: ImportReport) -> None:
+        sys.stderr.write(
+            f"committed up to offset {report.next_offset} "
+            f"(created={report.created} replayed={report.replayed} "
+            f"rejected={report.rejected})\n"
+        )
+
+    stream = (
+        sys.stdin if args.path == "-" else open(args.path, encoding="utf-8", newline="")
+    )
+    with stream:
+        report = import_receipts(
+            SessionLocal,
+            args.shop_id,
+            stream,
+            fmt=fmt,
+            chunk_size=args.chunk_size,
+            offset=args.offset,
+            progress=_progress,
+        )
+
+    sys.stdout.write(json.dumps(report.__dict__) + "\n")
+    return 0 if report.rejected == 0 else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
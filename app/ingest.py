@@ -0,0 +1,263 @@
+"""Receipt ingestion shared by the single, bulk and import endpoints.
+
+``ingest_receipts`` writes a batch of receipts for one shop without any
+per-line queries:
+
+- for idempotency keys not in the hot-key cache, one insert-ignore that
+  claims them and one query for the ones already used (``app.idempotency``),
+- for SKUs not in the catalog cache (``app.catalog``), one ``IN`` query
+  (plus an insert-ignore and a re-select for the ones that do not exist yet),
+- one counter bump for the shop's change sequence (``app.changes``), plus
+  one for the products when SKUs are created,
+- one insert per receipt (its id is needed for the lines), then one
+  executemany for all lines and one that stores the keys' responses,
+- one upsert per rollup table.
+
+Committing the batch invalidates the shop's cached KPIs (``app.kpi_cache``).
+
+Nothing is committed here; callers own the transaction.
+"""
+
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Protocol, Sequence
+
+from sqlalchemy import insert
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+
+from . import catalog, changes, idempotency, kpi_cache, rollups
+from .instrumentation import span
+from .models import Product, Receipt, ReceiptLine
+
+CREATED = "created"
+REPLAYED = "replayed"
+REJECTED = "rejected"
+# Idempotency key already used with a different payload
+CONFLICT = "conflict"
+
+
+class LineLike(Protocol):
+    sku: str
+    qty: int
+    unit_price: float
+
+
+@dataclass
+class ReceiptDraft:
+    lines: Sequence[LineLike]
+    idempotency_key: str | None = None
+    created_at: datetime | None = None
+    # When the API accepted a queued receipt (app.write_behind): its
+    # created_at, but not part of the idempotency payload hash
+    accepted_at: datetime | None = None
+
+
+@dataclass
+class IngestResult:
+    status: str
+    receipt_id: int | None = None
+    total: float | None = None
+    detail: str | None = None
+
+
+@dataclass
+class _Pending:
+    index: int
+    draft: ReceiptDraft
+    total: float
+    created_at: datetime
+    lines: list[ReceiptLine] = field(default_factory=list)
+
+
+def utcnow() -> datetime:
+    """Naive UTC timestamp, the format ``Receipt.created_at`` is stored in."""
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def validate_lines(lines: Sequence[LineLike]) -> str | None:
+    """Return an error message if any line is invalid, None otherwise."""
+    for line in lines:
+        if line.qty <= 0 or line.unit_price < 0:
+            return "Invalid qty or unit_price"
+    return None
+
+
+@span("products")
+def resolve_products(db: Session, prices: dict[str, float]) -> dict[str, int]:
+    """Map SKUs to product ids, creating missing products on-the-fly.
+
+    Missing products get the SKU as name and ``prices[sku]`` as price.
+    """
+    if not prices:
+        return {}
+
+    skus = list(prices)
+    found = catalog.product_ids(db, skus)
+    missing = [sku for sku in skus if sku not in found]
+    if missing:
+        first_seq = changes.allocate_products(db, len(missing))
+        rows = [
+            {"sku": sku, "name": sku, "price": prices[sku], "change_seq": first_seq + i}
+            for i, sku in enumerate(missing)
+        ]
+        dialect = db.get_bind().dialect.name
+        if dialect == "sqlite":
+            stmt = sqlite_insert(Product).on_conflict_do_nothing()
+        elif dialect in ("mysql", "mariadb"):
+            stmt = mysql_insert(Product).prefix_with("IGNORE")
+        else:
+            stmt = insert(Product)
+        # Ignore SKUs another transaction created in the meantime
+        db.execute(stmt, rows)
+        # Cached once the transaction commits
+        found.update(catalog.product_ids(db, missing))
+    return found
+
+
+def ingest_receipts(
+    db: Session,
+    shop_id: int,
+    drafts: Sequence[ReceiptDraft],
+) -> list[IngestResult]:
+    """Create the receipts in ``drafts`` for ``shop_id``. Does not commit.
+
+    Returns one result per draft, in order: ``created``, ``replayed`` (the
+    idempotency key was already used, the earlier receipt is returned),
+    ``conflict`` (the key was used with another payload) or ``rejected``
+    (validation failed). Nothing is written for the last three.
+    """
+    results: list[IngestResult | None] = [None] * len(drafts)
+
+    # 1) Validation
+    valid: list[int] = []
+    for i, draft in enumerate(drafts):
+        error = validate_lines(draft.lines)
+        if error:
+            results[i] = IngestResult(status=REJECTED, detail=error)
+        else:
+            valid.append(i)
+
+    # 2) Idempotency keys: hot-key cache first, then claim the rest
+    draft_hashes = {
+        i: idempotency.payload_hash(drafts[i].lines, drafts[i].created_at)
+        for i in valid
+        if drafts[i].idempotency_key is not None
+    }
+    hashes: dict[str, str] = {}
+    for i, request_hash in draft_hashes.items():
+        hashes.setdefault(drafts[i].idempotency_key, request_hash)
+    used: dict[str, idempotency.StoredKey] = {}
+    for key in hashes:
+        stored = idempotency.cached(shop_id, key)
+        if stored is not None:
+            used[key] = stored
+    claimed = {key: h for key, h in hashes.items() if key not in used}
+    used.update(idempotency.claim(db, shop_id, claimed))
+
+    # Keys repeated inside the batch replay the first occurrence
+    first_with_key: dict[str, int] = {}
+    duplicates: list[tuple[int, int]] = []
+    to_create: list[int] = []
+    for i in valid:
+        key = drafts[i].idempotency_key
+        if key is None:
+            to_create.append(i)
+        elif key in used and used[key].matches(draft_hashes[i]):
+            response = used[key].response
+            results[i] = IngestResult(
+                status=REPLAYED, receipt_id=response["id"], total=response["total"]
+            )
+        elif key in first_with_key and (
+            draft_hashes[i] == draft_hashes[first_with_key[key]]
+        ):
+            duplicates.append((i, first_with_key[key]))
+        elif key in used or key in first_with_key:
+            results[i] = IngestResult(
+                status=CONFLICT,
+                detail="Idempotency-Key already used with a different payload",
+            )
+        else:
+            first_with_key[key] = i
+            to_create.append(i)
+
+    # 3) Products: one lookup for every SKU in the batch
+    prices: dict[str, float] = {}
+    for i in to_create:
+        for line in drafts[i].lines:
+            prices.setdefault(line.sku, line.unit_price)
+    product_ids = resolve_products(db, prices)
+
+    # 4) Receipts, lines, idempotency keys
+    now = utcnow()
+    pending: list[_Pending] = []
+    for i in to_create:
+        draft = drafts[i]
+        total = sum(line.qty * line.unit_price for line in draft.lines)
+        pending.append(
+            _Pending(
+                index=i,
+                draft=draft,
+                total=round(total, 2),
+                created_at=draft.created_at or draft.accepted_at or now,
+                lines=[
+                    ReceiptLine(
+                        product_id=product_ids[line.sku],
+                        qty=line.qty,
+                        unit_price=line.unit_price,
+                    )
+                    for line in draft.lines
+                ],
+            )
+        )
+
+    receipts = [
+        Receipt(shop_id=shop_id, total=p.total, created_at=p.created_at)
+        for p in pending
+    ]
+    if receipts:
+        db.add_all(receipts)
+        db.flush()  # get receipt ids
+
+        line_rows = []
+        responses: dict[str, tuple[int, dict]] = {}
+        for p, receipt in zip(pending, receipts):
+            for lm in p.lines:
+                lm.receipt_id = receipt.id
+                line_rows.append(
+                    {
+                        "receipt_id": receipt.id,
+                        "product_id": lm.product_id,
+                        "qty": lm.qty,
+                        "unit_price": lm.unit_price,
+                    }
+                )
+            if p.draft.idempotency_key is not None:
+                responses[p.draft.idempotency_key] = (
+                    receipt.id,
+                    {"id": receipt.id, "total": p.total},
+                )
+            results[p.index] = IngestResult(
+                status=CREATED, receipt_id=receipt.id, total=p.total
+            )
+
+        if line_rows:
+            db.execute(insert(ReceiptLine), line_rows)
+        idempotency.record(db, shop_id, hashes, responses)
+
+        # 5) Daily KPI rollups in the same transaction
+        rollups.apply_receipts(
+            db,
+            shop_id,
+            [(p.created_at.date(), p.total, p.lines) for p in pending],
+        )
+        kpi_cache.mark_changed(db, shop_id)
+
+    for i, first in duplicates:
+        created = results[first]
+        results[i] = IngestResult(
+            status=REPLAYED, receipt_id=created.receipt_id, total=created.total
+        )
+
+    return results  # type: ignore[return-value]
@@ -0,0 +1,372 @@
+"""Per-request timing and SQL accounting.
+
+``RequestMetricsMiddleware`` (installed in ``app.main``) opens a
+``RequestStats`` for every HTTP request in a context variable. Engine-level
+SQLAlchemy hooks add each statement's count, DB time and rows to it,
+and ``span("auth")``-style blocks in the code add named phases (``auth``,
+``owner``, ``products``, ``aggregate``). When the request finishes:
+
+- a ``Server-Timing`` header (``SERVER_TIMING``, default on) reports total,
+  DB and per-phase time, so browser devtools show the split per request;
+- the per-route totals behind ``GET /metrics`` (Prometheus text format) are
+  updated: request count and latency histogram, statements, DB seconds,
+  rows returned, rows written and phase seconds;
+- with ``N_PLUS_ONE_THRESHOLD=K`` (default 0, off), a warning is logged when
+  the request ran more than K statements with the same SQL shape.
+
+Rows returned are counted as they are fetched: drivers only know a
+SELECT's row count then (``rowcount`` is -1 on SQLite, for instance), so the
+statement's DB-API cursor is wrapped to count what its result reads. Rows a
+handler leaves unfetched are not counted. Rows written are the DB-API
+``rowcount`` of INSERT/UPDATE/DELETE statements.
+Set ``REQUEST_METRICS=0`` to disable the middleware altogether.
+"""
+
+import logging
+import os
+import re
+import threading
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Iterator
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+def _env_bool(name: str, default: bool) -> bool:
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.lower() in ("1", "true", "yes")
+
+
+REQUEST_METRICS = _env_bool("REQUEST_METRICS", True)
+SERVER_TIMING = _env_bool("SERVER_TIMING", True)
+N_PLUS_ONE_THRESHOLD = int(os.getenv("N_PLUS_ONE_THRESHOLD", "0"))
+
+# Prometheus histogram buckets for request latency, in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+log = logging.getLogger("sync_kpis.instrumentation")
+
+
+@dataclass
+class RequestStats:
+    statements: int = 0
+    db_seconds: float = 0.0
+    rows_returned: int = 0
+    rows_written: int = 0
+    spans: dict[str, float] = field(default_factory=lambda: defaultdict(float))
+    shapes: Counter = field(default_factory=Counter)
+
+
+_current: ContextVar[RequestStats | None] = ContextVar("request_stats", default=None)
+
+
+def current() -> RequestStats | None:
+    return _current.get()
+
+
+@contextmanager
+def span(name: str) -> Iterator[None]:
+    """Add the block's duration to the current request's ``name`` phase."""
+    stats = _current.get()
+    if stats is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        stats.spans[name] += time.perf_counter() - started
+
+
+# ---------- SQL accounting (every engine, sync and async) ----------
+
+_IN_LIST = re.compile(r"\((?:\s*(?:\?|%s|%\(\w+\)s|:\w+)\s*,?)+\)")
+
+
+def statement_shape(statement: str) -> str:
+    """SQL with ``IN (?, ?, ...)`` lists collapsed, to group similar statements."""
+    return _IN_LIST.sub("(...)", " ".join(statement.split()))
+
+
+class _CountingCursor:
+    """DB-API cursor proxy adding the rows fetched to a request's stats."""
+
+    def __init__(self, cursor, stats: RequestStats) -> None:
+        object.__setattr__(self, "_cursor", cursor)
+        object.__setattr__(self, "_stats", stats)
+
+    def fetchone(self):
+        row = self._cursor.fetchone()
+        if row is not None:
+            self._stats.rows_returned += 1
+        return row
+
+    def fetchmany(self, *args):
+        rows = self._cursor.fetchmany(*args)
+        self._stats.rows_returned += len(rows)
+        return rows
+
+    def fetchall(self):
+        rows = self._cursor.fetchall()
+        self._stats.rows_returned += len(rows)
+        return rows
+
+    def __iter__(self):
+        return iter(self.fetchone, None)
+
+    def __getattr__(self, name: str):
+        return getattr(self._cursor, name)
+
+    def __setattr__(self, name: str, value) -> None:
+        setattr(self._cursor, name, value)
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_execute(conn, cursor, statement, parameters, context, executemany):
+    if _current.get() is not None:
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_execute(conn, cursor, statement, parameters, context, executemany):
+    stats = _current.get()
+    started = conn.info.get("query_started")
+    if stats is None or not started:
+        return
+    stats.db_seconds += time.perf_counter() - started.pop()
+    stats.statements += 1
+    if context is not None and (
+        context.isinsert or context.isupdate or context.isdelete
+    ):
+        stats.rows_written += max(cursor.rowcount or 0, 0)
+    if (
+        context is not None
+        and not executemany
+        and cursor.description is not None
+        and context.cursor is cursor
+    ):
+        # The result reads through context.cursor, set up right after this
+        context.cursor = _CountingCursor(cursor, stats)
+    stats.shapes[statement_shape(statement)] += 1
+
+
+@event.listens_for(Engine, "handle_error")
+def _failed_execute(context) -> None:
+    # after_cursor_execute does not run for a failed statement
+    conn = context.connection
+    started = conn.info.get("query_started") if conn is not None else None
+    if not started:
+        return
+    elapsed = time.perf_counter() - started.pop()
+    stats = _current.get()
+    if stats is not None:
+        stats.db_seconds += elapsed
+        stats.statements += 1
+
+
+# ---------- Per-route registry and Prometheus output ----------
+
+
+@dataclass
+class _RouteTotals:
+    requests: Counter = field(default_factory=Counter)  # by status code
+    seconds: float = 0.0
+    buckets: list[int] = field(default_factory=lambda: [0] * len(LATENCY_BUCKETS))
+    statements: int = 0
+    db_seconds: float = 0.0
+    rows_returned: int = 0
+    rows_written: int = 0
+    spans: dict[str, float] = field(default_factory=lambda: defaultdict(float))
+    n_plus_one: int = 0
+
+
+_routes: dict[tuple[str, str], _RouteTotals] = defaultdict(_RouteTotals)
+_lock = threading.Lock()
+
+
+def _record(
+    method: str, route: str, status: int, seconds: float, stats: RequestStats
+) -> None:
+    suspects = [
+        (shape, n)
+        for shape, n in stats.shapes.items()
+        if N_PLUS_ONE_THRESHOLD and n > N_PLUS_ONE_THRESHOLD
+    ]
+    for shape, n in suspects:
+        log.warning(
+            "Possible N+1: %s %s ran %d similar statements: %.200s",
+            method,
+            route,
+            n,
+            shape,
+        )
+    with _lock:
+        totals = _routes[(method, route)]
+        totals.requests[status] += 1
+        totals.seconds += seconds
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if seconds <= bound:
+                totals.buckets[i] += 1
+        totals.statements += stats.statements
+        totals.db_seconds += stats.db_seconds
+        totals.rows_returned += stats.rows_returned
+        totals.rows_written += stats.rows_written
+        for name, value in stats.spans.items():
+            totals.spans[name] += value
+        totals.n_plus_one += len(suspects)
+
+
+def reset() -> None:
+    with _lock:
+        _routes.clear()
+
+
+def route_metrics() -> dict[tuple[str, str], dict]:
+    """Snapshot of the per-route totals, keyed by ``(method, route)``."""
+    with _lock:
+        return {
+            key: {
+                "requests": sum(t.requests.values()),
+                "seconds": t.seconds,
+                "statements": t.statements,
+                "db_seconds": t.db_seconds,
+                "rows_returned": t.rows_returned,
+                "rows_written": t.rows_written,
+                "spans": dict(t.spans),
+                "n_plus_one": t.n_plus_one,
+            }
+            for key, t in _routes.items()
+        }
+
+
+def _labels(**labels: str) -> str:
+    body = ",".join(
+        '{}="{}"'.format(k, str(v).replace("\\", "\\\\").replace('"', '\\"'))
+        for k, v in labels.items()
+    )
+    return "{" + body + "}"
+
+
+def prometheus_text() -> str:
+    """All per-route metrics in the Prometheus text exposition format."""
+    out = [
+        "# HELP http_requests_total Requests by route and status.",
+        "# TYPE http_requests_total counter",
+    ]
+    with _lock:
+        routes = sorted(_routes.items())
+        for (method, route), t in routes:
+            for status, n in sorted(t.requests.items()):
+                out.append(
+                    f"http_requests_total{_labels(method=method, route=route, status=status)} {n}"  # noqa: E501
+                )
+
+        out += [
+            "# HELP http_request_duration_seconds Request wall time.",
+            "# TYPE http_request_duration_seconds histogram",
+        ]
+        for (method, route), t in routes:
+            count = sum(t.requests.values())
+            for bound, n in zip(LATENCY_BUCKETS, t.buckets):
+                labels = _labels(method=method, route=route, le=bound)
+                out.append(f"http_request_duration_seconds_bucket{labels} {n}")
+            labels = _labels(method=method, route=route, le="+Inf")
+            out.append(f"http_request_duration_seconds_bucket{labels} {count}")
+            labels = _labels(method=method, route=route)
+            out.append(f"http_request_duration_seconds_sum{labels} {t.seconds:.6f}")
+            out.append(f"http_request_duration_seconds_count{labels} {count}")
+
+        for name, help_text, attr in (
+            ("http_request_db_statements_total", "SQL statements run.", "statements"),
+            ("http_request_db_seconds_total", "Time spent in SQL.", "db_seconds"),
+            (
+                "http_request_db_rows_returned_total",
+                "Rows fetched from query results.",
+                "rows_returned",
+            ),
+            (
+                "http_request_db_rows_written_total",
+                "Rows inserted/updated/deleted.",
+                "rows_written",
+            ),
+            ("http_request_n_plus_one_total", "Suspected N+1 patterns.", "n_plus_one"),
+        ):
+            out += [f"# HELP {name} {help_text}", f"# TYPE {name} counter"]
+            for (method, route), t in routes:
+                out.append(
+                    f"{name}{_labels(method=method, route=route)} {getattr(t, attr)}"
+                )
+
+        out += [
+            "# HELP http_request_span_seconds_total Time per request phase.",
+            "# TYPE http_request_span_seconds_total counter",
+        ]
+        for (method, route), t in routes:
+            for span_name, seconds in sorted(t.spans.items()):
+                labels = _labels(method=method, route=route, span=span_name)
+                out.append(f"http_request_span_seconds_total{labels} {seconds:.6f}")
+    return "\n".join(out) + "\n"
+
+
+# ---------- ASGI middleware ----------
+
+
+def server_timing(total: float, stats: RequestStats) -> str:
+    parts = [
+        f"total;dur={total * 1000:.1f}",
+        f'db;dur={stats.db_seconds * 1000:.1f};desc="{stats.statements} queries"',
+    ]
+    parts += [
+        f"{name};dur={seconds * 1000:.1f}" for name, seconds in stats.spans.items()
+    ]
+    return ", ".join(parts)
+
+
+class RequestMetricsMiddleware:
+    """Pure ASGI middleware (no extra task per request, unlike BaseHTTPMiddleware)."""
+
+    def __init__(self, app) -> None:
+        self.app = app
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats()
+        token = _current.set(stats)
+        started = time.perf_counter()
+        status = 500
+
+        async def _send(message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if SERVER_TIMING:
+                    header = server_timing(time.perf_counter() - started, stats)
+                    message.setdefault("headers", [])
+                    message["headers"] = [
+                        *message["headers"],
+                        (b"server-timing", header.encode("latin-1")),
+                    ]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, _send)
+        finally:
+            _current.reset(token)
+            route = scope.get("route")
+            _record(
+                scope["method"],
+                getattr(route, "path", "unmatched"),
+                status,
+                time.perf_counter() - started,
+                stats,
+            )
@@ -0,0 +1,218 @@
+"""Response cache for ``GET /shops/{shop_id}/kpis``.
+
+Serialized KPI bodies are cached under ``(shop_id, generation, from, to)``
+together with an ETag (a hash of the body). Every shop has a generation
+counter: when a transaction that wrote receipts for a shop commits, the
+counter is bumped, so older entries for that shop are never read again and
+simply age out of the size-bounded store. Dashboards polling the same range
+therefore get a cached body, or a ``304`` when they send ``If-None-Match``,
+until the next receipt for that shop lands.
+
+Writers call ``mark_changed(db, shop_id)``; the bump happens in an
+``after_commit`` hook, so rolled-back writes do not invalidate anything.
+The backend also keeps the time of each shop's last bump: a body computed
+on a read replica is only stored once the bump is older than the replica
+stickiness window (``settled``), as the replica may not have the write yet
+and the process that computed it may not be the one that made it.
+
+Backends (``KPI_CACHE``):
+
+- ``memory`` (default): per-process LRU of ``KPI_CACHE_SIZE`` entries that
+  expire after ``KPI_CACHE_TTL`` seconds. With several workers each one
+  only sees its own writes; use ``redis`` there, or rely on the TTL.
+- ``redis``: any Redis-compatible server at ``KPI_CACHE_URL`` (needs the
+  ``redis`` package). Generations are shared ``INCR`` counters.
+- ``off``: no caching (ETags are still sent).
+"""
+
+import hashlib
+import os
+import threading
+import time
+from collections import defaultdict
+from dataclasses import dataclass
+from datetime import date
+from typing import Iterable, Protocol
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from .utils.cache import TTLCache
+
+KPI_CACHE = os.getenv("KPI_CACHE", "memory").lower()
+KPI_CACHE_URL = os.getenv("KPI_CACHE_URL", "redis://localhost:6379/0")
+KPI_CACHE_SIZE = int(os.getenv("KPI_CACHE_SIZE", "1024"))
+KPI_CACHE_TTL = float(os.getenv("KPI_CACHE_TTL", "300"))
+
+
+class Backend(Protocol):
+    # True when calls do network I/O (run them off the event loop)
+    blocking: bool
+
+    def get(self, key: str) -> bytes | None: ...
+
+    def set(self, key: str, value: bytes) -> None: ...
+
+    def generation(self, shop_id: int) -> int: ...
+
+    def bump(self, shop_ids: Iterable[int]) -> None: ...
+
+    # Wall-clock time of the shop's last bump, if any
+    def bumped_at(self, shop_id: int) -> float | None: ...
+
+
+class MemoryBackend:
+    blocking = False
+
+    def __init__(
+        self,
+        maxsize: int = KPI_CACHE_SIZE,
+        ttl: float = KPI_CACHE_TTL,
+        name: str = "kpis",
+    ):
+        self.entries: TTLCache[bytes] = TTLCache(name, maxsize, ttl)
+        self._generations: dict[int, int] = defaultdict(int)
+        self._bumped: dict[int, float] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> bytes | None:
+        return self.entries.get(key)
+
+    def set(self, key: str, value: bytes) -> None:
+        self.entries.set(key, value)
+
+    def generation(self, shop_id: int) -> int:
+        return self._generations[shop_id]
+
+    def bump(self, shop_ids: Iterable[int]) -> None:
+        with self._lock:
+            for shop_id in shop_ids:
+                self._generations[shop_id] += 1
+                self._bumped[shop_id] = time.time()
+
+    def bumped_at(self, shop_id: int) -> float | None:
+        return self._bumped.get(shop_id)
+
+
+class RedisBackend:
+    blocking = True
+
+    def __init__(self, client=None, ttl: float = KPI_CACHE_TTL):
+        if client is None:
+            try:
+                import redis
+            except ImportError as exc:  # pragma: no cover - optional dependency
+                raise RuntimeError(
+                    "KPI_CACHE=redis needs the redis package (pip install redis)"
+                ) from exc
+            client = redis.Redis.from_url(KPI_CACHE_URL)
+        self.client = client
+        self.ttl = int(ttl)
+
+    def get(self, key: str) -> bytes | None:
+        return self.client.get(key)
+
+    def set(self, key: str, value: bytes) -> None:
+        self.client.set(key, value, ex=self.ttl or None)
+
+    def generation(self, shop_id: int) -> int:
+        return int(self.client.get(f"kpis:gen:{shop_id}") or 0)
+
+    def bump(self, shop_ids: Iterable[int]) -> None:
+        for shop_id in shop_ids:
+            self.client.incr(f"kpis:gen:{shop_id}")
+            self.client.set(f"kpis:bumped:{shop_id}", time.time(), ex=self.ttl or None)
+
+    def bumped_at(self, shop_id: int) -> float | None:
+        value = self.client.get(f"kpis:bumped:{shop_id}")
+        return None if value is None else float(value)
+
+
+class NullBackend(MemoryBackend):
+    def __init__(self):
+        super().__init__(maxsize=0, ttl=0)
+
+
+def _make_backend() -> Backend:
+    if KPI_CACHE == "redis":
+        return RedisBackend()
+    if KPI_CACHE in ("off", "0", "false", "none"):
+        return NullBackend()
+    return MemoryBackend()
+
+
+backend: Backend = _make_backend()
+
+
+def set_backend(new_backend: Backend) -> None:
+    global backend
+    backend = new_backend
+
+
+@dataclass(frozen=True)
+class CachedKpis:
+    body: bytes
+    etag: str
+
+
+def etag_for(body: bytes) -> str:
+    return '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in candidates or etag in [tag.removeprefix("W/") for tag in candidates]
+
+
+def cache_key(
+    shop_id: int, start: date | None, end: date | None, approx: bool = False
+) -> str:
+    """Key for the shop's current generation; read it before computing."""
+    generation = backend.generation(shop_id)
+    key = f"kpis:{shop_id}:{generation}:{start or ''}:{end or ''}"
+    return key + ":approx" if approx else key
+
+
+def lookup(key: str) -> CachedKpis | None:
+    body = backend.get(key)
+    return None if body is None else CachedKpis(body, etag_for(body))
+
+
+def entry_for(body: bytes) -> CachedKpis:
+    return CachedKpis(body, etag_for(body))
+
+
+def store(key: str, body: bytes) -> CachedKpis:
+    backend.set(key, body)
+    return entry_for(body)
+
+
+def settled(shop_id: int, window: float) -> bool:
+    """Whether ``shop_id``'s last invalidation, by any process sharing the
+    backend, is at least ``window`` seconds old."""
+    bumped = backend.bumped_at(shop_id)
+    return bumped is None or time.time() - bumped >= window
+
+
+# ---------- Invalidation on commit ----------
+
+_PENDING_KEY = "kpi_cache_shops"
+
+
+def mark_changed(db: Session, shop_id: int) -> None:
+    """Invalidate ``shop_id``'s cached KPIs once ``db`` commits."""
+    db.info.setdefault(_PENDING_KEY, set()).add(shop_id)
+
+
+@event.listens_for(Session, "after_commit")
+def _bump_committed(session: Session) -> None:
+    shop_ids = session.info.pop(_PENDING_KEY, None)
+    if shop_ids:
+        backend.bump(shop_ids)
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _forget_rolled_back(session: Session, previous_transaction) -> None:
+    session.info.pop(_PENDING_KEY, None)
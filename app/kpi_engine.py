@@ -0,0 +1,243 @@
+"""Single-statement KPI engine.
+
+All headline metrics for a shop and date range are computed by one SELECT
+over the daily rollups (see ``app.rollups``):
+
+    SELECT totals.*, top.sku, top.name, top.qty, top.revenue
+    FROM (SELECT <metrics> FROM shop_daily_kpis WHERE <range>) AS totals
+    LEFT OUTER JOIN (SELECT ... top N SKUs ...) AS top ON 1 = 1
+
+Both sides are derived tables rather than CTEs/window functions, so the same
+statement runs on SQLite and on MySQL 5.7+ without a dialect-specific path.
+The date range is compiled once into a ``RangeFilter`` and applied to both
+rollup tables.
+
+Scalar metrics are pluggable: ``register_metric`` adds an aggregate over
+``shop_daily_kpis`` to the ``totals`` side of the same statement, so new
+metrics never add round trips.
+
+``compute_portfolio`` does the same for many shops at once: per-shop totals
+(``GROUP BY shop_id``), combined totals and the global top SKUs come back
+from one statement.
+"""
+
+from dataclasses import dataclass, field
+from datetime import date
+from typing import Any, Callable
+
+from sqlalchemy import ColumnElement, and_, desc, func, select, true
+from sqlalchemy.orm import Session
+
+from .instrumentation import span
+from .models import Product, Shop, ShopDailyKpi, ShopDailySkuKpi
+
+MetricExpr = Callable[[type[ShopDailyKpi]], ColumnElement[Any]]
+
+_METRICS: dict[str, MetricExpr] = {}
+
+
+def register_metric(name: str, expr: MetricExpr) -> None:
+    """Register an aggregate over ``ShopDailyKpi`` rows, e.g.
+    ``register_metric("days", lambda t: func.count(t.day))``."""
+    _METRICS[name] = expr
+
+
+def unregister_metric(name: str) -> None:
+    _METRICS.pop(name, None)
+
+
+register_metric("total_receipts", lambda t: func.coalesce(func.sum(t.receipts), 0))
+register_metric("total_revenue", lambda t: func.coalesce(func.sum(t.revenue), 0))
+
+
+@dataclass(frozen=True)
+class RangeFilter:
+    """Shop + inclusive day range, compiled to predicates for any rollup table."""
+
+    shop_id: int
+    start: date | None = None
+    end: date | None = None
+
+    def where(self, table) -> list[ColumnElement[bool]]:
+        clauses = [table.shop_id == self.shop_id]
+        if self.start is not None:
+            clauses.append(table.day >= self.start)
+        if self.end is not None:
+            clauses.append(table.day <= self.end)
+        return clauses
+
+
+@dataclass
+class KpiResult:
+    metrics: dict[str, Any]
+    top_skus: list[dict[str, Any]] = field(default_factory=list)
+
+
+@dataclass(frozen=True)
+class PortfolioFilter:
+    """Several shops + inclusive day range."""
+
+    shop_ids: tuple[int, ...]
+    start: date | None = None
+    end: date | None = None
+
+    def days(self, table) -> list[ColumnElement[bool]]:
+        clauses = []
+        if self.start is not None:
+            clauses.append(table.day >= self.start)
+        if self.end is not None:
+            clauses.append(table.day <= self.end)
+        return clauses
+
+    def where(self, table) -> list[ColumnElement[bool]]:
+        return [table.shop_id.in_(self.shop_ids), *self.days(table)]
+
+
+@dataclass
+class PortfolioResult:
+    per_shop: dict[int, dict[str, Any]]
+    combined: dict[str, Any]
+    top_skus: list[dict[str, Any]] = field(default_factory=list)
+
+
+def _metric_columns(prefix: str = "") -> list:
+    return [expr(ShopDailyKpi).label(prefix + name) for name, expr in _METRICS.items()]
+
+
+def _top_skus(rng: RangeFilter | PortfolioFilter, top_n: int):
+    qty = func.sum(ShopDailySkuKpi.qty).label("qty")
+    return (
+        select(
+            Product.sku.label("sku"),
+            Product.name.label("name"),
+            qty,
+            func.sum(ShopDailySkuKpi.revenue).label("revenue"),
+        )
+        .join(Product, ShopDailySkuKpi.product_id == Product.id)
+        .where(*rng.where(ShopDailySkuKpi))
+        .group_by(Product.id, Product.sku, Product.name)
+        .order_by(desc(qty))
+        .limit(top_n)
+        .subquery("top_skus")
+    )
+
+
+def _top_sku_rows(rows) -> list[dict[str, Any]]:
+    seen: set[str] = set()
+    top = []
+    for row in rows:
+        if row.sku is None or row.sku in seen:
+            continue
+        seen.add(row.sku)
+        top.append(
+            {
+                "sku": row.sku,
+                "name": row.name,
+                "qty": int(row.qty),
+                "revenue": float(row.revenue),
+            }
+        )
+    return top
+
+
+def totals_statement(rng: RangeFilter):
+    """The scalar metrics alone (``approx`` mode pairs them with sketches)."""
+    return select(*_metric_columns()).where(*rng.where(ShopDailyKpi))
+
+
+def build_statement(rng: RangeFilter, top_n: int = 5):
+    totals = totals_statement(rng).subquery("totals")
+    top = _top_skus(rng, top_n)
+
+    return (
+        select(totals, top.c.sku, top.c.name, top.c.qty, top.c.revenue)
+        .select_from(totals.outerjoin(top, true()))
+        .order_by(desc(top.c.qty))
+    )
+
+
+def compute(db: Session, rng: RangeFilter, top_n: int = 5) -> KpiResult:
+    """Run the KPI statement: exactly one round trip."""
+    with span("aggregate"):
+        rows = db.execute(build_statement(rng, top_n)).all()
+
+    # The totals side always yields exactly one row, repeated per top SKU
+    first = rows[0]._mapping
+    return KpiResult(
+        metrics={name: first[name] for name in _METRICS},
+        top_skus=_top_sku_rows(rows),
+    )
+
+
+def build_portfolio_statement(rng: PortfolioFilter, top_n: int = 5):
+    """Per-shop totals x combined totals x global top SKUs, in one SELECT."""
+    # Driven by ``shops`` so shops without rollup rows still get a row
+    per_shop = (
+        select(Shop.id.label("shop_id"), *_metric_columns())
+        .select_from(Shop)
+        .outerjoin(
+            ShopDailyKpi,
+            and_(ShopDailyKpi.shop_id == Shop.id, *rng.days(ShopDailyKpi)),
+        )
+        .where(Shop.id.in_(rng.shop_ids))
+        .group_by(Shop.id)
+        .subquery("per_shop")
+    )
+    combined = (
+        select(*_metric_columns("all_"))
+        .where(*rng.where(ShopDailyKpi))
+        .subquery("combined")
+    )
+    top = _top_skus(rng, top_n)
+
+    return (
+        select(combined, per_shop, top.c.sku, top.c.name, top.c.qty, top.c.revenue)
+        .select_from(combined.outerjoin(per_shop, true()).outerjoin(top, true()))
+        .order_by(per_shop.c.shop_id, desc(top.c.qty))
+    )
+
+
+def compute_portfolio(
+    db: Session, rng: PortfolioFilter, top_n: int = 5
+) -> PortfolioResult:
+    """Per-shop and combined metrics plus the global top SKUs: one round trip."""
+    with span("aggregate"):
+        rows = db.execute(build_portfolio_statement(rng, top_n)).all()
+
+    first = rows[0]._mapping
+    result = PortfolioResult(
+        per_shop={},
+        combined={name: first["all_" + name] for name in _METRICS},
+        top_skus=_top_sku_rows(rows),
+    )
+    for row in rows:
+        m = row._mapping
+        if m["shop_id"] is not None:
+            result.per_shop[m["shop_id"]] = {name: m[name] for name in _METRICS}
+    return result
+
+
+def merge_portfolios(results: list[PortfolioResult], top_n: int = 5) -> PortfolioResult:
+    """Combine ``compute_portfolio`` results from different databases.
+
+    Combined metrics are summed, which is exact for additive metrics such as
+    the default ones. Top SKUs are merged by SKU from each shard's top
+    ``top_n``, so a SKU that is just outside the top everywhere can be missed.
+    """
+    if len(results) == 1:
+        return results[0]
+
+    merged = PortfolioResult(per_shop={}, combined={})
+    skus: dict[str, dict[str, Any]] = {}
+    for result in results:
+        merged.per_shop.update(result.per_shop)
+        for name, value in result.combined.items():
+            merged.combined[name] = (merged.combined.get(name) or 0) + (value or 0)
+        for row in result.top_skus:
+            acc = skus.setdefault(row["sku"], {**row, "qty": 0, "revenue": 0.0})
+            acc["qty"] += row["qty"]
+            acc["revenue"] += row["revenue"]
+    merged.top_skus = sorted(skus.values(), key=lambda r: r["qty"], reverse=True)[
+        :top_n
+    ]
+    return merged
@@ -0,0 +1,171 @@
+"""Bucketed KPI time series (receipts and revenue per hour/day/week/month).
+
+One grouped query returns receipts and revenue per UTC hour for the range
+(quarter-hour for zones with a non-whole-hour offset, e.g. Asia/Kathmandu).
+It reads only the ``receipts (shop_id, created_at, total)`` index:
+
+    SELECT <epoch seconds of created_at> / 3600 AS slot, count(id), sum(total)
+    FROM receipts
+    WHERE shop_id = ? AND created_at >= ? AND created_at < ?
+    GROUP BY slot
+
+The slots are then folded into the shop's local buckets (``zoneinfo``, so
+DST days have 23/25 hourly buckets). Every bucket of the range is
+preallocated as zero in dense arrays and each slot is added at its bucket
+index, so empty buckets cost nothing and no per-bucket lookups are made.
+
+``from``/``to`` are local calendar days (inclusive). Week buckets start on
+Monday and month buckets on the 1st, so the first bucket may start before
+``from``; it only contains receipts from ``from`` onwards.
+"""
+
+from datetime import date, datetime, time, timedelta, timezone
+from typing import Any, Callable
+from zoneinfo import ZoneInfo
+
+from sqlalchemy import Integer, cast, func, literal_column, select
+from sqlalchemy.orm import Session
+
+from .instrumentation import span
+from .models import Receipt
+
+GRANULARITIES = ("hour", "day", "week", "month")
+MAX_BUCKETS = 10_000
+
+# Window used when ``from`` is omitted: ``to`` minus this many days
+DEFAULT_SPAN_DAYS = {"hour": 0, "day": 29, "week": 7 * 12 - 1, "month": 364}
+
+
+class SeriesRangeError(ValueError):
+    """The requested range is empty or has too many buckets."""
+
+
+def _utc(local_day: date, tz: ZoneInfo) -> datetime:
+    """Naive UTC instant of local midnight, the format receipts are stored in."""
+    start = datetime.combine(local_day, time.min, tzinfo=tz)
+    return start.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def _slot_seconds(tz: ZoneInfo, start: datetime, end: datetime) -> int:
+    offsets = {
+        tz.utcoffset(moment) for moment in (start, end, start + (end - start) / 2)
+    }
+    return 3600 if all(o.total_seconds() % 3600 == 0 for o in offsets) else 900
+
+
+def _slot_expr(dialect: str, width: int):
+    """``created_at`` as a whole number of ``width``-second slots since 1970."""
+    if dialect == "sqlite":
+        # Integer division in SQLite
+        return cast(func.strftime("%s", Receipt.created_at), Integer) / width
+    if dialect in ("mysql", "mariadb"):
+        seconds = func.timestampdiff(
+            literal_column("SECOND"), literal_column("'1970-01-01'"), Receipt.created_at
+        )
+        return seconds.op("DIV")(width)
+    return func.floor(func.extract("epoch", Receipt.created_at) / width)
+
+
+def build_statement(
+    shop_id: int, start: datetime, end: datetime, width: int, dialect: str
+):
+    slot = _slot_expr(dialect, width).label("slot")
+    return (
+        select(slot, func.count(Receipt.id), func.coalesce(func.sum(Receipt.total), 0))
+        .where(
+            Receipt.shop_id == shop_id,
+            Receipt.created_at >= start,
+            Receipt.created_at < end,
+        )
+        .group_by(slot)
+    )
+
+
+def _truncate(local: datetime, granularity: str) -> date:
+    day = local.date()
+    if granularity == "week":
+        return day - timedelta(days=day.weekday())
+    if granularity == "month":
+        return day.replace(day=1)
+    return day
+
+
+def _next(day: date, granularity: str) -> date:
+    if granularity == "week":
+        return day + timedelta(days=7)
+    if granularity == "month":
+        return (day.replace(day=28) + timedelta(days=4)).replace(day=1)
+    return day + timedelta(days=1)
+
+
+def _buckets(
+    tz: ZoneInfo, granularity: str, start: date, end: date
+) -> tuple[list[datetime], Callable[[datetime], int]]:
+    """Bucket labels (aware, local) and a UTC-instant -> bucket index function."""
+    utc_start, utc_end = _utc(start, tz), _utc(end + timedelta(days=1), tz)
+
+    if granularity == "hour":
+        count = int((utc_end - utc_start).total_seconds() // 3600)
+        if count > MAX_BUCKETS:
+            raise SeriesRangeError(f"Too many buckets ({count} > {MAX_BUCKETS})")
+        labels = [
+            (utc_start + timedelta(hours=i)).replace(tzinfo=timezone.utc).astimezone(tz)
+            for i in range(count)
+        ]
+
+        def locate(instant: datetime) -> int:
+            return int((instant - utc_start).total_seconds() // 3600)
+
+        return labels, locate
+
+    days: list[date] = []
+    day = _truncate(datetime.combine(start, time.min), granularity)
+    while day <= end:
+        days.append(day)
+        if len(days) > MAX_BUCKETS:
+            raise SeriesRangeError(f"Too many buckets (> {MAX_BUCKETS})")
+        day = _next(day, granularity)
+    index = {day: i for i, day in enumerate(days)}
+
+    def locate(instant: datetime) -> int:
+        local = instant.replace(tzinfo=timezone.utc).astimezone(tz)
+        return index[_truncate(local, granularity)]
+
+    labels = [datetime.combine(day, time.min, tzinfo=tz) for day in days]
+    return labels, locate
+
+
+def compute(
+    db: Session,
+    shop_id: int,
+    tz_name: str,
+    granularity: str,
+    start: date,
+    end: date,
+) -> list[dict[str, Any]]:
+    """Zero-filled ``{"bucket", "receipts", "revenue"}`` points, oldest first."""
+    if granularity not in GRANULARITIES:
+        raise SeriesRangeError(f"Unknown granularity {granularity!r}")
+    if start > end:
+        raise SeriesRangeError("'from' must not be after 'to'")
+
+    tz = ZoneInfo(tz_name)
+    labels, locate = _buckets(tz, granularity, start, end)
+    utc_start, utc_end = _utc(start, tz), _utc(end + timedelta(days=1), tz)
+    width = _slot_seconds(tz, utc_start, utc_end)
+
+    receipts = [0] * len(labels)
+    revenue = [0.0] * len(labels)
+    stmt = build_statement(
+        shop_id, utc_start, utc_end, width, db.get_bind().dialect.name
+    )
+    with span("aggregate"):
+        for slot, count, total in db.execute(stmt):
+            i = locate(datetime(1970, 1, 1) + timedelta(seconds=int(slot) * width))
+            receipts[i] += count
+            revenue[i] += float(total)
+
+    return [
+        {"bucket": label, "receipts": receipts[i], "revenue": round(revenue[i], 2)}
+        for i, label in enumerate(labels)
+    ]
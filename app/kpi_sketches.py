@@ -0,0 +1,213 @@
+"""Approximate KPIs from per-day sketches (``GET /shops/{id}/kpis?approx=true``).
+
+Each ``shop_daily_sketches`` row summarises one shop-day with a Space-Saving
+summary of product quantities (``KPI_SKETCH_TOPK`` counters, default 64) and
+a HyperLogLog of the products sold (``app.utils.sketches``). Ingest adds
+each batch's counts to its transaction (``apply``); they are merged into
+the stored rows once per shop-day when the transaction commits, however
+many batches it wrote, so each sketch blob is read and written once. That
+is after the rollup upserts, which already serialise writers of a
+shop-day. ``rollups.rebuild`` rebuilds them exactly from
+``shop_daily_sku_kpis``.
+
+An approximate read fetches one sketch row per day and merges them, instead
+of grouping one rollup row per day and product. Totals stay exact. Bounds,
+for a range whose total quantity sold is ``N`` and ``k`` counters:
+
+- a reported ``qty`` overestimates the true quantity by at most its
+  ``qty_error`` (itself at most ``N / k``); any SKU with more than ``N / k``
+  units is guaranteed to be ranked;
+- ``revenue`` is only counted while a SKU is tracked, so it can be low for
+  SKUs near the cut-off;
+- ``distinct_products`` has a relative standard error of about 2.3%.
+
+``KPI_SKETCHES=0`` stops maintaining the sketches (``approx`` then reads
+whatever rows exist).
+"""
+
+import os
+from datetime import date
+
+from sqlalchemy import bindparam, delete, event, insert, select, update
+from sqlalchemy.orm import Session
+
+from . import kpi_engine
+from .instrumentation import span
+from .models import Product, ShopDailySketch, ShopDailySkuKpi
+from .utils.sketches import HyperLogLog, TopK
+
+KPI_SKETCHES = os.getenv("KPI_SKETCHES", "1").lower() in ("1", "true", "yes")
+TOPK_CAPACITY = int(os.getenv("KPI_SKETCH_TOPK", "64"))
+HLL_PRECISION = 11
+
+# day -> product_id -> (qty, revenue)
+DayCounts = dict[date, dict[int, tuple[float, float]]]
+
+
+def _sketch(counts: dict[int, tuple[float, float]]) -> tuple[TopK, HyperLogLog]:
+    hll = HyperLogLog(HLL_PRECISION)
+    for product_id in counts:
+        hll.add(product_id)
+    return TopK.exact(TOPK_CAPACITY, counts), hll
+
+
+def _row(shop_id: int, day: date, top: TopK, hll: HyperLogLog) -> dict:
+    return {
+        "shop_id": shop_id,
+        "day": day,
+        "top_products": top.to_json(),
+        "products_hll": hll.to_bytes(),
+    }
+
+
+_PENDING_KEY = "kpi_sketch_counts"
+
+
+def apply(db: Session, shop_id: int, per_day: DayCounts) -> None:
+    """Add a batch of receipts to the shop's day sketches when ``db`` commits."""
+    if not KPI_SKETCHES or not per_day:
+        return
+    pending: dict[int, DayCounts] = db.info.setdefault(_PENDING_KEY, {})
+    days = pending.setdefault(shop_id, {})
+    for day, counts in per_day.items():
+        merged = days.setdefault(day, {})
+        for product_id, (qty, revenue) in counts.items():
+            old_qty, old_revenue = merged.get(product_id, (0, 0.0))
+            merged[product_id] = (old_qty + qty, old_revenue + revenue)
+
+
+def _merge(db: Session, shop_id: int, per_day: DayCounts) -> None:
+    """Merge counts into the stored day sketches: one read and one write per
+    day for the whole transaction."""
+    table = ShopDailySketch.__table__
+    stored = {
+        day: (TopK.from_json(TOPK_CAPACITY, top), HyperLogLog(HLL_PRECISION, hll))
+        for day, top, hll in db.execute(
+            select(table.c.day, table.c.top_products, table.c.products_hll)
+            .where(table.c.shop_id == shop_id, table.c.day.in_(list(per_day)))
+            .with_for_update()
+        )
+    }
+
+    inserts, updates = [], []
+    for day, counts in sorted(per_day.items()):
+        top, hll = _sketch(counts)
+        if day in stored:
+            old_top, old_hll = stored[day]
+            updates.append(
+                {
+                    "b_day": day,
+                    "b_top": old_top.merge(top).to_json(),
+                    "b_hll": old_hll.merge(hll).to_bytes(),
+                }
+            )
+        else:
+            inserts.append(_row(shop_id, day, top, hll))
+    if inserts:
+        db.execute(insert(table), inserts)
+    if updates:
+        db.execute(
+            update(table)
+            .where(table.c.shop_id == shop_id, table.c.day == bindparam("b_day"))
+            .values(top_products=bindparam("b_top"), products_hll=bindparam("b_hll")),
+            updates,
+        )
+
+
+@event.listens_for(Session, "before_commit")
+def _merge_pending(session: Session) -> None:
+    pending = session.info.pop(_PENDING_KEY, None)
+    for shop_id, per_day in sorted((pending or {}).items()):
+        _merge(session, shop_id, per_day)
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _forget_rolled_back(session: Session, previous_transaction) -> None:
+    session.info.pop(_PENDING_KEY, None)
+
+
+def rebuild(db: Session, shop_id: int | None = None) -> None:
+    """Recompute the sketches from ``shop_daily_sku_kpis``. Does not commit."""
+    # The rollups already include this transaction's pending counts
+    pending = db.info.get(_PENDING_KEY)
+    if pending:
+        if shop_id is None:
+            pending.clear()
+        else:
+            pending.pop(shop_id, None)
+    sketch_delete = delete(ShopDailySketch)
+    source = select(
+        ShopDailySkuKpi.shop_id,
+        ShopDailySkuKpi.day,
+        ShopDailySkuKpi.product_id,
+        ShopDailySkuKpi.qty,
+        ShopDailySkuKpi.revenue,
+    ).order_by(ShopDailySkuKpi.shop_id, ShopDailySkuKpi.day)
+    if shop_id is not None:
+        sketch_delete = sketch_delete.where(ShopDailySketch.shop_id == shop_id)
+        source = source.where(ShopDailySkuKpi.shop_id == shop_id)
+    db.execute(sketch_delete)
+
+    rows: list[dict] = []
+    current: tuple[int, date] | None = None
+    counts: dict[int, tuple[float, float]] = {}
+    for row_shop, day, product_id, qty, revenue in db.execute(
+        source.execution_options(yield_per=10_000)
+    ):
+        if current != (row_shop, day):
+            if current is not None:
+                rows.append(_row(*current, *_sketch(counts)))
+            current, counts = (row_shop, day), {}
+        counts[product_id] = (qty, float(revenue))
+        if len(rows) >= 1000:
+            db.execute(insert(ShopDailySketch), rows)
+            rows = []
+    if current is not None:
+        rows.append(_row(*current, *_sketch(counts)))
+    if rows:
+        db.execute(insert(ShopDailySketch), rows)
+
+
+def compute(
+    db: Session, rng: kpi_engine.RangeFilter, top_n: int = 5
+) -> kpi_engine.KpiResult:
+    """Exact totals, approximate top SKUs and distinct products."""
+    with span("aggregate"):
+        totals = db.execute(kpi_engine.totals_statement(rng)).one()._mapping
+        sketches = db.execute(
+            select(ShopDailySketch.top_products, ShopDailySketch.products_hll).where(
+                *rng.where(ShopDailySketch)
+            )
+        ).all()
+
+        top = TopK(TOPK_CAPACITY)
+        hll = HyperLogLog(HLL_PRECISION)
+        for top_json, registers in sketches:
+            top = top.merge(TopK.from_json(TOPK_CAPACITY, top_json))
+            hll = hll.merge(HyperLogLog(HLL_PRECISION, registers))
+        ranked = top.top(top_n)
+
+        names = {
+            pid: (sku, name)
+            for pid, sku, name in db.execute(
+                select(Product.id, Product.sku, Product.name).where(
+                    Product.id.in_([item for item, *_ in ranked])
+                )
+            )
+        }
+
+    metrics = dict(totals)
+    metrics["distinct_products"] = hll.count() if sketches else 0
+    return kpi_engine.KpiResult(
+        metrics=metrics,
+        top_skus=[
+            {
+                "sku": names[pid][0],
+                "name": names[pid][1],
+                "qty": int(count),
+                "revenue": round(payload, 2),
+                "qty_error": int(error),
+            }
+            for pid, count, error, payload in ranked
+        ],
+    )
@@ -7,19 +7,44 @@ from .routers import (
     products_router,
     receipts_router,
     kpis_router,
+    metrics_router,
+    portfolio_router,
+    devices_router,
 )
-from .database import Base, engine
+from . import catalog, changes, idempotency, instrumentation, write_behind  # noqa: F401
+from .database import ASYNC_DB, SessionLocal, engine
+from .migrate import upgrade_to_head
+from .utils import hashing
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    # Startup
-    Base.metadata.create_all(bind=engine)
+    # Startup: bring the schema to the latest migration
+    upgrade_to_head(engine)
+    catalog.warm(SessionLocal)
+    purger = idempotency.Purger(SessionLocal, idempotency.IDEMPOTENCY_PURGE_SECONDS)
+    purger.start()
+    queued_purger = idempotency.Purger(
+        SessionLocal,
+        write_behind.WRITE_BEHIND_PURGE_SECONDS,
+        write_behind.purge_materialized,
+        "materialized queued receipts",
+    )
+    queued_purger.start()
+    if write_behind.queue is not None:
+        # Commits what a previous run left queued, then keeps draining
+        write_behind.queue.start()
     yield
-    # Shutdown (de momento nada)
+    if write_behind.queue is not None:
+        write_behind.queue.stop()
+    queued_purger.stop()
+    purger.stop()
+    hashing.pool.shutdown()
 
 
 app = FastAPI(title="Sync KPIs API", lifespan=lifespan)
+if instrumentation.REQUEST_METRICS:
+    app.add_middleware(instrumentation.RequestMetricsMiddleware)
 
 
 @app.get("/health")
@@ -27,8 +52,17 @@ def health() -> dict:
     return {"status": "ok"}
 
 
-app.include_router(auth_router.router)
-app.include_router(shops_router.router)
-app.include_router(products_router.router)
-app.include_router(receipts_router.router)
-app.include_router(kpis_router.router)
+for module in (
+    auth_router,
+    shops_router,
+    products_router,
+    receipts_router,
+    kpis_router,
+    portfolio_router,
+    devices_router,
+):
+    # ASYNC_DB=1 swaps every router for its AsyncSession twin
+    app.include_router(module.async_router if ASYNC_DB else module.router)
+
+
+app.include_router(metrics_router.router)
@@ -0,0 +1,58 @@
+"""Apply the Alembic migrations in ``app/migrations``.
+
+``upgrade_to_head`` is what the app runs on startup (and the tests before
+the first request). Databases created by the old ``create_all`` startup have
+no ``alembic_version`` table: if their schema already matches the models
+they are stamped at ``head``, otherwise every migration runs (the baseline
+only creates the tables they are missing).
+
+CLI:
+
+    python -m app.migrate            # upgrade to head
+    alembic upgrade head             # same, through alembic.ini
+"""
+
+import sys
+from pathlib import Path
+
+from alembic import command
+from alembic.autogenerate import compare_metadata
+from alembic.config import Config
+from alembic.migration import MigrationContext
+from sqlalchemy import inspect
+from sqlalchemy.engine import Engine
+
+from . import models  # noqa: F401
+from .database import Base
+
+MIGRATIONS_DIR = Path(__file__).parent / "migrations"
+
+
+def _config(connection) -> Config:
+    config = Config()
+    config.set_main_option("script_location", str(MIGRATIONS_DIR))
+    config.attributes["connection"] = connection
+    return config
+
+
+def upgrade_to_head(engine: Engine) -> None:
+    with engine.begin() as connection:
+        config = _config(connection)
+        tables = set(inspect(connection).get_table_names())
+        if tables and "alembic_version" not in tables:
+            context = MigrationContext.configure(connection)
+            if not compare_metadata(context, Base.metadata):
+                command.stamp(config, "head")
+        command.upgrade(config, "head")
+
+
+def main() -> int:
+    from .database import engine
+
+    upgrade_to_head(engine)
+    sys.stdout.write("Database schema is at head\n")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,152 @@
+"""Baseline: the schema previously created by ``Base.metadata.create_all``.
+
+Databases from before migrations existed were created by the app's startup
+``create_all``, which also added any table new to the models. Like it, this
+revision only creates the tables that are missing, so it can be applied to
+such a database as well as to an empty one.
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-18
+"""
+
+import sqlalchemy as sa
+from alembic import op
+
+revision = "0001"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def _missing(table: str) -> bool:
+    return not sa.inspect(op.get_bind()).has_table(table)
+
+
+def upgrade() -> None:
+    if _missing("users"):
+        op.create_table(
+            "users",
+            sa.Column("id", sa.Integer(), primary_key=True),
+            sa.Column("email", sa.String(255), nullable=False),
+            sa.Column("password_hash", sa.String(255), nullable=False),
+            sa.Column("is_active", sa.Boolean(), nullable=False),
+        )
+        op.create_index("ix_users_id", "users", ["id"])
+        op.create_index("ix_users_email", "users", ["email"], unique=True)
+
+    if _missing("shops"):
+        op.create_table(
+            "shops",
+            sa.Column("id", sa.Integer(), primary_key=True),
+            sa.Column("name", sa.String(120), nullable=False),
+            sa.Column(
+                "owner_id", sa.Integer(), sa.ForeignKey("users.id"), nullable=False
+            ),
+            sa.UniqueConstraint("owner_id", "name", name="uq_shop_owner_name"),
+        )
+        op.create_index("ix_shops_id", "shops", ["id"])
+        op.create_index("ix_shops_name", "shops", ["name"])
+
+    if _missing("products"):
+        op.create_table(
+            "products",
+            sa.Column("id", sa.Integer(), primary_key=True),
+            sa.Column("sku", sa.String(64), nullable=False),
+            sa.Column("name", sa.String(255), nullable=False),
+            sa.Column("price", sa.Numeric(10, 2), nullable=False),
+        )
+        op.create_index("ix_products_id", "products", ["id"])
+        op.create_index("ix_products_sku", "products", ["sku"], unique=True)
+
+    if _missing("receipts"):
+        op.create_table(
+            "receipts",
+            sa.Column("id", sa.Integer(), primary_key=True),
+            sa.Column(
+                "shop_id", sa.Integer(), sa.ForeignKey("shops.id"), nullable=False
+            ),
+            sa.Column(
+                "created_at",
+                sa.DateTime(timezone=True),
+                server_default=sa.func.now(),
+                nullable=False,
+            ),
+            sa.Column("total", sa.Numeric(12, 2), nullable=False),
+        )
+        op.create_index("ix_receipts_id", "receipts", ["id"])
+        op.create_index("ix_receipts_shop_id", "receipts", ["shop_id"])
+
+    if _missing("receipt_lines"):
+        op.create_table(
+            "receipt_lines",
+            sa.Column("id", sa.Integer(), primary_key=True),
+            sa.Column(
+                "receipt_id",
+                sa.Integer(),
+                sa.ForeignKey("receipts.id", ondelete="CASCADE"),
+                nullable=False,
+            ),
+            sa.Column(
+                "product_id", sa.Integer(), sa.ForeignKey("products.id"), nullable=False
+            ),
+            sa.Column("qty", sa.Integer(), nullable=False),
+            sa.Column("unit_price", sa.Numeric(10, 2), nullable=False),
+        )
+        op.create_index("ix_receipt_lines_id", "receipt_lines", ["id"])
+        op.create_index("ix_receipt_lines_receipt_id", "receipt_lines", ["receipt_id"])
+
+    if _missing("idempotency_keys"):
+        op.create_table(
+            "idempotency_keys",
+            sa.Column("id", sa.Integer(), primary_key=True),
+            sa.Column("key", sa.String(64), nullable=False),
+            sa.Column(
+                "receipt_id", sa.Integer(), sa.ForeignKey("receipts.id"), nullable=True
+            ),
+        )
+        op.create_index(
+            "ix_idempotency_keys_key", "idempotency_keys", ["key"], unique=True
+        )
+
+    if _missing("shop_daily_kpis"):
+        op.create_table(
+            "shop_daily_kpis",
+            sa.Column(
+                "shop_id", sa.Integer(), sa.ForeignKey("shops.id"), primary_key=True
+            ),
+            sa.Column("day", sa.Date(), primary_key=True),
+            sa.Column("receipts", sa.Integer(), nullable=False),
+            sa.Column("revenue", sa.Numeric(14, 2), nullable=False),
+        )
+
+    if _missing("shop_daily_sku_kpis"):
+        op.create_table(
+            "shop_daily_sku_kpis",
+            sa.Column(
+                "shop_id", sa.Integer(), sa.ForeignKey("shops.id"), primary_key=True
+            ),
+            sa.Column("day", sa.Date(), primary_key=True),
+            sa.Column(
+                "product_id",
+                sa.Integer(),
+                sa.ForeignKey("products.id"),
+                primary_key=True,
+            ),
+            sa.Column("qty", sa.Integer(), nullable=False),
+            sa.Column("revenue", sa.Numeric(14, 2), nullable=False),
+        )
+
+
+def downgrade() -> None:
+    for table in (
+        "shop_daily_sku_kpis",
+        "shop_daily_kpis",
+        "idempotency_keys",
+        "receipt_lines",
+        "receipts",
+        "products",
+        "shops",
+        "users",
+    ):
+        op.drop_table(table)
@@ -0,0 +1,58 @@
+"""Composite indexes for the KPI range scans and the top-SKU join.
+
+- ``receipts (shop_id, created_at, total)``: per-shop date-range scans
+  (rollup rebuilds, time series) read only the index. Replaces the
+  single-column ``shop_id`` index, which is its leftmost prefix.
+- ``receipt_lines (receipt_id, product_id, qty, unit_price)``: joining the
+  lines of the receipts in range and summing per product reads only the
+  index. Replaces the single-column ``receipt_id`` index.
+- ``receipt_lines (product_id)``: product lookups / FK checks.
+- ``shop_daily_sku_kpis (shop_id, day, product_id, qty, revenue)``: the
+  top-SKU aggregate over a range without touching the table rows.
+
+New indexes are created before the ones they replace are dropped, so MySQL
+always has an index backing each foreign key.
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18
+"""
+
+from alembic import op
+
+revision = "0002"
+down_revision = "0001"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_index(
+        "ix_receipts_shop_created", "receipts", ["shop_id", "created_at", "total"]
+    )
+    op.drop_index("ix_receipts_shop_id", table_name="receipts")
+
+    op.create_index(
+        "ix_receipt_lines_receipt_product",
+        "receipt_lines",
+        ["receipt_id", "product_id", "qty", "unit_price"],
+    )
+    op.create_index("ix_receipt_lines_product_id", "receipt_lines", ["product_id"])
+    op.drop_index("ix_receipt_lines_receipt_id", table_name="receipt_lines")
+
+    op.create_index(
+        "ix_shop_daily_sku_kpis_range",
+        "shop_daily_sku_kpis",
+        ["shop_id", "day", "product_id", "qty", "revenue"],
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_shop_daily_sku_kpis_range", table_name="shop_daily_sku_kpis")
+
+    op.create_index("ix_receipt_lines_receipt_id", "receipt_lines", ["receipt_id"])
+    op.drop_index("ix_receipt_lines_product_id", table_name="receipt_lines")
+    op.drop_index("ix_receipt_lines_receipt_product", table_name="receipt_lines")
+
+    op.create_index("ix_receipts_shop_id", "receipts", ["shop_id"])
+    op.drop_index("ix_receipts_shop_created", table_name="receipts")
@@ -0,0 +1,26 @@
+"""Per-shop timezone for the KPI time series.
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18
+"""
+
+import sqlalchemy as sa
+from alembic import op
+
+revision = "0003"
+down_revision = "0002"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column(
+        "shops",
+        sa.Column("timezone", sa.String(64), nullable=False, server_default="UTC"),
+    )
+
+
+def downgrade() -> None:
+    with op.batch_alter_table("shops") as batch:
+        batch.drop_column("timezone")
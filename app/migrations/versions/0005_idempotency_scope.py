@@ -0,0 +1,76 @@
+"""Idempotency keys scoped per shop, with payload hash, response and expiry.
+
+Existing keys are attached to the shop of their receipt and expire one TTL
+after the upgrade; keys without a receipt are dropped. The global unique
+index on ``key`` becomes a unique constraint on ``(shop_id, key)``.
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-18
+"""
+
+from datetime import datetime, timedelta
+
+import sqlalchemy as sa
+from alembic import op
+
+revision = "0005"
+down_revision = "0004"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    with op.batch_alter_table("idempotency_keys") as batch:
+        batch.add_column(sa.Column("shop_id", sa.Integer(), nullable=True))
+        batch.add_column(sa.Column("request_hash", sa.String(64), nullable=True))
+        batch.add_column(sa.Column("response", sa.JSON(), nullable=True))
+        batch.add_column(sa.Column("expires_at", sa.DateTime(), nullable=True))
+
+    keys = sa.table(
+        "idempotency_keys",
+        sa.column("shop_id", sa.Integer()),
+        sa.column("receipt_id", sa.Integer()),
+        sa.column("expires_at", sa.DateTime()),
+    )
+    receipts = sa.table(
+        "receipts", sa.column("id", sa.Integer()), sa.column("shop_id", sa.Integer())
+    )
+    op.execute(sa.delete(keys).where(keys.c.receipt_id.is_(None)))
+    op.execute(
+        sa.update(keys).values(
+            shop_id=sa.select(receipts.c.shop_id)
+            .where(receipts.c.id == keys.c.receipt_id)
+            .scalar_subquery(),
+            expires_at=datetime.utcnow() + timedelta(hours=24),
+        )
+    )
+
+    with op.batch_alter_table("idempotency_keys") as batch:
+        batch.drop_index("ix_idempotency_keys_key")
+        batch.alter_column("shop_id", existing_type=sa.Integer(), nullable=False)
+        batch.alter_column("expires_at", existing_type=sa.DateTime(), nullable=False)
+        batch.create_foreign_key(
+            "fk_idempotency_keys_shop_id", "shops", ["shop_id"], ["id"]
+        )
+        batch.create_unique_constraint("uq_idempotency_shop_key", ["shop_id", "key"])
+        batch.create_index("ix_idempotency_keys_expires_at", ["expires_at"])
+
+
+def downgrade() -> None:
+    # Keys were only unique per shop: keep the first row of each key
+    keys = sa.table("idempotency_keys", sa.column("id"), sa.column("key"))
+    first = (
+        sa.select(sa.func.min(keys.c.id).label("id")).group_by(keys.c.key).subquery()
+    )
+    op.execute(sa.delete(keys).where(keys.c.id.not_in(sa.select(first.c.id))))
+
+    with op.batch_alter_table("idempotency_keys") as batch:
+        batch.drop_index("ix_idempotency_keys_expires_at")
+        batch.drop_constraint("uq_idempotency_shop_key", type_="unique")
+        batch.drop_constraint("fk_idempotency_keys_shop_id", type_="foreignkey")
+        batch.drop_column("expires_at")
+        batch.drop_column("response")
+        batch.drop_column("request_hash")
+        batch.drop_column("shop_id")
+        batch.create_index("ix_idempotency_keys_key", ["key"], unique=True)
@@ -0,0 +1,72 @@
+"""Change sequences and updated_at for device sync.
+
+Existing rows are numbered by id: products on the global ``products``
+counter, receipts on their shop's ``last_change_seq``, so a device syncing
+from scratch receives everything.
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-18
+"""
+
+import sqlalchemy as sa
+from alembic import op
+
+revision = "0006"
+down_revision = "0005"
+branch_labels = None
+depends_on = None
+
+SYNCED = ("shops", "products", "receipts")
+
+
+def upgrade() -> None:
+    for table in SYNCED:
+        op.add_column(table, sa.Column("updated_at", sa.DateTime(), nullable=True))
+    op.add_column(
+        "shops",
+        sa.Column("change_seq", sa.BigInteger(), nullable=False, server_default="1"),
+    )
+    op.add_column(
+        "shops",
+        sa.Column(
+            "last_change_seq", sa.BigInteger(), nullable=False, server_default="1"
+        ),
+    )
+    op.add_column("products", sa.Column("change_seq", sa.BigInteger(), nullable=True))
+    op.add_column("receipts", sa.Column("change_seq", sa.BigInteger(), nullable=True))
+    op.create_table(
+        "change_counters",
+        sa.Column("name", sa.String(32), primary_key=True),
+        sa.Column("value", sa.BigInteger(), nullable=False),
+    )
+
+    op.execute("UPDATE products SET change_seq = id")
+    # Shop rows sort after their receipts; head = last number handed out
+    op.execute(
+        "UPDATE shops SET last_change_seq = 1 + COALESCE("
+        "(SELECT MAX(r.id) FROM receipts r WHERE r.shop_id = shops.id), 0)"
+    )
+    op.execute("UPDATE shops SET change_seq = last_change_seq")
+    op.execute("UPDATE receipts SET change_seq = id, updated_at = created_at")
+    op.execute(
+        "INSERT INTO change_counters (name, value) "
+        "SELECT 'products', COALESCE(MAX(id), 0) FROM products"
+    )
+
+    op.create_index("ix_products_change_seq", "products", ["change_seq"])
+    op.create_index(
+        "ix_receipts_shop_change_seq", "receipts", ["shop_id", "change_seq"]
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_receipts_shop_change_seq", table_name="receipts")
+    op.drop_index("ix_products_change_seq", table_name="products")
+    op.drop_table("change_counters")
+    with op.batch_alter_table("shops") as batch:
+        batch.drop_column("last_change_seq")
+    for table in SYNCED:
+        with op.batch_alter_table(table) as batch:
+            batch.drop_column("change_seq")
+            batch.drop_column("updated_at")
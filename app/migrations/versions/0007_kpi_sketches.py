@@ -0,0 +1,31 @@
+"""Per-shop, per-day sketches for approximate KPIs.
+
+The table starts empty; fill it for existing receipts with
+``python -m app.rollups rebuild``.
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2026-10-18
+"""
+
+import sqlalchemy as sa
+from alembic import op
+
+revision = "0007"
+down_revision = "0006"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "shop_daily_sketches",
+        sa.Column("shop_id", sa.Integer(), sa.ForeignKey("shops.id"), primary_key=True),
+        sa.Column("day", sa.Date(), primary_key=True),
+        sa.Column("top_products", sa.JSON(), nullable=False),
+        sa.Column("products_hll", sa.LargeBinary(), nullable=False),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("shop_daily_sketches")
@@ -0,0 +1,94 @@
+"""Receipt archives; monthly RANGE partitions on MySQL and MariaDB.
+
+``receipt_archives`` records the months moved out of the hot tables by
+``app.archive``. On MySQL/MariaDB, ``receipts`` (by ``created_at``) and the
+daily rollups (by ``day``) are partitioned per month (see ``app.partitions``),
+from their oldest row to ``PARTITION_MONTHS_AHEAD`` months from now. That
+needs their foreign keys dropped and ``receipts``' primary key widened to
+``(id, created_at)``; on large tables this rebuilds them, run it in a
+maintenance window.
+
+Revision ID: 0008
+Revises: 0007
+Create Date: 2026-10-18
+"""
+
+from datetime import date
+
+import sqlalchemy as sa
+from alembic import op
+
+from app import partitions
+
+revision = "0008"
+down_revision = "0007"
+branch_labels = None
+depends_on = None
+
+# (table, columns, referred table, ondelete) dropped for partitioning
+FOREIGN_KEYS = [
+    ("receipts", ["shop_id"], "shops", None),
+    ("receipt_lines", ["receipt_id"], "receipts", "CASCADE"),
+    ("idempotency_keys", ["receipt_id"], "receipts", None),
+    ("shop_daily_kpis", ["shop_id"], "shops", None),
+    ("shop_daily_sku_kpis", ["shop_id"], "shops", None),
+    ("shop_daily_sku_kpis", ["product_id"], "products", None),
+    ("shop_daily_sketches", ["shop_id"], "shops", None),
+]
+
+
+def upgrade() -> None:
+    op.create_table(
+        "receipt_archives",
+        sa.Column("month", sa.Date(), primary_key=True),
+        sa.Column("path", sa.String(512), nullable=False),
+        sa.Column("receipts", sa.Integer(), nullable=False),
+        sa.Column("lines", sa.Integer(), nullable=False),
+        sa.Column("archived_at", sa.DateTime(), nullable=False),
+    )
+    if partitions.supported(op.get_bind()):
+        _partition()
+
+
+def downgrade() -> None:
+    if partitions.supported(op.get_bind()):
+        _unpartition()
+    op.drop_table("receipt_archives")
+
+
+def _partition() -> None:
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+    for table, columns, referred, _ in FOREIGN_KEYS:
+        for fk in inspector.get_foreign_keys(table):
+            if (
+                fk["constrained_columns"] == columns
+                and fk["referred_table"] == referred
+            ):
+                op.drop_constraint(fk["name"], table, type_="foreignkey")
+    op.execute(
+        "ALTER TABLE receipts DROP PRIMARY KEY, ADD PRIMARY KEY (id, created_at)"
+    )
+
+    last = partitions.add_months(
+        partitions.month_start(date.today()), partitions.PARTITION_MONTHS_AHEAD
+    )
+    for table, column in partitions.PARTITIONED.items():
+        oldest = bind.execute(sa.text(f"SELECT MIN({column}) FROM {table}")).scalar()
+        first = oldest.date() if hasattr(oldest, "date") else oldest
+        op.execute(partitions.partition_table_ddl(table, first or last, last))
+
+
+def _unpartition() -> None:
+    for table in partitions.PARTITIONED:
+        op.execute(f"ALTER TABLE {table} REMOVE PARTITIONING")
+    op.execute("ALTER TABLE receipts DROP PRIMARY KEY, ADD PRIMARY KEY (id)")
+    for table, columns, referred, ondelete in FOREIGN_KEYS:
+        op.create_foreign_key(
+            f"fk_{table}_{columns[0]}",
+            table,
+            referred,
+            columns,
+            ["id"],
+            ondelete=ondelete,
+        )
@@ -0,0 +1,42 @@
+"""Receipts accepted through the write-behind queue: pending rows holding
+their idempotency keys, then their outcomes.
+
+Revision ID: 0009
+Revises: 0008
+Create Date: 2026-10-18
+"""
+
+import sqlalchemy as sa
+from alembic import op
+
+revision = "0009"
+down_revision = "0008"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "queued_receipts",
+        sa.Column("handle", sa.String(32), primary_key=True),
+        sa.Column("shop_id", sa.Integer(), nullable=False),
+        sa.Column("status", sa.String(16), nullable=False),
+        sa.Column("idempotency_key", sa.String(64), nullable=True),
+        sa.Column("request_hash", sa.String(64), nullable=True),
+        sa.Column("receipt_id", sa.Integer(), nullable=True),
+        sa.Column("total", sa.Numeric(12, 2), nullable=True),
+        sa.Column("detail", sa.String(255), nullable=True),
+        sa.Column("accepted_at", sa.DateTime(), nullable=False),
+        sa.Column("materialized_at", sa.DateTime(), nullable=True),
+        sa.UniqueConstraint(
+            "shop_id", "idempotency_key", name="uq_queued_receipts_shop_key"
+        ),
+    )
+    op.create_index(
+        "ix_queued_receipts_materialized_at", "queued_receipts", ["materialized_at"]
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_queued_receipts_materialized_at", table_name="queued_receipts")
+    op.drop_table("queued_receipts")
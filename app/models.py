@@ -1,7 +1,14 @@
+from datetime import datetime, timezone
+
 from sqlalchemy import (
+    BigInteger,
     Boolean,
+    Date,
     ForeignKey,
+    Index,
     Integer,
+    JSON,
+    LargeBinary,
     String,
     UniqueConstraint,
     DateTime,
@@ -13,6 +20,11 @@ from sqlalchemy.orm import Mapped, mapped_column, relationship
 from .database import Base
 
 
+def _utcnow() -> datetime:
+    # Set client-side, so inserts need no RETURNING/refetch for it
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
 class User(Base):
     __tablename__ = "users"
 
@@ -20,6 +32,8 @@ class User(Base):
     email: Mapped[str] = mapped_column(String(255), unique=True, index=True)
     password_hash: Mapped[str] = mapped_column(String(255))
     is_active: Mapped[bool] = mapped_column(Boolean, default=True)
+    # Carried in every token; bumping it revokes all of the user's tokens
+    token_version: Mapped[int] = mapped_column(Integer, default=0, server_default="0")
 
     shops: Mapped[list["Shop"]] = relationship(back_populates="owner")
 
@@ -31,6 +45,19 @@ class Shop(Base):
     id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True)
     name: Mapped[str] = mapped_column(String(120), index=True)
     owner_id: Mapped[int] = mapped_column(ForeignKey("users.id"))
+    # IANA timezone used to bucket KPI series (see app.kpi_series)
+    timezone: Mapped[str] = mapped_column(
+        String(64), default="UTC", server_default="UTC"
+    )
+    # Sync watermarks (see app.changes): this row's change sequence, and the
+    # head of the shop's sequence, shared with its receipts
+    change_seq: Mapped[int] = mapped_column(BigInteger, default=1, server_default="1")
+    last_change_seq: Mapped[int] = mapped_column(
+        BigInteger, default=1, server_default="1"
+    )
+    updated_at: Mapped[DateTime | None] = mapped_column(
+        DateTime, nullable=True, default=_utcnow, onupdate=_utcnow
+    )
 
     owner: Mapped[User] = relationship(back_populates="shops")
 
@@ -42,17 +69,33 @@ class Product(Base):
     sku: Mapped[str] = mapped_column(String(64), unique=True, index=True)
     name: Mapped[str] = mapped_column(String(255))
     price: Mapped[float] = mapped_column(Numeric(10, 2))
+    change_seq: Mapped[int | None] = mapped_column(
+        BigInteger, nullable=True, index=True
+    )
+    updated_at: Mapped[DateTime | None] = mapped_column(
+        DateTime, nullable=True, default=_utcnow, onupdate=_utcnow
+    )
 
 
 class Receipt(Base):
     __tablename__ = "receipts"
+    # Per-shop date-range scans read only the index (migration 0002)
+    __table_args__ = (
+        Index("ix_receipts_shop_created", "shop_id", "created_at", "total"),
+        # Device sync reads a shop's changes in sequence order (migration 0006)
+        Index("ix_receipts_shop_change_seq", "shop_id", "change_seq"),
+    )
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True)
-    shop_id: Mapped[int] = mapped_column(ForeignKey("shops.id"), index=True)
+    shop_id: Mapped[int] = mapped_column(ForeignKey("shops.id"))
     created_at: Mapped[DateTime] = mapped_column(
         DateTime(timezone=True), server_default=func.now()
     )
     total: Mapped[float] = mapped_column(Numeric(12, 2))
+    change_seq: Mapped[int | None] = mapped_column(BigInteger, nullable=True)
+    updated_at: Mapped[DateTime | None] = mapped_column(
+        DateTime, nullable=True, default=_utcnow, onupdate=_utcnow
+    )
 
     # Relación bidireccional con ReceiptLine
     lines: Mapped[list["ReceiptLine"]] = relationship(
@@ -63,25 +106,168 @@ class Receipt(Base):
 
 class ReceiptLine(Base):
     __tablename__ = "receipt_lines"
+    # Covering index for the lines-of-receipts-in-range join (top SKUs)
+    __table_args__ = (
+        Index(
+            "ix_receipt_lines_receipt_product",
+            "receipt_id",
+            "product_id",
+            "qty",
+            "unit_price",
+        ),
+    )
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True)
     receipt_id: Mapped[int] = mapped_column(
-        ForeignKey("receipts.id", ondelete="CASCADE"),
-        index=True,
+        ForeignKey("receipts.id", ondelete="CASCADE")
     )
-    product_id: Mapped[int] = mapped_column(ForeignKey("products.id"))
+    product_id: Mapped[int] = mapped_column(ForeignKey("products.id"), index=True)
     qty: Mapped[int] = mapped_column(Integer)
     unit_price: Mapped[float] = mapped_column(Numeric(10, 2))
 
     receipt: Mapped["Receipt"] = relationship(back_populates="lines")
-    # Optional: product: Mapped["Product"] = relationship()
+    product: Mapped["Product"] = relationship()
 
 
 class IdempotencyKey(Base):
+    """A used ``Idempotency-Key`` and the response to replay (see app.idempotency)."""
+
     __tablename__ = "idempotency_keys"
+    __table_args__ = (
+        UniqueConstraint("shop_id", "key", name="uq_idempotency_shop_key"),
+    )
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True)
-    key: Mapped[str] = mapped_column(String(64), unique=True, index=True)
+    shop_id: Mapped[int] = mapped_column(ForeignKey("shops.id"))
+    key: Mapped[str] = mapped_column(String(64))
+    # sha256 of the request payload; NULL for keys stored before migration 0005
+    request_hash: Mapped[str | None] = mapped_column(String(64), nullable=True)
     receipt_id: Mapped[int | None] = mapped_column(
         ForeignKey("receipts.id"), nullable=True
     )
+    response: Mapped[dict | None] = mapped_column(JSON, nullable=True)
+    expires_at: Mapped[DateTime] = mapped_column(DateTime, index=True)
+
+
+class ShopDailyKpi(Base):
+    """Per-shop, per-day rollup maintained on receipt ingest (see app.rollups)."""
+
+    __tablename__ = "shop_daily_kpis"
+
+    shop_id: Mapped[int] = mapped_column(ForeignKey("shops.id"), primary_key=True)
+    day: Mapped[Date] = mapped_column(Date, primary_key=True)
+    receipts: Mapped[int] = mapped_column(Integer, default=0)
+    revenue: Mapped[float] = mapped_column(Numeric(14, 2), default=0)
+
+
+class ShopDailySkuKpi(Base):
+    """Per-shop, per-day, per-product rollup used for the top SKUs."""
+
+    __tablename__ = "shop_daily_sku_kpis"
+    __table_args__ = (
+        Index(
+            "ix_shop_daily_sku_kpis_range",
+            "shop_id",
+            "day",
+            "product_id",
+            "qty",
+            "revenue",
+        ),
+    )
+
+    shop_id: Mapped[int] = mapped_column(ForeignKey("shops.id"), primary_key=True)
+    day: Mapped[Date] = mapped_column(Date, primary_key=True)
+    product_id: Mapped[int] = mapped_column(ForeignKey("products.id"), primary_key=True)
+    qty: Mapped[int] = mapped_column(Integer, default=0)
+    revenue: Mapped[float] = mapped_column(Numeric(14, 2), default=0)
+
+
+class ShopDailySketch(Base):
+    """Per-shop, per-day sketches for approximate KPIs (see app.kpi_sketches)."""
+
+    __tablename__ = "shop_daily_sketches"
+
+    shop_id: Mapped[int] = mapped_column(ForeignKey("shops.id"), primary_key=True)
+    day: Mapped[Date] = mapped_column(Date, primary_key=True)
+    # Space-Saving summary of product qty: [[product_id, qty, error, revenue]]
+    top_products: Mapped[list] = mapped_column(JSON)
+    # HyperLogLog registers of the day's distinct product ids
+    products_hll: Mapped[bytes] = mapped_column(LargeBinary)
+
+
+class ReceiptArchive(Base):
+    """A closed month moved out of receipts/receipt_lines (see app.archive)."""
+
+    __tablename__ = "receipt_archives"
+
+    month: Mapped[Date] = mapped_column(Date, primary_key=True)
+    # Per-month SQLite file holding the archived receipts and lines
+    path: Mapped[str] = mapped_column(String(512))
+    receipts: Mapped[int] = mapped_column(Integer)
+    lines: Mapped[int] = mapped_column(Integer)
+    archived_at: Mapped[DateTime] = mapped_column(DateTime, default=_utcnow)
+
+
+class QueuedReceipt(Base):
+    """A receipt accepted through the write-behind queue, and its outcome.
+
+    Inserted ``pending`` when the receipt is accepted, updated in the
+    transaction that materializes it and purged once older than the
+    retention (see app.write_behind).
+    """
+
+    __tablename__ = "queued_receipts"
+    __table_args__ = (
+        UniqueConstraint(
+            "shop_id", "idempotency_key", name="uq_queued_receipts_shop_key"
+        ),
+    )
+
+    handle: Mapped[str] = mapped_column(String(32), primary_key=True)
+    shop_id: Mapped[int] = mapped_column(Integer)
+    # pending, then the ingest status: created / replayed / conflict /
+    # rejected, or failed
+    status: Mapped[str] = mapped_column(String(16))
+    # Held while pending only (NULL afterwards: idempotency_keys takes over)
+    idempotency_key: Mapped[str | None] = mapped_column(String(64), nullable=True)
+    request_hash: Mapped[str | None] = mapped_column(String(64), nullable=True)
+    receipt_id: Mapped[int | None] = mapped_column(Integer, nullable=True)
+    total: Mapped[float | None] = mapped_column(Numeric(12, 2), nullable=True)
+    detail: Mapped[str | None] = mapped_column(String(255), nullable=True)
+    accepted_at: Mapped[DateTime] = mapped_column(DateTime)
+    materialized_at: Mapped[DateTime | None] = mapped_column(
+        DateTime, nullable=True, index=True
+    )
+
+
+class RefreshToken(Base):
+    """Issued refresh tokens (see app.tokens); rotated on every use."""
+
+    __tablename__ = "refresh_tokens"
+
+    jti: Mapped[str] = mapped_column(String(32), primary_key=True)
+    user_id: Mapped[int] = mapped_column(ForeignKey("users.id"), index=True)
+    # Every token rotated from the same login shares the family
+    family: Mapped[str] = mapped_column(String(32), index=True)
+    expires_at: Mapped[DateTime] = mapped_column(DateTime)
+    revoked_at: Mapped[DateTime | None] = mapped_column(DateTime, nullable=True)
+    replaced_by: Mapped[str | None] = mapped_column(String(32), nullable=True)
+
+
+class RevokedToken(Base):
+    """Revoked access tokens, kept until they would have expired anyway."""
+
+    __tablename__ = "revoked_tokens"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    jti: Mapped[str] = mapped_column(String(32), unique=True, index=True)
+    expires_at: Mapped[DateTime] = mapped_column(DateTime, index=True)
+
+
+class ChangeCounter(Base):
+    """Global change sequences (see app.changes); one row per scope."""
+
+    __tablename__ = "change_counters"
+
+    name: Mapped[str] = mapped_column(String(32), primary_key=True)
+    value: Mapped[int] = mapped_column(BigInteger, default=0)
@@ -0,0 +1,159 @@
+"""Monthly RANGE partitions (MySQL, MariaDB) for receipts and the daily rollups.
+
+Partitioned tables and their partition column:
+
+- ``receipts``: ``created_at``
+- ``shop_daily_kpis``, ``shop_daily_sku_kpis``, ``shop_daily_sketches``: ``day``
+
+Each calendar month gets a partition ``pYYYYMM``, plus a catch-all ``pmax``.
+MySQL only reads the partitions a query's range on that column can touch:
+``GET /shops/{id}/kpis?from=&to=`` filters both rollup tables on ``day``
+(``kpi_engine.RangeFilter``), so a one-month request reads one partition
+per table however many years of rollups exist. Listings, series and sync
+filter receipts on ``created_at`` the same way.
+
+Partitioned InnoDB tables have no foreign keys, and every unique key must
+contain the partition column: migration 0008 drops these tables' foreign keys
+(and those pointing at ``receipts``) and makes ``receipts``' primary key
+``(id, created_at)``. Receipts, lines and rollups are still written in one
+transaction (``app.ingest``).
+
+``receipt_lines`` has no date and is not partitioned; lines leave the hot
+table together with their receipts (``app.archive``). SQLite has no
+partitioning: there, ``app.archive`` moving closed months out of the hot
+tables is the whole strategy.
+
+``ensure_partitions`` adds partitions ``PARTITION_MONTHS_AHEAD`` months
+(default 3) ahead by splitting ``pmax``; ``python -m app.archive run`` calls
+it, schedule that monthly.
+"""
+
+import os
+from datetime import date
+
+from sqlalchemy import text
+from sqlalchemy.engine import Connection, Engine
+
+PARTITION_MONTHS_AHEAD = int(os.getenv("PARTITION_MONTHS_AHEAD", "3"))
+
+PARTITIONED = {
+    "receipts": "created_at",
+    "shop_daily_kpis": "day",
+    "shop_daily_sku_kpis": "day",
+    "shop_daily_sketches": "day",
+}
+CATCH_ALL = "pmax"
+# Dialects with RANGE partitioning (same DDL and information_schema)
+DIALECTS = ("mysql", "mariadb")
+
+
+def supported(conn: Connection | Engine) -> bool:
+    """Whether ``conn``'s database is partitioned (MySQL or MariaDB)."""
+    return conn.dialect.name in DIALECTS
+
+
+def month_start(day: date) -> date:
+    return day.replace(day=1)
+
+
+def add_months(month: date, n: int) -> date:
+    index = month.year * 12 + month.month - 1 + n
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def months(first: date, last: date) -> list[date]:
+    """First day of every month from ``first``'s to ``last``'s, inclusive."""
+    result, month = [], month_start(first)
+    while month <= last:
+        result.append(month)
+        month = add_months(month, 1)
+    return result
+
+
+def partition_name(month: date) -> str:
+    return f"p{month:%Y%m}"
+
+
+def _definitions(monthly: list[date]) -> str:
+    parts = [
+        f"PARTITION {partition_name(m)} VALUES LESS THAN ('{add_months(m, 1)}')"
+        for m in monthly
+    ]
+    parts.append(f"PARTITION {CATCH_ALL} VALUES LESS THAN (MAXVALUE)")
+    return ", ".join(parts)
+
+
+def partition_table_ddl(table: str, first: date, last: date) -> str:
+    """``ALTER TABLE`` partitioning ``table`` by month from ``first`` to ``last``."""
+    column = PARTITIONED[table]
+    return (
+        f"ALTER TABLE {table} PARTITION BY RANGE COLUMNS({column}) "
+        f"({_definitions(months(first, last))})"
+    )
+
+
+def add_partitions_ddl(table: str, monthly: list[date]) -> str:
+    """Split ``pmax`` into new monthly partitions (``pmax`` stays last)."""
+    return (
+        f"ALTER TABLE {table} REORGANIZE PARTITION {CATCH_ALL} "
+        f"INTO ({_definitions(monthly)})"
+    )
+
+
+def drop_partition_ddl(table: str, month: date) -> str:
+    return f"ALTER TABLE {table} DROP PARTITION {partition_name(month)}"
+
+
+def existing_partitions(conn: Connection, table: str) -> list[str]:
+    return list(
+        conn.execute(
+            text(
+                "SELECT partition_name FROM information_schema.partitions "
+                "WHERE table_schema = DATABASE() AND table_name = :table "
+                "AND partition_name IS NOT NULL ORDER BY partition_ordinal_position"
+            ),
+            {"table": table},
+        ).scalars()
+    )
+
+
+def _last_month(names: list[str]) -> date | None:
+    monthly = [n for n in names if n != CATCH_ALL]
+    if not monthly:
+        return None
+    name = monthly[-1]
+    return date(int(name[1:5]), int(name[5:7]), 1)
+
+
+def ensure_partitions(
+    conn: Connection, today: date, ahead: int = PARTITION_MONTHS_AHEAD
+) -> list[str]:
+    """Add the monthly partitions up to ``ahead`` months after ``today``.
+
+    Returns the statements run; a no-op off MySQL/MariaDB or on unpartitioned
+    tables.
+    """
+    if not supported(conn):
+        return []
+    target = add_months(month_start(today), ahead)
+    statements = []
+    for table in PARTITIONED:
+        last = _last_month(existing_partitions(conn, table))
+        if last is None or last >= target:
+            continue
+        statements.append(
+            add_partitions_ddl(table, months(add_months(last, 1), target))
+        )
+    for statement in statements:
+        conn.execute(text(statement))
+    return statements
+
+
+def drop_month(conn: Connection, table: str, month: date) -> bool:
+    """Drop ``table``'s partition for ``month`` if it exists (MySQL/MariaDB)."""
+    if not supported(conn):
+        return False
+    if partition_name(month) not in existing_partitions(conn, table):
+        return False
+    conn.execute(text(drop_partition_ddl(table, month)))
+    return True
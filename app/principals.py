@@ -0,0 +1,114 @@
+"""Authenticated principals, cached per token subject.
+
+``deps.get_current_user`` resolves a JWT subject (the user's email) to a
+``Principal``: the user id, whether the account is active and the ids of the
+shops it owns. Principals are loaded with one query and kept in a TTL/LRU
+cache, so in steady state a protected request (including the shop ownership
+check) does not touch the database for auth at all.
+
+Invalidation is explicit: any ORM commit that creates/deletes a ``Shop`` or
+changes/deletes a ``User`` drops that user's principal (see the session hooks
+at the bottom). Writes made with bulk ``update()``/``delete()`` statements or
+by another process are not seen by the hooks; call ``invalidate_user`` for
+the former, the TTL bounds the latter.
+
+Settings: ``AUTH_CACHE_TTL`` (seconds, default 60, 0 disables) and
+``AUTH_CACHE_SIZE`` (entries, default 10000).
+"""
+
+import os
+from dataclasses import dataclass
+
+from sqlalchemy import Select, event, inspect, select
+from sqlalchemy.orm import Session
+
+from .models import Shop, User
+from .utils.cache import TTLCache
+
+AUTH_CACHE_TTL = float(os.getenv("AUTH_CACHE_TTL", "60"))
+AUTH_CACHE_SIZE = int(os.getenv("AUTH_CACHE_SIZE", "10000"))
+
+
+@dataclass(frozen=True)
+class Principal:
+    """What the API needs to know about the caller, without a ``User`` row."""
+
+    id: int
+    email: str
+    is_active: bool
+    shop_ids: frozenset[int]
+    token_version: int = 0
+
+    def owns(self, shop_id: int) -> bool:
+        return shop_id in self.shop_ids
+
+
+cache: TTLCache[Principal] = TTLCache("principals", AUTH_CACHE_SIZE, AUTH_CACHE_TTL)
+
+
+def load_statement(email: str) -> Select:
+    """User columns plus one row per owned shop (``None`` if it owns none)."""
+    return (
+        select(User.id, User.email, User.is_active, User.token_version, Shop.id)
+        .outerjoin(Shop, Shop.owner_id == User.id)
+        .where(User.email == email)
+    )
+
+
+def from_rows(rows) -> Principal | None:
+    if not rows:
+        return None
+    user_id, email, is_active, token_version, _ = rows[0]
+    return Principal(
+        id=user_id,
+        email=email,
+        is_active=bool(is_active),
+        shop_ids=frozenset(shop_id for *_, shop_id in rows if shop_id is not None),
+        token_version=token_version,
+    )
+
+
+def load(db: Session, email: str) -> Principal | None:
+    """Cached principal for ``email``, loading it on a miss."""
+    principal = cache.get(email)
+    if principal is None:
+        principal = from_rows(db.execute(load_statement(email)).all())
+        if principal is not None:
+            cache.set(email, principal)
+    return principal
+
+
+def invalidate_user(user_id: int) -> None:
+    cache.discard_where(lambda _, principal: principal.id == user_id)
+
+
+# ---------- Invalidation on commit ----------
+
+_PENDING_KEY = "principals_to_invalidate"
+
+
+@event.listens_for(Session, "before_flush")
+def _collect_changes(session: Session, flush_context, instances) -> None:
+    user_ids: set[int] = session.info.setdefault(_PENDING_KEY, set())
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        if isinstance(obj, Shop):
+            # Old and new owner when a shop changes hands
+            history = inspect(obj).attrs.owner_id.history
+            user_ids.update(
+                owner_id
+                for owner_id in (*history.deleted, obj.owner_id)
+                if owner_id is not None
+            )
+        elif isinstance(obj, User) and obj.id is not None:
+            user_ids.add(obj.id)
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_committed(session: Session) -> None:
+    for user_id in session.info.pop(_PENDING_KEY, ()):
+        invalidate_user(user_id)
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _forget_rolled_back(session: Session, previous_transaction) -> None:
+    session.info.pop(_PENDING_KEY, None)
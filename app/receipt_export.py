@@ -0,0 +1,229 @@
+"""Reading receipts back out: keyset pages and streamed exports.
+
+Pages are ordered by ``(created_at, id)`` and continue after an opaque
+cursor instead of an ``OFFSET``, so every page is an index range scan on
+``receipts (shop_id, created_at, ...)`` however deep it is:
+
+    SELECT ... FROM receipts
+    WHERE shop_id = ? AND <range>
+      AND (created_at > ? OR (created_at = ? AND id > ?))
+    ORDER BY created_at, id LIMIT ?
+
+The lines (with their product's SKU) of a whole page come from one batched
+``selectinload`` query, never lazily per receipt.
+
+``export`` streams a whole range as NDJSON (one receipt per line) or CSV (one
+row per receipt line, importable with ``app.importer``) from a single
+server-side cursor (``yield_per``), so memory stays flat whatever the range.
+"""
+
+import base64
+import binascii
+import csv
+import io
+import json
+import os
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Callable, Iterable, Iterator
+
+from sqlalchemy import and_, or_, select
+from sqlalchemy.orm import Session, selectinload
+
+from .models import Product, Receipt, ReceiptLine
+
+FORMATS = ("ndjson", "csv")
+DEFAULT_PAGE_SIZE = 100
+# selectinload batches 500 ids per IN list: one lines query per page
+MAX_PAGE_SIZE = 500
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "1000"))
+# Bytes buffered per streamed chunk (one threadpool hop each)
+EXPORT_CHUNK_BYTES = 64 * 1024
+
+CSV_COLUMNS = ("receipt_ref", "created_at", "total", "sku", "qty", "unit_price")
+
+
+class CursorError(ValueError):
+    pass
+
+
+def encode_cursor(created_at: datetime, receipt_id: int) -> str:
+    raw = json.dumps([created_at.isoformat(), receipt_id], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(token: str) -> tuple[datetime, int]:
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        created_at, receipt_id = json.loads(raw)
+        return datetime.fromisoformat(created_at), int(receipt_id)
+    except (binascii.Error, ValueError, TypeError) as exc:
+        raise CursorError("Invalid cursor") from exc
+
+
+@dataclass(frozen=True)
+class ReceiptRange:
+    """Receipts of a shop with ``start <= created_at < end``, after a cursor."""
+
+    shop_id: int
+    start: datetime | None = None
+    end: datetime | None = None
+    after: tuple[datetime, int] | None = None
+
+    def where(self) -> list:
+        conditions = [Receipt.shop_id == self.shop_id]
+        if self.start is not None:
+            conditions.append(Receipt.created_at >= self.start)
+        if self.end is not None:
+            conditions.append(Receipt.created_at < self.end)
+        if self.after is not None:
+            created_at, receipt_id = self.after
+            # Expanded row comparison: portable and index-friendly on MySQL
+            conditions.append(
+                or_(
+                    Receipt.created_at > created_at,
+                    and_(Receipt.created_at == created_at, Receipt.id > receipt_id),
+                )
+            )
+        return conditions
+
+
+@dataclass
+class Page:
+    receipts: list[dict[str, Any]]
+    next_cursor: str | None
+
+
+def _receipt(receipt_id, created_at, total, lines: list[dict]) -> dict[str, Any]:
+    return {
+        "id": receipt_id,
+        "created_at": created_at,
+        "total": float(total),
+        "lines": lines,
+    }
+
+
+def _line(sku, qty, unit_price) -> dict[str, Any]:
+    return {"sku": sku, "qty": qty, "unit_price": float(unit_price)}
+
+
+def list_page(db: Session, rng: ReceiptRange, limit: int = DEFAULT_PAGE_SIZE) -> Page:
+    """One page of receipts with their lines: two queries whatever the depth."""
+    receipts = db.scalars(
+        select(Receipt)
+        .where(*rng.where())
+        .order_by(Receipt.created_at, Receipt.id)
+        .limit(limit + 1)
+        .options(selectinload(Receipt.lines).joinedload(ReceiptLine.product))
+    ).all()
+    has_more = len(receipts) > limit
+    receipts = receipts[:limit]
+    last = receipts[-1] if receipts else None
+    return Page(
+        receipts=[
+            _receipt(
+                r.id,
+                r.created_at,
+                r.total,
+                [
+                    _line(line.product.sku, line.qty, line.unit_price)
+                    for line in sorted(r.lines, key=lambda line: line.id)
+                ],
+            )
+            for r in receipts
+        ],
+        next_cursor=(
+            encode_cursor(last.created_at, last.id) if has_more and last else None
+        ),
+    )
+
+
+def iter_receipts(
+    db: Session, rng: ReceiptRange, batch_size: int = EXPORT_BATCH_SIZE
+) -> Iterator[dict[str, Any]]:
+    """Every receipt of the range, oldest first, from one server-side cursor."""
+    stmt = (
+        select(
+            Receipt.id,
+            Receipt.created_at,
+            Receipt.total,
+            Product.sku,
+            ReceiptLine.qty,
+            ReceiptLine.unit_price,
+        )
+        .select_from(Receipt)
+        .outerjoin(ReceiptLine, ReceiptLine.receipt_id == Receipt.id)
+        .outerjoin(Product, Product.id == ReceiptLine.product_id)
+        .where(*rng.where())
+        .order_by(Receipt.created_at, Receipt.id, ReceiptLine.id)
+        # Streams rows in batches instead of buffering the result set
+        .execution_options(yield_per=batch_size)
+    )
+    current: dict[str, Any] | None = None
+    for receipt_id, created_at, total, sku, qty, unit_price in db.execute(stmt):
+        if current is None or current["id"] != receipt_id:
+            if current is not None:
+                yield current
+            current = _receipt(receipt_id, created_at, total, [])
+        if sku is not None:
+            current["lines"].append(_line(sku, qty, unit_price))
+    if current is not None:
+        yield current
+
+
+def _ndjson(receipts: Iterable[dict]) -> Iterator[str]:
+    for receipt in receipts:
+        yield json.dumps(
+            {**receipt, "created_at": receipt["created_at"].isoformat()},
+            separators=(",", ":"),
+        ) + "\n"
+
+
+def _csv(receipts: Iterable[dict]) -> Iterator[str]:
+    buf = io.StringIO()
+    writer = csv.writer(buf, lineterminator="\n")
+    writer.writerow(CSV_COLUMNS)
+    for receipt in receipts:
+        yield buf.getvalue()
+        buf.seek(0)
+        buf.truncate()
+        created_at = receipt["created_at"].isoformat()
+        for line in receipt["lines"]:
+            writer.writerow(
+                (
+                    receipt["id"],
+                    created_at,
+                    receipt["total"],
+                    line["sku"],
+                    line["qty"],
+                    line["unit_price"],
+                )
+            )
+    yield buf.getvalue()
+
+
+def _chunked(pieces: Iterable[str], size: int) -> Iterator[bytes]:
+    buffered: list[str] = []
+    length = 0
+    for piece in pieces:
+        buffered.append(piece)
+        length += len(piece)
+        if length >= size:
+            yield "".join(buffered).encode()
+            buffered, length = [], 0
+    if buffered:
+        yield "".join(buffered).encode()
+
+
+def export(
+    session_factory: Callable[[], Session],
+    rng: ReceiptRange,
+    fmt: str,
+    batch_size: int = EXPORT_BATCH_SIZE,
+) -> Iterator[bytes]:
+    """Encoded chunks of the whole range; the session lives as long as the stream."""
+    encode = _ndjson if fmt == "ndjson" else _csv
+    with session_factory() as db:
+        yield from _chunked(
+            encode(iter_receipts(db, rng, batch_size)), EXPORT_CHUNK_BYTES
+        )
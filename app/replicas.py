@@ -0,0 +1,90 @@
+"""Read-replica routing with read-your-writes stickiness.
+
+``DB_READ_URLS`` (comma-separated) adds reader engines next to the primary
+(``app.database``). Read-only endpoints (KPIs, receipt listings, device sync)
+take their session from ``deps.get_read_db``, which picks a replica
+round-robin, unless one of the shops the request reads was written in the
+last ``READ_STICKY_SECONDS`` (default 5): those go to the primary, so a
+client sees its own receipts even while the replicas lag behind.
+
+A shop counts as written when a transaction that bumped its change sequence
+(``app.changes``: receipts, shop updates) commits. Stickiness is tracked per
+process; keep the window above the expected replication lag. State shared
+between processes must not take a replica's view for current within the
+window (see ``kpi_cache.settled``); ``on_replica`` tells the sessions apart.
+
+Without ``DB_READ_URLS`` every read goes to the primary.
+"""
+
+import itertools
+import os
+from typing import Callable, Iterable
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from . import database
+from .changes import CHANGED_SHOPS
+from .utils.cache import TTLCache
+
+READ_STICKY_SECONDS = float(os.getenv("READ_STICKY_SECONDS", "5"))
+READ_STICKY_MAX_SHOPS = int(os.getenv("READ_STICKY_MAX_SHOPS", "100000"))
+
+recent_writes: TTLCache[bool] = TTLCache(
+    "recent_writes", READ_STICKY_MAX_SHOPS, READ_STICKY_SECONDS
+)
+
+# Session.info flag of replica sessions (set by deps.get_read_db)
+REPLICA_KEY = "replica"
+
+
+class ReplicaSet:
+    """Session factories of the replicas, handed out round-robin."""
+
+    def __init__(self, factories: Iterable[Callable]) -> None:
+        self.factories = list(factories)
+        self._turn = itertools.count()
+
+    def __bool__(self) -> bool:
+        return bool(self.factories)
+
+    def next(self) -> Callable:
+        return self.factories[next(self._turn) % len(self.factories)]
+
+
+readers = ReplicaSet(database.ReadSessionLocals)
+async_readers = ReplicaSet(database.AsyncReadSessionLocals)
+
+
+def mark_written(shop_ids: Iterable[int]) -> None:
+    for shop_id in shop_ids:
+        recent_writes.set(shop_id, True)
+
+
+def is_sticky(shop_ids: Iterable[int]) -> bool:
+    """Whether any of ``shop_ids`` was written within the window."""
+    return any(recent_writes.get(shop_id) for shop_id in shop_ids)
+
+
+def replica_for(shop_ids: Iterable[int], replica_set: ReplicaSet) -> Callable | None:
+    """Next replica's session factory, or None when the primary must serve."""
+    if not replica_set or is_sticky(shop_ids):
+        return None
+    return replica_set.next()
+
+
+def on_replica(db) -> bool:
+    """Whether ``db`` (sync or async session) reads from a replica."""
+    return db.info.get(REPLICA_KEY, False)
+
+
+def read_factory(shop_ids: Iterable[int]) -> Callable[[], Session]:
+    """Session factory for reading ``shop_ids``: a replica or the primary."""
+    return replica_for(shop_ids, readers) or database.SessionLocal
+
+
+@event.listens_for(Session, "after_commit")
+def _mark_committed_writes(session: Session) -> None:
+    shop_ids = session.info.pop(CHANGED_SHOPS, None)
+    if shop_ids:
+        mark_written(shop_ids)
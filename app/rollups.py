@@ -0,0 +1,209 @@
+"""Daily KPI rollups.
+
+``shop_daily_kpis`` and ``shop_daily_sku_kpis`` hold one row per shop and day
+(and per product for the SKU table). ``ingest.ingest_receipts`` calls
+``apply_receipts`` once per batch inside its transaction, so KPI reads only
+have to sum one row per day in the requested range instead of scanning every
+receipt. The same call hands the batch to the per-day sketches behind
+approximate KPIs (``app.kpi_sketches``), merged once per shop-day when the
+transaction commits.
+
+Existing data (or data loaded behind the API's back) can be rebuilt with:
+
+    python -m app.rollups rebuild [--shop-id N]
+"""
+
+import argparse
+import sys
+from collections import defaultdict
+from datetime import date
+from typing import Iterable
+
+from sqlalchemy import delete, func, insert, select, update
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+
+from . import archive, kpi_cache, kpi_sketches
+from .models import Receipt, ReceiptLine, Shop, ShopDailyKpi, ShopDailySkuKpi
+
+
+def _increment(
+    db: Session,
+    model,
+    keys: tuple[str, ...],
+    rows: list[dict],
+) -> None:
+    """Add ``rows`` to the rollup table, creating missing rows as needed."""
+    if not rows:
+        return
+
+    table = model.__table__
+    counters = [name for name in rows[0] if name not in keys]
+    dialect = db.get_bind().dialect.name
+
+    if dialect == "sqlite":
+        stmt = sqlite_insert(table).values(rows)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=list(keys),
+            set_={c: table.c[c] + stmt.excluded[c] for c in counters},
+        )
+        db.execute(stmt)
+        return
+
+    if dialect in ("mysql", "mariadb"):
+        stmt = mysql_insert(table).values(rows)
+        stmt = stmt.on_duplicate_key_update(
+            {c: table.c[c] + stmt.inserted[c] for c in counters}
+        )
+        db.execute(stmt)
+        return
+
+    # Generic fallback: update first, insert the rows that did not exist.
+    for row in rows:
+        where = [table.c[k] == row[k] for k in keys]
+        result = db.execute(
+            update(table)
+            .where(*where)
+            .values({c: table.c[c] + row[c] for c in counters})
+        )
+        if result.rowcount == 0:
+            db.execute(insert(table).values(row))
+
+
+def apply_receipt(
+    db: Session,
+    shop_id: int,
+    day: date,
+    total: float,
+    lines: Iterable[ReceiptLine],
+) -> None:
+    """Add one receipt to the daily rollups. Does not commit."""
+    apply_receipts(db, shop_id, [(day, total, lines)])
+
+
+def apply_receipts(
+    db: Session,
+    shop_id: int,
+    receipts: Iterable[tuple[date, float, Iterable[ReceiptLine]]],
+) -> None:
+    """Add a batch of ``(day, total, lines)`` receipts with one upsert per table."""
+    per_day: dict[date, list[float]] = defaultdict(lambda: [0, 0.0])
+    per_product: dict[tuple[date, int], list[float]] = defaultdict(lambda: [0, 0.0])
+    for day, total, lines in receipts:
+        acc = per_day[day]
+        acc[0] += 1
+        acc[1] += total
+        for line in lines:
+            acc = per_product[(day, line.product_id)]
+            acc[0] += line.qty
+            acc[1] += line.qty * float(line.unit_price)
+
+    _increment(
+        db,
+        ShopDailyKpi,
+        ("shop_id", "day"),
+        [
+            {"shop_id": shop_id, "day": day, "receipts": count, "revenue": revenue}
+            for day, (count, revenue) in sorted(per_day.items())
+        ],
+    )
+    _increment(
+        db,
+        ShopDailySkuKpi,
+        ("shop_id", "day", "product_id"),
+        [
+            {
+                "shop_id": shop_id,
+                "day": day,
+                "product_id": product_id,
+                "qty": qty,
+                "revenue": revenue,
+            }
+            for (day, product_id), (qty, revenue) in sorted(per_product.items())
+        ],
+    )
+
+    per_day_products: kpi_sketches.DayCounts = defaultdict(dict)
+    for (day, product_id), (qty, revenue) in per_product.items():
+        per_day_products[day][product_id] = (qty, revenue)
+    kpi_sketches.apply(db, shop_id, per_day_products)
+
+
+def rebuild(db: Session, shop_id: int | None = None) -> None:
+    """Recompute the rollups from ``receipts``/``receipt_lines``. Does not commit."""
+    day = func.date(Receipt.created_at)
+
+    daily_delete = delete(ShopDailyKpi)
+    sku_delete = delete(ShopDailySkuKpi)
+    daily_select = select(
+        Receipt.shop_id,
+        day,
+        func.count(Receipt.id),
+        func.coalesce(func.sum(Receipt.total), 0),
+    )
+    sku_select = select(
+        Receipt.shop_id,
+        day,
+        ReceiptLine.product_id,
+        func.sum(ReceiptLine.qty),
+        func.sum(ReceiptLine.qty * ReceiptLine.unit_price),
+    ).join(Receipt, ReceiptLine.receipt_id == Receipt.id)
+
+    # Archived months have no receipts left: their rollups are the record
+    hot_from = archive.archived_until(db)
+    if hot_from is not None:
+        daily_delete = daily_delete.where(ShopDailyKpi.day >= hot_from)
+        sku_delete = sku_delete.where(ShopDailySkuKpi.day >= hot_from)
+        daily_select = daily_select.where(Receipt.created_at >= hot_from)
+        sku_select = sku_select.where(Receipt.created_at >= hot_from)
+
+    if shop_id is not None:
+        daily_delete = daily_delete.where(ShopDailyKpi.shop_id == shop_id)
+        sku_delete = sku_delete.where(ShopDailySkuKpi.shop_id == shop_id)
+        daily_select = daily_select.where(Receipt.shop_id == shop_id)
+        sku_select = sku_select.where(Receipt.shop_id == shop_id)
+
+    shop_ids = [shop_id] if shop_id is not None else db.scalars(select(Shop.id))
+    for changed in shop_ids:
+        kpi_cache.mark_changed(db, changed)
+
+    db.execute(daily_delete)
+    db.execute(sku_delete)
+    db.execute(
+        insert(ShopDailyKpi).from_select(
+            ["shop_id", "day", "receipts", "revenue"],
+            daily_select.group_by(Receipt.shop_id, day),
+        )
+    )
+    db.execute(
+        insert(ShopDailySkuKpi).from_select(
+            ["shop_id", "day", "product_id", "qty", "revenue"],
+            sku_select.group_by(Receipt.shop_id, day, ReceiptLine.product_id),
+        )
+    )
+    kpi_sketches.rebuild(db, shop_id)
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m app.rollups")
+    sub = parser.add_subparsers(dest="command", required=True)
+    rebuild_cmd = sub.add_parser("rebuild", help="Rebuild daily KPI rollups")
+    rebuild_cmd.add_argument("--shop-id", type=int, default=None)
+    args = parser.parse_args(argv)
+
+    from .database import SessionLocal, engine
+    from .migrate import upgrade_to_head
+
+    upgrade_to_head(engine)
+    with SessionLocal() as db:
+        rebuild(db, shop_id=args.shop_id)
+        db.commit()
+
+    scope = f"shop {args.shop_id}" if args.shop_id is not None else "all shops"
+    sys.stdout.write(f"Rebuilt KPI rollups for {scope}\n")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -1,47 +1,226 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from datetime import datetime
+
+from fastapi import APIRouter, Depends, HTTPException, Response, status
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
-from .. import schemas
+from .. import schemas, tokens
 from ..models import User
-from ..deps import get_db
-from ..utils.security import (
-    create_access_token,
-    hash_password,
-    verify_password,
+from ..deps import (
+    get_access_claims,
+    get_async_db,
+    get_current_user,
+    get_current_user_async,
+    get_db,
 )
+from ..principals import Principal
+from ..utils import hashing
+from ..utils.security import needs_rehash
 
 router = APIRouter(prefix="/auth", tags=["auth"])
+# Same endpoints on AsyncSession, mounted instead of `router` when ASYNC_DB=1
+async_router = APIRouter(prefix="/auth", tags=["auth"])
 
 
-@router.post("/register", response_model=schemas.Token, status_code=201)
-def register(user_in: schemas.UserCreate, db: Session = Depends(get_db)):
-    existing = db.query(User).filter(User.email == user_in.email).first()
-    if existing:
+async def _hashing(fn, *args):
+    """Run a hashing call on the hash pool; 503 when its queue is full."""
+    try:
+        return await fn(*args)
+    except hashing.HashPoolBusy:
         raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Email already registered",
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Too many concurrent logins, retry shortly",
+            headers={"Retry-After": "1"},
         )
 
-    user = User(
-        email=user_in.email,
-        password_hash=hash_password(user_in.password),
+
+def _invalid_credentials() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Invalid email or password",
     )
+
+
+def _token_out(issued: tokens.IssuedTokens) -> dict:
+    return {
+        "access_token": issued.access_token,
+        "refresh_token": issued.refresh_token,
+    }
+
+
+def _get_user(db: Session, email: str) -> User | None:
+    return db.query(User).filter(User.email == email).first()
+
+
+def _create_user(db: Session, email: str, password_hash: str) -> tokens.IssuedTokens:
+    user = User(email=email, password_hash=password_hash)
     db.add(user)
+    db.flush()
+    issued = tokens.issue(db, user)
+    db.commit()
+    return issued
+
+
+def _login(db: Session, user: User, new_hash: str | None) -> tokens.IssuedTokens:
+    if new_hash is not None:
+        user.password_hash = new_hash
+    issued = tokens.issue(db, user)
+    db.commit()
+    return issued
+
+
+def _rotate(db: Session, refresh_token: str) -> tokens.IssuedTokens:
+    try:
+        return tokens.rotate(db, refresh_token)
+    except tokens.TokenError as exc:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail=str(exc))
+
+
+def _logout(db: Session, claims: dict, user_id: int, refresh_token: str | None) -> None:
+    tokens.revoke_access(db, claims["jti"], datetime.utcfromtimestamp(claims["exp"]))
+    if refresh_token is not None:
+        try:
+            tokens.revoke_refresh(db, refresh_token, user_id)
+        except tokens.TokenError as exc:
+            db.rollback()
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST, detail=str(exc)
+            )
+    db.commit()
+
+
+def _logout_all(db: Session, user_id: int) -> None:
+    tokens.revoke_user(db, user_id)
     db.commit()
-    db.refresh(user)
 
-    token = create_access_token(subject=user.email)
-    return {"access_token": token}
+
+async def _rehash(password: str, password_hash: str) -> str | None:
+    """A new hash when BCRYPT_ROUNDS changed since ``password_hash`` was made."""
+    if not needs_rehash(password_hash):
+        return None
+    return await _hashing(hashing.hash_password, password)
+
+
+# The handlers that hash are async so bcrypt runs on the hash pool instead of
+# holding a threadpool worker; only the (short) DB steps use the threadpool.
+@router.post("/register", response_model=schemas.Token, status_code=201)
+async def register(user_in: schemas.UserCreate, db: Session = Depends(get_db)):
+    existing = await run_in_threadpool(_get_user, db, user_in.email)
+    if existing:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Email already registered",
+        )
+
+    password_hash = await _hashing(hashing.hash_password, user_in.password)
+    issued = await run_in_threadpool(_create_user, db, user_in.email, password_hash)
+    return _token_out(issued)
 
 
 @router.post("/login", response_model=schemas.Token)
-def login(user_in: schemas.UserCreate, db: Session = Depends(get_db)):
-    user = db.query(User).filter(User.email == user_in.email).first()
-    if not user or not verify_password(user_in.password, user.password_hash):
+async def login(user_in: schemas.UserCreate, db: Session = Depends(get_db)):
+    user = await run_in_threadpool(_get_user, db, user_in.email)
+    if not user or not await _hashing(
+        hashing.verify_password, user_in.password, user.password_hash
+    ):
+        raise _invalid_credentials()
+
+    new_hash = await _rehash(user_in.password, user.password_hash)
+    issued = await run_in_threadpool(_login, db, user, new_hash)
+    return _token_out(issued)
+
+
+@router.post("/refresh", response_model=schemas.Token)
+def refresh(body: schemas.RefreshRequest, db: Session = Depends(get_db)):
+    """New access + refresh pair; the presented refresh token is used up."""
+    return _token_out(_rotate(db, body.refresh_token))
+
+
+@router.post("/logout", status_code=204)
+def logout(
+    body: schemas.LogoutRequest | None = None,
+    claims: dict = Depends(get_access_claims),
+    current_user: Principal = Depends(get_current_user),
+    db: Session = Depends(get_db),
+):
+    refresh_token = body.refresh_token if body else None
+    _logout(db, claims, current_user.id, refresh_token)
+    return Response(status_code=204)
+
+
+@router.post("/logout-all", status_code=204)
+def logout_all(
+    current_user: Principal = Depends(get_current_user),
+    db: Session = Depends(get_db),
+):
+    """Revoke every access and refresh token of the user."""
+    _logout_all(db, current_user.id)
+    return Response(status_code=204)
+
+
+# ---------- Async path (ASYNC_DB=1) ----------
+
+
+@async_router.post("/register", response_model=schemas.Token, status_code=201)
+async def register_async(
+    user_in: schemas.UserCreate, db: AsyncSession = Depends(get_async_db)
+):
+    existing = (
+        await db.execute(select(User).where(User.email == user_in.email))
+    ).scalar_one_or_none()
+    if existing:
         raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Invalid email or password",
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Email already registered",
         )
 
-    token = create_access_token(subject=user.email)
-    return {"access_token": token}
+    password_hash = await _hashing(hashing.hash_password, user_in.password)
+    issued = await db.run_sync(_create_user, user_in.email, password_hash)
+    return _token_out(issued)
+
+
+@async_router.post("/login", response_model=schemas.Token)
+async def login_async(
+    user_in: schemas.UserCreate, db: AsyncSession = Depends(get_async_db)
+):
+    user = (
+        await db.execute(select(User).where(User.email == user_in.email))
+    ).scalar_one_or_none()
+    if not user or not await _hashing(
+        hashing.verify_password, user_in.password, user.password_hash
+    ):
+        raise _invalid_credentials()
+
+    new_hash = await _rehash(user_in.password, user.password_hash)
+    issued = await db.run_sync(_login, user, new_hash)
+    return _token_out(issued)
+
+
+@async_router.post("/refresh", response_model=schemas.Token)
+async def refresh_async(
+    body: schemas.RefreshRequest, db: AsyncSession = Depends(get_async_db)
+):
+    return _token_out(await db.run_sync(_rotate, body.refresh_token))
+
+
+@async_router.post("/logout", status_code=204)
+async def logout_async(
+    body: schemas.LogoutRequest | None = None,
+    claims: dict = Depends(get_access_claims),
+    current_user: Principal = Depends(get_current_user_async),
+    db: AsyncSession = Depends(get_async_db),
+):
+    refresh_token = body.refresh_token if body else None
+    await db.run_sync(_logout, claims, current_user.id, refresh_token)
+    return Response(status_code=204)
+
+
+@async_router.post("/logout-all", status_code=204)
+async def logout_all_async(
+    current_user: Principal = Depends(get_current_user_async),
+    db: AsyncSession = Depends(get_async_db),
+):
+    await db.run_sync(_logout_all, current_user.id)
+    return Response(status_code=204)
@@ -0,0 +1,89 @@
+from typing import Optional
+
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, status
+from fastapi.responses import Response
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from .. import device_sync, schemas
+from ..deps import (
+    ensure_shop_owner,
+    ensure_shop_owner_async,
+    get_async_read_db,
+    get_current_user,
+    get_current_user_async,
+    get_read_db,
+)
+from ..principals import Principal
+from ..utils import compression, encoding
+
+router = APIRouter(prefix="/devices", tags=["devices"])
+# Same endpoints on AsyncSession, mounted instead of `router` when ASYNC_DB=1
+async_router = APIRouter(prefix="/devices", tags=["devices"])
+
+
+def _cursor(since: Optional[str]) -> device_sync.SyncCursor:
+    try:
+        return device_sync.SyncCursor.decode(since)
+    except device_sync.CursorError as exc:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(exc),
+        )
+
+
+def _sync_response(
+    batch: device_sync.SyncBatch,
+    accept_encoding: Optional[str],
+    accept: Optional[str],
+) -> Response:
+    media_type = encoding.negotiate(accept)
+    body = encoding.encode(schemas.SyncBatchOut(**batch.__dict__), media_type)
+    response = compression.encoded_response(body, accept_encoding, media_type)
+    if encoding.NEGOTIATES:
+        response.headers["Vary"] = "Accept-Encoding, Accept"
+    return response
+
+
+@router.get("/sync", response_model=schemas.SyncBatchOut)
+def sync(
+    shop_id: int = Query(..., description="Shop the device belongs to"),
+    since: Optional[str] = Query(None, description="next_cursor of the last sync"),
+    limit: int = Query(
+        device_sync.DEFAULT_BATCH_SIZE, ge=1, le=device_sync.MAX_BATCH_SIZE
+    ),
+    accept_encoding: Optional[str] = Header(default=None, alias="Accept-Encoding"),
+    accept: Optional[str] = Header(default=None),
+    db: Session = Depends(get_read_db),
+    current_user: Principal = Depends(get_current_user),
+):
+    """Shop, products and receipts changed since ``since`` (everything if absent).
+
+    The body is gzip- or zstd-compressed when the client accepts it, and
+    MessagePack with ``Accept: application/msgpack`` (``app.utils.encoding``).
+    """
+    ensure_shop_owner(db, shop_id, current_user)
+    batch = device_sync.changes_since(db, shop_id, _cursor(since), limit)
+    db.commit()
+    return _sync_response(batch, accept_encoding, accept)
+
+
+# ---------- Async path (ASYNC_DB=1) ----------
+
+
+@async_router.get("/sync", response_model=schemas.SyncBatchOut)
+async def sync_async(
+    shop_id: int = Query(..., description="Shop the device belongs to"),
+    since: Optional[str] = Query(None, description="next_cursor of the last sync"),
+    limit: int = Query(
+        device_sync.DEFAULT_BATCH_SIZE, ge=1, le=device_sync.MAX_BATCH_SIZE
+    ),
+    accept_encoding: Optional[str] = Header(default=None, alias="Accept-Encoding"),
+    accept: Optional[str] = Header(default=None),
+    db: AsyncSession = Depends(get_async_read_db),
+    current_user: Principal = Depends(get_current_user_async),
+):
+    await ensure_shop_owner_async(db, shop_id, current_user)
+    batch = await db.run_sync(device_sync.changes_since, shop_id, _cursor(since), limit)
+    await db.commit()
+    return _sync_response(batch, accept_encoding, accept)
@@ -1,34 +1,37 @@
-from datetime import datetime, time
+from datetime import date, datetime, time, timedelta
 from typing import Optional
+from zoneinfo import ZoneInfo
 
-from fastapi import APIRouter, Depends, HTTPException, Query, status
-from sqlalchemy import func, desc
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Response, status
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
-from .. import schemas
-from ..deps import get_db, get_current_user
-from ..models import Receipt, ReceiptLine, Product, Shop, User
+from .. import (
+    analytics,
+    kpi_cache,
+    kpi_engine,
+    kpi_series,
+    kpi_sketches,
+    replicas,
+    schemas,
+)
+from ..deps import (
+    ensure_shop_owner,
+    ensure_shop_owner_async,
+    get_async_read_db,
+    get_current_user,
+    get_current_user_async,
+    get_read_db,
+)
+from ..models import Product, Shop
+from ..principals import Principal
+from ..utils import encoding
 
 router = APIRouter(prefix="/shops/{shop_id}/kpis", tags=["kpis"])
-
-
-def _ensure_shop_owner(
-    db: Session,
-    shop_id: int,
-    user: User,
-) -> Shop:
-    shop = db.query(Shop).filter(Shop.id == shop_id).first()
-    if not shop:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Shop not found",
-        )
-    if shop.owner_id != user.id:
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="You are not the owner of this shop",
-        )
-    return shop
+# Same endpoints on AsyncSession, mounted instead of `router` when ASYNC_DB=1
+async_router = APIRouter(prefix="/shops/{shop_id}/kpis", tags=["kpis"])
 
 
 def _parse_date(date_str: Optional[str]) -> Optional[datetime]:
@@ -45,6 +48,156 @@ def _parse_date(date_str: Optional[str]) -> Optional[datetime]:
         )
 
 
+def _day_range(
+    from_date: Optional[str], to_date: Optional[str]
+) -> tuple[Optional[date], Optional[date]]:
+    start_dt = _parse_date(from_date)
+    end_dt = _parse_date(to_date)
+    return (
+        start_dt.date() if start_dt is not None else None,
+        end_dt.date() if end_dt is not None else None,
+    )
+
+
+def _range_filter(
+    shop_id: int, from_date: Optional[str], to_date: Optional[str]
+) -> kpi_engine.RangeFilter:
+    # Rollups are kept per day, so 'from'/'to' map directly to whole days
+    start, end = _day_range(from_date, to_date)
+    return kpi_engine.RangeFilter(shop_id=shop_id, start=start, end=end)
+
+
+def _kpis_out(shop_id: int, result: kpi_engine.KpiResult) -> schemas.KPIs:
+    if "distinct_products" in result.metrics:
+        return schemas.ApproxKPIs(
+            shop_id=shop_id,
+            total_receipts=int(result.metrics["total_receipts"]),
+            total_revenue=float(result.metrics["total_revenue"] or 0),
+            distinct_products=result.metrics["distinct_products"],
+            top_skus=[schemas.ApproxTopSku(**row) for row in result.top_skus],
+        )
+    return schemas.KPIs(
+        shop_id=shop_id,
+        total_receipts=int(result.metrics["total_receipts"]),
+        total_revenue=float(result.metrics["total_revenue"] or 0),
+        top_skus=[schemas.TopSku(**row) for row in result.top_skus],
+    )
+
+
+def _cached_response(
+    entry: kpi_cache.CachedKpis, if_none_match: str | None, accept: str | None
+) -> Response:
+    media_type = encoding.negotiate(accept)
+    # One ETag per representation of the same cached KPIs
+    etag = entry.etag if media_type == encoding.JSON else entry.etag[:-1] + '-mp"'
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if encoding.NEGOTIATES:
+        headers["Vary"] = "Accept"
+    if kpi_cache.etag_matches(if_none_match, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    body = entry.body
+    if media_type == encoding.MSGPACK:
+        body = encoding.json_to_msgpack(body)
+    return Response(body, media_type=media_type, headers=headers)
+
+
+def _cacheable(db: Session | AsyncSession, shop_id: int) -> bool:
+    # Stickiness is per process, the cache may be shared: a replica read
+    # soon after a write made elsewhere can predate it (app.replicas)
+    return not replicas.on_replica(db) or kpi_cache.settled(
+        shop_id, replicas.READ_STICKY_SECONDS
+    )
+
+
+def _series_out(
+    db: Session,
+    shop_id: int,
+    granularity: str,
+    from_date: Optional[str],
+    to_date: Optional[str],
+) -> schemas.KpiSeries:
+    tz_name = db.execute(select(Shop.timezone).where(Shop.id == shop_id)).scalar_one()
+
+    # Same YYYY-MM-DD parsing as /kpis, read as days in the shop's timezone
+    end_dt = _parse_date(to_date)
+    end = end_dt.date() if end_dt else datetime.now(ZoneInfo(tz_name)).date()
+    start_dt = _parse_date(from_date)
+    start = (
+        start_dt.date()
+        if start_dt
+        else end - timedelta(days=kpi_series.DEFAULT_SPAN_DAYS[granularity])
+    )
+
+    try:
+        points = kpi_series.compute(db, shop_id, tz_name, granularity, start, end)
+    except kpi_series.SeriesRangeError as exc:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(exc),
+        )
+    return schemas.KpiSeries(
+        shop_id=shop_id,
+        granularity=granularity,
+        timezone=tz_name,
+        from_date=start,
+        to_date=end,
+        points=[schemas.KpiSeriesPoint(**point) for point in points],
+    )
+
+
+def _analytics_range(
+    from_date: Optional[str], to_date: Optional[str]
+) -> analytics.TimeRange:
+    # Same inclusive UTC days as /kpis
+    start = _parse_date(from_date)
+    end = _parse_date(to_date)
+    return analytics.TimeRange.from_datetimes(
+        start, end + timedelta(days=1) if end is not None else None
+    )
+
+
+def _basket_out(
+    db: Session, shop_id: int, rng: analytics.TimeRange
+) -> schemas.BasketKPIs:
+    snapshot = analytics.store.snapshot(db, shop_id)
+    return schemas.BasketKPIs(shop_id=shop_id, **analytics.basket(snapshot, rng))
+
+
+def _hour_of_week_out(
+    db: Session, shop_id: int, rng: analytics.TimeRange
+) -> schemas.HourOfWeekKPIs:
+    snapshot = analytics.store.snapshot(db, shop_id)
+    return schemas.HourOfWeekKPIs(
+        shop_id=shop_id,
+        timezone=snapshot.tz.key,
+        points=[
+            schemas.HourOfWeekPoint(**point)
+            for point in analytics.hour_of_week(snapshot, rng)
+        ],
+    )
+
+
+def _co_occurrence_out(
+    db: Session, shop_id: int, rng: analytics.TimeRange, top: int
+) -> schemas.CoOccurrenceKPIs:
+    snapshot = analytics.store.snapshot(db, shop_id)
+    pairs = analytics.co_occurrence(snapshot, rng, top)
+    ids = {pid for a, b, _ in pairs for pid in (a, b)}
+    skus = {
+        pid: sku
+        for pid, sku in db.execute(
+            select(Product.id, Product.sku).where(Product.id.in_(ids))
+        )
+    }
+    return schemas.CoOccurrenceKPIs(
+        shop_id=shop_id,
+        pairs=[
+            schemas.SkuPair(sku_a=skus[a], sku_b=skus[b], receipts=count)
+            for a, b, count in pairs
+        ],
+    )
+
+
 @router.get("", response_model=schemas.KPIs)
 def get_kpis(
     shop_id: int,
@@ -54,74 +207,224 @@ def get_kpis(
     to_date: Optional[str] = Query(
         None, alias="to", description="YYYY-MM-DD (inclusive)"
     ),
-    db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user),
+    approx: bool = Query(
+        False, description="Top SKUs and distinct products from sketches"
+    ),
+    if_none_match: str | None = Header(default=None),
+    accept: str | None = Header(default=None),
+    db: Session = Depends(get_read_db),
+    current_user: Principal = Depends(get_current_user),
 ):
-    _ensure_shop_owner(db, shop_id, current_user)
+    """Headline KPIs, served from ``app.kpi_cache`` until the next receipt."""
+    ensure_shop_owner(db, shop_id, current_user)
 
-    start_dt = _parse_date(from_date)
-    end_dt = _parse_date(to_date)
+    rng = _range_filter(shop_id, from_date, to_date)
+    key = kpi_cache.cache_key(shop_id, rng.start, rng.end, approx)
+    entry = kpi_cache.lookup(key)
+    if entry is None:
+        cacheable = _cacheable(db, shop_id)
+        result = (kpi_sketches.compute if approx else kpi_engine.compute)(db, rng)
+        # Release the connection before the response is sent
+        db.commit()
+        body = _kpis_out(shop_id, result).model_dump_json().encode()
+        entry = kpi_cache.store(key, body) if cacheable else kpi_cache.entry_for(body)
+    return _cached_response(entry, if_none_match, accept)
 
-    # Adjust to include the whole day in 'to'
-    if end_dt is not None:
-        end_dt = end_dt.replace(hour=23, minute=59, second=59, microsecond=999999)
-
-    # ---- total_receipts & total_revenue ----
-    receipts_query = db.query(Receipt).filter(Receipt.shop_id == shop_id)
-
-    if start_dt is not None:
-        receipts_query = receipts_query.filter(Receipt.created_at >= start_dt)
-    if end_dt is not None:
-        receipts_query = receipts_query.filter(Receipt.created_at <= end_dt)
-
-    total_receipts = receipts_query.count()
-    total_revenue = (
-        db.query(func.coalesce(func.sum(Receipt.total), 0))
-        .filter(Receipt.shop_id == shop_id)
-        .filter(
-            *([Receipt.created_at >= start_dt] if start_dt is not None else []),
-            *([Receipt.created_at <= end_dt] if end_dt is not None else []),
-        )
-        .scalar()
-    )
 
-    # ---- top_skus ----
-    lines_query = (
-        db.query(
-            Product.sku.label("sku"),
-            Product.name.label("name"),
-            func.sum(ReceiptLine.qty).label("qty"),
-            func.sum(ReceiptLine.qty * ReceiptLine.unit_price).label("revenue"),
-        )
-        .join(Receipt, ReceiptLine.receipt_id == Receipt.id)
-        .join(Product, ReceiptLine.product_id == Product.id)
-        .filter(Receipt.shop_id == shop_id)
-    )
+@router.get("/series", response_model=schemas.KpiSeries)
+def get_kpi_series(
+    shop_id: int,
+    granularity: schemas.Granularity = "day",
+    from_date: Optional[str] = Query(
+        None, alias="from", description="YYYY-MM-DD (inclusive, shop timezone)"
+    ),
+    to_date: Optional[str] = Query(
+        None, alias="to", description="YYYY-MM-DD (inclusive, shop timezone)"
+    ),
+    db: Session = Depends(get_read_db),
+    current_user: Principal = Depends(get_current_user),
+):
+    """Receipts and revenue per bucket, zero-filled, from one grouped query."""
+    ensure_shop_owner(db, shop_id, current_user)
 
-    if start_dt is not None:
-        lines_query = lines_query.filter(Receipt.created_at >= start_dt)
-    if end_dt is not None:
-        lines_query = lines_query.filter(Receipt.created_at <= end_dt)
+    series = _series_out(db, shop_id, granularity, from_date, to_date)
+    db.commit()
+    return series
 
-    lines_query = (
-        lines_query.group_by(Product.id, Product.sku, Product.name)
-        .order_by(desc("qty"))
-        .limit(5)
-    )
 
-    top_skus = [
-        schemas.TopSku(
-            sku=row.sku,
-            name=row.name,
-            qty=int(row.qty),
-            revenue=float(row.revenue),
-        )
-        for row in lines_query.all()
-    ]
+@router.get("/basket", response_model=schemas.BasketKPIs)
+def get_basket_kpis(
+    shop_id: int,
+    from_date: Optional[str] = Query(
+        None, alias="from", description="YYYY-MM-DD (inclusive)"
+    ),
+    to_date: Optional[str] = Query(
+        None, alias="to", description="YYYY-MM-DD (inclusive)"
+    ),
+    db: Session = Depends(get_read_db),
+    current_user: Principal = Depends(get_current_user),
+):
+    """Average items, lines and value per receipt, from ``app.analytics``."""
+    ensure_shop_owner(db, shop_id, current_user)
 
-    return schemas.KPIs(
-        shop_id=shop_id,
-        total_receipts=int(total_receipts),
-        total_revenue=float(total_revenue or 0),
-        top_skus=top_skus,
-    )
+    out = _basket_out(db, shop_id, _analytics_range(from_date, to_date))
+    db.commit()
+    return out
+
+
+@router.get("/hour-of-week", response_model=schemas.HourOfWeekKPIs)
+def get_hour_of_week_kpis(
+    shop_id: int,
+    from_date: Optional[str] = Query(
+        None, alias="from", description="YYYY-MM-DD (inclusive)"
+    ),
+    to_date: Optional[str] = Query(
+        None, alias="to", description="YYYY-MM-DD (inclusive)"
+    ),
+    db: Session = Depends(get_read_db),
+    current_user: Principal = Depends(get_current_user),
+):
+    """Receipts and revenue per local weekday and hour (168 points)."""
+    ensure_shop_owner(db, shop_id, current_user)
+
+    out = _hour_of_week_out(db, shop_id, _analytics_range(from_date, to_date))
+    db.commit()
+    return out
+
+
+@router.get("/co-occurrence", response_model=schemas.CoOccurrenceKPIs)
+def get_co_occurrence_kpis(
+    shop_id: int,
+    from_date: Optional[str] = Query(
+        None, alias="from", description="YYYY-MM-DD (inclusive)"
+    ),
+    to_date: Optional[str] = Query(
+        None, alias="to", description="YYYY-MM-DD (inclusive)"
+    ),
+    top: int = Query(10, ge=1, le=100),
+    db: Session = Depends(get_read_db),
+    current_user: Principal = Depends(get_current_user),
+):
+    """SKU pairs most often bought in the same receipt."""
+    ensure_shop_owner(db, shop_id, current_user)
+
+    out = _co_occurrence_out(db, shop_id, _analytics_range(from_date, to_date), top)
+    db.commit()
+    return out
+
+
+# ---------- Async path (ASYNC_DB=1) ----------
+
+
+@async_router.get("", response_model=schemas.KPIs)
+async def get_kpis_async(
+    shop_id: int,
+    from_date: Optional[str] = Query(
+        None, alias="from", description="YYYY-MM-DD (inclusive)"
+    ),
+    to_date: Optional[str] = Query(
+        None, alias="to", description="YYYY-MM-DD (inclusive)"
+    ),
+    approx: bool = Query(
+        False, description="Top SKUs and distinct products from sketches"
+    ),
+    if_none_match: str | None = Header(default=None),
+    accept: str | None = Header(default=None),
+    db: AsyncSession = Depends(get_async_read_db),
+    current_user: Principal = Depends(get_current_user_async),
+):
+    await ensure_shop_owner_async(db, shop_id, current_user)
+
+    rng = _range_filter(shop_id, from_date, to_date)
+
+    async def _cache(fn, *args):
+        # Network backends (redis) must not block the event loop
+        if kpi_cache.backend.blocking:
+            return await run_in_threadpool(fn, *args)
+        return fn(*args)
+
+    key = await _cache(kpi_cache.cache_key, shop_id, rng.start, rng.end, approx)
+    entry = await _cache(kpi_cache.lookup, key)
+    if entry is None:
+        cacheable = await _cache(_cacheable, db, shop_id)
+        compute = kpi_sketches.compute if approx else kpi_engine.compute
+        result = await db.run_sync(compute, rng)
+        body = _kpis_out(shop_id, result).model_dump_json().encode()
+        if cacheable:
+            entry = await _cache(kpi_cache.store, key, body)
+        else:
+            entry = kpi_cache.entry_for(body)
+    return _cached_response(entry, if_none_match, accept)
+
+
+@async_router.get("/series", response_model=schemas.KpiSeries)
+async def get_kpi_series_async(
+    shop_id: int,
+    granularity: schemas.Granularity = "day",
+    from_date: Optional[str] = Query(
+        None, alias="from", description="YYYY-MM-DD (inclusive, shop timezone)"
+    ),
+    to_date: Optional[str] = Query(
+        None, alias="to", description="YYYY-MM-DD (inclusive, shop timezone)"
+    ),
+    db: AsyncSession = Depends(get_async_read_db),
+    current_user: Principal = Depends(get_current_user_async),
+):
+    await ensure_shop_owner_async(db, shop_id, current_user)
+
+    return await db.run_sync(_series_out, shop_id, granularity, from_date, to_date)
+
+
+@async_router.get("/basket", response_model=schemas.BasketKPIs)
+async def get_basket_kpis_async(
+    shop_id: int,
+    from_date: Optional[str] = Query(
+        None, alias="from", description="YYYY-MM-DD (inclusive)"
+    ),
+    to_date: Optional[str] = Query(
+        None, alias="to", description="YYYY-MM-DD (inclusive)"
+    ),
+    db: AsyncSession = Depends(get_async_read_db),
+    current_user: Principal = Depends(get_current_user_async),
+):
+    await ensure_shop_owner_async(db, shop_id, current_user)
+
+    rng = _analytics_range(from_date, to_date)
+    return await db.run_sync(_basket_out, shop_id, rng)
+
+
+@async_router.get("/hour-of-week", response_model=schemas.HourOfWeekKPIs)
+async def get_hour_of_week_kpis_async(
+    shop_id: int,
+    from_date: Optional[str] = Query(
+        None, alias="from", description="YYYY-MM-DD (inclusive)"
+    ),
+    to_date: Optional[str] = Query(
+        None, alias="to", description="YYYY-MM-DD (inclusive)"
+    ),
+    db: AsyncSession = Depends(get_async_read_db),
+    current_user: Principal = Depends(get_current_user_async),
+):
+    await ensure_shop_owner_async(db, shop_id, current_user)
+
+    rng = _analytics_range(from_date, to_date)
+    return await db.run_sync(_hour_of_week_out, shop_id, rng)
+
+
+@async_router.get("/co-occurrence", response_model=schemas.CoOccurrenceKPIs)
+async def get_co_occurrence_kpis_async(
+    shop_id: int,
+    from_date: Optional[str] = Query(
+        None, alias="from", description="YYYY-MM-DD (inclusive)"
+    ),
+    to_date: Optional[str] = Query(
+        None, alias="to", description="YYYY-MM-DD (inclusive)"
+    ),
+    top: int = Query(10, ge=1, le=100),
+    db: AsyncSession = Depends(get_async_read_db),
+    current_user: Principal = Depends(get_current_user_async),
+):
+    await ensure_shop_owner_async(db, shop_id, current_user)
+
+    rng = _analytics_range(from_date, to_date)
+    return await db.run_sync(_co_occurrence_out, shop_id, rng, top)
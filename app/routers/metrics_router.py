@@ -0,0 +1,49 @@
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+
+from .. import analytics, db_pool, instrumentation, write_behind
+from ..utils import cache, hashing
+
+router = APIRouter(prefix="/metrics", tags=["metrics"])
+
+
+@router.get("", response_class=PlainTextResponse)
+def get_request_metrics() -> PlainTextResponse:
+    """Per-route latency, SQL statements, DB time, rows returned and written,
+    for Prometheus."""
+    return PlainTextResponse(
+        instrumentation.prometheus_text(),
+        media_type="text/plain; version=0.0.4",
+    )
+
+
+@router.get("/pool")
+def get_pool_metrics() -> dict:
+    """Connection pool usage per engine, to size DB_POOL_SIZE / DB_MAX_OVERFLOW."""
+    return db_pool.pool_metrics()
+
+
+@router.get("/caches")
+def get_cache_metrics() -> dict:
+    """Hit/miss counters of the in-process caches (e.g. ``principals``)."""
+    return cache.cache_metrics()
+
+
+@router.get("/hashing")
+def get_hashing_metrics() -> dict:
+    """Password hashing pool: in-flight/queued work, rejections, wait vs. run time."""
+    return hashing.pool.stats()
+
+
+@router.get("/analytics")
+def get_analytics_metrics() -> dict:
+    """Columnar snapshots in memory: total bytes, snapshots, loads, evictions."""
+    return analytics.store.stats()
+
+
+@router.get("/ingest-queue")
+def get_ingest_queue_metrics() -> dict:
+    """Write-behind queue: pending receipts, batches committed, failures."""
+    if write_behind.queue is None:
+        return {"enabled": False}
+    return {"enabled": True, **write_behind.queue.stats()}
@@ -0,0 +1,145 @@
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from .. import kpi_engine, schemas, shards
+from ..deps import (
+    ensure_shop_owner,
+    ensure_shop_owner_async,
+    get_async_read_db,
+    get_current_user,
+    get_current_user_async,
+    get_read_db,
+)
+from ..principals import Principal
+from .kpis_router import _day_range
+
+router = APIRouter(prefix="/kpis", tags=["kpis"])
+# Same endpoints on AsyncSession, mounted instead of `router` when ASYNC_DB=1
+async_router = APIRouter(prefix="/kpis", tags=["kpis"])
+
+MAX_PORTFOLIO_SHOPS = 500
+
+
+def _shop_ids(raw: Optional[str], principal: Principal) -> list[int]:
+    """Requested ids (comma separated), or every shop the caller owns."""
+    if not raw:
+        return sorted(principal.shop_ids)
+    try:
+        ids = list(dict.fromkeys(int(part) for part in raw.split(",") if part))
+    except ValueError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="shop_ids must be a comma-separated list of integers",
+        )
+    if len(ids) > MAX_PORTFOLIO_SHOPS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"At most {MAX_PORTFOLIO_SHOPS} shops per request",
+        )
+    return ids
+
+
+def _portfolio_filter(
+    shop_ids: list[int], from_date: Optional[str], to_date: Optional[str]
+) -> kpi_engine.PortfolioFilter:
+    # Same date parsing as the per-shop endpoint
+    start, end = _day_range(from_date, to_date)
+    return kpi_engine.PortfolioFilter(tuple(shop_ids), start, end)
+
+
+def _compute(
+    rng: kpi_engine.PortfolioFilter, db: Session | None = None
+) -> kpi_engine.PortfolioResult:
+    """One grouped statement per database the shops live on."""
+    results = shards.fan_out(
+        rng.shop_ids,
+        lambda session, ids: kpi_engine.compute_portfolio(
+            session, kpi_engine.PortfolioFilter(tuple(ids), rng.start, rng.end)
+        ),
+        db=db,
+    )
+    return kpi_engine.merge_portfolios(results)
+
+
+def _portfolio_out(
+    shop_ids: list[int], result: kpi_engine.PortfolioResult
+) -> schemas.PortfolioKPIs:
+    return schemas.PortfolioKPIs(
+        shop_ids=shop_ids,
+        total_receipts=int(result.combined["total_receipts"]),
+        total_revenue=float(result.combined["total_revenue"] or 0),
+        shops=[
+            schemas.ShopKpiTotals(
+                shop_id=shop_id,
+                total_receipts=int(result.per_shop[shop_id]["total_receipts"]),
+                total_revenue=float(result.per_shop[shop_id]["total_revenue"] or 0),
+            )
+            for shop_id in shop_ids
+        ],
+        top_skus=[schemas.TopSku(**row) for row in result.top_skus],
+    )
+
+
+def _zero_totals() -> dict:
+    return {"total_receipts": 0, "total_revenue": 0}
+
+
+@router.get("", response_model=schemas.PortfolioKPIs)
+def get_portfolio_kpis(
+    shop_ids: Optional[str] = Query(
+        None, description="Comma-separated shop ids (default: all owned shops)"
+    ),
+    from_date: Optional[str] = Query(
+        None, alias="from", description="YYYY-MM-DD (inclusive)"
+    ),
+    to_date: Optional[str] = Query(
+        None, alias="to", description="YYYY-MM-DD (inclusive)"
+    ),
+    db: Session = Depends(get_read_db),
+    current_user: Principal = Depends(get_current_user),
+):
+    """Per-shop and combined KPIs plus the global top SKUs for many shops."""
+    ids = _shop_ids(shop_ids, current_user)
+    for shop_id in ids:
+        ensure_shop_owner(db, shop_id, current_user)
+    if not ids:
+        return _portfolio_out(ids, kpi_engine.PortfolioResult({}, _zero_totals()))
+
+    result = _compute(_portfolio_filter(ids, from_date, to_date), db)
+    db.commit()
+    return _portfolio_out(ids, result)
+
+
+# ---------- Async path (ASYNC_DB=1) ----------
+
+
+@async_router.get("", response_model=schemas.PortfolioKPIs)
+async def get_portfolio_kpis_async(
+    shop_ids: Optional[str] = Query(
+        None, description="Comma-separated shop ids (default: all owned shops)"
+    ),
+    from_date: Optional[str] = Query(
+        None, alias="from", description="YYYY-MM-DD (inclusive)"
+    ),
+    to_date: Optional[str] = Query(
+        None, alias="to", description="YYYY-MM-DD (inclusive)"
+    ),
+    db: AsyncSession = Depends(get_async_read_db),
+    current_user: Principal = Depends(get_current_user_async),
+):
+    ids = _shop_ids(shop_ids, current_user)
+    for shop_id in ids:
+        await ensure_shop_owner_async(db, shop_id, current_user)
+    if not ids:
+        return _portfolio_out(ids, kpi_engine.PortfolioResult({}, _zero_totals()))
+
+    rng = _portfolio_filter(ids, from_date, to_date)
+    if set(shards.group_by_shard(ids)) == {shards.PRIMARY}:
+        result = await db.run_sync(kpi_engine.compute_portfolio, rng)
+    else:
+        result = await run_in_threadpool(_compute, rng)
+    return _portfolio_out(ids, result)
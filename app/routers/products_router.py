@@ -1,11 +1,61 @@
-from fastapi import APIRouter, Depends, status
+from typing import List
+
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
-from .. import schemas
-from ..deps import get_db, get_current_user
-from ..models import Product, User
+from .. import catalog, schemas
+from ..deps import get_async_db, get_current_user, get_current_user_async, get_db
+from ..models import Product
+from ..principals import Principal
 
 router = APIRouter(prefix="/products", tags=["products"])
+# Same endpoints on AsyncSession, mounted instead of `router` when ASYNC_DB=1
+async_router = APIRouter(prefix="/products", tags=["products"])
+
+MAX_SKUS = 1000
+
+
+def _parse_skus(skus: str) -> list[str]:
+    parsed = list(dict.fromkeys(s.strip() for s in skus.split(",") if s.strip()))
+    if len(parsed) > MAX_SKUS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"At most {MAX_SKUS} SKUs per request",
+        )
+    return parsed
+
+
+def _in_request_order(
+    skus: list[str], found: dict[str, catalog.CachedProduct]
+) -> list[schemas.ProductOut]:
+    return [
+        schemas.ProductOut.model_validate(found[sku]) for sku in skus if sku in found
+    ]
+
+
+def _new_product(product_in: schemas.ProductCreate) -> Product:
+    return Product(
+        sku=product_in.sku,
+        name=product_in.name,
+        price=product_in.price,
+    )
+
+
+@router.get("", response_model=List[schemas.ProductOut])
+def get_products(
+    skus: str = Query(..., description="Comma-separated SKUs"),
+    db: Session = Depends(get_db),
+    current_user: Principal = Depends(get_current_user),
+):
+    """Products by SKU, in request order; unknown SKUs are left out.
+
+    Served from the catalog cache, with one query for the misses.
+    """
+    wanted = _parse_skus(skus)
+    found = catalog.products(db, wanted)
+    db.commit()
+    return _in_request_order(wanted, found)
 
 
 @router.post(
@@ -16,19 +66,55 @@ router = APIRouter(prefix="/products", tags=["products"])
 def create_product(
     product_in: schemas.ProductCreate,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_user),
 ):
     # For the MVP we don't limit by user: global catalog.
-    existing = db.query(Product).filter(Product.sku == product_in.sku).first()
+    existing = catalog.products(db, [product_in.sku]).get(product_in.sku)
     if existing:
+        db.commit()  # release the connection, nothing was written
         return existing
 
-    product = Product(
-        sku=product_in.sku,
-        name=product_in.name,
-        price=product_in.price,
-    )
+    product = _new_product(product_in)
     db.add(product)
     db.commit()
     db.refresh(product)
     return product
+
+
+# ---------- Async path (ASYNC_DB=1) ----------
+
+
+@async_router.get("", response_model=List[schemas.ProductOut])
+async def get_products_async(
+    skus: str = Query(..., description="Comma-separated SKUs"),
+    db: AsyncSession = Depends(get_async_db),
+    current_user: Principal = Depends(get_current_user_async),
+):
+    wanted = _parse_skus(skus)
+    found = await db.run_sync(catalog.products, wanted)
+    await db.commit()
+    return _in_request_order(wanted, found)
+
+
+@async_router.post(
+    "",
+    response_model=schemas.ProductOut,
+    status_code=status.HTTP_201_CREATED,
+)
+async def create_product_async(
+    product_in: schemas.ProductCreate,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: Principal = Depends(get_current_user_async),
+):
+    existing = (await db.run_sync(catalog.products, [product_in.sku])).get(
+        product_in.sku
+    )
+    if existing:
+        await db.commit()
+        return existing
+
+    product = _new_product(product_in)
+    db.add(product)
+    await db.commit()
+    await db.refresh(product)
+    return product
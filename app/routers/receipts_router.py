@@ -1,40 +1,230 @@
-from fastapi import APIRouter, Depends, Header, HTTPException, status
+from datetime import datetime, time, timedelta
+from typing import Optional
+
+import anyio
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Request, status
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
-from .. import schemas
-from ..deps import get_db, get_current_user
-from ..models import (
-    Shop,
-    User,
-    Product,
-    Receipt,
-    ReceiptLine,
-    IdempotencyKey,
+from .. import (
+    idempotency,
+    importer,
+    ingest,
+    receipt_export,
+    replicas,
+    schemas,
+    write_behind,
+)
+from ..database import SessionLocal
+from ..deps import (
+    ensure_shop_owner,
+    ensure_shop_owner_async,
+    get_async_db,
+    get_async_read_db,
+    get_current_user,
+    get_current_user_async,
+    get_db,
+    get_read_db,
 )
+from ..principals import Principal
+from ..utils import encoding
+from .kpis_router import _day_range
 
 router = APIRouter(
     prefix="/shops/{shop_id}/receipts",
     tags=["receipts"],
 )
+# Same endpoints on AsyncSession, mounted instead of `router` when ASYNC_DB=1
+async_router = APIRouter(
+    prefix="/shops/{shop_id}/receipts",
+    tags=["receipts"],
+)
 
+MAX_BULK_RECEIPTS = 1000
 
-def _ensure_shop_owner(
-    db: Session,
-    shop_id: int,
-    user: User,
-) -> Shop:
-    shop = db.query(Shop).filter(Shop.id == shop_id).first()
-    if not shop:
+
+def _bulk_out(
+    receipts: list[schemas.BulkReceiptIn],
+    results: list[ingest.IngestResult],
+) -> schemas.BulkReceiptsOut:
+    return schemas.BulkReceiptsOut(
+        results=[
+            schemas.BulkReceiptResult(
+                index=i,
+                idempotency_key=r_in.idempotency_key,
+                status=res.status,
+                receipt=(
+                    schemas.ReceiptOut(id=res.receipt_id, total=res.total)
+                    if res.receipt_id is not None
+                    else None
+                ),
+                detail=res.detail,
+            )
+            for i, (r_in, res) in enumerate(zip(receipts, results))
+        ]
+    )
+
+
+def _raise_for_result(result: ingest.IngestResult) -> None:
+    if result.status == ingest.REJECTED:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=result.detail,
+        )
+    if result.status == ingest.CONFLICT:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=result.detail,
+        )
+
+
+def _wants_queue(prefer: str | None) -> bool:
+    # Write-behind only when enabled and asked for (RFC 7240 respond-async)
+    return write_behind.queue is not None and "respond-async" in (prefer or "")
+
+
+def _replay_before_queue(
+    body: schemas.ReceiptIn, stored: idempotency.StoredKey | None
+) -> schemas.ReceiptOut | None:
+    """Validate a receipt about to be queued; its replay if the key is used."""
+    error = ingest.validate_lines(body.lines)
+    if error:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=error)
+    if stored is None:
+        return None
+    if not stored.matches(idempotency.payload_hash(body.lines)):
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Idempotency-Key already used with a different payload",
+        )
+    return schemas.ReceiptOut(**stored.response)
+
+
+def _receipt_response(receipt_id: int, total: float, accept: str | None):
+    if encoding.wants_fast(accept):
+        # Encoded once from the ingest result: no model, no re-validation
+        return encoding.fast_response(
+            {"id": receipt_id, "total": float(total)},
+            accept,
+            status_code=status.HTTP_201_CREATED,
+        )
+    return schemas.ReceiptOut(id=receipt_id, total=total)
+
+
+def _key_conflict(exc: write_behind.KeyConflict) -> HTTPException:
+    return HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(exc))
+
+
+def _accepted(shop_id: int, handle: str) -> JSONResponse:
+    out = schemas.QueuedReceiptOut(handle=handle, status=write_behind.PENDING)
+    return JSONResponse(
+        out.model_dump(),
+        status_code=status.HTTP_202_ACCEPTED,
+        headers={"Location": f"/shops/{shop_id}/receipts/queued/{handle}"},
+    )
+
+
+def _queued_out(handle: str, row) -> schemas.QueuedReceiptOut:
+    if row is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
-            detail="Shop not found",
+            detail="Queued receipt not found",
         )
-    if shop.owner_id != user.id:
+    return schemas.QueuedReceiptOut(
+        handle=handle,
+        status=row.status,
+        receipt=(
+            schemas.ReceiptOut(id=row.receipt_id, total=row.total)
+            if row.receipt_id is not None
+            else None
+        ),
+        detail=row.detail,
+    )
+
+
+def _receipt_range(
+    shop_id: int,
+    from_date: Optional[str],
+    to_date: Optional[str],
+    cursor: Optional[str],
+) -> receipt_export.ReceiptRange:
+    start, end = _day_range(from_date, to_date)
+    try:
+        after = receipt_export.decode_cursor(cursor) if cursor else None
+    except receipt_export.CursorError as exc:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(exc),
+        )
+    return receipt_export.ReceiptRange(
+        shop_id=shop_id,
+        start=datetime.combine(start, time.min) if start else None,
+        # 'to' is inclusive: everything before the next midnight
+        end=datetime.combine(end + timedelta(days=1), time.min) if end else None,
+        after=after,
+    )
+
+
+def _page_out(page: receipt_export.Page) -> schemas.ReceiptPageOut:
+    return schemas.ReceiptPageOut(
+        receipts=[schemas.ReceiptDetailOut(**r) for r in page.receipts],
+        next_cursor=page.next_cursor,
+    )
+
+
+def _export_response(
+    shop_id: int, rng: receipt_export.ReceiptRange, fmt: str
+) -> StreamingResponse:
+    # Its own session: the stream outlives the request's dependencies
+    return StreamingResponse(
+        receipt_export.export(replicas.read_factory([shop_id]), rng, fmt),
+        media_type="application/x-ndjson" if fmt == "ndjson" else "text/csv",
+        headers={
+            "Content-Disposition": f'attachment; filename="receipts-{shop_id}.{fmt}"'
+        },
+    )
+
+
+def _check_bulk_size(body: schemas.BulkReceiptsIn) -> None:
+    if len(body.receipts) > MAX_BULK_RECEIPTS:
         raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="You are not the owner of this shop",
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"At most {MAX_BULK_RECEIPTS} receipts per request",
         )
-    return shop
+
+
+@router.get("", response_model=schemas.ReceiptPageOut)
+def list_receipts(
+    shop_id: int,
+    from_date: Optional[str] = Query(
+        None, alias="from", description="YYYY-MM-DD (inclusive, UTC)"
+    ),
+    to_date: Optional[str] = Query(
+        None, alias="to", description="YYYY-MM-DD (inclusive, UTC)"
+    ),
+    cursor: Optional[str] = Query(None, description="next_cursor of the last page"),
+    limit: int = Query(
+        receipt_export.DEFAULT_PAGE_SIZE, ge=1, le=receipt_export.MAX_PAGE_SIZE
+    ),
+    fmt: str = Query("json", alias="format", pattern="^(json|ndjson|csv)$"),
+    db: Session = Depends(get_read_db),
+    current_user: Principal = Depends(get_current_user),
+):
+    """Receipts with their lines, oldest first, by keyset pages.
+
+    ``format=ndjson|csv`` streams the whole range instead of one page.
+    """
+    ensure_shop_owner(db, shop_id, current_user)
+    rng = _receipt_range(shop_id, from_date, to_date, cursor)
+    if fmt != "json":
+        db.commit()
+        return _export_response(shop_id, rng, fmt)
+
+    page = receipt_export.list_page(db, rng, limit)
+    db.commit()
+    return _page_out(page)
 
 
 @router.post(
@@ -46,81 +236,275 @@ def create_receipt(
     shop_id: int,
     body: schemas.ReceiptIn,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_user),
     idempotency_key: str | None = Header(default=None, alias="Idempotency-Key"),
+    prefer: str | None = Header(default=None),
+    accept: str | None = Header(default=None),
 ):
+    """Create a receipt (201).
+
+    With ``Prefer: respond-async`` and ``WRITE_BEHIND=1``, queue it instead
+    and answer 202 with a handle (see ``app.write_behind``).
+    """
     # 1) Validate shop & owner
-    _ensure_shop_owner(db, shop_id, current_user)
-
-    # 2) Si hay Idempotency-Key, mirar si ya existe
-    if idempotency_key:
-        existing = (
-            db.query(IdempotencyKey)
-            .filter(IdempotencyKey.key == idempotency_key)
-            .first()
+    ensure_shop_owner(db, shop_id, current_user)
+
+    if _wants_queue(prefer):
+        stored = (
+            idempotency.lookup(db, shop_id, idempotency_key)
+            if idempotency_key is not None
+            else None
         )
-        if existing and existing.receipt_id is not None:
-            # Recover the associated receipt and return it
-            receipt = (
-                db.query(Receipt).filter(Receipt.id == existing.receipt_id).first()
-            )
-            if receipt:
-                return schemas.ReceiptOut(
-                    id=receipt.id,
-                    total=float(receipt.total),
-                )
-
-    # 3) Create / ensure products + calculate total
-    total = 0.0
-    lines_models: list[ReceiptLine] = []
-
-    for line in body.lines:
-        if line.qty <= 0 or line.unit_price < 0:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="Invalid qty or unit_price",
+        db.commit()
+        replay = _replay_before_queue(body, stored)
+        if replay is not None:
+            return _receipt_response(replay.id, replay.total, accept)
+        try:
+            handle = write_behind.queue.enqueue(
+                db, shop_id, body.lines, idempotency_key
             )
+        except write_behind.KeyConflict as exc:
+            raise _key_conflict(exc)
+        return _accepted(shop_id, handle)
 
-        product = db.query(Product).filter(Product.sku == line.sku).first()
-        if not product:
-            # If not exists, create it on-the-fly with the SKU as name
-            product = Product(
-                sku=line.sku,
-                name=line.sku,
-                price=line.unit_price,
-            )
-            db.add(product)
-            db.flush()  # get product.id
+    # 2) Products, receipt, lines, Idempotency-Key and rollups in one go
+    [result] = ingest.ingest_receipts(
+        db,
+        shop_id,
+        [ingest.ReceiptDraft(lines=body.lines, idempotency_key=idempotency_key)],
+    )
+    _raise_for_result(result)
+
+    db.commit()
 
-        line_total = line.qty * line.unit_price
-        total += line_total
+    return _receipt_response(result.receipt_id, result.total, accept)
 
-        lines_models.append(
-            ReceiptLine(
-                product_id=product.id,
-                qty=line.qty,
-                unit_price=line.unit_price,
-            )
+
+@router.get("/queued/{handle}", response_model=schemas.QueuedReceiptOut)
+def get_queued_receipt(
+    shop_id: int,
+    handle: str,
+    db: Session = Depends(get_db),
+    current_user: Principal = Depends(get_current_user),
+):
+    """Whether a receipt accepted with 202 is committed yet, and its outcome."""
+    ensure_shop_owner(db, shop_id, current_user)
+    out = _queued_out(handle, write_behind.outcome(db, shop_id, handle))
+    db.commit()
+    return out
+
+
+@router.post(
+    ":bulk",
+    response_model=schemas.BulkReceiptsOut,
+)
+def create_receipts_bulk(
+    shop_id: int,
+    body: schemas.BulkReceiptsIn,
+    db: Session = Depends(get_db),
+    current_user: Principal = Depends(get_current_user),
+):
+    """Create many receipts (e.g. an offline POS catching up) in one transaction.
+
+    Each receipt carries its own ``idempotency_key``. Invalid receipts are
+    reported as ``rejected`` without failing the rest of the batch.
+    """
+    ensure_shop_owner(db, shop_id, current_user)
+
+    _check_bulk_size(body)
+
+    results = ingest.ingest_receipts(
+        db,
+        shop_id,
+        [
+            ingest.ReceiptDraft(lines=r.lines, idempotency_key=r.idempotency_key)
+            for r in body.receipts
+        ],
+    )
+    db.commit()
+
+    return _bulk_out(body.receipts, results)
+
+
+# The import already runs its chunked transactions in a worker thread with its
+# own sessions, so the same handler serves both the sync and async routers.
+@async_router.post(
+    ":import",
+    response_model=schemas.ImportReportOut,
+)
+@router.post(
+    ":import",
+    response_model=schemas.ImportReportOut,
+)
+async def import_receipts(
+    shop_id: int,
+    request: Request,
+    fmt: str = Query("ndjson", alias="format", pattern="^(ndjson|csv)$"),
+    offset: int = Query(0, ge=0, description="Receipts to skip (resume point)"),
+    chunk_size: int = Query(importer.DEFAULT_CHUNK_SIZE, ge=1, le=5000),
+    db: Session = Depends(get_db),
+    current_user: Principal = Depends(get_current_user),
+):
+    """Stream an NDJSON/CSV body of historical receipts into the shop.
+
+    The body is parsed as it arrives and written in transactions of
+    ``chunk_size`` receipts; see ``app.importer`` for the formats. On failure,
+    resume from the last reported ``next_offset``.
+    """
+    await run_in_threadpool(ensure_shop_owner, db, shop_id, current_user)
+
+    body = request.stream()
+
+    def _body_chunks():
+        # Runs in the worker thread and pulls the body from the event loop
+        while True:
+            try:
+                yield anyio.from_thread.run(body.__anext__)
+            except StopAsyncIteration:
+                return
+
+    def _progress(report: importer.ImportReport) -> None:
+        importer.log.info(
+            "shop=%s import committed up to offset %s", shop_id, report.next_offset
         )
 
-    # 4) Create receipt + lines in a transaction
-    receipt = Receipt(shop_id=shop_id, total=total)
-    db.add(receipt)
-    db.flush()  # get receipt.id
+    report = await run_in_threadpool(
+        importer.import_receipts,
+        SessionLocal,
+        shop_id,
+        importer.iter_lines(_body_chunks()),
+        fmt,
+        chunk_size,
+        offset,
+        _progress,
+    )
+    return schemas.ImportReportOut(**report.__dict__)
+
+
+# ---------- Async path (ASYNC_DB=1) ----------
 
-    for lm in lines_models:
-        lm.receipt_id = receipt.id
-        db.add(lm)
 
-    # 5) Save Idempotency-Key if applies
-    if idempotency_key:
-        idem = IdempotencyKey(
-            key=idempotency_key,
-            receipt_id=receipt.id,
+@async_router.get("", response_model=schemas.ReceiptPageOut)
+async def list_receipts_async(
+    shop_id: int,
+    from_date: Optional[str] = Query(
+        None, alias="from", description="YYYY-MM-DD (inclusive, UTC)"
+    ),
+    to_date: Optional[str] = Query(
+        None, alias="to", description="YYYY-MM-DD (inclusive, UTC)"
+    ),
+    cursor: Optional[str] = Query(None, description="next_cursor of the last page"),
+    limit: int = Query(
+        receipt_export.DEFAULT_PAGE_SIZE, ge=1, le=receipt_export.MAX_PAGE_SIZE
+    ),
+    fmt: str = Query("json", alias="format", pattern="^(json|ndjson|csv)$"),
+    db: AsyncSession = Depends(get_async_read_db),
+    current_user: Principal = Depends(get_current_user_async),
+):
+    await ensure_shop_owner_async(db, shop_id, current_user)
+    rng = _receipt_range(shop_id, from_date, to_date, cursor)
+    if fmt != "json":
+        # The stream runs on a sync session in the threadpool, like imports
+        await db.commit()
+        return _export_response(shop_id, rng, fmt)
+
+    page = await db.run_sync(receipt_export.list_page, rng, limit)
+    await db.commit()
+    return _page_out(page)
+
+
+@async_router.post(
+    "",
+    response_model=schemas.ReceiptOut,
+    status_code=status.HTTP_201_CREATED,
+)
+async def create_receipt_async(
+    shop_id: int,
+    body: schemas.ReceiptIn,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: Principal = Depends(get_current_user_async),
+    idempotency_key: str | None = Header(default=None, alias="Idempotency-Key"),
+    prefer: str | None = Header(default=None),
+    accept: str | None = Header(default=None),
+):
+    await ensure_shop_owner_async(db, shop_id, current_user)
+
+    if _wants_queue(prefer):
+        stored = (
+            await db.run_sync(idempotency.lookup, shop_id, idempotency_key)
+            if idempotency_key is not None
+            else None
         )
-        db.add(idem)
+        await db.commit()
+        replay = _replay_before_queue(body, stored)
+        if replay is not None:
+            return _receipt_response(replay.id, replay.total, accept)
+        try:
+            handle, entry = await db.run_sync(
+                write_behind.accept, shop_id, body.lines, idempotency_key
+            )
+        except write_behind.KeyConflict as exc:
+            raise _key_conflict(exc)
+        if entry is None:
+            await db.commit()
+            return _accepted(shop_id, handle)
+        # The append (and its fsync) is blocking file I/O
+        await run_in_threadpool(write_behind.queue.append, entry)
+        try:
+            await db.commit()
+        except BaseException:
+            write_behind.queue.discard(entry)
+            raise
+        write_behind.queue.publish(entry)
+        return _accepted(shop_id, handle)
 
-    db.commit()
-    db.refresh(receipt)
+    # The ingest service is shared with the sync path through run_sync
+    [result] = await db.run_sync(
+        ingest.ingest_receipts,
+        shop_id,
+        [ingest.ReceiptDraft(lines=body.lines, idempotency_key=idempotency_key)],
+    )
+    _raise_for_result(result)
+
+    await db.commit()
+
+    return _receipt_response(result.receipt_id, result.total, accept)
+
+
+@async_router.get("/queued/{handle}", response_model=schemas.QueuedReceiptOut)
+async def get_queued_receipt_async(
+    shop_id: int,
+    handle: str,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: Principal = Depends(get_current_user_async),
+):
+    await ensure_shop_owner_async(db, shop_id, current_user)
+    out = _queued_out(handle, await db.run_sync(write_behind.outcome, shop_id, handle))
+    await db.commit()
+    return out
+
+
+@async_router.post(
+    ":bulk",
+    response_model=schemas.BulkReceiptsOut,
+)
+async def create_receipts_bulk_async(
+    shop_id: int,
+    body: schemas.BulkReceiptsIn,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: Principal = Depends(get_current_user_async),
+):
+    await ensure_shop_owner_async(db, shop_id, current_user)
+    _check_bulk_size(body)
+
+    results = await db.run_sync(
+        ingest.ingest_receipts,
+        shop_id,
+        [
+            ingest.ReceiptDraft(lines=r.lines, idempotency_key=r.idempotency_key)
+            for r in body.receipts
+        ],
+    )
+    await db.commit()
 
-    return schemas.ReceiptOut(id=receipt.id, total=float(receipt.total))
+    return _bulk_out(body.receipts, results)
@@ -1,11 +1,15 @@
 from fastapi import APIRouter, Depends, status
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
 from .. import schemas
-from ..deps import get_db, get_current_user
-from ..models import Shop, User
+from ..deps import get_async_db, get_current_user, get_current_user_async, get_db
+from ..models import Shop
+from ..principals import Principal
 
 router = APIRouter(prefix="/shops", tags=["shops"])
+# Same endpoints on AsyncSession, mounted instead of `router` when ASYNC_DB=1
+async_router = APIRouter(prefix="/shops", tags=["shops"])
 
 
 @router.post(
@@ -16,10 +20,29 @@ router = APIRouter(prefix="/shops", tags=["shops"])
 def create_shop(
     shop_in: schemas.ShopCreate,
     db: Session = Depends(get_db),
-    current_user: User = Depends(get_current_user),
+    current_user: Principal = Depends(get_current_user),
 ):
-    shop = Shop(name=shop_in.name, owner_id=current_user.id)
+    shop = Shop(name=shop_in.name, owner_id=current_user.id, timezone=shop_in.timezone)
     db.add(shop)
     db.commit()
     db.refresh(shop)
     return shop
+
+
+# ---------- Async path (ASYNC_DB=1) ----------
+
+
+@async_router.post(
+    "",
+    response_model=schemas.ShopOut,
+    status_code=status.HTTP_201_CREATED,
+)
+async def create_shop_async(
+    shop_in: schemas.ShopCreate,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: Principal = Depends(get_current_user_async),
+):
+    shop = Shop(name=shop_in.name, owner_id=current_user.id, timezone=shop_in.timezone)
+    db.add(shop)
+    await db.commit()
+    return shop
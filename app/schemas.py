@@ -1,5 +1,8 @@
-from pydantic import BaseModel, EmailStr, ConfigDict
-from typing import List, Optional
+from datetime import date, datetime
+from typing import List, Literal, Optional, Tuple
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+from pydantic import BaseModel, ConfigDict, EmailStr, field_validator
 
 
 # ---------- Auth ----------
@@ -13,6 +16,16 @@ class UserCreate(BaseModel):
 class Token(BaseModel):
     access_token: str
     token_type: str = "bearer"
+    refresh_token: str | None = None
+
+
+class RefreshRequest(BaseModel):
+    refresh_token: str
+
+
+class LogoutRequest(BaseModel):
+    # Also revoke this refresh token (and the tokens rotated from it)
+    refresh_token: str | None = None
 
 
 # ---------- Shops ----------
@@ -20,11 +33,23 @@ class Token(BaseModel):
 
 class ShopCreate(BaseModel):
     name: str
+    # IANA name; KPI series are bucketed in the shop's local time
+    timezone: str = "UTC"
+
+    @field_validator("timezone")
+    @classmethod
+    def _known_timezone(cls, value: str) -> str:
+        try:
+            ZoneInfo(value)
+        except (ZoneInfoNotFoundError, ValueError):
+            raise ValueError(f"Unknown timezone {value!r}")
+        return value
 
 
 class ShopOut(BaseModel):
     id: int
     name: str
+    timezone: str
 
     model_config = ConfigDict(from_attributes=True)
 
@@ -67,6 +92,70 @@ class ReceiptOut(BaseModel):
     model_config = ConfigDict(from_attributes=True)
 
 
+class QueuedReceiptOut(BaseModel):
+    handle: str
+    # pending, then the ingest outcome: created | replayed | conflict |
+    # rejected | failed
+    status: str
+    receipt: Optional[ReceiptOut] = None
+    detail: Optional[str] = None
+
+
+class ReceiptLineOut(BaseModel):
+    sku: str
+    qty: int
+    unit_price: float
+
+
+class ReceiptDetailOut(BaseModel):
+    id: int
+    created_at: datetime
+    total: float
+    lines: List[ReceiptLineOut]
+
+
+class ReceiptPageOut(BaseModel):
+    receipts: List[ReceiptDetailOut]
+    # Pass as ?cursor= for the next page; null on the last page
+    next_cursor: Optional[str] = None
+
+
+class BulkReceiptIn(ReceiptIn):
+    idempotency_key: Optional[str] = None
+
+
+class BulkReceiptsIn(BaseModel):
+    receipts: List[BulkReceiptIn]
+
+
+class BulkReceiptResult(BaseModel):
+    index: int
+    idempotency_key: Optional[str] = None
+    status: str  # created | replayed | conflict | rejected
+    receipt: Optional[ReceiptOut] = None
+    detail: Optional[str] = None
+
+
+class BulkReceiptsOut(BaseModel):
+    results: List[BulkReceiptResult]
+
+
+class ImportRecordError(BaseModel):
+    record: int
+    # Line of the input (1-based; for CSV the header is line 1)
+    row: Optional[int] = None
+    detail: str
+
+
+class ImportReportOut(BaseModel):
+    processed: int
+    created: int
+    replayed: int
+    rejected: int
+    next_offset: int
+    errors: List[ImportRecordError]
+
+
 # ---------- KPIs ----------
 
 
@@ -82,3 +171,116 @@ class KPIs(BaseModel):
     total_receipts: int
     total_revenue: float
     top_skus: List[TopSku]
+
+
+class ApproxTopSku(TopSku):
+    # qty is an upper bound; the true quantity is at least qty - qty_error
+    qty_error: int
+
+
+class ApproxKPIs(KPIs):
+    """``?approx=true``: exact totals, sketch-based SKUs (see app.kpi_sketches)."""
+
+    approximate: bool = True
+    distinct_products: int
+    top_skus: List[ApproxTopSku]
+
+
+Granularity = Literal["hour", "day", "week", "month"]
+
+
+class KpiSeriesPoint(BaseModel):
+    # Start of the bucket in the shop's timezone
+    bucket: datetime
+    receipts: int
+    revenue: float
+
+
+class KpiSeries(BaseModel):
+    shop_id: int
+    granularity: Granularity
+    timezone: str
+    from_date: date
+    to_date: date
+    points: List[KpiSeriesPoint]
+
+
+class BasketKPIs(BaseModel):
+    shop_id: int
+    receipts: int
+    avg_items: float
+    avg_lines: float
+    avg_value: float
+
+
+class HourOfWeekPoint(BaseModel):
+    # 0 = Monday, local time in the shop's timezone
+    weekday: int
+    hour: int
+    receipts: int
+    revenue: float
+
+
+class HourOfWeekKPIs(BaseModel):
+    shop_id: int
+    timezone: str
+    points: List[HourOfWeekPoint]
+
+
+class SkuPair(BaseModel):
+    sku_a: str
+    sku_b: str
+    receipts: int
+
+
+class CoOccurrenceKPIs(BaseModel):
+    shop_id: int
+    pairs: List[SkuPair]
+
+
+class ShopKpiTotals(BaseModel):
+    shop_id: int
+    total_receipts: int
+    total_revenue: float
+
+
+class PortfolioKPIs(BaseModel):
+    shop_ids: List[int]
+    total_receipts: int
+    total_revenue: float
+    shops: List[ShopKpiTotals]
+    top_skus: List[TopSku]
+
+
+# ---------- Device sync ----------
+
+
+class SyncShop(BaseModel):
+    id: int
+    name: str
+    timezone: str
+
+
+class SyncProduct(BaseModel):
+    id: int
+    sku: str
+    name: str
+    price: float
+
+
+class SyncReceipt(BaseModel):
+    id: int
+    created_at: datetime
+    total: float
+    # Compact lines: [sku, qty, unit_price]
+    lines: List[Tuple[str, int, float]]
+
+
+class SyncBatchOut(BaseModel):
+    # Only when the shop row changed since the cursor
+    shop: Optional[SyncShop] = None
+    products: List[SyncProduct]
+    receipts: List[SyncReceipt]
+    # Pass as ?since= on the next sync; call again at once while has_more
+    next_cursor: str
+    has_more: bool
@@ -0,0 +1,94 @@
+"""Which database each shop lives on, and fan-out across them.
+
+Every shop lives on the primary database (``app.database``) unless a
+resolver registered with ``set_resolver`` maps it to another shard whose
+sessions come from ``register_shard``:
+
+    shards.register_shard("eu", sessionmaker(create_engine(EU_URL)))
+    shards.set_resolver(lambda shop_id: "eu" if shop_id in EU_SHOPS else "primary")
+
+``fan_out`` runs a per-shard function once per database involved: inline on
+the caller's session when every shop is on the primary (the common case, no
+threads), otherwise in parallel on a bounded thread pool
+(``SHARD_FANOUT_WORKERS``, default 8) with one session per shard.
+"""
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterable, TypeVar
+
+from sqlalchemy.orm import Session
+
+PRIMARY = "primary"
+SHARD_FANOUT_WORKERS = int(os.getenv("SHARD_FANOUT_WORKERS", "8"))
+
+T = TypeVar("T")
+
+_factories: dict[str, Callable[[], Session]] = {}
+_resolver: Callable[[int], str] | None = None
+_executor: ThreadPoolExecutor | None = None
+
+
+def register_shard(name: str, session_factory: Callable[[], Session]) -> None:
+    _factories[name] = session_factory
+
+
+def unregister_shard(name: str) -> None:
+    _factories.pop(name, None)
+
+
+def set_resolver(resolver: Callable[[int], str] | None) -> None:
+    """Map shop ids to shard names (``None`` puts every shop on the primary)."""
+    global _resolver
+    _resolver = resolver
+
+
+def shard_of(shop_id: int) -> str:
+    return PRIMARY if _resolver is None else _resolver(shop_id)
+
+
+def group_by_shard(shop_ids: Iterable[int]) -> dict[str, list[int]]:
+    groups: dict[str, list[int]] = {}
+    for shop_id in shop_ids:
+        groups.setdefault(shard_of(shop_id), []).append(shop_id)
+    return groups
+
+
+def _pool() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=SHARD_FANOUT_WORKERS, thread_name_prefix="shard-fanout"
+        )
+    return _executor
+
+
+def _primary_factory() -> Session:
+    from .database import SessionLocal
+
+    return SessionLocal()
+
+
+def fan_out(
+    shop_ids: Iterable[int],
+    fn: Callable[[Session, list[int]], T],
+    db: Session | None = None,
+) -> list[T]:
+    """Call ``fn(session, shop_ids_on_that_shard)`` for every shard involved.
+
+    ``db`` (a primary session) is reused for the primary group; it is only
+    used from the calling thread.
+    """
+    groups = group_by_shard(shop_ids)
+
+    def _run(name: str, ids: list[int]) -> T:
+        factory = _factories.get(name, _primary_factory if name == PRIMARY else None)
+        if factory is None:
+            raise LookupError(f"No database registered for shard {name!r}")
+        with factory() as session:
+            return fn(session, ids)
+
+    local = groups.pop(PRIMARY, None) if db is not None else None
+    futures = [_pool().submit(_run, name, ids) for name, ids in groups.items()]
+    results = [fn(db, local)] if local is not None else []
+    return results + [future.result() for future in futures]
@@ -0,0 +1,208 @@
+"""Refresh tokens with rotation, and revocation of access tokens.
+
+Login/register return a short-lived access token and a refresh token. The
+access token carries the user id, active flag and ``token_version``, so
+``deps.get_current_user`` authenticates from the claims plus the cached
+principal, without a per-request query. Revocation is honoured in two ways:
+
+- ``revoke_access`` (logout) puts the token's ``jti`` on the revocation list
+  (``revoked_tokens``, indexed). Each process mirrors the list in a Bloom
+  filter, refreshed every ``REVOCATION_SYNC_SECONDS`` (default 30) from the
+  rows added since the last sync, so the table is only read for the rare
+  token that hits the filter.
+- ``revoke_user`` (logout everywhere, password change) bumps
+  ``users.token_version``: every token issued before carries an older
+  version and is rejected once the principal is reloaded.
+
+Refresh tokens are single-use: ``rotate`` marks the presented token as
+replaced and issues a new pair in the same *family*. Presenting a token that
+was already rotated means it leaked, so the whole family is revoked.
+"""
+
+import os
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+
+from jose import JWTError
+from sqlalchemy import delete, select, update
+from sqlalchemy.orm import Session
+
+from .models import RefreshToken, RevokedToken, User
+from .utils import security
+from .utils.bloom import BloomFilter
+
+REVOCATION_SYNC_SECONDS = float(os.getenv("REVOCATION_SYNC_SECONDS", "30"))
+REVOCATION_BLOOM_CAPACITY = int(os.getenv("REVOCATION_BLOOM_CAPACITY", "100000"))
+
+
+class TokenError(Exception):
+    """The presented token is invalid, expired, reused or revoked."""
+
+
+@dataclass(frozen=True)
+class IssuedTokens:
+    access_token: str
+    refresh_token: str
+    refresh_jti: str
+
+
+def issue(db: Session, user: User, family: str | None = None) -> IssuedTokens:
+    """New access + refresh pair for ``user`` (the caller commits)."""
+    jti = security.new_jti()
+    expires_at = datetime.utcnow() + timedelta(days=security.REFRESH_TOKEN_EXPIRE_DAYS)
+    db.add(
+        RefreshToken(
+            jti=jti, user_id=user.id, family=family or jti, expires_at=expires_at
+        )
+    )
+    return IssuedTokens(
+        access_token=security.create_access_token(
+            user.email, user.id, user.token_version, user.is_active
+        ),
+        refresh_token=security.create_refresh_token(
+            jti, user.id, user.token_version, expires_at
+        ),
+        refresh_jti=jti,
+    )
+
+
+def revoke_family(db: Session, family: str) -> None:
+    db.execute(
+        update(RefreshToken)
+        .where(RefreshToken.family == family, RefreshToken.revoked_at.is_(None))
+        .values(revoked_at=datetime.utcnow())
+    )
+
+
+def revoke_refresh(db: Session, refresh_token: str, user_id: int) -> None:
+    """Revoke the family of one of ``user_id``'s refresh tokens (logout)."""
+    try:
+        claims = security.decode_token(refresh_token, "refresh")
+    except JWTError:
+        raise TokenError("Invalid refresh token")
+    row = db.get(RefreshToken, claims["jti"])
+    if row is None or row.user_id != user_id:
+        raise TokenError("Unknown refresh token")
+    revoke_family(db, row.family)
+
+
+def rotate(db: Session, refresh_token: str) -> IssuedTokens:
+    """Exchange a refresh token for a new pair; commits."""
+    try:
+        claims = security.decode_token(refresh_token, "refresh")
+    except JWTError:
+        raise TokenError("Invalid refresh token")
+
+    row = db.execute(
+        select(RefreshToken).where(RefreshToken.jti == claims["jti"]).with_for_update()
+    ).scalar_one_or_none()
+    if row is None:
+        raise TokenError("Unknown refresh token")
+    if row.replaced_by is not None or row.revoked_at is not None:
+        # Already used: someone else holds a copy of this token
+        revoke_family(db, row.family)
+        db.commit()
+        raise TokenError("Refresh token reused")
+
+    user = db.get(User, row.user_id)
+    if user is None or not user.is_active or user.token_version != claims["ver"]:
+        raise TokenError("Refresh token revoked")
+
+    tokens = issue(db, user, family=row.family)
+    row.replaced_by = tokens.refresh_jti
+    row.revoked_at = datetime.utcnow()
+    db.commit()
+    return tokens
+
+
+def revoke_user(db: Session, user_id: int) -> None:
+    """Invalidate every token of the user (the caller commits)."""
+    user = db.get(User, user_id)
+    if user is not None:
+        # An ORM change, so the principal cache drops the user on commit
+        user.token_version += 1
+    db.execute(
+        update(RefreshToken)
+        .where(RefreshToken.user_id == user_id, RefreshToken.revoked_at.is_(None))
+        .values(revoked_at=datetime.utcnow())
+    )
+
+
+# ---------- Access-token revocation list ----------
+
+
+class _RevocationList:
+    """Per-process Bloom filter over ``revoked_tokens.jti``."""
+
+    def __init__(self, capacity: int, sync_seconds: float) -> None:
+        self.capacity = capacity
+        self.sync_seconds = sync_seconds
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        self._bloom = BloomFilter(self.capacity)
+        self._last_id = 0
+        self._synced_at = float("-inf")
+
+    def needs_sync(self) -> bool:
+        return time.monotonic() - self._synced_at >= self.sync_seconds
+
+    def might_be_revoked(self, jti: str) -> bool:
+        """False means definitely not revoked (as of the last sync)."""
+        return self.needs_sync() or jti in self._bloom
+
+    def __contains__(self, jti: str) -> bool:
+        return jti in self._bloom
+
+    def add(self, jti: str) -> None:
+        with self._lock:
+            self._bloom.add(jti)
+
+    def sync(self, db: Session) -> None:
+        with self._lock:
+            if self._bloom.saturated:
+                # Rebuild from the entries that have not expired yet
+                self._bloom = BloomFilter(self.capacity)
+                self._last_id = 0
+            stmt = (
+                select(RevokedToken.id, RevokedToken.jti)
+                .where(
+                    RevokedToken.id > self._last_id,
+                    RevokedToken.expires_at > datetime.utcnow(),
+                )
+                .order_by(RevokedToken.id)
+            )
+            for row_id, jti in db.execute(stmt):
+                self._bloom.add(jti)
+                self._last_id = row_id
+            self._synced_at = time.monotonic()
+
+
+revocations = _RevocationList(REVOCATION_BLOOM_CAPACITY, REVOCATION_SYNC_SECONDS)
+
+
+def is_revoked(db: Session, jti: str) -> bool:
+    """Whether an access token was revoked; only reads the DB on a filter hit."""
+    if revocations.needs_sync():
+        revocations.sync(db)
+    if jti not in revocations:
+        return False
+    return (
+        db.execute(
+            select(RevokedToken.id).where(RevokedToken.jti == jti)
+        ).scalar_one_or_none()
+        is not None
+    )
+
+
+def revoke_access(db: Session, jti: str, expires_at: datetime) -> None:
+    """Put an access token on the revocation list (the caller commits)."""
+    now = datetime.utcnow()
+    # Expired entries can never match a valid token again
+    db.execute(delete(RevokedToken).where(RevokedToken.expires_at <= now))
+    if expires_at > now:
+        db.add(RevokedToken(jti=jti, expires_at=expires_at))
+        revocations.add(jti)
@@ -0,0 +1,66 @@
+"""``Content-Encoding`` negotiation for large response bodies.
+
+``zstd`` is used when the client accepts it and the optional ``zstandard``
+package is installed (``pip install zstandard``), ``gzip`` otherwise. Bodies
+under ``MIN_SIZE`` bytes are sent as-is: compressing them costs more than it
+saves.
+"""
+
+import gzip
+
+from starlette.responses import Response
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - optional dependency
+    zstandard = None
+
+MIN_SIZE = 1024
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 3
+
+
+def _accepted(accept_encoding: str | None) -> dict[str, float]:
+    accepted: dict[str, float] = {}
+    for part in (accept_encoding or "").split(","):
+        name, _, params = part.strip().partition(";")
+        q = 1.0
+        if params.strip().startswith("q="):
+            try:
+                q = float(params.strip()[2:])
+            except ValueError:
+                q = 0.0
+        if name:
+            accepted[name.lower()] = q
+    return accepted
+
+
+def negotiate(accept_encoding: str | None) -> str | None:
+    """Best supported encoding for an ``Accept-Encoding`` header, or None."""
+    accepted = _accepted(accept_encoding)
+    available = ("zstd", "gzip") if zstandard is not None else ("gzip",)
+    candidates = [e for e in available if accepted.get(e, 0) > 0]
+    if not candidates:
+        return None
+    # Highest q wins; on ties the order of ``available`` (zstd first)
+    return max(candidates, key=lambda e: (accepted[e], -available.index(e)))
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "zstd":
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(body)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL)
+
+
+def encoded_response(
+    body: bytes,
+    accept_encoding: str | None,
+    media_type: str = "application/json",
+) -> Response:
+    """``body`` compressed with the negotiated encoding, if worth it."""
+    headers = {"Vary": "Accept-Encoding"}
+    encoding = negotiate(accept_encoding) if len(body) >= MIN_SIZE else None
+    if encoding is not None:
+        body = compress(body, encoding)
+        headers["Content-Encoding"] = encoding
+    return Response(body, media_type=media_type, headers=headers)
@@ -0,0 +1,115 @@
+"""Response bodies without FastAPI's re-validation, as JSON or MessagePack.
+
+A handler returning a model lets FastAPI validate it again against
+``response_model``, run ``jsonable_encoder`` and ``json.dumps``. With
+``FAST_RESPONSES=1`` the hot handlers encode once instead:
+
+- typed results (Pydantic models) with their own serializer
+  (``model_dump_json``, pydantic-core),
+- plain dicts with ``orjson`` when installed (``pip install orjson``),
+  ``json`` otherwise.
+
+Clients sending ``Accept: application/msgpack`` get MessagePack when the
+optional ``msgpack`` package is installed, whatever ``FAST_RESPONSES`` is.
+``python -m benchmarks.response_encoding`` measures both paths.
+"""
+
+import json
+import os
+
+from pydantic import BaseModel
+from starlette.responses import Response
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional dependency
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover - optional dependency
+    msgpack = None
+
+FAST_RESPONSES = os.getenv("FAST_RESPONSES", "0") == "1"
+
+# Responses only vary on Accept when there is something to negotiate
+NEGOTIATES = msgpack is not None
+
+JSON = "application/json"
+MSGPACK = "application/msgpack"
+_MSGPACK_TYPES = (MSGPACK, "application/x-msgpack")
+
+
+def _accepted(accept: str | None) -> dict[str, float]:
+    accepted: dict[str, float] = {}
+    for part in (accept or "").split(","):
+        media_type, *params = (p.strip() for p in part.split(";"))
+        q = 1.0
+        for param in params:
+            if param.startswith("q="):
+                try:
+                    q = float(param[2:])
+                except ValueError:
+                    q = 0.0
+        if media_type:
+            accepted[media_type.lower()] = q
+    return accepted
+
+
+def negotiate(accept: str | None) -> str:
+    """``MSGPACK`` if the client prefers it (and it is installed), else ``JSON``."""
+    if not NEGOTIATES or not accept or "msgpack" not in accept:
+        return JSON
+    accepted = _accepted(accept)
+    q_msgpack = max(accepted.get(t, 0.0) for t in _MSGPACK_TYPES)
+    q_json = max(accepted.get(t, 0.0) for t in (JSON, "application/*", "*/*"))
+    return MSGPACK if q_msgpack > 0 and q_msgpack >= q_json else JSON
+
+
+def dumps_json(content: BaseModel | dict | list) -> bytes:
+    if isinstance(content, BaseModel):
+        return content.model_dump_json().encode()
+    if orjson is not None:
+        return orjson.dumps(content)
+    return json.dumps(content, separators=(",", ":")).encode()
+
+
+def dumps_msgpack(content: BaseModel | dict | list) -> bytes:
+    if isinstance(content, BaseModel):
+        content = content.model_dump(mode="json")
+    return msgpack.packb(content)
+
+
+def json_to_msgpack(body: bytes) -> bytes:
+    """Re-encode an already serialized JSON body (e.g. a cached one)."""
+    return msgpack.packb(orjson.loads(body) if orjson is not None else json.loads(body))
+
+
+def encode(content: BaseModel | dict | list, media_type: str) -> bytes:
+    if media_type == MSGPACK:
+        return dumps_msgpack(content)
+    return dumps_json(content)
+
+
+def wants_fast(accept: str | None) -> bool:
+    """Whether a handler should encode its result itself (see module doc)."""
+    return FAST_RESPONSES or negotiate(accept) == MSGPACK
+
+
+def fast_response(
+    content: BaseModel | dict | list,
+    accept: str | None,
+    status_code: int = 200,
+    headers: dict[str, str] | None = None,
+) -> Response:
+    """``content`` encoded once, in the negotiated media type."""
+    media_type = negotiate(accept)
+    headers = dict(headers or {})
+    if NEGOTIATES:
+        headers["Vary"] = "Accept"
+    return Response(
+        encode(content, media_type),
+        status_code=status_code,
+        media_type=media_type,
+        headers=headers,
+    )
@@ -0,0 +1,185 @@
+"""Password hashing on a dedicated, bounded worker pool.
+
+bcrypt is deliberately slow (~250 ms at 12 rounds) and holds the GIL, so
+hashing inline in a request handler ties up a threadpool worker that would
+otherwise serve receipts. Register/login instead await ``hash_password`` /
+``verify_password`` here, which run on their own pool:
+
+- ``HASH_POOL=process`` (default) uses a ``ProcessPoolExecutor`` with
+  ``HASH_WORKERS`` processes, so hashing never competes for the GIL;
+  ``thread`` uses threads, ``inline`` runs in the caller (tests, scripts).
+- At most ``HASH_WORKERS + HASH_MAX_QUEUE`` hashes are in flight; beyond
+  that ``HashPoolBusy`` is raised and the API answers 503 with Retry-After
+  instead of letting a login burst queue without bound.
+- A caller that goes away (the request is cancelled) drops its hash if it is
+  still queued.
+- ``stats()`` (``GET /metrics/hashing``) reports in-flight and queued work,
+  rejections, cancellations, and the time spent queued vs. hashing.
+"""
+
+import asyncio
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable
+
+from . import security
+
+HASH_POOL = os.getenv("HASH_POOL", "process").lower()
+HASH_WORKERS = int(os.getenv("HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+HASH_MAX_QUEUE = int(os.getenv("HASH_MAX_QUEUE", "64"))
+
+
+class HashPoolBusy(RuntimeError):
+    """Too many hashes are already queued."""
+
+
+def _timed(fn: Callable[..., Any], args: tuple, submitted: float) -> tuple:
+    # Runs in the worker: report how long the job waited and how long it ran
+    started = time.time()
+    result = fn(*args)
+    return started - submitted, time.time() - started, result
+
+
+class HashPool:
+    def __init__(self, kind: str, workers: int, max_queue: int) -> None:
+        if kind not in ("process", "thread", "inline"):
+            raise ValueError(f"Unknown HASH_POOL {kind!r}")
+        self.kind = kind
+        self.workers = max(1, workers)
+        self.max_queue = max(0, max_queue)
+        self._executor: Executor | None = None
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.completed = 0
+        self.rejected = 0
+        self.cancelled = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        self.run_seconds = 0.0
+
+    def _pool(self) -> Executor:
+        if self._executor is None:
+            if self.kind == "process":
+                # spawn: forking a process that holds DB connections and
+                # threads is unsafe
+                self._executor = ProcessPoolExecutor(
+                    self.workers, mp_context=multiprocessing.get_context("spawn")
+                )
+            else:
+                self._executor = ThreadPoolExecutor(
+                    self.workers, thread_name_prefix="hashing"
+                )
+        return self._executor
+
+    def _record(self, wait: float, run: float) -> None:
+        with self._lock:
+            self.in_flight -= 1
+            self.completed += 1
+            self.wait_seconds += wait
+            self.max_wait_seconds = max(self.max_wait_seconds, wait)
+            self.run_seconds += run
+
+    def _record_cancelled(self) -> None:
+        with self._lock:
+            self.in_flight -= 1
+            self.cancelled += 1
+
+    def submit(self, fn: Callable[..., Any], *args: Any) -> Future:
+        """Schedule ``fn(*args)``; the future resolves to its return value."""
+        with self._lock:
+            if self.in_flight >= self.workers + self.max_queue:
+                self.rejected += 1
+                raise HashPoolBusy("Password hashing queue is full")
+            self.in_flight += 1
+
+        result: Future = Future()
+        if self.kind == "inline":
+            try:
+                wait, run, value = _timed(fn, args, time.time())
+            except BaseException as exc:
+                self._record(0.0, 0.0)
+                result.set_exception(exc)
+            else:
+                self._record(wait, run)
+                result.set_result(value)
+            return result
+
+        def _done(job: Future) -> None:
+            if job.cancelled():
+                # Dropped while queued: the caller is gone, or shutdown
+                self._record_cancelled()
+                result.cancel()
+                return
+            exc = job.exception()
+            if exc is not None:
+                self._record(0.0, 0.0)
+            else:
+                wait, run, value = job.result()
+                self._record(wait, run)
+            # False if the caller cancelled meanwhile; once running,
+            # ``result`` can no longer be cancelled under us
+            if not result.set_running_or_notify_cancel():
+                return
+            if exc is not None:
+                result.set_exception(exc)
+            else:
+                result.set_result(value)
+
+        def _cancelled(result: Future) -> None:
+            # The caller went away (e.g. a client disconnect): drop the
+            # hash if it has not started yet
+            if result.cancelled():
+                job.cancel()
+
+        try:
+            job = self._pool().submit(_timed, fn, args, time.time())
+        except BaseException:
+            self._record(0.0, 0.0)
+            raise
+        job.add_done_callback(_done)
+        result.add_done_callback(_cancelled)
+        return result
+
+    async def run(self, fn: Callable[..., Any], *args: Any) -> Any:
+        return await asyncio.wrap_future(self.submit(fn, *args))
+
+    def stats(self) -> dict:
+        with self._lock:
+            completed = self.completed
+            return {
+                "pool": self.kind,
+                "workers": self.workers,
+                "max_queue": self.max_queue,
+                "in_flight": self.in_flight,
+                "queued": max(0, self.in_flight - self.workers),
+                "completed": completed,
+                "rejected": self.rejected,
+                "cancelled": self.cancelled,
+                "avg_wait_ms": (
+                    round(self.wait_seconds / completed * 1000, 3) if completed else 0.0
+                ),
+                "max_wait_ms": round(self.max_wait_seconds * 1000, 3),
+                "avg_run_ms": (
+                    round(self.run_seconds / completed * 1000, 3) if completed else 0.0
+                ),
+            }
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+pool = HashPool(HASH_POOL, HASH_WORKERS, HASH_MAX_QUEUE)
+
+
+async def hash_password(password: str) -> str:
+    # Rounds are passed explicitly: spawned workers do not see runtime changes
+    return await pool.run(security.hash_password, password, security.BCRYPT_ROUNDS)
+
+
+async def verify_password(password: str, password_hash: str) -> bool:
+    return await pool.run(security.verify_password, password, password_hash)
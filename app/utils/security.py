@@ -1,29 +1,80 @@
 import os
 from datetime import datetime, timedelta
-from logging import getLogger
+from functools import lru_cache
+from uuid import uuid4
 
-from jose import jwt
+from jose import JWTError, jwt
 from passlib.context import CryptContext
 
 SECRET_KEY = os.getenv("SECRET_KEY", "change-me")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "60"))
+REFRESH_TOKEN_EXPIRE_DAYS = int(os.getenv("REFRESH_TOKEN_EXPIRE_DAYS", "30"))
+# bcrypt cost; hashes made with another cost are upgraded on the next login
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
 
-log = getLogger("sync_kpis_security")
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+@lru_cache
+def _context(rounds: int) -> CryptContext:
+    return CryptContext(
+        schemes=["bcrypt"],
+        deprecated="auto",
+        bcrypt__default_rounds=rounds,
+        bcrypt__min_rounds=rounds,
+        bcrypt__max_rounds=rounds,
+    )
 
 
-def hash_password(password: str) -> str:
-    log.warning("[hash_password] len=%s repr=%r", len(password), password)
-    return pwd_context.hash(password)
+def hash_password(password: str, rounds: int | None = None) -> str:
+    return _context(rounds or BCRYPT_ROUNDS).hash(password)
 
 
 def verify_password(password: str, password_hash: str) -> bool:
-    return pwd_context.verify(password, password_hash)
+    return _context(BCRYPT_ROUNDS).verify(password, password_hash)
 
 
-def create_access_token(subject: str) -> str:
+def needs_rehash(password_hash: str) -> bool:
+    """True if the hash was made with a different cost than BCRYPT_ROUNDS."""
+    return _context(BCRYPT_ROUNDS).needs_update(password_hash)
+
+
+def new_jti() -> str:
+    return uuid4().hex
+
+
+def create_access_token(
+    subject: str, user_id: int, token_version: int = 0, is_active: bool = True
+) -> str:
+    """Short-lived token whose claims are enough to authenticate statelessly."""
     expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    payload = {"sub": subject, "exp": expire}
+    payload = {
+        "typ": "access",
+        "sub": subject,
+        "uid": user_id,
+        "act": is_active,
+        "ver": token_version,
+        "jti": new_jti(),
+        "exp": expire,
+    }
     return jwt.encode(payload, SECRET_KEY, algorithm=ALGORITHM)
+
+
+def create_refresh_token(
+    jti: str, user_id: int, token_version: int, expire: datetime
+) -> str:
+    payload = {
+        "typ": "refresh",
+        "uid": user_id,
+        "ver": token_version,
+        "jti": jti,
+        "exp": expire,
+    }
+    return jwt.encode(payload, SECRET_KEY, algorithm=ALGORITHM)
+
+
+def decode_token(token: str, token_type: str) -> dict:
+    """Verified claims of a ``token_type`` token; raises ``JWTError``."""
+    claims = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    if claims.get("typ") != token_type or not isinstance(claims.get("jti"), str):
+        raise JWTError(f"Expected a {token_type} token")
+    return claims
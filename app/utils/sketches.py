@@ -0,0 +1,128 @@
+"""Mergeable streaming sketches: heavy hitters and distinct counts.
+
+``TopK`` is a weighted Space-Saving summary with at most ``capacity``
+counters. Every estimate is an upper bound: ``count - error <= true count <=
+count``. For a stream (or a merge of summaries) of total weight ``N``,
+``error <= N / capacity``, so any item heavier than ``N / capacity`` is
+guaranteed to be kept.
+
+``HyperLogLog`` estimates the number of distinct items with ``2**precision``
+one-byte registers; the relative standard error is ``1.04 / sqrt(2**p)``
+(2.3% at the default precision 11, 2 KiB per sketch).
+
+Both merge losslessly with respect to their bounds, so per-day sketches can
+be combined into any date range at query time.
+"""
+
+import hashlib
+import math
+from typing import Hashable, Iterable
+
+
+class TopK:
+    """Weighted Space-Saving: ``item -> [count, error, payload]``.
+
+    ``payload`` is a secondary weight (e.g. revenue) summed for the item while
+    it is monitored; it is not bounded like ``count``.
+    """
+
+    def __init__(self, capacity: int, counters: dict | None = None) -> None:
+        self.capacity = capacity
+        self.counters: dict[Hashable, list[float]] = counters or {}
+
+    @property
+    def floor(self) -> float:
+        """Upper bound on the count of any item not monitored."""
+        if len(self.counters) < self.capacity:
+            return 0
+        return min(c[0] for c in self.counters.values())
+
+    def add(self, item: Hashable, weight: float = 1, payload: float = 0.0) -> None:
+        counter = self.counters.get(item)
+        if counter is not None:
+            counter[0] += weight
+            counter[2] += payload
+        elif len(self.counters) < self.capacity:
+            self.counters[item] = [weight, 0, payload]
+        else:
+            victim = min(self.counters, key=lambda k: self.counters[k][0])
+            floor = self.counters.pop(victim)[0]
+            self.counters[item] = [floor + weight, floor, payload]
+
+    def merge(self, other: "TopK") -> "TopK":
+        """Union of both summaries, truncated back to ``capacity`` counters."""
+        floors = (self.floor, other.floor)
+        merged: dict[Hashable, list[float]] = {}
+        for item in self.counters.keys() | other.counters.keys():
+            count = error = payload = 0.0
+            for summary, floor in zip((self, other), floors):
+                counter = summary.counters.get(item)
+                if counter is None:
+                    # Unseen there: it may have had up to ``floor``
+                    count += floor
+                    error += floor
+                else:
+                    count += counter[0]
+                    error += counter[1]
+                    payload += counter[2]
+            merged[item] = [count, error, payload]
+        capacity = max(self.capacity, other.capacity)
+        kept = sorted(merged.items(), key=lambda kv: kv[1][0], reverse=True)
+        return TopK(capacity, dict(kept[:capacity]))
+
+    def top(self, n: int) -> list[tuple[Hashable, float, float, float]]:
+        """``(item, count, error, payload)`` for the ``n`` largest counts."""
+        ranked = sorted(self.counters.items(), key=lambda kv: kv[1][0], reverse=True)
+        return [(item, *counter) for item, counter in ranked[:n]]
+
+    @classmethod
+    def exact(cls, capacity: int, counts: dict[Hashable, tuple[float, float]]):
+        """Summary of exactly known ``item -> (count, payload)`` totals."""
+        ranked = sorted(counts.items(), key=lambda kv: kv[1][0], reverse=True)
+        return cls(
+            capacity,
+            {item: [count, 0, payload] for item, (count, payload) in ranked[:capacity]},
+        )
+
+    def to_json(self) -> list:
+        return [[item, *counter] for item, counter in self.counters.items()]
+
+    @classmethod
+    def from_json(cls, capacity: int, data: Iterable) -> "TopK":
+        return cls(capacity, {row[0]: list(row[1:]) for row in data})
+
+
+class HyperLogLog:
+    def __init__(self, precision: int = 11, registers: bytes | None = None) -> None:
+        self.precision = precision
+        self.m = 1 << precision
+        self.registers = bytearray(registers or bytes(self.m))
+        if len(self.registers) != self.m:
+            raise ValueError("Register count does not match the precision")
+
+    def add(self, item: Hashable) -> None:
+        digest = hashlib.blake2b(str(item).encode(), digest_size=8).digest()
+        x = int.from_bytes(digest, "big")
+        index = x >> (64 - self.precision)
+        rest = x & ((1 << (64 - self.precision)) - 1)
+        rank = (64 - self.precision) - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other: "HyperLogLog") -> "HyperLogLog":
+        return HyperLogLog(
+            self.precision, bytes(map(max, self.registers, other.registers))
+        )
+
+    def count(self) -> int:
+        m = self.m
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / sum(2.0**-r for r in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            # Small ranges: linear counting is more accurate
+            estimate = m * math.log(m / zeros)
+        return round(estimate)
+
+    def to_bytes(self) -> bytes:
+        return bytes(self.registers)
@@ -0,0 +1,691 @@
+"""Write-behind receipt ingestion: accept now, commit in groups.
+
+With ``WRITE_BEHIND=1``, ``POST /shops/{id}/receipts`` sent with
+``Prefer: respond-async`` validates the receipt, appends it to a local
+write-ahead queue file and answers ``202`` with a handle. The only database
+write on that path is the handle's ``pending`` row in ``queued_receipts``.
+A background thread commits queued receipts ``WRITE_BEHIND_BATCH`` (default
+500) at a time through ``ingest.ingest_receipts``, one transaction per
+batch, every ``WRITE_BEHIND_INTERVAL_MS`` (default 200) or as soon as a
+batch is full. The same transaction turns the ``pending`` rows into the
+ingest outcome, so ``GET /shops/{id}/receipts/queued/{handle}`` answers from
+the database, whichever worker process accepted the receipt.
+
+Durability: an entry is one JSON line, flushed and (``WRITE_BEHIND_FSYNC=1``,
+the default) fsynced before the ``pending`` row commits. Only then does the
+worker see it; if that commit fails the entry is dropped, and the worker
+only ever ingests handles whose ``pending`` row is committed, so a receipt
+the client was told failed is never written. The byte offset up to which the
+file is materialized is saved next to it (``.offset``). On start, entries
+after that offset are queued again if their row is still ``pending``: not
+the ones materialized between the commit and the checkpoint, nor the ones
+whose row never committed. A torn last line is cut off. The file is
+truncated whenever the queue empties.
+
+Worker processes: each one locks its own queue file, the first free one of
+``WRITE_BEHIND_PATH`` (default ``./ingest-queue.wal``), ``ingest-queue.1.wal``,
+... up to ``WRITE_BEHIND_SLOTS`` (default 64). On start a worker also drains
+the files no running worker holds, so receipts accepted by a worker that is
+not restarted are still committed.
+
+Failures: lock waits, deadlocks and lost connections leave the entries
+queued (and the offset where it is); the worker retries with exponential
+backoff up to ``WRITE_BEHIND_RETRY_MAX_MS`` (default 30000). Only an entry
+that fails on its own with a constraint or data error is recorded as
+``failed``.
+
+Retention: outcomes are purged in batches ``WRITE_BEHIND_RETENTION_HOURS``
+(default 24) after materializing, every ``WRITE_BEHIND_PURGE_SECONDS``
+(default 3600, 0 disables); the status of an older handle is a ``404``.
+
+Idempotency: an ``Idempotency-Key`` whose receipt is committed is answered
+from ``app.idempotency`` as usual (``201`` replay or ``409``). While queued,
+the key is held by its ``pending`` row (unique per shop): the same payload
+gets the same handle from any worker, another payload ``409``. The key is
+cleared from the row once materialized, leaving ``idempotency_keys`` and its
+expiry in charge. The receipt's ``created_at`` is the time it was accepted,
+which is not part of the payload hash, so queued and direct requests with
+the same key and lines replay each other.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Callable, Sequence
+from uuid import uuid4
+
+from sqlalchemy import bindparam, delete, insert, select, update
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import (
+    DataError,
+    DBAPIError,
+    DisconnectionError,
+    IntegrityError,
+)
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.orm import Session
+
+from . import idempotency, ingest
+from .importer import ImportedLine
+from .instrumentation import span
+from .models import QueuedReceipt
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - not on Windows
+    fcntl = None
+
+WRITE_BEHIND = os.getenv("WRITE_BEHIND", "0") == "1"
+WRITE_BEHIND_PATH = Path(os.getenv("WRITE_BEHIND_PATH", "./ingest-queue.wal"))
+WRITE_BEHIND_SLOTS = int(os.getenv("WRITE_BEHIND_SLOTS", "64"))
+WRITE_BEHIND_BATCH = int(os.getenv("WRITE_BEHIND_BATCH", "500"))
+WRITE_BEHIND_INTERVAL_MS = float(os.getenv("WRITE_BEHIND_INTERVAL_MS", "200"))
+WRITE_BEHIND_FSYNC = os.getenv("WRITE_BEHIND_FSYNC", "1") == "1"
+# Longest wait between retries after a transient database error
+WRITE_BEHIND_RETRY_MAX_MS = float(os.getenv("WRITE_BEHIND_RETRY_MAX_MS", "30000"))
+# Outcomes stay readable this long after materializing, then are purged
+WRITE_BEHIND_RETENTION_HOURS = float(os.getenv("WRITE_BEHIND_RETENTION_HOURS", "24"))
+WRITE_BEHIND_PURGE_SECONDS = float(os.getenv("WRITE_BEHIND_PURGE_SECONDS", "3600"))
+WRITE_BEHIND_PURGE_BATCH = int(os.getenv("WRITE_BEHIND_PURGE_BATCH", "1000"))
+
+PENDING = "pending"
+# Materialization failed on its own (not with the rest of a batch)
+FAILED = "failed"
+
+log = logging.getLogger("sync_kpis.write_behind")
+
+
+def is_transient(exc: Exception) -> bool:
+    """Whether retrying later can succeed: lock waits, deadlocks, lost
+    connections, a full pool. Constraint and data errors are permanent, and
+    so is anything that is not a database error (the entry itself is bad).
+    """
+    if isinstance(exc, (IntegrityError, DataError)):
+        return False
+    return isinstance(exc, (DBAPIError, DisconnectionError, PoolTimeoutError))
+
+
+class KeyConflict(Exception):
+    """The Idempotency-Key is queued with a different payload."""
+
+
+@dataclass
+class Entry:
+    handle: str
+    shop_id: int
+    idempotency_key: str | None
+    request_hash: str
+    lines: list[ImportedLine]
+    accepted_at: datetime
+    # Offset just past the entry's line in the queue file
+    end: int = 0
+    # False between the append and its pending row's commit
+    ready: bool = True
+
+    def draft(self) -> ingest.ReceiptDraft:
+        return ingest.ReceiptDraft(
+            lines=self.lines,
+            idempotency_key=self.idempotency_key,
+            accepted_at=self.accepted_at,
+        )
+
+
+def _encode(entry: Entry) -> bytes:
+    record = {
+        "handle": entry.handle,
+        "shop_id": entry.shop_id,
+        "key": entry.idempotency_key,
+        "lines": [list(line) for line in entry.lines],
+        "accepted_at": entry.accepted_at.isoformat(),
+    }
+    return (json.dumps(record, separators=(",", ":")) + "\n").encode()
+
+
+def _decode(raw: bytes) -> Entry:
+    record = json.loads(raw)
+    lines = [ImportedLine(str(s), int(q), float(p)) for s, q, p in record["lines"]]
+    return Entry(
+        handle=record["handle"],
+        shop_id=record["shop_id"],
+        idempotency_key=record["key"],
+        request_hash=idempotency.payload_hash(lines),
+        lines=lines,
+        accepted_at=datetime.fromisoformat(record["accepted_at"]),
+    )
+
+
+def slot_path(base: Path, slot: int) -> Path:
+    """Queue file of worker slot ``slot``: ``base`` itself for slot 0."""
+    return base if slot == 0 else base.with_name(f"{base.stem}.{slot}{base.suffix}")
+
+
+# ---------- Accepting (request side, any worker) ----------
+
+
+def _insert_ignore(db: Session):
+    dialect = db.get_bind().dialect.name
+    if dialect == "sqlite":
+        return sqlite_insert(QueuedReceipt).on_conflict_do_nothing()
+    if dialect in ("mysql", "mariadb"):
+        return mysql_insert(QueuedReceipt).prefix_with("IGNORE")
+    if dialect == "postgresql":
+        return pg_insert(QueuedReceipt).on_conflict_do_nothing()
+    return insert(QueuedReceipt)
+
+
+def accept(
+    db: Session, shop_id: int, lines: Sequence, idempotency_key: str | None = None
+) -> tuple[str, Entry | None]:
+    """Insert the ``pending`` row of a validated receipt. Does not commit.
+
+    Returns its handle and the entry to append to the queue file, or the
+    handle of the receipt already queued with this key (and no entry).
+    Raises ``KeyConflict`` if the key is queued with another payload.
+    """
+    lines = [ImportedLine(line.sku, line.qty, line.unit_price) for line in lines]
+    entry = Entry(
+        handle=uuid4().hex,
+        shop_id=shop_id,
+        idempotency_key=idempotency_key,
+        request_hash=idempotency.payload_hash(lines),
+        lines=lines,
+        accepted_at=ingest.utcnow(),
+        ready=False,
+    )
+    # Another worker's pending row with the same key wins (and blocks this
+    # insert until it commits)
+    db.execute(
+        _insert_ignore(db),
+        {
+            "handle": entry.handle,
+            "shop_id": shop_id,
+            "status": PENDING,
+            "idempotency_key": idempotency_key,
+            "request_hash": entry.request_hash,
+            "accepted_at": entry.accepted_at,
+        },
+    )
+    if idempotency_key is None:
+        return entry.handle, entry
+    handle, request_hash = db.execute(
+        select(QueuedReceipt.handle, QueuedReceipt.request_hash).where(
+            QueuedReceipt.shop_id == shop_id,
+            QueuedReceipt.idempotency_key == idempotency_key,
+        )
+    ).one()
+    if handle == entry.handle:
+        return handle, entry
+    if request_hash != entry.request_hash:
+        raise KeyConflict("Idempotency-Key already used with a different payload")
+    return handle, None
+
+
+def outcome(db: Session, shop_id: int, handle: str) -> QueuedReceipt | None:
+    """The ``pending`` row or the outcome of a queued receipt of ``shop_id``."""
+    row = db.get(QueuedReceipt, handle)
+    return row if row is not None and row.shop_id == shop_id else None
+
+
+def _queued_handles(db: Session, entries: Sequence[Entry]) -> set[str]:
+    """The handles of ``entries`` whose ``pending`` row is committed."""
+    return set(
+        db.scalars(
+            select(QueuedReceipt.handle).where(
+                QueuedReceipt.handle.in_([e.handle for e in entries]),
+                QueuedReceipt.status == PENDING,
+            )
+        )
+    )
+
+
+def _store_outcomes(
+    db: Session, outcomes: list[tuple[Entry, ingest.IngestResult]]
+) -> None:
+    """Turn pending rows into outcomes and release their keys. Does not
+    commit.
+    """
+    now = ingest.utcnow()
+    table = QueuedReceipt.__table__
+    # Core executemany: one statement for the whole batch
+    db.execute(
+        update(table)
+        .where(table.c.handle == bindparam("b_handle"))
+        .values(
+            status=bindparam("status"),
+            receipt_id=bindparam("receipt_id"),
+            total=bindparam("total"),
+            detail=bindparam("detail"),
+            materialized_at=bindparam("materialized_at"),
+            idempotency_key=None,
+        ),
+        [
+            {
+                "b_handle": entry.handle,
+                "status": result.status,
+                "receipt_id": result.receipt_id,
+                "total": result.total,
+                "detail": result.detail,
+                "materialized_at": now,
+            }
+            for entry, result in outcomes
+        ],
+    )
+
+
+def purge_materialized(
+    session_factory: Callable[[], Session],
+    batch_size: int = WRITE_BEHIND_PURGE_BATCH,
+    now: datetime | None = None,
+) -> int:
+    """Delete outcomes materialized more than ``WRITE_BEHIND_RETENTION_HOURS``
+    ago, ``batch_size`` rows per transaction. Returns the count.
+
+    Pending rows (no ``materialized_at``) are never purged.
+    """
+    cutoff = (now or ingest.utcnow()) - timedelta(hours=WRITE_BEHIND_RETENTION_HOURS)
+    purged = 0
+    while True:
+        with session_factory() as db:
+            handles = (
+                db.execute(
+                    select(QueuedReceipt.handle)
+                    .where(QueuedReceipt.materialized_at <= cutoff)
+                    .order_by(QueuedReceipt.materialized_at)
+                    .limit(batch_size)
+                )
+                .scalars()
+                .all()
+            )
+            if not handles:
+                return purged
+            db.execute(delete(QueuedReceipt).where(QueuedReceipt.handle.in_(handles)))
+            db.commit()
+        purged += len(handles)
+
+
+# ---------- Queue file and worker ----------
+
+
+class WriteBehindQueue:
+    """Queue file plus the worker thread committing it in batches."""
+
+    def __init__(
+        self,
+        path: Path,
+        session_factory: Callable[[], Session],
+        batch_size: int = WRITE_BEHIND_BATCH,
+        interval: float = WRITE_BEHIND_INTERVAL_MS / 1000,
+        fsync: bool = WRITE_BEHIND_FSYNC,
+        slots: int = WRITE_BEHIND_SLOTS,
+    ) -> None:
+        self.base_path = Path(path)
+        self.path = self.base_path
+        self.session_factory = session_factory
+        self.batch_size = batch_size
+        self.interval = interval
+        self.fsync = fsync
+        self.slots = slots
+        self._lock = threading.Lock()
+        self._drain_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._thread: threading.Thread | None = None
+        # The last drain left entries queued after a transient error
+        self.stalled = False
+        self._file = None
+        # handle -> entry, in file order
+        self._pending: OrderedDict[str, Entry] = OrderedDict()
+        self._stats = {
+            "enqueued": 0,
+            "recovered": 0,
+            "adopted": 0,
+            "materialized": 0,
+            "failed": 0,
+            "dropped": 0,
+            "batches": 0,
+            "retries": 0,
+            "last_batch_ms": 0.0,
+        }
+
+    @property
+    def checkpoint_path(self) -> Path:
+        return self.path.with_name(self.path.name + ".offset")
+
+    # ---------- Lifecycle ----------
+
+    def _try_lock(self, path: Path) -> bool:
+        handle = open(path, "a+b")
+        if fcntl is not None:
+            try:
+                fcntl.flock(handle.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                handle.close()
+                return False
+        self._file = handle
+        self.path = path
+        return True
+
+    def open(self) -> None:
+        """Lock the first free slot's file and queue its unfinished entries."""
+        if self._file is not None:
+            return
+        self.base_path.parent.mkdir(parents=True, exist_ok=True)
+        for slot in range(self.slots):
+            if self._try_lock(slot_path(self.base_path, slot)):
+                self._recover()
+                return
+        raise RuntimeError(
+            f"All {self.slots} queue files of {self.base_path} are in use"
+        )
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def start(self) -> None:
+        """Open the queue, drain orphaned files and start the worker thread."""
+        self.open()
+        self.adopt_orphans()
+        if self._thread is not None:
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="write-behind", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stop the worker after it has committed what it can.
+
+        Entries it cannot commit now stay in the file for the next start.
+        """
+        self._stopping.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=30)
+            self._thread = None
+        self.close()
+
+    def adopt_orphans(self) -> int:
+        """Drain the other slots' files no running worker holds."""
+        adopted = 0
+        for slot in range(self.slots):
+            path = slot_path(self.base_path, slot)
+            if path == self.path or not path.exists() or not path.stat().st_size:
+                continue
+            orphan = WriteBehindQueue(
+                path, self.session_factory, self.batch_size, fsync=self.fsync, slots=1
+            )
+            try:
+                orphan.open()
+            except RuntimeError:
+                continue  # a live worker's file
+            try:
+                adopted += orphan.drain()
+            finally:
+                orphan.close()
+        self._stats["adopted"] += adopted
+        return adopted
+
+    def _run(self) -> None:
+        delay = self.interval
+        while True:
+            if self.stalled:
+                # Back off, ignoring full-batch wake-ups, until the DB recovers
+                self._stopping.wait(delay)
+                delay = min(delay * 2, WRITE_BEHIND_RETRY_MAX_MS / 1000)
+            else:
+                self._wake.wait(self.interval)
+                delay = self.interval
+            self._wake.clear()
+            try:
+                self.drain()
+            except Exception:
+                log.exception("Committing queued receipts failed")
+            if self._stopping.is_set():
+                return
+
+    # ---------- Recovery ----------
+
+    def _read_checkpoint(self) -> int:
+        try:
+            return int(self.checkpoint_path.read_text() or 0)
+        except (FileNotFoundError, ValueError):
+            return 0
+
+    def _write_checkpoint(self, offset: int) -> None:
+        staging = self.checkpoint_path.with_suffix(".tmp")
+        staging.write_text(str(offset))
+        os.replace(staging, self.checkpoint_path)
+
+    def _recover(self) -> None:
+        size = self._file.seek(0, os.SEEK_END)
+        offset = self._read_checkpoint()
+        if offset > size:
+            # Truncated after emptying, before the checkpoint was reset
+            offset = 0
+        self._file.seek(offset)
+        entries: list[Entry] = []
+        for raw in self._file:
+            try:
+                if not raw.endswith(b"\n"):
+                    raise ValueError("torn write")
+                entry = _decode(raw)
+            except ValueError:
+                # Only the last write can be incomplete: drop it
+                self._file.truncate(offset)
+                break
+            offset += len(raw)
+            entry.end = offset
+            entries.append(entry)
+        self._file.seek(0, os.SEEK_END)
+
+        queued = set()
+        if entries:
+            with self.session_factory() as db:
+                queued = _queued_handles(db, entries)
+        for entry in entries:
+            if entry.handle in queued:
+                self._pending[entry.handle] = entry
+                self._stats["recovered"] += 1
+            else:
+                # Materialized already, or its pending row never committed
+                self._stats["dropped"] += 1
+        if not self._pending:
+            self._compact()
+
+    # ---------- Enqueue ----------
+
+    def append(self, entry: Entry) -> None:
+        """Durably write ``entry``; it is drained once ``publish``-ed."""
+        with self._lock:
+            self._file.write(_encode(entry))
+            self._file.flush()
+            if self.fsync:
+                os.fsync(self._file.fileno())
+            entry.end = self._file.tell()
+            self._pending[entry.handle] = entry
+            self._stats["enqueued"] += 1
+
+    def publish(self, entry: Entry) -> None:
+        """Let the worker drain ``entry`` (its pending row has committed)."""
+        with self._lock:
+            entry.ready = True
+            if len(self._pending) >= self.batch_size:
+                self._wake.set()
+
+    def discard(self, entry: Entry) -> None:
+        """Drop ``entry``: its pending row did not commit, the client got an
+        error. Its line stays in the file until the next compaction, where
+        recovery skips it for the same reason (no pending row).
+        """
+        with self._lock:
+            if self._pending.pop(entry.handle, None) is not None:
+                self._stats["dropped"] += 1
+            if not self._pending:
+                self._compact()
+
+    def enqueue(
+        self,
+        db: Session,
+        shop_id: int,
+        lines: Sequence,
+        idempotency_key: str | None = None,
+    ) -> str:
+        """Accept a validated receipt and commit ``db``; returns its handle.
+
+        Raises ``KeyConflict`` if the key is queued with another payload.
+        """
+        handle, entry = accept(db, shop_id, lines, idempotency_key)
+        if entry is None:
+            db.commit()
+            return handle
+        self.append(entry)
+        try:
+            db.commit()
+        except BaseException:
+            self.discard(entry)
+            raise
+        self.publish(entry)
+        return handle
+
+    # ---------- Materialization ----------
+
+    def _commit(self, db: Session, entries: list[Entry]) -> None:
+        """Ingest ``entries`` and record their outcomes. Does not commit.
+
+        Only entries with a committed ``pending`` row are ingested: the
+        others are materialized already, or were never accepted.
+        """
+        queued = _queued_handles(db, entries)
+        by_shop: dict[int, list[Entry]] = {}
+        for entry in entries:
+            if entry.handle in queued:
+                by_shop.setdefault(entry.shop_id, []).append(entry)
+
+        outcomes = []
+        for shop_id, shop_entries in by_shop.items():
+            results = ingest.ingest_receipts(
+                db, shop_id, [e.draft() for e in shop_entries]
+            )
+            outcomes.extend(zip(shop_entries, results))
+        if outcomes:
+            _store_outcomes(db, outcomes)
+
+    def _record_failure(self, entry: Entry, exc: Exception) -> None:
+        with self.session_factory() as db:
+            result = ingest.IngestResult(status=FAILED, detail=str(exc)[:255])
+            _store_outcomes(db, [(entry, result)])
+            db.commit()
+
+    def _materialize(self, entries: list[Entry]) -> int:
+        """Commit ``entries`` as one transaction; returns how many are done.
+
+        If the group fails for a permanent reason, each entry is retried on
+        its own and the ones failing permanently again are recorded as
+        ``failed``. A transient error (see ``is_transient``) stops at the
+        entry it hit: it and the ones after it stay queued for the retry.
+        """
+        try:
+            with self.session_factory() as db:
+                self._commit(db, entries)
+                db.commit()
+            return len(entries)
+        except Exception as exc:
+            log.exception("Batch of %s queued receipts failed", len(entries))
+            if is_transient(exc):
+                return 0
+
+        for done, entry in enumerate(entries):
+            try:
+                with self.session_factory() as db:
+                    self._commit(db, [entry])
+                    db.commit()
+                continue
+            except Exception as exc:
+                if is_transient(exc):
+                    return done
+                error = exc
+            try:
+                self._record_failure(entry, error)
+            except Exception:
+                log.exception("Recording queued receipt %s failed", entry.handle)
+                return done
+            self._stats["failed"] += 1
+        return len(entries)
+
+    def _next_batch(self) -> list[Entry]:
+        # Only a prefix of ready entries: the checkpoint covers a prefix
+        batch = []
+        with self._lock:
+            for entry in self._pending.values():
+                if not entry.ready or len(batch) == self.batch_size:
+                    break
+                batch.append(entry)
+        return batch
+
+    def drain(self) -> int:
+        """Commit everything queued, batch by batch. Returns the receipts done."""
+        total = 0
+        with self._drain_lock:
+            self.stalled = False
+            while True:
+                batch = self._next_batch()
+                if not batch:
+                    return total
+                started = time.perf_counter()
+                with span("write_behind_batch"):
+                    done = self._materialize(batch)
+                if done:
+                    self._checkpoint(batch[:done])
+                self._stats["batches"] += 1
+                self._stats["materialized"] += done
+                self._stats["last_batch_ms"] = round(
+                    (time.perf_counter() - started) * 1000, 3
+                )
+                total += done
+                if done < len(batch):
+                    # Transient error: the rest waits for the next attempt
+                    self.stalled = True
+                    self._stats["retries"] += 1
+                    return total
+
+    def _checkpoint(self, entries: list[Entry]) -> None:
+        with self._lock:
+            self._write_checkpoint(entries[-1].end)
+            for entry in entries:
+                self._pending.pop(entry.handle, None)
+            # Entries appended but not published yet keep the file
+            if not self._pending:
+                self._compact()
+
+    def _compact(self) -> None:
+        # Empty queue: start the file over (file first, see _recover)
+        self._file.truncate(0)
+        self._file.seek(0)
+        self._write_checkpoint(0)
+
+    def stats(self) -> dict:
+        return {
+            "path": str(self.path),
+            "pending": len(self._pending),
+            "file_bytes": self._file.tell() if self._file is not None else 0,
+            **self._stats,
+        }
+
+
+# The app's queue (started in main.lifespan), None unless WRITE_BEHIND=1
+queue: WriteBehindQueue | None = None
+if WRITE_BEHIND:
+    from .database import SessionLocal
+
+    queue = WriteBehindQueue(WRITE_BEHIND_PATH, SessionLocal)
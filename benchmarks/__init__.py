@@ -0,0 +1,4 @@
+"""Performance benchmarks (not part of the test suite).
+
+Run from the repo root, e.g. ``python -m benchmarks.kpi_round_trips``.
+"""
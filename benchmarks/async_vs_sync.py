@@ -0,0 +1,108 @@
+"""Load comparison of the sync routers vs. the ASYNC_DB=1 routers.
+
+    python -m benchmarks.async_vs_sync --db-url sqlite:///./bench.db \
+        --concurrency 12 --threads 4
+
+Each mode runs in its own subprocess (ASYNC_DB is read at import time) with
+the Starlette threadpool capped at ``--threads`` workers, so the sync path's
+threadpool limit shows up in the numbers. Point ``--db-url`` at MySQL to
+reproduce production behaviour; prints one JSON report.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+
+
+def _worker(args) -> dict:
+    import anyio.to_thread
+
+    from app.database import SessionLocal, engine
+    from app.main import app
+    from app.migrate import upgrade_to_head
+    from app.models import Shop, User
+    from app.utils.security import create_access_token
+
+    from .load import run_load
+
+    upgrade_to_head(engine)
+    with SessionLocal() as db:
+        email = f"load-{args.mode}@example.com"
+        user = db.query(User).filter(User.email == email).first()
+        if user is None:
+            user = User(email=email, password_hash="x")
+            db.add(user)
+            db.flush()
+        shop = Shop(name=f"load-{args.mode}-{os.getpid()}", owner_id=user.id)
+        db.add(shop)
+        db.commit()
+        shop_id = shop.id
+        token = create_access_token(email, user.id, user.token_version)
+    headers = {"Authorization": f"Bearer {token}"}
+
+    async def _kpis(client, i):
+        return await client.get(f"/shops/{shop_id}/kpis", headers=headers)
+
+    async def _receipt(client, i):
+        return await client.post(
+            f"/shops/{shop_id}/receipts",
+            headers=headers,
+            json={"lines": [{"sku": f"LOAD-{i % 50}", "qty": 1, "unit_price": 1.0}]},
+        )
+
+    async def _main():
+        anyio.to_thread.current_default_thread_limiter().total_tokens = args.threads
+        return {
+            "POST /shops/{id}/receipts": await run_load(
+                app, _receipt, args.requests, args.concurrency
+            ),
+            "GET /shops/{id}/kpis": await run_load(
+                app, _kpis, args.requests, args.concurrency
+            ),
+        }
+
+    return asyncio.run(_main())
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.async_vs_sync")
+    parser.add_argument("--db-url", default="sqlite:///./bench.db")
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=12)
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--mode", choices=("sync", "async"), default=None)
+    args = parser.parse_args(argv)
+
+    if args.mode is not None:
+        sys.stdout.write(json.dumps(_worker(args)) + "\n")
+        return 0
+
+    report = {"db_url": args.db_url, "threads": args.threads, "results": {}}
+    for mode in ("sync", "async"):
+        env = {
+            **os.environ,
+            "DB_URL": args.db_url,
+            "ASYNC_DB": "1" if mode == "async" else "0",
+        }
+        out = subprocess.run(
+            [sys.executable, "-m", "benchmarks.async_vs_sync", "--mode", mode]
+            + [
+                f"--{k}={getattr(args, k)}"
+                for k in ("requests", "concurrency", "threads")
+            ],
+            env=env,
+            check=True,
+            capture_output=True,
+            text=True,
+        )
+        report["results"][mode] = json.loads(out.stdout.strip().splitlines()[-1])
+
+    sys.stdout.write(json.dumps(report, indent=2) + "\n")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
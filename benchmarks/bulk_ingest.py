@@ -0,0 +1,91 @@
+"""Receipt ingest throughput: one POST per receipt vs. ``receipts:bulk``.
+
+    python -m benchmarks.bulk_ingest --receipts 500 --batch 250
+
+Runs the app in-process against a fresh SQLite file and prints receipts/s
+for both paths as JSON.
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.bulk_ingest")
+    parser.add_argument("--receipts", type=int, default=500)
+    parser.add_argument("--batch", type=int, default=250)
+    parser.add_argument("--skus", type=int, default=200)
+    args = parser.parse_args(argv)
+
+    tmp_dir = tempfile.mkdtemp(prefix="bench_ingest_")
+    os.environ["DB_URL"] = f"sqlite:///{tmp_dir}/bench.db"
+
+    from fastapi.testclient import TestClient
+
+    from app.main import app
+
+    rnd = random.Random(7)
+
+    def receipt(i: int) -> dict:
+        return {
+            "idempotency_key": f"bench-{i}",
+            "lines": [
+                {
+                    "sku": f"SKU-{rnd.randrange(args.skus)}",
+                    "qty": rnd.randint(1, 4),
+                    "unit_price": 1.5,
+                }
+                for _ in range(rnd.randint(1, 5))
+            ],
+        }
+
+    with TestClient(app) as client:
+        r = client.post(
+            "/auth/register",
+            json={"email": "bench@example.com", "password": "ChangeMe123"},
+        )
+        headers = {"Authorization": f"Bearer {r.json()['access_token']}"}
+        single_shop = client.post("/shops", headers=headers, json={"name": "a"})
+        bulk_shop = client.post("/shops", headers=headers, json={"name": "b"})
+
+        t0 = time.perf_counter()
+        for i in range(args.receipts):
+            body = receipt(i)
+            client.post(
+                f"/shops/{single_shop.json()['id']}/receipts",
+                headers={**headers, "Idempotency-Key": body.pop("idempotency_key")},
+                json=body,
+            )
+        single_s = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        for start in range(0, args.receipts, args.batch):
+            batch = [
+                receipt(args.receipts + i)
+                for i in range(start, min(start + args.batch, args.receipts))
+            ]
+            client.post(
+                f"/shops/{bulk_shop.json()['id']}/receipts:bulk",
+                headers=headers,
+                json={"receipts": batch},
+            )
+        bulk_s = time.perf_counter() - t0
+
+    report = {
+        "receipts": args.receipts,
+        "batch": args.batch,
+        "single_receipts_per_s": round(args.receipts / single_s, 1),
+        "bulk_receipts_per_s": round(args.receipts / bulk_s, 1),
+        "speedup": round(single_s / bulk_s, 1),
+    }
+    sys.stdout.write(json.dumps(report, indent=2) + "\n")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,83 @@
+"""Compare two ``benchmarks.hot_paths`` reports and fail on regressions.
+
+    python -m benchmarks.compare baseline.json current.json --threshold 0.15
+
+For every endpoint in both reports, throughput may not drop and p50/p95/p99
+latency may not grow by more than ``--threshold`` (a fraction; per-metric
+overrides with ``--metric-threshold p99_ms=0.3``). New errors also count as
+a regression. Prints the per-metric changes as JSON and exits with 1 if
+anything regressed, so it can gate CI.
+"""
+
+import argparse
+import json
+import sys
+
+# metric -> True if higher is better
+METRICS = {
+    "throughput_rps": True,
+    "p50_ms": False,
+    "p95_ms": False,
+    "p99_ms": False,
+}
+
+
+def compare(
+    baseline: dict,
+    current: dict,
+    threshold: float,
+    overrides: dict[str, float] | None = None,
+) -> dict:
+    """Per-endpoint, per-metric relative change and the list of regressions."""
+    overrides = overrides or {}
+    changes: dict[str, dict] = {}
+    regressions: list[str] = []
+    for endpoint, before in baseline["endpoints"].items():
+        after = current["endpoints"].get(endpoint)
+        if after is None:
+            continue
+        changes[endpoint] = {}
+        for metric, higher_is_better in METRICS.items():
+            if not before.get(metric):
+                continue
+            change = (after[metric] - before[metric]) / before[metric]
+            changes[endpoint][metric] = round(change, 4)
+            worse = -change if higher_is_better else change
+            if worse > overrides.get(metric, threshold):
+                regressions.append(f"{endpoint} {metric} {change:+.1%}")
+        if after.get("errors", 0) > before.get("errors", 0):
+            regressions.append(
+                f"{endpoint} errors {before.get('errors', 0)} -> {after['errors']}"
+            )
+    return {"threshold": threshold, "changes": changes, "regressions": regressions}
+
+
+def _override(value: str) -> tuple[str, float]:
+    metric, _, limit = value.partition("=")
+    if metric not in METRICS or not limit:
+        raise argparse.ArgumentTypeError(f"expected one of {list(METRICS)}=FRACTION")
+    return metric, float(limit)
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.compare")
+    parser.add_argument("baseline")
+    parser.add_argument("current")
+    parser.add_argument("--threshold", type=float, default=0.15)
+    parser.add_argument(
+        "--metric-threshold", type=_override, action="append", default=[]
+    )
+    args = parser.parse_args(argv)
+
+    with open(args.baseline) as fh:
+        baseline = json.load(fh)
+    with open(args.current) as fh:
+        current = json.load(fh)
+
+    result = compare(baseline, current, args.threshold, dict(args.metric_threshold))
+    sys.stdout.write(json.dumps(result, indent=2) + "\n")
+    return 1 if result["regressions"] else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
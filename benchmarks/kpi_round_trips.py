@@ -0,0 +1,127 @@
+"""KPI query benchmark: legacy count/sum/top-N queries vs. ``app.kpi_engine``.
+
+    python -m benchmarks.kpi_round_trips --receipts 1000000
+
+Seeds ``--db-url`` first if it has no receipts, then runs both strategies for
+a 30-day and a full-history range and prints round trips and p50/p99 latency
+as JSON.
+"""
+
+import argparse
+import json
+import sys
+import time
+from datetime import date, datetime, time as dtime, timedelta
+
+from sqlalchemy import create_engine, desc, event, func
+from sqlalchemy.orm import Session
+
+from app import kpi_engine
+from app.models import Product, Receipt, ReceiptLine, Shop
+
+from .seed import seed
+from .stats import summarize
+
+
+def legacy_kpis(db: Session, shop_id: int, start: date | None, end: date | None):
+    """The pre-rollup implementation of get_kpis: three scans of receipts."""
+    start_dt = datetime.combine(start, dtime.min) if start else None
+    end_dt = datetime.combine(end, dtime.max) if end else None
+    filters = [Receipt.shop_id == shop_id]
+    if start_dt is not None:
+        filters.append(Receipt.created_at >= start_dt)
+    if end_dt is not None:
+        filters.append(Receipt.created_at <= end_dt)
+
+    total_receipts = db.query(Receipt).filter(*filters).count()
+    total_revenue = (
+        db.query(func.coalesce(func.sum(Receipt.total), 0)).filter(*filters).scalar()
+    )
+    top = (
+        db.query(
+            Product.sku,
+            Product.name,
+            func.sum(ReceiptLine.qty).label("qty"),
+            func.sum(ReceiptLine.qty * ReceiptLine.unit_price).label("revenue"),
+        )
+        .join(Receipt, ReceiptLine.receipt_id == Receipt.id)
+        .join(Product, ReceiptLine.product_id == Product.id)
+        .filter(*filters)
+        .group_by(Product.id, Product.sku, Product.name)
+        .order_by(desc("qty"))
+        .limit(5)
+        .all()
+    )
+    return total_receipts, total_revenue, top
+
+
+def engine_kpis(db: Session, shop_id: int, start: date | None, end: date | None):
+    return kpi_engine.compute(
+        db, kpi_engine.RangeFilter(shop_id=shop_id, start=start, end=end)
+    )
+
+
+def _measure(engine, fn, shop_id, start, end, iterations: int) -> dict:
+    statements = 0
+
+    def _count(*_args):
+        nonlocal statements
+        statements += 1
+
+    samples = []
+    event.listen(engine, "before_cursor_execute", _count)
+    try:
+        with Session(engine) as db:
+            fn(db, shop_id, start, end)  # warm-up
+            statements = 0
+            for _ in range(iterations):
+                t0 = time.perf_counter()
+                fn(db, shop_id, start, end)
+                samples.append(time.perf_counter() - t0)
+    finally:
+        event.remove(engine, "before_cursor_execute", _count)
+
+    return {"round_trips": statements / iterations, **summarize(samples)}
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.kpi_round_trips")
+    parser.add_argument("--db-url", default="sqlite:///./bench.db")
+    parser.add_argument("--receipts", type=int, default=1_000_000)
+    parser.add_argument("--iterations", type=int, default=30)
+    args = parser.parse_args(argv)
+
+    engine = create_engine(args.db_url, future=True)
+    with Session(engine) as db:
+        try:
+            has_data = db.query(Receipt.id).first() is not None
+        except Exception:
+            has_data = False
+    if not has_data:
+        seed(args.db_url, receipts=args.receipts)
+
+    with Session(engine) as db:
+        shop_id = db.query(Shop.id).order_by(Shop.id).first()[0]
+
+    today = date.today()
+    ranges = {
+        "last_30_days": (today - timedelta(days=30), today),
+        "all_time": (None, None),
+    }
+    report = {"db_url": args.db_url, "receipts": args.receipts, "results": {}}
+    for label, (start, end) in ranges.items():
+        report["results"][label] = {
+            "before": _measure(
+                engine, legacy_kpis, shop_id, start, end, args.iterations
+            ),
+            "after": _measure(
+                engine, engine_kpis, shop_id, start, end, args.iterations
+            ),
+        }
+
+    sys.stdout.write(json.dumps(report, indent=2) + "\n")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,48 @@
+"""In-process load driver: fires requests at an ASGI app at fixed concurrency."""
+
+import asyncio
+import time
+from typing import Awaitable, Callable
+
+import httpx
+
+from .stats import summarize
+
+RequestFn = Callable[[httpx.AsyncClient, int], Awaitable[httpx.Response]]
+
+
+async def run_load(app, request: RequestFn, total: int, concurrency: int) -> dict:
+    """Send ``total`` requests, at most ``concurrency`` in flight at once.
+
+    ``request(client, i)`` performs the i-th request. Returns throughput,
+    latency percentiles and the number of non-2xx responses.
+    """
+    transport = httpx.ASGITransport(app=app, raise_app_exceptions=False)
+    samples: list[float] = []
+    errors = 0
+    counter = iter(range(total))
+
+    async with httpx.AsyncClient(
+        transport=transport, base_url="http://bench"
+    ) as client:
+
+        async def _worker() -> None:
+            nonlocal errors
+            for i in counter:
+                t0 = time.perf_counter()
+                response = await request(client, i)
+                samples.append(time.perf_counter() - t0)
+                if response.status_code >= 300:
+                    errors += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(_worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    return {
+        "requests": total,
+        "concurrency": concurrency,
+        "errors": errors,
+        "throughput_rps": round(total / elapsed, 1),
+        **summarize(samples),
+    }
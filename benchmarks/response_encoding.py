@@ -0,0 +1,104 @@
+"""Per-response CPU: FastAPI's default serialization vs. ``app.utils.encoding``.
+
+    python -m benchmarks.response_encoding --iterations 20000
+
+"before" is what a handler returning a model costs: FastAPI's
+``serialize_response`` against the route's ``response_model`` (validation +
+encoding) and a ``JSONResponse``. "after" is the ``FAST_RESPONSES=1`` path:
+one ``orjson`` / ``model_dump_json`` encode (and MessagePack, if installed).
+Prints mean/p50/p95/p99 microseconds per response as JSON; no database involved.
+"""
+
+import argparse
+import asyncio
+import json
+import sys
+import time
+
+from fastapi import APIRouter
+from fastapi.responses import JSONResponse
+from fastapi.routing import serialize_response
+
+from app import schemas
+from app.utils import encoding
+
+from .stats import summarize
+
+
+def _payloads() -> dict:
+    receipt = {"id": 123456, "total": 42.5}
+    kpis = schemas.KPIs(
+        shop_id=1,
+        total_receipts=250_000,
+        total_revenue=1_234_567.89,
+        top_skus=[
+            schemas.TopSku(
+                sku=f"SKU-{i:04d}", name=f"Product {i}", qty=900 - i, revenue=1.5 * i
+            )
+            for i in range(5)
+        ],
+    )
+    return {
+        "receipt": (schemas.ReceiptOut, schemas.ReceiptOut(**receipt), receipt),
+        "kpis": (schemas.KPIs, kpis, kpis),
+    }
+
+
+def _response_field(model):
+    router = APIRouter()
+    router.add_api_route("/", lambda: None, response_model=model)
+    return router.routes[0].response_field
+
+
+async def _before(field, content, iterations: int) -> list[float]:
+    samples = []
+    for _ in range(iterations):
+        t0 = time.perf_counter()
+        JSONResponse(await serialize_response(field=field, response_content=content))
+        samples.append(time.perf_counter() - t0)
+    return samples
+
+
+def _after(content, accept: str | None, iterations: int) -> list[float]:
+    samples = []
+    for _ in range(iterations):
+        t0 = time.perf_counter()
+        encoding.fast_response(content, accept)
+        samples.append(time.perf_counter() - t0)
+    return samples
+
+
+def _us(samples: list[float]) -> dict:
+    # summarize() reports milliseconds: scaled, its figures are microseconds
+    stats = summarize([s * 1000 for s in samples])
+    return {key.replace("_ms", "_us"): value for key, value in stats.items()}
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.response_encoding")
+    parser.add_argument("--iterations", type=int, default=20_000)
+    args = parser.parse_args(argv)
+
+    report = {
+        "orjson": encoding.orjson is not None,
+        "msgpack": encoding.msgpack is not None,
+        "results": {},
+    }
+    for name, (model, typed, fast) in _payloads().items():
+        field = _response_field(model)
+        result = {
+            "before": _us(asyncio.run(_before(field, typed, args.iterations))),
+            "after_json": _us(_after(fast, None, args.iterations)),
+        }
+        if encoding.NEGOTIATES:
+            result["after_msgpack"] = _us(
+                _after(fast, encoding.MSGPACK, args.iterations)
+            )
+        report["results"][name] = result
+
+    sys.stdout.write(json.dumps(report, indent=2) + "\n")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,121 @@
+"""Seed a database with synthetic shops, products and receipts.
+
+    python -m benchmarks.seed --db-url sqlite:///./bench.db --receipts 1000000
+
+Rows are written with chunked executemany inserts and the daily KPI rollups
+are rebuilt at the end, so the database is ready for KPI benchmarks.
+"""
+
+import argparse
+import random
+import sys
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import create_engine, insert, update
+from sqlalchemy.orm import Session
+
+from app import changes  # noqa: F401  (stamps products with a change_seq)
+from app import rollups
+from app.migrate import upgrade_to_head
+from app.models import Product, Receipt, ReceiptLine, Shop, User
+
+CHUNK = 50_000
+
+
+def seed(
+    db_url: str,
+    receipts: int,
+    shops: int = 1,
+    products: int = 500,
+    days: int = 365,
+    seed_value: int = 42,
+) -> list[int]:
+    """Create the schema and insert synthetic data. Returns the shop ids."""
+    rnd = random.Random(seed_value)
+    engine = create_engine(db_url, future=True)
+    upgrade_to_head(engine)
+
+    with Session(engine) as db:
+        user = User(email="bench@example.com", password_hash="x")
+        db.add(user)
+        db.flush()
+        shop_rows = [Shop(name=f"Bench {i}", owner_id=user.id) for i in range(shops)]
+        product_rows = [
+            Product(sku=f"BENCH-{i:05d}", name=f"Product {i}", price=1 + i % 20)
+            for i in range(products)
+        ]
+        db.add_all(shop_rows + product_rows)
+        db.commit()
+        shop_ids = [s.id for s in shop_rows]
+        product_ids = [p.id for p in product_rows]
+
+        now = datetime.now(timezone.utc).replace(tzinfo=None, microsecond=0)
+        start = now - timedelta(days=days)
+        next_receipt_id = 1
+        while next_receipt_id <= receipts:
+            upper = min(next_receipt_id + CHUNK, receipts + 1)
+            receipt_rows, line_rows = [], []
+            for receipt_id in range(next_receipt_id, upper):
+                total = 0.0
+                for _ in range(rnd.randint(1, 3)):
+                    qty = rnd.randint(1, 5)
+                    price = float(rnd.randint(1, 20))
+                    total += qty * price
+                    line_rows.append(
+                        {
+                            "receipt_id": receipt_id,
+                            "product_id": rnd.choice(product_ids),
+                            "qty": qty,
+                            "unit_price": price,
+                        }
+                    )
+                receipt_rows.append(
+                    {
+                        "id": receipt_id,
+                        "shop_id": rnd.choice(shop_ids),
+                        "created_at": start
+                        + timedelta(seconds=rnd.randint(0, days * 86400)),
+                        "total": total,
+                        # Receipt ids double as change sequence numbers
+                        "change_seq": receipt_id,
+                    }
+                )
+            db.execute(insert(Receipt), receipt_rows)
+            db.execute(insert(ReceiptLine), line_rows)
+            db.commit()
+            next_receipt_id = upper
+
+        db.execute(
+            update(Shop)
+            .where(Shop.id.in_(shop_ids))
+            .values(last_change_seq=max(receipts, 1))
+        )
+        rollups.rebuild(db)
+        db.commit()
+
+    engine.dispose()
+    return shop_ids
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.seed")
+    parser.add_argument("--db-url", default="sqlite:///./bench.db")
+    parser.add_argument("--receipts", type=int, default=100_000)
+    parser.add_argument("--shops", type=int, default=1)
+    parser.add_argument("--products", type=int, default=500)
+    parser.add_argument("--days", type=int, default=365)
+    args = parser.parse_args(argv)
+
+    shop_ids = seed(
+        args.db_url,
+        receipts=args.receipts,
+        shops=args.shops,
+        products=args.products,
+        days=args.days,
+    )
+    sys.stdout.write(f"Seeded {args.receipts} receipts into shops {shop_ids}\n")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,16 @@
+import statistics
+
+
+def summarize(samples_s: list[float]) -> dict:
+    """p50/p95/p99/mean in milliseconds for a list of durations in seconds."""
+    ms = sorted(s * 1000 for s in samples_s)
+    if len(ms) == 1:
+        ms = ms * 2
+    cuts = statistics.quantiles(ms, n=100, method="inclusive")
+    return {
+        "n": len(samples_s),
+        "mean_ms": round(statistics.fmean(ms), 3),
+        "p50_ms": round(cuts[49], 3),
+        "p95_ms": round(cuts[94], 3),
+        "p99_ms": round(cuts[98], 3),
+    }
@@ -0,0 +1,44 @@
+import os
+import tempfile
+
+# Tests run against a throwaway SQLite file (override with TEST_DB_URL), so the
+# schema always matches the models and the committed dev.db is left alone.
+# This has to happen before anything imports app.database.
+_tmp_dir = tempfile.mkdtemp(prefix="sync_kpis_tests_")
+os.environ["DB_URL"] = os.getenv("TEST_DB_URL", f"sqlite:///{_tmp_dir}/test.db")
+# Cheapest bcrypt cost: the suite registers many users
+os.environ.setdefault("BCRYPT_ROUNDS", "4")
+# Revocations made in-process reach the Bloom filter directly; a periodic
+# resync would add a query to the statement-count assertions
+os.environ.setdefault("REVOCATION_SYNC_SECONDS", "3600")
+
+from app.database import engine  # noqa: E402
+from app.migrate import upgrade_to_head  # noqa: E402
+
+upgrade_to_head(engine)
+
+import pytest  # noqa: E402
+
+from app import database, replicas  # noqa: E402
+
+
+@pytest.fixture(scope="session")
+def replica_engines() -> list:
+    """Two SQLite files standing in for read replicas, migrated to head."""
+    engines = [
+        database.create_read_engine(
+            f"sqlite:///{_tmp_dir}/replica{i}.db", f"replica-{i}"
+        )
+        for i in range(2)
+    ]
+    for replica in engines:
+        upgrade_to_head(replica)
+    return engines
+
+
+@pytest.fixture()
+def read_replicas(replica_engines, monkeypatch) -> list:
+    """Route ``get_read_db`` to the replica files for one test."""
+    factories = [database.session_factory(e) for e in replica_engines]
+    monkeypatch.setattr(replicas, "readers", replicas.ReplicaSet(factories))
+    return replica_engines
@@ -0,0 +1,213 @@
+from datetime import datetime
+from uuid import uuid4
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import select
+
+from app import analytics, ingest
+from app.database import SessionLocal
+from app.importer import ImportedLine
+from app.main import app
+from app.models import Receipt, Shop
+
+client = TestClient(app)
+
+
+@pytest.fixture(params=["array", "numpy"], autouse=True)
+def backend(request, monkeypatch) -> str:
+    """Every test on the plain-loop path, and on NumPy when installed."""
+    if request.param == "numpy":
+        pytest.importorskip("numpy")
+    else:
+        monkeypatch.setattr(analytics, "numpy", None)
+    return request.param
+
+
+def _shop(timezone: str = "UTC") -> tuple[dict, int, str]:
+    email = f"analytics_{uuid4().hex[:8]}@example.com"
+    r = client.post("/auth/register", json={"email": email, "password": "x1"})
+    headers = {"Authorization": f"Bearer {r.json()['access_token']}"}
+    r = client.post(
+        "/shops", headers=headers, json={"name": "Analytics", "timezone": timezone}
+    )
+    return headers, r.json()["id"], uuid4().hex[:6]
+
+
+def _ingest(shop_id: int, receipts: list[tuple[datetime, list[ImportedLine]]]):
+    drafts = [
+        ingest.ReceiptDraft(lines=lines, created_at=created_at)
+        for created_at, lines in receipts
+    ]
+    with SessionLocal() as db:
+        ingest.ingest_receipts(db, shop_id, drafts)
+        db.commit()
+
+
+def _get(headers: dict, shop_id: int, path: str, **params) -> dict:
+    r = client.get(f"/shops/{shop_id}/kpis/{path}", headers=headers, params=params)
+    assert r.status_code == 200, r.text
+    return r.json()
+
+
+def test_basket_and_co_occurrence_follow_new_receipts() -> None:
+    headers, shop_id, p = _shop()
+    a, b, c = (f"AN-{p}-{x}" for x in "abc")
+    _ingest(
+        shop_id,
+        [
+            (datetime(2024, 5, 1, 9), [ImportedLine(a, 2, 1.0), ImportedLine(b, 1, 3)]),
+            (
+                datetime(2024, 5, 1, 10),
+                [ImportedLine(a, 1, 1.0), ImportedLine(c, 1, 2)],
+            ),
+            (
+                datetime(2024, 5, 2, 11),
+                [ImportedLine(a, 1, 1.0), ImportedLine(b, 1, 3)],
+            ),
+        ],
+    )
+
+    basket = _get(headers, shop_id, "basket")
+    assert basket["receipts"] == 3
+    assert basket["avg_items"] == 7 / 3
+    assert basket["avg_lines"] == 2
+    assert basket["avg_value"] == 4.0
+
+    pairs = _get(headers, shop_id, "co-occurrence")["pairs"]
+    assert pairs[0] == {"sku_a": a, "sku_b": b, "receipts": 2}
+    assert {"sku_a": a, "sku_b": c, "receipts": 1} in pairs
+
+    day = _get(headers, shop_id, "basket", **{"from": "2024-05-01", "to": "2024-05-01"})
+    assert day["receipts"] == 2
+
+    # The snapshot is topped up, not rebuilt
+    loads = analytics.store.loads
+    _ingest(
+        shop_id,
+        [(datetime(2024, 5, 3, 9), [ImportedLine(b, 1, 3), ImportedLine(c, 1, 2)])],
+    )
+    assert _get(headers, shop_id, "basket")["receipts"] == 4
+    assert analytics.store.loads == loads
+    stats = client.get("/metrics/analytics").json()
+    assert stats["snapshots"] >= 1
+    assert 0 < stats["bytes"] <= stats["max_bytes"]
+    # Aggregates only: no shop ids for an anonymous caller
+    assert "shops" not in stats
+
+
+def test_hour_of_week_uses_the_shop_timezone() -> None:
+    headers, shop_id, p = _shop("America/New_York")
+    # 2024-05-06 is a Monday; 14:00 UTC is 10:00 in New York (EDT)
+    _ingest(
+        shop_id,
+        [
+            (datetime(2024, 5, 6, 14), [ImportedLine(f"HW-{p}", 1, 5.0)]),
+            (datetime(2024, 5, 6, 14, 30), [ImportedLine(f"HW-{p}", 2, 5.0)]),
+        ],
+    )
+    out = _get(headers, shop_id, "hour-of-week")
+    assert out["timezone"] == "America/New_York"
+    assert len(out["points"]) == 168
+    busy = [pt for pt in out["points"] if pt["receipts"]]
+    assert busy == [{"weekday": 0, "hour": 10, "receipts": 2, "revenue": 15.0}]
+
+
+def test_cold_shops_are_evicted_within_the_budget() -> None:
+    store = analytics.AnalyticsStore(max_bytes=1)
+    shops = []
+    for _ in range(2):
+        _, shop_id, p = _shop()
+        _ingest(shop_id, [(datetime(2024, 5, 1), [ImportedLine(f"EV-{p}", 1, 1.0)])])
+        shops.append(shop_id)
+
+    with SessionLocal() as db:
+        store.snapshot(db, shops[0])
+        store.snapshot(db, shops[1])
+    # Over budget: only the shop just queried is kept
+    assert list(store._snapshots) == [shops[1]]
+    assert store.stats()["snapshots"] == 1
+    assert store.evictions == 1
+
+
+def test_modified_receipts_replace_their_old_values() -> None:
+    headers, shop_id, p = _shop()
+    _ingest(
+        shop_id,
+        [
+            (datetime(2024, 5, 1, 9), [ImportedLine(f"MOD-{p}", 1, 2.0)]),
+            (datetime(2024, 5, 1, 10), [ImportedLine(f"MOD-{p}", 1, 4.0)]),
+        ],
+    )
+    assert _get(headers, shop_id, "basket")["avg_value"] == 3.0
+
+    with SessionLocal() as db:
+        receipt = db.scalars(
+            select(Receipt).where(Receipt.shop_id == shop_id).order_by(Receipt.id)
+        ).first()
+        receipt.total = 8.0
+        db.commit()
+    basket = _get(headers, shop_id, "basket")
+    assert basket["receipts"] == 2
+    assert basket["avg_value"] == 6.0
+    with SessionLocal() as db:
+        assert analytics.store.snapshot(db, shop_id).rebuilds == 1
+
+
+def test_timezone_changes_rebuild_the_snapshot() -> None:
+    headers, shop_id, p = _shop()
+    _ingest(shop_id, [(datetime(2024, 5, 6, 14), [ImportedLine(f"TZ-{p}", 1, 5.0)])])
+    busy = [
+        pt for pt in _get(headers, shop_id, "hour-of-week")["points"] if pt["receipts"]
+    ]
+    assert (busy[0]["weekday"], busy[0]["hour"]) == (0, 14)
+
+    with SessionLocal() as db:
+        db.get(Shop, shop_id).timezone = "America/New_York"
+        db.commit()
+    out = _get(headers, shop_id, "hour-of-week")
+    assert out["timezone"] == "America/New_York"
+    busy = [pt for pt in out["points"] if pt["receipts"]]
+    assert (busy[0]["weekday"], busy[0]["hour"]) == (0, 10)
+
+
+def test_numpy_and_loop_paths_agree(monkeypatch) -> None:
+    pytest.importorskip("numpy")
+    _, shop_id, p = _shop("Europe/Paris")
+    a, b, c = (f"NP-{p}-{x}" for x in "abc")
+    _ingest(
+        shop_id,
+        [
+            (datetime(2024, 5, 1, 9), [ImportedLine(a, 2, 1.0), ImportedLine(b, 1, 3)]),
+            # The same SKU twice in one receipt counts once per pair
+            (
+                datetime(2024, 5, 1, 23),
+                [ImportedLine(a, 1, 1), ImportedLine(c, 1, 2), ImportedLine(a, 3, 1)],
+            ),
+            (datetime(2024, 5, 3, 7), [ImportedLine(b, 1, 3)]),
+            (datetime(2024, 5, 4, 12), [ImportedLine(c, 4, 2), ImportedLine(b, 1, 3)]),
+        ],
+    )
+    snapshot = analytics.ShopSnapshot(shop_id, "Europe/Paris")
+    with SessionLocal() as db:
+        snapshot.refresh(db)
+    ranges = [
+        analytics.TimeRange(),
+        analytics.TimeRange.from_datetimes(datetime(2024, 5, 1, 12), None),
+        analytics.TimeRange.from_datetimes(None, datetime(2024, 5, 3)),
+    ]
+
+    def _results() -> list:
+        return [
+            (
+                analytics.basket(snapshot, rng),
+                analytics.hour_of_week(snapshot, rng),
+                analytics.co_occurrence(snapshot, rng),
+            )
+            for rng in ranges
+        ]
+
+    monkeypatch.setattr(analytics, "numpy", pytest.importorskip("numpy"))
+    vectorized = _results()
+    monkeypatch.setattr(analytics, "numpy", None)
+    assert vectorized == _results()
@@ -0,0 +1,135 @@
+import sqlite3
+from datetime import date, datetime
+from uuid import uuid4
+
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.dialects import mysql
+
+from app import archive, ingest, kpi_engine, partitions, rollups
+from app.database import SessionLocal
+from app.importer import ImportedLine
+from app.main import app
+from app.models import ReceiptArchive
+
+client = TestClient(app)
+
+
+def test_monthly_partition_ddl() -> None:
+    ddl = partitions.partition_table_ddl(
+        "shop_daily_kpis", date(2023, 11, 15), date(2024, 1, 1)
+    )
+    assert ddl == (
+        "ALTER TABLE shop_daily_kpis PARTITION BY RANGE COLUMNS(day) ("
+        "PARTITION p202311 VALUES LESS THAN ('2023-12-01'), "
+        "PARTITION p202312 VALUES LESS THAN ('2024-01-01'), "
+        "PARTITION p202401 VALUES LESS THAN ('2024-02-01'), "
+        "PARTITION pmax VALUES LESS THAN (MAXVALUE))"
+    )
+    assert partitions.add_partitions_ddl("receipts", [date(2024, 2, 1)]) == (
+        "ALTER TABLE receipts REORGANIZE PARTITION pmax INTO ("
+        "PARTITION p202402 VALUES LESS THAN ('2024-03-01'), "
+        "PARTITION pmax VALUES LESS THAN (MAXVALUE))"
+    )
+
+
+def test_partitioning_covers_mysql_and_mariadb() -> None:
+    for url, partitioned in (
+        ("mysql+pymysql://u:p@db/sync_kpis", True),
+        ("mariadb+pymysql://u:p@db/sync_kpis", True),
+        ("sqlite://", False),
+    ):
+        engine = create_engine(url)
+        assert partitions.supported(engine) is partitioned, url
+
+
+def test_kpi_statement_filters_both_rollups_on_the_partition_column() -> None:
+    rng = kpi_engine.RangeFilter(
+        shop_id=1, start=date(2024, 3, 1), end=date(2024, 3, 31)
+    )
+    sql = str(
+        kpi_engine.build_statement(rng).compile(
+            dialect=mysql.dialect(), compile_kwargs={"literal_binds": True}
+        )
+    )
+    # Bare column comparisons: MySQL prunes to the March partitions
+    for table in ("shop_daily_kpis", "shop_daily_sku_kpis"):
+        assert f"{table}.day >= '2024-03-01'" in sql
+        assert f"{table}.day <= '2024-03-31'" in sql
+
+
+def _shop() -> tuple[dict, int]:
+    email = f"archive_{uuid4().hex[:8]}@example.com"
+    r = client.post("/auth/register", json={"email": email, "password": "x1"})
+    headers = {"Authorization": f"Bearer {r.json()['access_token']}"}
+    r = client.post("/shops", headers=headers, json={"name": "Archive"})
+    return headers, r.json()["id"]
+
+
+def _ingest(shop_id: int, *created: datetime) -> None:
+    sku = f"AR-{uuid4().hex[:6]}"
+    with SessionLocal() as db:
+        ingest.ingest_receipts(
+            db,
+            shop_id,
+            [
+                ingest.ReceiptDraft(lines=[ImportedLine(sku, 2, 1.5)], created_at=at)
+                for at in created
+            ],
+        )
+        db.commit()
+
+
+def _kpis(headers: dict, shop_id: int) -> dict:
+    r = client.get(f"/shops/{shop_id}/kpis", headers=headers)
+    assert r.status_code == 200, r.text
+    return r.json()
+
+
+def test_archiving_moves_closed_months_and_keeps_their_kpis(tmp_path) -> None:
+    headers, shop_id = _shop()
+    _ingest(
+        shop_id,
+        datetime(1999, 1, 10, 12),
+        datetime(1999, 1, 20, 12),
+        datetime(1999, 2, 5, 12),
+        datetime(2024, 6, 1, 12),
+    )
+    before = _kpis(headers, shop_id)
+
+    moved = archive.run(
+        SessionLocal, date(2024, 7, 1), before=date(2000, 1, 1), directory=tmp_path
+    )
+    assert moved[date(1999, 1, 1)] == 2
+    assert moved[date(1999, 2, 1)] == 1
+
+    with sqlite3.connect(tmp_path / "receipts-1999-01.sqlite") as archived:
+        rows = archived.execute(
+            "SELECT r.created_at, r.total, l.qty, l.unit_price "
+            "FROM receipts r JOIN receipt_lines l ON l.receipt_id = r.id "
+            "WHERE r.shop_id = ? ORDER BY r.created_at",
+            (shop_id,),
+        ).fetchall()
+    assert rows == [
+        ("1999-01-10 12:00:00", "3.00", 2, "1.50"),
+        ("1999-01-20 12:00:00", "3.00", 2, "1.50"),
+    ]
+
+    r = client.get(f"/shops/{shop_id}/receipts", headers=headers)
+    assert [rc["created_at"][:4] for rc in r.json()["receipts"]] == ["2024"]
+
+    # Rollups are the summary of archived months, even after a rebuild
+    with SessionLocal() as db:
+        rollups.rebuild(db, shop_id)
+        db.commit()
+    assert _kpis(headers, shop_id)["total_receipts"] == before["total_receipts"] == 4
+
+    # A late import into an archived month is appended on the next run
+    _ingest(shop_id, datetime(1999, 1, 25, 12))
+    archive.run(
+        SessionLocal, date(2024, 7, 1), before=date(2000, 1, 1), directory=tmp_path
+    )
+    with SessionLocal() as db:
+        record = db.get(ReceiptArchive, date(1999, 1, 1))
+        assert record.receipts >= 3
+        assert archive.archived_until(db) == date(1999, 3, 1)
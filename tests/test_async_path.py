@@ -0,0 +1,120 @@
+from uuid import uuid4
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+pytest.importorskip("aiosqlite")
+pytest.importorskip("greenlet")
+
+from sqlalchemy.ext.asyncio import (  # noqa: E402
+    async_sessionmaker,
+    create_async_engine,
+)
+
+from app.database import DB_URL, to_async_url  # noqa: E402
+from app.deps import get_async_db  # noqa: E402
+from app.routers import (  # noqa: E402
+    auth_router,
+    kpis_router,
+    products_router,
+    receipts_router,
+    shops_router,
+)
+
+async_app = FastAPI()
+for module in (
+    auth_router,
+    shops_router,
+    products_router,
+    receipts_router,
+    kpis_router,
+):
+    async_app.include_router(module.async_router)
+
+
+@pytest.fixture()
+def client():
+    # The engine is created inside the client's event loop
+    holder = {}
+
+    async def _get_async_db():
+        if "factory" not in holder:
+            holder["factory"] = async_sessionmaker(
+                create_async_engine(to_async_url(DB_URL)),
+                autoflush=False,
+                expire_on_commit=False,
+            )
+        async with holder["factory"]() as db:
+            yield db
+
+    async_app.dependency_overrides[get_async_db] = _get_async_db
+    with TestClient(async_app) as c:
+        yield c
+    async_app.dependency_overrides.clear()
+
+
+def test_to_async_url() -> None:
+    assert to_async_url("sqlite:///./dev.db") == "sqlite+aiosqlite:///./dev.db"
+    assert (
+        to_async_url("mysql+pymysql://u:p@db:3306/x")
+        == "mysql+aiomysql://u:p@db:3306/x"
+    )
+
+
+def test_async_routers_full_flow(client) -> None:
+    email = f"async_{uuid4().hex[:8]}@example.com"
+    r = client.post("/auth/register", json={"email": email, "password": "ChangeMe123"})
+    assert r.status_code == 201, r.text
+    r = client.post("/auth/login", json={"email": email, "password": "ChangeMe123"})
+    assert r.status_code == 200, r.text
+    headers = {"Authorization": f"Bearer {r.json()['access_token']}"}
+
+    r = client.post("/shops", headers=headers, json={"name": "Async Shop"})
+    assert r.status_code == 201, r.text
+    shop_id = r.json()["id"]
+
+    sku = f"ASYNC-{uuid4().hex[:6]}"
+    r = client.post(
+        "/products", headers=headers, json={"sku": sku, "name": "Async", "price": 2}
+    )
+    assert r.status_code == 201, r.text
+
+    receipt_headers = {**headers, "Idempotency-Key": f"async-{uuid4().hex}"}
+    body = {"lines": [{"sku": sku, "qty": 3, "unit_price": 2.0}]}
+    r1 = client.post(f"/shops/{shop_id}/receipts", headers=receipt_headers, json=body)
+    r2 = client.post(f"/shops/{shop_id}/receipts", headers=receipt_headers, json=body)
+    assert r1.status_code == r2.status_code == 201, r1.text
+    assert r1.json() == r2.json() == {"id": r1.json()["id"], "total": 6.0}
+
+    r = client.post(
+        f"/shops/{shop_id}/receipts:bulk",
+        headers=headers,
+        json={"receipts": [body, {"lines": [{"sku": sku, "qty": 0, "unit_price": 1}]}]},
+    )
+    assert [res["status"] for res in r.json()["results"]] == ["created", "rejected"]
+
+    rk = client.get(f"/shops/{shop_id}/kpis", headers=headers)
+    assert rk.status_code == 200, rk.text
+    data = rk.json()
+    assert data["total_receipts"] == 2
+    assert data["top_skus"][0] == {
+        "sku": sku,
+        "name": "Async",
+        "qty": 6,
+        "revenue": 12.0,
+    }
+
+    r = client.get(f"/shops/{shop_id}/receipts", headers=headers, params={"limit": 1})
+    assert r.status_code == 200, r.text
+    page = r.json()
+    assert len(page["receipts"]) == 1 and page["next_cursor"]
+    r = client.get(
+        f"/shops/{shop_id}/receipts",
+        headers=headers,
+        params={"cursor": page["next_cursor"]},
+    )
+    assert [x["id"] for x in r.json()["receipts"]] != [page["receipts"][0]["id"]]
+
+    r = client.get("/shops/999999/kpis", headers=headers)
+    assert r.status_code == 404
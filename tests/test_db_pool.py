@@ -0,0 +1,58 @@
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, text
+
+from app import db_pool
+from app.database import engine
+from app.main import app
+
+client = TestClient(app)
+
+
+def test_mysql_presets_and_env_overrides(monkeypatch) -> None:
+    url = "mysql+pymysql://u:p@db:3306/x"
+    kwargs = db_pool.engine_kwargs(url)
+    assert kwargs["pool_size"] == 10
+    assert kwargs["pool_pre_ping"] is True
+    assert kwargs["pool_recycle"] == 1800
+
+    monkeypatch.setenv("DB_POOL_SIZE", "3")
+    monkeypatch.setenv("DB_POOL_PRE_PING", "false")
+    kwargs = db_pool.engine_kwargs(url)
+    assert kwargs["pool_size"] == 3
+    assert kwargs["pool_pre_ping"] is False
+    assert kwargs["poolclass"] is db_pool.InstrumentedQueuePool
+
+
+def test_sqlite_pragmas_and_shared_cache(tmp_path, monkeypatch) -> None:
+    url = f"sqlite:///{tmp_path}/pragmas.db"
+    sqlite_engine = create_engine(url, **db_pool.engine_kwargs(url))
+    db_pool.configure_sqlite(sqlite_engine)
+    with sqlite_engine.connect() as conn:
+        assert conn.execute(text("PRAGMA journal_mode")).scalar() == "wal"
+        # NORMAL == 1
+        assert conn.execute(text("PRAGMA synchronous")).scalar() == 1
+    sqlite_engine.dispose()
+
+    monkeypatch.setenv("SQLITE_SHARED_CACHE", "1")
+    shared = db_pool.sqlite_url(url)
+    assert shared.startswith(f"sqlite:///file:{tmp_path}/pragmas.db?")
+    assert "cache=shared" in shared and "uri=true" in shared
+    assert db_pool.sqlite_url("sqlite://") == "sqlite://"
+    shared_engine = create_engine(shared, **db_pool.engine_kwargs(shared))
+    with shared_engine.connect() as conn:
+        assert conn.execute(text("SELECT 1")).scalar() == 1
+    shared_engine.dispose()
+
+
+def test_pool_metrics_endpoint_counts_checkouts() -> None:
+    before = client.get("/metrics/pool").json()["primary"]["checkouts"]
+    with engine.connect() as conn:
+        conn.execute(text("SELECT 1"))
+
+    r = client.get("/metrics/pool")
+    assert r.status_code == 200
+    primary = r.json()["primary"]
+    assert primary["pool"] == "InstrumentedQueuePool"
+    assert primary["checkouts"] == before + 1
+    assert primary["checked_out"] == 0
+    assert primary["wait_seconds_total"] >= 0
@@ -0,0 +1,173 @@
+import gzip
+from datetime import datetime
+from uuid import uuid4
+
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, select, update
+
+from app import changes, db_pool
+from app.database import DB_URL, SessionLocal, session_factory
+from app.main import app
+from app.models import Product
+from app.utils import compression
+
+client = TestClient(app)
+
+
+def _owner_with_shop() -> tuple[dict, int]:
+    email = f"sync_{uuid4().hex[:8]}@example.com"
+    r = client.post("/auth/register", json={"email": email, "password": "x1"})
+    assert r.status_code == 201, r.text
+    headers = {"Authorization": f"Bearer {r.json()['access_token']}"}
+    r = client.post("/shops", headers=headers, json={"name": "Sync"})
+    assert r.status_code == 201, r.text
+    return headers, r.json()["id"]
+
+
+def _receipt(headers: dict, shop_id: int, sku: str, qty: int = 1) -> int:
+    r = client.post(
+        f"/shops/{shop_id}/receipts",
+        headers=headers,
+        json={"lines": [{"sku": sku, "qty": qty, "unit_price": 2.0}]},
+    )
+    assert r.status_code == 201, r.text
+    return r.json()["id"]
+
+
+def _sync(headers: dict, shop_id: int, since: str | None = None, **params):
+    r = client.get(
+        "/devices/sync",
+        headers=headers,
+        params={"shop_id": shop_id, **({"since": since} if since else {}), **params},
+    )
+    assert r.status_code == 200, r.text
+    return r.json()
+
+
+def _drain(headers: dict, shop_id: int, since: str | None = None, **params):
+    """Follow has_more to the end; returns (batches, cursor)."""
+    batches = []
+    while True:
+        batch = _sync(headers, shop_id, since, **params)
+        batches.append(batch)
+        since = batch["next_cursor"]
+        if not batch["has_more"]:
+            return batches, since
+
+
+def test_sync_returns_only_what_changed_since_the_cursor() -> None:
+    headers, shop_id = _owner_with_shop()
+    sku = f"SYNC-{uuid4().hex[:6]}"
+    ids = [_receipt(headers, shop_id, sku, qty) for qty in (1, 2)]
+
+    batches, cursor = _drain(headers, shop_id)
+    assert batches[0]["shop"]["id"] == shop_id
+    receipts = [r for b in batches for r in b["receipts"]]
+    assert [r["id"] for r in receipts] == ids
+    assert receipts[1]["lines"] == [[sku, 2, 2.0]]
+    assert sku in {p["sku"] for b in batches for p in b["products"]}
+
+    # Nothing changed: empty batch, same cursor
+    again = _sync(headers, shop_id, cursor)
+    assert again["shop"] is None
+    assert again["products"] == again["receipts"] == []
+    assert again["next_cursor"] == cursor
+
+    # One more receipt for an existing SKU: only that receipt
+    new_id = _receipt(headers, shop_id, sku)
+    delta = _sync(headers, shop_id, cursor)
+    assert [r["id"] for r in delta["receipts"]] == [new_id]
+    assert delta["products"] == []
+
+
+def test_sync_pages_through_large_backlogs() -> None:
+    headers, shop_id = _owner_with_shop()
+    ids = [_receipt(headers, shop_id, "COCA-500") for _ in range(5)]
+    _, cursor = _drain(headers, shop_id)
+
+    more = [_receipt(headers, shop_id, "COCA-500") for _ in range(5)]
+    batches, _ = _drain(headers, shop_id, cursor, limit=2)
+    assert [len(b["receipts"]) for b in batches] == [2, 2, 1]
+    assert [r["id"] for b in batches for r in b["receipts"]] == more
+    assert not set(ids) & set(more)
+
+    r = client.get(
+        "/devices/sync", headers=headers, params={"shop_id": shop_id, "since": "x"}
+    )
+    assert r.status_code == 400
+
+
+def test_sync_body_is_compressed_when_accepted(monkeypatch) -> None:
+    headers, shop_id = _owner_with_shop()
+    _receipt(headers, shop_id, "COCA-500")
+    monkeypatch.setattr(compression, "MIN_SIZE", 0)
+
+    r = client.get(
+        "/devices/sync",
+        headers={**headers, "Accept-Encoding": "gzip"},
+        params={"shop_id": shop_id},
+    )
+    assert r.status_code == 200
+    assert r.headers["content-encoding"] == "gzip"
+    assert r.headers["vary"] == "Accept-Encoding"
+    assert r.json()["receipts"]  # decoded transparently by the client
+
+    assert compression.negotiate("identity") is None
+    assert compression.negotiate("gzip;q=0, br") is None
+    assert compression.negotiate("br, gzip;q=0.5") == "gzip"
+    expected = "zstd" if compression.zstandard is not None else "gzip"
+    assert compression.negotiate("gzip, zstd") == expected
+    assert gzip.decompress(compression.compress(b"abc", "gzip")) == b"abc"
+
+
+def test_product_cursor_waits_for_lower_numbers_to_settle(monkeypatch) -> None:
+    headers, shop_id = _owner_with_shop()
+    _, cursor = _drain(headers, shop_id)
+    sku = f"SETTLE-{uuid4().hex[:6]}"
+    _receipt(headers, shop_id, sku)
+
+    # Product numbers reserved outside the writing transaction (not SQLite)
+    monkeypatch.setattr(changes, "product_settle_seconds", lambda db: 60.0)
+    first = _sync(headers, shop_id, cursor)
+    assert [p["sku"] for p in first["products"]] == [sku]
+    # Sent, but the cursor stays before it: sent again next time
+    again = _sync(headers, shop_id, first["next_cursor"])
+    assert [p["sku"] for p in again["products"]] == [sku]
+
+    with SessionLocal() as db:
+        db.execute(
+            update(Product)
+            .where(Product.sku == sku)
+            .values(updated_at=datetime(2020, 1, 1))
+        )
+        db.commit()
+    settled = _sync(headers, shop_id, again["next_cursor"])
+    assert _sync(headers, shop_id, settled["next_cursor"])["products"] == []
+
+
+def test_product_numbers_do_not_need_a_second_request_connection(
+    monkeypatch,
+) -> None:
+    # Every request connection held: the reservation must not wait for one
+    engine = create_engine(
+        DB_URL,
+        **{
+            **db_pool.engine_kwargs(DB_URL),
+            "pool_size": 1,
+            "max_overflow": 0,
+            "pool_timeout": 1,
+        },
+    )
+    monkeypatch.setattr(changes, "separate_product_seqs", lambda db: True)
+    sku = f"POOL-{uuid4().hex[:6]}"
+    try:
+        with session_factory(engine)() as db:
+            db.execute(select(Product.id).limit(1))
+            db.add(Product(sku=sku, name=sku, price=1.0))
+            db.commit()
+        with SessionLocal() as db:
+            product = db.scalars(select(Product).where(Product.sku == sku)).one()
+        assert product.change_seq is not None
+        assert db_pool.pool_metrics()["change-seq"]["timeouts"] == 0
+    finally:
+        engine.dispose()
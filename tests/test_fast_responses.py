@@ -0,0 +1,83 @@
+from uuid import uuid4
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app import schemas
+from app.main import app
+from app.utils import encoding
+
+client = TestClient(app)
+
+MSGPACK = {"Accept": "application/msgpack"}
+
+
+def _shop() -> tuple[dict, int]:
+    email = f"fast_{uuid4().hex[:8]}@example.com"
+    r = client.post("/auth/register", json={"email": email, "password": "x1"})
+    headers = {"Authorization": f"Bearer {r.json()['access_token']}"}
+    r = client.post("/shops", headers=headers, json={"name": "Fast"})
+    return headers, r.json()["id"]
+
+
+def _post_receipt(headers: dict, shop_id: int, **extra):
+    return client.post(
+        f"/shops/{shop_id}/receipts",
+        headers={**headers, **extra},
+        json={"lines": [{"sku": "COCA-500", "qty": 2, "unit_price": 1.5}]},
+    )
+
+
+def test_fast_path_sends_the_same_receipt_body(monkeypatch) -> None:
+    headers, shop_id = _shop()
+    slow = _post_receipt(headers, shop_id)
+    monkeypatch.setattr(encoding, "FAST_RESPONSES", True)
+    fast = _post_receipt(headers, shop_id)
+
+    assert fast.status_code == slow.status_code == 201
+    assert fast.headers["content-type"] == "application/json"
+    assert list(fast.json()) == list(slow.json()) == ["id", "total"]
+    assert fast.json()["total"] == slow.json()["total"] == 3.0
+
+
+def test_encoders_match_pydantic_json() -> None:
+    kpis = schemas.KPIs(
+        shop_id=1,
+        total_receipts=2,
+        total_revenue=3.5,
+        top_skus=[schemas.TopSku(sku="A", name=None, qty=2, revenue=3.5)],
+    )
+    assert encoding.dumps_json(kpis) == kpis.model_dump_json().encode()
+    assert encoding.dumps_json({"id": 1, "total": 3.0}) == b'{"id":1,"total":3.0}'
+
+
+def test_msgpack_is_negotiated_by_accept() -> None:
+    msgpack = pytest.importorskip("msgpack")
+    assert encoding.negotiate("application/msgpack") == encoding.MSGPACK
+    assert encoding.negotiate("application/json, application/msgpack;q=0.5") == (
+        encoding.JSON
+    )
+    assert encoding.negotiate("*/*") == encoding.JSON
+
+    headers, shop_id = _shop()
+    r = _post_receipt(headers, shop_id, **MSGPACK)
+    assert r.status_code == 201
+    assert r.headers["content-type"] == encoding.MSGPACK
+    body = msgpack.unpackb(r.content)
+    assert body["total"] == 3.0 and isinstance(body["id"], int)
+
+    json_kpis = client.get(f"/shops/{shop_id}/kpis", headers=headers)
+    r = client.get(f"/shops/{shop_id}/kpis", headers={**headers, **MSGPACK})
+    assert msgpack.unpackb(r.content) == json_kpis.json()
+    # Each representation has its own validator
+    assert r.headers["etag"] != json_kpis.headers["etag"]
+    r = client.get(
+        f"/shops/{shop_id}/kpis",
+        headers={**headers, **MSGPACK, "If-None-Match": r.headers["etag"]},
+    )
+    assert r.status_code == 304
+
+    r = client.get(
+        "/devices/sync", headers={**headers, **MSGPACK}, params={"shop_id": shop_id}
+    )
+    assert msgpack.unpackb(r.content)["receipts"]
@@ -0,0 +1,160 @@
+import threading
+from datetime import datetime, timedelta
+from uuid import uuid4
+
+from fastapi.testclient import TestClient
+from sqlalchemy import event, func, select, update
+
+from app import idempotency, ingest
+from app.database import SessionLocal, engine
+from app.importer import ImportedLine
+from app.main import app
+from app.models import IdempotencyKey, Receipt
+
+client = TestClient(app)
+
+LINES = {"lines": [{"sku": "COCA-500", "qty": 2, "unit_price": 1.2}]}
+
+
+def _owner_with_shops(n: int) -> tuple[dict, list[int]]:
+    email = f"idem_{uuid4().hex[:8]}@example.com"
+    r = client.post("/auth/register", json={"email": email, "password": "x1"})
+    assert r.status_code == 201, r.text
+    headers = {"Authorization": f"Bearer {r.json()['access_token']}"}
+    shop_ids = []
+    for i in range(n):
+        r = client.post("/shops", headers=headers, json={"name": f"Idem {i}"})
+        assert r.status_code == 201, r.text
+        shop_ids.append(r.json()["id"])
+    return headers, shop_ids
+
+
+def _post(headers: dict, shop_id: int, key: str, body: dict = LINES):
+    return client.post(
+        f"/shops/{shop_id}/receipts",
+        headers={**headers, "Idempotency-Key": key},
+        json=body,
+    )
+
+
+def _statements(fn) -> list[str]:
+    statements: list[str] = []
+
+    def _count(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", _count)
+    try:
+        fn()
+    finally:
+        event.remove(engine, "before_cursor_execute", _count)
+    return statements
+
+
+def test_keys_are_scoped_per_shop_and_checked_against_the_payload() -> None:
+    headers, (a, b) = _owner_with_shops(2)
+    key = uuid4().hex
+
+    ra, rb = _post(headers, a, key), _post(headers, b, key)
+    assert ra.status_code == rb.status_code == 201
+    assert ra.json()["id"] != rb.json()["id"]
+
+    other = {"lines": [{"sku": "COCA-500", "qty": 3, "unit_price": 1.2}]}
+    r = _post(headers, a, key, other)
+    assert r.status_code == 409, r.text
+
+    r = client.post(
+        f"/shops/{a}/receipts:bulk",
+        headers=headers,
+        json={"receipts": [{**other, "idempotency_key": key}]},
+    )
+    assert r.json()["results"][0]["status"] == "conflict"
+
+
+def test_replays_never_read_the_receipts_table() -> None:
+    headers, (shop_id,) = _owner_with_shops(1)
+    key = uuid4().hex
+    first = _post(headers, shop_id, key).json()
+
+    # Hot key: answered from the in-process cache
+    statements = _statements(lambda: _post(headers, shop_id, key))
+    assert not any("idempotency_keys" in s or "receipts" in s for s in statements)
+
+    # Cold key: answered from the idempotency_keys row
+    idempotency.cache.clear()
+    replays = []
+    statements = _statements(lambda: replays.append(_post(headers, shop_id, key)))
+    assert replays[0].status_code == 201
+    assert replays[0].json() == first
+    assert any("idempotency_keys" in s for s in statements)
+    assert not any("receipts" in s.replace("idempotency_keys", "") for s in statements)
+
+
+def test_concurrent_duplicates_create_one_receipt() -> None:
+    _, (shop_id,) = _owner_with_shops(1)
+    key = uuid4().hex
+    barrier = threading.Barrier(4)
+    results: list[ingest.IngestResult] = []
+
+    def _ingest() -> None:
+        draft = ingest.ReceiptDraft(
+            lines=[ImportedLine("COCA-500", 1, 1.0)], idempotency_key=key
+        )
+        with SessionLocal() as db:
+            barrier.wait()
+            [result] = ingest.ingest_receipts(db, shop_id, [draft])
+            db.commit()
+        results.append(result)
+
+    threads = [threading.Thread(target=_ingest) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(r.status for r in results) == ["created"] + ["replayed"] * 3
+    assert len({r.receipt_id for r in results}) == 1
+    with SessionLocal() as db:
+        count = db.scalar(
+            select(func.count(Receipt.id)).where(Receipt.shop_id == shop_id)
+        )
+    assert count == 1
+
+
+def test_expired_keys_are_reusable_and_purged_in_batches() -> None:
+    headers, (shop_id,) = _owner_with_shops(1)
+    keys = [uuid4().hex for _ in range(5)]
+    first_ids = [_post(headers, shop_id, key).json()["id"] for key in keys]
+
+    with SessionLocal() as db:
+        db.execute(
+            update(IdempotencyKey)
+            .where(IdempotencyKey.key.in_(keys))
+            .values(expires_at=datetime.utcnow() - timedelta(minutes=1))
+        )
+        db.commit()
+    idempotency.cache.clear()
+
+    # An expired key creates a new receipt
+    r = _post(headers, shop_id, keys[0])
+    assert r.status_code == 201 and r.json()["id"] != first_ids[0]
+
+    assert idempotency.purge_expired(SessionLocal, batch_size=2) >= 4
+    with SessionLocal() as db:
+        remaining = db.scalars(
+            select(IdempotencyKey.key).where(IdempotencyKey.key.in_(keys))
+        ).all()
+    assert remaining == [keys[0]]
+
+
+def test_cached_keys_expire_with_their_row(monkeypatch) -> None:
+    headers, (shop_id,) = _owner_with_shops(1)
+    key = uuid4().hex
+    first = _post(headers, shop_id, key).json()["id"]
+    assert idempotency.cache.get((shop_id, key)) is not None
+
+    # Still within the cache TTL, but past the key's own expiry
+    later = datetime.utcnow() + timedelta(hours=idempotency.IDEMPOTENCY_TTL_HOURS)
+    monkeypatch.setattr(idempotency, "_utcnow", lambda: later + timedelta(minutes=1))
+    r = _post(headers, shop_id, key)
+    assert r.status_code == 201 and r.json()["id"] != first
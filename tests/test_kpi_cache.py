@@ -0,0 +1,127 @@
+from uuid import uuid4
+
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+
+from app import kpi_cache
+from app.database import engine
+from app.main import app
+
+client = TestClient(app)
+
+
+def _register_and_shop() -> tuple[dict, int]:
+    email = f"kpicache_{uuid4().hex[:8]}@example.com"
+    r = client.post("/auth/register", json={"email": email, "password": "ChangeMe123"})
+    assert r.status_code == 201, r.text
+    headers = {"Authorization": f"Bearer {r.json()['access_token']}"}
+
+    r = client.post("/shops", headers=headers, json={"name": "Cache Shop"})
+    assert r.status_code == 201, r.text
+    return headers, r.json()["id"]
+
+
+def _post_receipt(headers: dict, shop_id: int, qty: int) -> None:
+    r = client.post(
+        f"/shops/{shop_id}/receipts",
+        headers=headers,
+        json={"lines": [{"sku": "COCA-500", "qty": qty, "unit_price": 1.0}]},
+    )
+    assert r.status_code == 201, r.text
+
+
+def _get(headers: dict, shop_id: int, **extra_headers) -> tuple[object, int]:
+    statements: list[str] = []
+
+    def _count(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", _count)
+    try:
+        r = client.get(
+            f"/shops/{shop_id}/kpis",
+            headers={**headers, **extra_headers},
+            params={"from": "2000-01-01", "to": "2999-12-31"},
+        )
+    finally:
+        event.remove(engine, "before_cursor_execute", _count)
+    return r, len(statements)
+
+
+class _FakeRedis:
+    """Dict-backed stand-in for the few Redis commands the backend uses."""
+
+    def __init__(self) -> None:
+        self.data: dict[str, bytes] = {}
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def set(self, key, value, ex=None):
+        self.data[key] = value
+
+    def incr(self, key):
+        self.data[key] = str(int(self.data.get(key, 0)) + 1).encode()
+        return int(self.data[key])
+
+
+def test_repeated_polls_hit_cache_and_revalidate_with_304() -> None:
+    headers, shop_id = _register_and_shop()
+    _post_receipt(headers, shop_id, qty=2)
+
+    first, _ = _get(headers, shop_id)
+    assert first.status_code == 200
+    etag = first.headers["ETag"]
+
+    second, queries = _get(headers, shop_id)
+    assert second.status_code == 200
+    assert second.headers["ETag"] == etag
+    assert second.json() == first.json()
+    assert queries == 0
+
+    not_modified, queries = _get(headers, shop_id, **{"If-None-Match": etag})
+    assert not_modified.status_code == 304
+    assert not_modified.content == b""
+    assert queries == 0
+
+
+def test_receipt_commit_invalidates_shop_entries() -> None:
+    headers, shop_id = _register_and_shop()
+    _post_receipt(headers, shop_id, qty=1)
+    before, _ = _get(headers, shop_id)
+
+    _post_receipt(headers, shop_id, qty=3)
+    after, queries = _get(headers, shop_id, **{"If-None-Match": before.headers["ETag"]})
+    assert after.status_code == 200
+    assert queries > 0
+    assert after.headers["ETag"] != before.headers["ETag"]
+    assert after.json()["total_receipts"] == before.json()["total_receipts"] + 1
+
+
+def test_redis_compatible_backend() -> None:
+    fake = _FakeRedis()
+    previous = kpi_cache.backend
+    kpi_cache.set_backend(kpi_cache.RedisBackend(client=fake))
+    try:
+        headers, shop_id = _register_and_shop()
+        _post_receipt(headers, shop_id, qty=1)
+        first, _ = _get(headers, shop_id)
+        assert any(key.startswith(f"kpis:{shop_id}:1:") for key in fake.data)
+
+        _, queries = _get(headers, shop_id)
+        assert queries == 0
+
+        _post_receipt(headers, shop_id, qty=1)
+        assert fake.get(f"kpis:gen:{shop_id}") == b"2"
+        second, _ = _get(headers, shop_id)
+        assert second.json()["total_receipts"] == 2
+    finally:
+        kpi_cache.set_backend(previous)
+
+
+def test_memory_backend_is_size_bounded() -> None:
+    backend = kpi_cache.MemoryBackend(maxsize=2, ttl=60, name="kpis_test")
+    for i in range(3):
+        backend.set(f"k{i}", b"{}")
+    assert backend.get("k0") is None
+    assert backend.entries.evictions == 1
@@ -0,0 +1,78 @@
+from datetime import date
+from uuid import uuid4
+
+from sqlalchemy import event, func
+
+from app import kpi_engine, rollups
+from app.database import SessionLocal, engine
+from app.models import Product, ReceiptLine, Shop, User
+
+
+def _seed_shop(db) -> int:
+    user = User(email=f"engine_{uuid4().hex[:8]}@example.com", password_hash="x")
+    db.add(user)
+    db.flush()
+    shop = Shop(name="Engine Shop", owner_id=user.id)
+    db.add(shop)
+    products = [
+        Product(sku=f"ENG-{i}-{uuid4().hex[:6]}", name=f"P{i}", price=1)
+        for i in range(7)
+    ]
+    db.add_all(products)
+    db.flush()
+
+    for day in (date(2024, 3, 1), date(2024, 3, 2), date(2024, 4, 1)):
+        for i, product in enumerate(products):
+            line = ReceiptLine(product_id=product.id, qty=i + 1, unit_price=2.0)
+            rollups.apply_receipt(db, shop.id, day, (i + 1) * 2.0, [line])
+    db.commit()
+    return shop.id
+
+
+def test_compute_is_a_single_round_trip():
+    statements = []
+
+    def _count(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    with SessionLocal() as db:
+        shop_id = _seed_shop(db)
+        rng = kpi_engine.RangeFilter(
+            shop_id=shop_id, start=date(2024, 3, 1), end=date(2024, 3, 31)
+        )
+
+        event.listen(engine, "before_cursor_execute", _count)
+        try:
+            result = kpi_engine.compute(db, rng)
+        finally:
+            event.remove(engine, "before_cursor_execute", _count)
+
+    assert len(statements) == 1
+    assert result.metrics["total_receipts"] == 14
+    assert float(result.metrics["total_revenue"]) == 2 * 2.0 * sum(range(1, 8))
+    assert [row["qty"] for row in result.top_skus] == [14, 12, 10, 8, 6]
+
+
+def test_registered_metric_joins_the_same_statement():
+    kpi_engine.register_metric("active_days", lambda t: func.count(t.day))
+    try:
+        with SessionLocal() as db:
+            shop_id = _seed_shop(db)
+            result = kpi_engine.compute(db, kpi_engine.RangeFilter(shop_id=shop_id))
+    finally:
+        kpi_engine.unregister_metric("active_days")
+
+    assert result.metrics["active_days"] == 3
+    assert result.metrics["total_receipts"] == 21
+
+
+def test_empty_range_returns_zeroes():
+    with SessionLocal() as db:
+        shop_id = _seed_shop(db)
+        result = kpi_engine.compute(
+            db, kpi_engine.RangeFilter(shop_id=shop_id, start=date(2030, 1, 1))
+        )
+
+    assert result.metrics["total_receipts"] == 0
+    assert float(result.metrics["total_revenue"]) == 0
+    assert result.top_skus == []
@@ -0,0 +1,135 @@
+from datetime import datetime
+from uuid import uuid4
+
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+
+from app import ingest
+from app.database import SessionLocal, engine
+from app.importer import ImportedLine
+from app.main import app
+
+client = TestClient(app)
+
+
+def _shop(timezone: str) -> tuple[dict, int]:
+    email = f"series_{uuid4().hex[:8]}@example.com"
+    r = client.post("/auth/register", json={"email": email, "password": "ChangeMe123"})
+    assert r.status_code == 201, r.text
+    headers = {"Authorization": f"Bearer {r.json()['access_token']}"}
+
+    r = client.post(
+        "/shops", headers=headers, json={"name": "Series", "timezone": timezone}
+    )
+    assert r.status_code == 201, r.text
+    assert r.json()["timezone"] == timezone
+    return headers, r.json()["id"]
+
+
+def _receipts_at(shop_id: int, *utc_times: str) -> None:
+    drafts = [
+        ingest.ReceiptDraft(
+            lines=[ImportedLine("COCA-500", 1, 2.0)],
+            created_at=datetime.fromisoformat(ts),
+        )
+        for ts in utc_times
+    ]
+    with SessionLocal() as db:
+        ingest.ingest_receipts(db, shop_id, drafts)
+        db.commit()
+
+
+def _series(headers: dict, shop_id: int, granularity: str, start: str, end: str):
+    r = client.get(
+        f"/shops/{shop_id}/kpis/series",
+        headers=headers,
+        params={"granularity": granularity, "from": start, "to": end},
+    )
+    assert r.status_code == 200, r.text
+    return r.json()
+
+
+def test_daily_series_is_zero_filled_in_shop_timezone() -> None:
+    headers, shop_id = _shop("Europe/Madrid")
+    # 23:30 UTC on the 30th is already the 31st in Madrid (UTC+1)
+    _receipts_at(
+        shop_id, "2024-03-30T23:30:00", "2024-03-31T10:00:00", "2024-04-02T12:00:00"
+    )
+
+    body = _series(headers, shop_id, "day", "2024-03-29", "2024-04-02")
+    assert [p["bucket"] for p in body["points"]] == [
+        "2024-03-29T00:00:00+01:00",
+        "2024-03-30T00:00:00+01:00",
+        "2024-03-31T00:00:00+01:00",
+        "2024-04-01T00:00:00+02:00",
+        "2024-04-02T00:00:00+02:00",
+    ]
+    assert [p["receipts"] for p in body["points"]] == [0, 0, 2, 0, 1]
+    assert [p["revenue"] for p in body["points"]] == [0.0, 0.0, 4.0, 0.0, 2.0]
+
+
+def test_hourly_series_follows_dst_and_runs_one_query() -> None:
+    headers, shop_id = _shop("Europe/Madrid")
+    _receipts_at(shop_id, "2024-03-31T01:15:00")  # 03:15 local, after the jump
+
+    statements: list[str] = []
+
+    def _count(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", _count)
+    try:
+        body = _series(headers, shop_id, "hour", "2024-03-31", "2024-03-31")
+    finally:
+        event.remove(engine, "before_cursor_execute", _count)
+
+    points = body["points"]
+    assert len(points) == 23  # 02:00 does not exist that day
+    assert points[2] == {
+        "bucket": "2024-03-31T03:00:00+02:00",
+        "receipts": 1,
+        "revenue": 2.0,
+    }
+    assert len([s for s in statements if "FROM receipts" in s]) == 1
+
+
+def test_week_month_and_quarter_hour_offsets() -> None:
+    headers, shop_id = _shop("Asia/Kathmandu")  # UTC+05:45
+    # 23:55 local on Jan 31st and 00:05 local on Feb 1st
+    _receipts_at(shop_id, "2024-01-31T18:10:00", "2024-01-31T18:20:00")
+
+    months = _series(headers, shop_id, "month", "2024-01-15", "2024-02-10")
+    assert [(p["bucket"][:10], p["receipts"]) for p in months["points"]] == [
+        ("2024-01-01", 1),
+        ("2024-02-01", 1),
+    ]
+
+    weeks = _series(headers, shop_id, "week", "2024-01-31", "2024-02-05")
+    # Wednesday 31st belongs to the week starting Monday 29th
+    assert [(p["bucket"][:10], p["receipts"]) for p in weeks["points"]] == [
+        ("2024-01-29", 2),
+        ("2024-02-05", 0),
+    ]
+
+
+def test_series_rejects_bad_ranges() -> None:
+    headers, shop_id = _shop("UTC")
+    r = client.get(
+        f"/shops/{shop_id}/kpis/series",
+        headers=headers,
+        params={"from": "2024-02-01", "to": "2024-01-01"},
+    )
+    assert r.status_code == 400
+
+    r = client.get(
+        f"/shops/{shop_id}/kpis/series",
+        headers=headers,
+        params={"granularity": "hour", "from": "2000-01-01", "to": "2024-01-01"},
+    )
+    assert r.status_code == 400
+    assert "Too many buckets" in r.json()["detail"]
+
+    r = client.post(
+        "/shops", headers=headers, json={"name": "x", "timezone": "Mars/Base"}
+    )
+    assert r.status_code == 422
@@ -0,0 +1,165 @@
+import random
+from collections import Counter
+from datetime import datetime, timedelta
+from uuid import uuid4
+
+from fastapi.testclient import TestClient
+from sqlalchemy import distinct, event, func, select
+
+from app import ingest, rollups
+from app.database import SessionLocal, engine
+from app.importer import ImportedLine
+from app.main import app
+from app.models import Receipt, ReceiptLine
+from app.utils.sketches import HyperLogLog, TopK
+
+client = TestClient(app)
+
+
+def _zipf_stream(rnd: random.Random, n: int, items: int) -> list[int]:
+    weights = [1 / (rank + 1) for rank in range(items)]
+    return rnd.choices(range(items), weights=weights, k=n)
+
+
+def test_merged_space_saving_bounds_hold() -> None:
+    rnd = random.Random(7)
+    capacity = 32
+    exact: Counter = Counter()
+    merged = TopK(capacity)
+    for _ in range(30):  # 30 "days"
+        day = TopK(capacity)
+        for item in _zipf_stream(rnd, 500, 400):
+            day.add(item, 1, 2.0)
+            exact[item] += 1
+        merged = merged.merge(day)
+
+    total = sum(exact.values())
+    assert [item for item, *_ in merged.top(5)] == [i for i, _ in exact.most_common(5)]
+    for item, count, error, _ in merged.top(capacity):
+        assert count - error <= exact[item] <= count
+        assert error <= total / capacity
+
+
+def test_hyperloglog_estimates_and_merges() -> None:
+    a, b = HyperLogLog(), HyperLogLog()
+    for i in range(6000):
+        a.add(i)
+    for i in range(3000, 10_000):
+        b.add(i)
+    assert abs(a.count() - 6000) / 6000 < 0.07
+    assert abs(a.merge(b).count() - 10_000) / 10_000 < 0.07
+    assert HyperLogLog(registers=a.to_bytes()).count() == a.count()
+    assert HyperLogLog().count() == 0
+
+
+def _seed_shop(days: int = 10, receipts_per_day: int = 60) -> tuple[dict, int]:
+    email = f"sketch_{uuid4().hex[:8]}@example.com"
+    r = client.post("/auth/register", json={"email": email, "password": "x1"})
+    headers = {"Authorization": f"Bearer {r.json()['access_token']}"}
+    r = client.post("/shops", headers=headers, json={"name": "Sketches"})
+    shop_id = r.json()["id"]
+
+    rnd = random.Random(shop_id)
+    prefix = uuid4().hex[:6]
+    start = datetime(2024, 3, 1, 12)
+    drafts = [
+        ingest.ReceiptDraft(
+            lines=[
+                ImportedLine(f"SK-{prefix}-{item}", 1 + rnd.randint(0, 2), 1.0)
+                for item in set(_zipf_stream(rnd, 3, 150))
+            ],
+            created_at=start + timedelta(days=day),
+        )
+        for day in range(days)
+        for _ in range(receipts_per_day)
+    ]
+    with SessionLocal() as db:
+        # A few batches per day, so day sketches are merged on ingest too
+        for i in range(0, len(drafts), 25):
+            ingest.ingest_receipts(db, shop_id, drafts[i : i + 25])
+            db.commit()
+    return headers, shop_id
+
+
+def _kpis(headers: dict, shop_id: int, **params) -> dict:
+    r = client.get(
+        f"/shops/{shop_id}/kpis",
+        headers=headers,
+        params={"from": "2024-03-01", "to": "2024-03-31", **params},
+    )
+    assert r.status_code == 200, r.text
+    return r.json()
+
+
+def test_approx_kpis_match_the_exact_query_within_bounds() -> None:
+    headers, shop_id = _seed_shop()
+    exact = _kpis(headers, shop_id)
+    approx = _kpis(headers, shop_id, approx="true")
+
+    assert approx["approximate"] is True
+    assert approx["total_receipts"] == exact["total_receipts"] == 600
+    assert approx["total_revenue"] == exact["total_revenue"]
+
+    exact_qty = {row["sku"]: row["qty"] for row in exact["top_skus"]}
+    assert [row["sku"] for row in approx["top_skus"]][:3] == list(exact_qty)[:3]
+    for row in approx["top_skus"]:
+        if row["sku"] in exact_qty:
+            assert row["qty"] - row["qty_error"] <= exact_qty[row["sku"]] <= row["qty"]
+
+    with SessionLocal() as db:
+        distinct_products = db.scalar(
+            select(func.count(distinct(ReceiptLine.product_id)))
+            .join(Receipt, ReceiptLine.receipt_id == Receipt.id)
+            .where(Receipt.shop_id == shop_id)
+        )
+    assert abs(approx["distinct_products"] - distinct_products) <= max(
+        3, 0.07 * distinct_products
+    )
+
+
+def test_rebuild_recreates_the_sketches() -> None:
+    headers, shop_id = _seed_shop(days=3, receipts_per_day=20)
+    before = _kpis(headers, shop_id, approx="true")
+
+    with SessionLocal() as db:
+        rollups.rebuild(db, shop_id)
+        db.commit()
+    after = _kpis(headers, shop_id, approx="true")
+
+    # Rebuilt from exact per-day totals: no error left within a day
+    assert [r["sku"] for r in after["top_skus"]] == [
+        r["sku"] for r in before["top_skus"]
+    ]
+    assert after["distinct_products"] == before["distinct_products"]
+
+
+def test_sketches_are_merged_once_per_shop_day_per_transaction() -> None:
+    headers, shop_id = _seed_shop(days=1, receipts_per_day=1)
+    statements = []
+
+    def _count(conn, cursor, statement, parameters, context, executemany):
+        if "shop_daily_sketches" in statement:
+            statements.append(statement.split()[0])
+
+    drafts = [
+        ingest.ReceiptDraft(
+            lines=[ImportedLine(f"ONCE-{i}", 10 + i, 1.0)],
+            created_at=datetime(2024, 3, 1, 13),
+        )
+        for i in range(4)
+    ]
+    event.listen(engine, "before_cursor_execute", _count)
+    try:
+        with SessionLocal() as db:
+            # One receipt per call, as single POSTs batched by write-behind
+            for draft in drafts:
+                ingest.ingest_receipts(db, shop_id, [draft])
+            assert statements == []
+            db.commit()
+    finally:
+        event.remove(engine, "before_cursor_execute", _count)
+    assert statements == ["SELECT", "UPDATE"]
+
+    approx = _kpis(headers, shop_id, approx="true")
+    assert approx["total_receipts"] == 5
+    assert {f"ONCE-{i}" for i in range(4)} <= {r["sku"] for r in approx["top_skus"]}
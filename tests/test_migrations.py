@@ -0,0 +1,29 @@
+from alembic import command
+from alembic.autogenerate import compare_metadata
+from alembic.migration import MigrationContext
+from sqlalchemy import create_engine, inspect
+
+from app import migrate
+from app.database import Base, engine
+
+
+def test_migrated_schema_matches_models() -> None:
+    with engine.connect() as conn:
+        diff = compare_metadata(MigrationContext.configure(conn), Base.metadata)
+    assert diff == []
+
+
+def test_downgrade_and_upgrade_round_trip(tmp_path) -> None:
+    scratch = create_engine(f"sqlite:///{tmp_path}/migrations.db")
+    migrate.upgrade_to_head(scratch)
+
+    with scratch.begin() as conn:
+        command.downgrade(migrate._config(conn), "0001")
+    indexes = {i["name"] for i in inspect(scratch).get_indexes("receipts")}
+    assert "ix_receipts_shop_id" in indexes
+    assert "ix_receipts_shop_created" not in indexes
+
+    migrate.upgrade_to_head(scratch)
+    indexes = {i["name"] for i in inspect(scratch).get_indexes("receipts")}
+    assert "ix_receipts_shop_created" in indexes
+    scratch.dispose()
@@ -0,0 +1,114 @@
+import asyncio
+import logging
+import threading
+from uuid import uuid4
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.database import SessionLocal
+from app.main import app
+from app.models import User
+from app.utils import hashing, security
+
+client = TestClient(app)
+
+
+def _credentials() -> dict:
+    return {"email": f"hash_{uuid4().hex[:8]}@example.com", "password": "ChangeMe123"}
+
+
+def _stored_hash(email: str) -> str:
+    with SessionLocal() as db:
+        return db.query(User).filter(User.email == email).one().password_hash
+
+
+def test_hashing_does_not_log_the_password(caplog) -> None:
+    with caplog.at_level(logging.DEBUG):
+        password_hash = security.hash_password("s3cret-value")
+    assert "s3cret-value" not in caplog.text
+    assert security.verify_password("s3cret-value", password_hash)
+
+
+def test_login_rehashes_when_rounds_change(monkeypatch) -> None:
+    creds = _credentials()
+    assert client.post("/auth/register", json=creds).status_code == 201
+    old = _stored_hash(creds["email"])
+    assert old.startswith("$2b$04$")
+
+    monkeypatch.setattr(security, "BCRYPT_ROUNDS", 5)
+    assert security.needs_rehash(old)
+    assert client.post("/auth/login", json=creds).status_code == 200
+    new = _stored_hash(creds["email"])
+    assert new.startswith("$2b$05$") and not security.needs_rehash(new)
+
+    # Still valid, and not re-hashed again
+    assert client.post("/auth/login", json=creds).status_code == 200
+    assert _stored_hash(creds["email"]) == new
+    bad = {**creds, "password": "wrong"}
+    assert client.post("/auth/login", json=bad).status_code == 401
+
+
+def test_pool_bounds_queue_and_reports_metrics() -> None:
+    pool = hashing.HashPool("thread", workers=1, max_queue=1)
+    release = threading.Event()
+    try:
+        first = pool.submit(release.wait, 5)
+        second = pool.submit(str, 42)
+        with pytest.raises(hashing.HashPoolBusy):
+            pool.submit(str, 43)
+        stats = pool.stats()
+        assert (stats["in_flight"], stats["queued"], stats["rejected"]) == (2, 1, 1)
+
+        release.set()
+        assert first.result(timeout=5) is True
+        assert second.result(timeout=5) == "42"
+        stats = pool.stats()
+        assert (stats["in_flight"], stats["completed"]) == (0, 2)
+        assert stats["max_wait_ms"] > 0
+    finally:
+        release.set()
+        pool.shutdown()
+
+
+def test_cancelled_callers_drop_their_queued_hash(caplog) -> None:
+    pool = hashing.HashPool("thread", workers=1, max_queue=1)
+    release = threading.Event()
+    ran = []
+
+    async def _cancel_queued() -> None:
+        task = asyncio.ensure_future(pool.run(ran.append, "queued"))
+        await asyncio.sleep(0)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    try:
+        busy = pool.submit(release.wait, 5)
+        with caplog.at_level(logging.ERROR, logger="concurrent.futures"):
+            asyncio.run(_cancel_queued())
+            release.set()
+            assert busy.result(timeout=5) is True
+            pool.submit(str, 1).result(timeout=5)
+        assert "exception calling callback" not in caplog.text
+        assert ran == []
+        stats = pool.stats()
+        assert (stats["in_flight"], stats["cancelled"]) == (0, 1)
+    finally:
+        release.set()
+        pool.shutdown()
+
+
+def test_full_pool_returns_503(monkeypatch) -> None:
+    monkeypatch.setattr(hashing, "pool", hashing.HashPool("inline", 1, 0))
+    monkeypatch.setattr(hashing.pool, "in_flight", 1)
+    r = client.post("/auth/register", json=_credentials())
+    assert r.status_code == 503
+    assert r.headers["Retry-After"] == "1"
+
+
+def test_hashing_metrics_endpoint() -> None:
+    assert client.post("/auth/register", json=_credentials()).status_code == 201
+    body = client.get("/metrics/hashing").json()
+    assert body["pool"] == hashing.HASH_POOL
+    assert body["completed"] >= 1 and body["in_flight"] == 0
@@ -0,0 +1,130 @@
+from datetime import date
+from uuid import uuid4
+
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import Session, sessionmaker
+
+from app import shards
+from app.database import engine
+from app.main import app
+from app.migrate import upgrade_to_head
+from app.models import Product, Shop, ShopDailyKpi, ShopDailySkuKpi, User
+
+client = TestClient(app)
+
+
+def _owner_with_shops(n: int) -> tuple[dict, list[int]]:
+    email = f"portfolio_{uuid4().hex[:8]}@example.com"
+    r = client.post("/auth/register", json={"email": email, "password": "ChangeMe123"})
+    assert r.status_code == 201, r.text
+    headers = {"Authorization": f"Bearer {r.json()['access_token']}"}
+
+    shop_ids = []
+    for i in range(n):
+        r = client.post("/shops", headers=headers, json={"name": f"Shop {i}"})
+        assert r.status_code == 201, r.text
+        shop_ids.append(r.json()["id"])
+    return headers, shop_ids
+
+
+def _receipt(headers: dict, shop_id: int, sku: str, qty: int) -> None:
+    r = client.post(
+        f"/shops/{shop_id}/receipts",
+        headers=headers,
+        json={"lines": [{"sku": sku, "qty": qty, "unit_price": 1.0}]},
+    )
+    assert r.status_code == 201, r.text
+
+
+def test_portfolio_kpis_in_one_statement() -> None:
+    headers, (a, b, c) = _owner_with_shops(3)
+    sku_a, sku_b = f"PF-{uuid4().hex[:6]}", f"PF-{uuid4().hex[:6]}"
+    _receipt(headers, a, sku_a, 2)
+    _receipt(headers, a, sku_b, 1)
+    _receipt(headers, b, sku_b, 5)
+
+    statements: list[str] = []
+
+    def _count(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", _count)
+    try:
+        r = client.get("/kpis", headers=headers)
+    finally:
+        event.remove(engine, "before_cursor_execute", _count)
+    assert r.status_code == 200, r.text
+    body = r.json()
+
+    assert body["shop_ids"] == [a, b, c]
+    assert body["total_receipts"] == 3
+    assert body["total_revenue"] == 8.0
+    assert [(s["shop_id"], s["total_receipts"]) for s in body["shops"]] == [
+        (a, 2),
+        (b, 1),
+        (c, 0),
+    ]
+    assert [(t["sku"], t["qty"]) for t in body["top_skus"]] == [(sku_b, 6), (sku_a, 2)]
+    # Principal cached by the receipt POSTs: only the KPI statement runs
+    assert len(statements) == 1
+
+
+def test_portfolio_checks_ownership_and_input() -> None:
+    headers, (a,) = _owner_with_shops(1)
+    _, (foreign,) = _owner_with_shops(1)
+
+    r = client.get("/kpis", headers=headers, params={"shop_ids": f"{a},{foreign}"})
+    assert r.status_code == 403
+
+    r = client.get("/kpis", headers=headers, params={"shop_ids": "1,abc"})
+    assert r.status_code == 400
+
+    r = client.get("/kpis", headers=headers, params={"shop_ids": str(a)})
+    assert r.status_code == 200
+    assert r.json()["shops"] == [
+        {"shop_id": a, "total_receipts": 0, "total_revenue": 0.0}
+    ]
+
+
+def test_portfolio_fans_out_across_databases(tmp_path) -> None:
+    headers, (local, remote) = _owner_with_shops(2)
+    sku = f"PF-{uuid4().hex[:6]}"
+    _receipt(headers, local, sku, 3)
+
+    # The second shop's data lives on another database
+    other = create_engine(f"sqlite:///{tmp_path}/shard.db")
+    upgrade_to_head(other)
+    with Session(other) as db:
+        db.add(User(id=1, email="o@example.com", password_hash="x"))
+        db.add(Shop(id=remote, name="Remote", owner_id=1))
+        db.add(Product(id=1, sku=sku, name=sku, price=1.0))
+        db.flush()
+        db.add(
+            ShopDailyKpi(shop_id=remote, day=date(2024, 1, 1), receipts=4, revenue=10)
+        )
+        db.add(
+            ShopDailySkuKpi(
+                shop_id=remote, day=date(2024, 1, 1), product_id=1, qty=7, revenue=10
+            )
+        )
+        db.commit()
+
+    shards.register_shard("other", sessionmaker(other))
+    shards.set_resolver(lambda shop_id: "other" if shop_id == remote else "primary")
+    try:
+        r = client.get("/kpis", headers=headers)
+    finally:
+        shards.set_resolver(None)
+        shards.unregister_shard("other")
+        other.dispose()
+    assert r.status_code == 200, r.text
+    body = r.json()
+
+    assert [(s["shop_id"], s["total_receipts"]) for s in body["shops"]] == [
+        (local, 1),
+        (remote, 4),
+    ]
+    assert body["total_receipts"] == 5
+    assert body["total_revenue"] == 13.0
+    assert body["top_skus"][0] == {"sku": sku, "name": sku, "qty": 10, "revenue": 13.0}
@@ -0,0 +1,117 @@
+from uuid import uuid4
+
+from fastapi.testclient import TestClient
+from sqlalchemy import event, insert
+
+from app import principals
+from app.database import SessionLocal, engine
+from app.main import app
+from app.models import Shop, User
+from app.utils.cache import TTLCache
+
+client = TestClient(app)
+
+
+def _register() -> tuple[str, dict]:
+    email = f"principal_{uuid4().hex[:8]}@example.com"
+    r = client.post("/auth/register", json={"email": email, "password": "ChangeMe123"})
+    assert r.status_code == 201, r.text
+    return email, {"Authorization": f"Bearer {r.json()['access_token']}"}
+
+
+def _create_shop(headers: dict) -> int:
+    r = client.post("/shops", headers=headers, json={"name": uuid4().hex[:12]})
+    assert r.status_code == 201, r.text
+    return r.json()["id"]
+
+
+def _post_receipt(headers: dict, shop_id: int) -> list[str]:
+    statements: list[str] = []
+
+    def _count(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", _count)
+    try:
+        r = client.post(
+            f"/shops/{shop_id}/receipts",
+            headers=headers,
+            json={"lines": [{"sku": "COCA-500", "qty": 1, "unit_price": 1.2}]},
+        )
+    finally:
+        event.remove(engine, "before_cursor_execute", _count)
+    assert r.status_code == 201, r.text
+    return statements
+
+
+def _auth_queries(statements: list[str]) -> list[str]:
+    return [s for s in statements if "FROM users" in s or "FROM shops" in s]
+
+
+def test_steady_state_receipt_needs_no_auth_queries() -> None:
+    _, headers = _register()
+    shop_id = _create_shop(headers)
+
+    # Creating the shop invalidated the principal: one load, then cached
+    assert len(_auth_queries(_post_receipt(headers, shop_id))) == 1
+    assert _auth_queries(_post_receipt(headers, shop_id)) == []
+
+    stats = client.get("/metrics/caches").json()["principals"]
+    assert stats["hits"] >= 1 and stats["misses"] >= 1
+
+
+def test_new_shop_and_deactivation_invalidate_principal() -> None:
+    email, headers = _register()
+    first = _create_shop(headers)
+    _post_receipt(headers, first)
+
+    second = _create_shop(headers)
+    assert principals.cache.get(email) is None
+    _post_receipt(headers, second)
+    assert principals.cache.get(email).shop_ids == {first, second}
+
+    with SessionLocal() as db:
+        user = db.query(User).filter(User.email == email).one()
+        user.is_active = False
+        db.commit()
+
+    r = client.get(f"/shops/{first}/kpis", headers=headers)
+    assert r.status_code == 401
+
+
+def test_ownership_falls_back_to_db_for_unknown_shops() -> None:
+    _, headers = _register()
+    _, other_headers = _register()
+    own = _create_shop(headers)
+    other = _create_shop(other_headers)
+    _post_receipt(headers, own)
+
+    assert client.get(f"/shops/{other}/kpis", headers=headers).status_code == 403
+    assert client.get("/shops/999999/kpis", headers=headers).status_code == 404
+
+    # A shop written behind the ORM hooks' back (bulk insert, another worker)
+    with SessionLocal() as db:
+        owner_id = db.get(Shop, own).owner_id
+        late = db.execute(
+            insert(Shop).values(name=uuid4().hex[:12], owner_id=owner_id)
+        ).inserted_primary_key[0]
+        db.commit()
+
+    assert client.get(f"/shops/{late}/kpis", headers=headers).status_code == 200
+
+
+def test_ttl_cache_expiry_and_lru_eviction() -> None:
+    now = [0.0]
+    cache: TTLCache[str] = TTLCache("test", maxsize=2, ttl=10, clock=lambda: now[0])
+
+    cache.set("a", "A")
+    cache.set("b", "B")
+    assert cache.get("a") == "A"  # "b" is now the least recently used
+    cache.set("c", "C")
+    assert cache.get("b") is None
+    assert cache.evictions == 1
+
+    now[0] = 11
+    assert cache.get("a") is None
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 2
@@ -0,0 +1,108 @@
+from contextlib import contextmanager
+from uuid import uuid4
+
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+
+from app import catalog
+from app.database import SessionLocal, engine
+from app.main import app
+from app.models import Product
+
+client = TestClient(app)
+
+
+def _headers() -> dict:
+    email = f"catalog_{uuid4().hex[:8]}@example.com"
+    r = client.post("/auth/register", json={"email": email, "password": "x1"})
+    return {"Authorization": f"Bearer {r.json()['access_token']}"}
+
+
+@contextmanager
+def _product_queries():
+    statements: list[str] = []
+
+    def _count(conn, cursor, statement, parameters, context, executemany):
+        if "FROM products" in statement:
+            statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", _count)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, "before_cursor_execute", _count)
+
+
+def _sku() -> str:
+    return f"CAT-{uuid4().hex[:8]}"
+
+
+def test_created_products_are_served_from_the_cache() -> None:
+    headers = _headers()
+    skus = [_sku(), _sku()]
+    for sku in skus:
+        r = client.post(
+            "/products", headers=headers, json={"sku": sku, "name": sku, "price": 2}
+        )
+        assert r.status_code == 201, r.text
+
+    with _product_queries() as queries:
+        r = client.get(
+            "/products",
+            headers=headers,
+            params={"skus": f"{skus[1]},UNKNOWN-{uuid4().hex[:6]},{skus[0]}"},
+        )
+    assert r.status_code == 200, r.text
+    assert [p["sku"] for p in r.json()] == [skus[1], skus[0]]
+    # Only the unknown SKU reached the database
+    assert len(queries) == 1
+
+    # Creating an existing SKU returns it without a lookup
+    with _product_queries() as queries:
+        r = client.post(
+            "/products", headers=headers, json={"sku": skus[0], "name": "x", "price": 9}
+        )
+    assert r.json()["price"] == 2.0
+    assert queries == []
+
+
+def test_ingest_resolves_cached_skus_without_queries() -> None:
+    headers = _headers()
+    r = client.post("/shops", headers=headers, json={"name": "Catalog"})
+    shop_id = r.json()["id"]
+    sku = _sku()
+
+    def _post():
+        r = client.post(
+            f"/shops/{shop_id}/receipts",
+            headers=headers,
+            json={"lines": [{"sku": sku, "qty": 1, "unit_price": 1.25}]},
+        )
+        assert r.status_code == 201, r.text
+
+    # Created on-the-fly: cached once the receipt commits
+    _post()
+    assert catalog.cache.get(sku).price == 1.25
+    with _product_queries() as queries:
+        _post()
+    assert queries == []
+
+
+def test_rolled_back_products_are_not_cached() -> None:
+    sku = _sku()
+    with SessionLocal() as db:
+        db.add(Product(sku=sku, name=sku, price=1))
+        db.flush()
+        db.rollback()
+    assert catalog.cache.get(sku) is None
+
+
+def test_warm_loads_the_newest_products() -> None:
+    sku = _sku()
+    with SessionLocal() as db:
+        db.add(Product(sku=sku, name=sku, price=1))
+        db.commit()
+    catalog.cache.clear()
+
+    assert catalog.warm(SessionLocal, limit=1) == 1
+    assert catalog.cache.get(sku).name == sku
@@ -0,0 +1,113 @@
+import sqlite3
+from uuid import uuid4
+
+from fastapi.testclient import TestClient
+
+from app import kpi_cache, replicas
+from app.database import engine
+from app.main import app
+from app.utils.cache import TTLCache
+
+client = TestClient(app)
+
+
+def _replicate(replica) -> None:
+    """Copy the primary into a replica file: replication catching up."""
+    replica.dispose()
+    source = sqlite3.connect(engine.url.database)
+    target = sqlite3.connect(replica.url.database)
+    with source, target:
+        source.backup(target)
+    source.close()
+    target.close()
+
+
+def _shop() -> tuple[dict, int]:
+    email = f"replica_{uuid4().hex[:8]}@example.com"
+    r = client.post("/auth/register", json={"email": email, "password": "x1"})
+    headers = {"Authorization": f"Bearer {r.json()['access_token']}"}
+    r = client.post("/shops", headers=headers, json={"name": "Replicas"})
+    return headers, r.json()["id"]
+
+
+def _add_receipt(headers: dict, shop_id: int) -> None:
+    r = client.post(
+        f"/shops/{shop_id}/receipts",
+        headers=headers,
+        json={"lines": [{"sku": "COCA-500", "qty": 1, "unit_price": 1.5}]},
+    )
+    assert r.status_code == 201, r.text
+
+
+def _listed(headers: dict, shop_id: int) -> int:
+    r = client.get(f"/shops/{shop_id}/receipts", headers=headers)
+    assert r.status_code == 200, r.text
+    return len(r.json()["receipts"])
+
+
+def test_reads_stick_to_the_primary_after_a_write(read_replicas) -> None:
+    headers, shop_id = _shop()
+    _add_receipt(headers, shop_id)
+
+    # Within the window: the primary, which has the new receipt
+    assert _listed(headers, shop_id) == 1
+
+    # Window over, replicas not caught up yet: stale but served by them
+    replicas.recent_writes.pop(shop_id)
+    assert _listed(headers, shop_id) == 0
+
+    for replica in read_replicas:
+        _replicate(replica)
+    assert _listed(headers, shop_id) == 1
+
+
+def test_replicas_are_used_round_robin(read_replicas) -> None:
+    headers, shop_id = _shop()
+    _add_receipt(headers, shop_id)
+    _replicate(read_replicas[0])
+    replicas.recent_writes.pop(shop_id)
+
+    assert sorted(_listed(headers, shop_id) for _ in range(2)) == [0, 1]
+
+
+def test_stickiness_is_per_shop(read_replicas) -> None:
+    headers, shop_id = _shop()
+    r = client.post("/shops", headers=headers, json={"name": "Other"})
+    other_id = r.json()["id"]
+    _add_receipt(headers, shop_id)
+
+    assert replicas.is_sticky([shop_id])
+    assert not replicas.is_sticky([other_id])
+    # Portfolio reads cover every owned shop, so one write pins them all
+    assert replicas.is_sticky([other_id, shop_id])
+
+
+def _kpis(headers: dict, shop_id: int) -> int:
+    r = client.get(f"/shops/{shop_id}/kpis", headers=headers)
+    assert r.status_code == 200, r.text
+    return r.json()["total_receipts"]
+
+
+def test_replica_reads_after_another_process_writes_are_not_cached(
+    read_replicas, monkeypatch
+) -> None:
+    headers, shop_id = _shop()
+    writer = replicas.recent_writes
+    # A second worker sharing the KPI cache, with its own stickiness
+    other = TTLCache("recent_writes_other", 100, replicas.READ_STICKY_SECONDS)
+    _add_receipt(headers, shop_id)
+
+    # The other worker reads the lagging replica under the new generation...
+    monkeypatch.setattr(replicas, "recent_writes", other)
+    assert _kpis(headers, shop_id) == 0
+    # ...without storing it: the writer still sees its receipt
+    monkeypatch.setattr(replicas, "recent_writes", writer)
+    assert _kpis(headers, shop_id) == 1
+
+    # Past the window, replica bodies are cached again
+    monkeypatch.setattr(replicas, "READ_STICKY_SECONDS", 0)
+    writer.pop(shop_id)
+    for replica in read_replicas:
+        _replicate(replica)
+    assert _kpis(headers, shop_id) == 1
+    assert kpi_cache.lookup(kpi_cache.cache_key(shop_id, None, None)) is not None
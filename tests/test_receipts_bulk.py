@@ -0,0 +1,104 @@
+from uuid import uuid4
+
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+
+from app.database import engine
+from app.main import app
+
+client = TestClient(app)
+
+
+def _register_and_shop() -> tuple[dict, int]:
+    email = f"bulk_{uuid4().hex[:8]}@example.com"
+    r = client.post("/auth/register", json={"email": email, "password": "ChangeMe123"})
+    assert r.status_code == 201, r.text
+    headers = {"Authorization": f"Bearer {r.json()['access_token']}"}
+
+    r = client.post("/shops", headers=headers, json={"name": "Bulk Shop"})
+    assert r.status_code == 201, r.text
+    return headers, r.json()["id"]
+
+
+def test_bulk_receipts_report_per_receipt_results() -> None:
+    headers, shop_id = _register_and_shop()
+    key = f"bulk-{uuid4().hex}"
+    sku = f"BULK-{uuid4().hex[:6]}"
+    body = {
+        "receipts": [
+            {
+                "idempotency_key": key,
+                "lines": [{"sku": sku, "qty": 2, "unit_price": 1.5}],
+            },
+            {"lines": [{"sku": sku, "qty": 0, "unit_price": 1.5}]},
+            {
+                "idempotency_key": key,
+                "lines": [{"sku": sku, "qty": 2, "unit_price": 1.5}],
+            },
+            {"lines": [{"sku": "COCA-500", "qty": 1, "unit_price": 1.2}]},
+        ]
+    }
+
+    r = client.post(f"/shops/{shop_id}/receipts:bulk", headers=headers, json=body)
+    assert r.status_code == 200, r.text
+    results = r.json()["results"]
+
+    assert [res["status"] for res in results] == [
+        "created",
+        "rejected",
+        "replayed",
+        "created",
+    ]
+    assert results[0]["receipt"] == {"id": results[0]["receipt"]["id"], "total": 3.0}
+    assert results[1]["detail"] == "Invalid qty or unit_price"
+    assert results[2]["receipt"] == results[0]["receipt"]
+
+    # Replaying the whole batch does not create anything new for the keyed one
+    r = client.post(
+        f"/shops/{shop_id}/receipts:bulk",
+        headers=headers,
+        json={"receipts": body["receipts"][:1]},
+    )
+    assert r.json()["results"][0]["status"] == "replayed"
+    assert r.json()["results"][0]["receipt"] == results[0]["receipt"]
+
+    rk = client.get(f"/shops/{shop_id}/kpis", headers=headers)
+    assert rk.json()["total_receipts"] == 2
+
+
+def test_bulk_statements_grow_by_one_insert_per_receipt() -> None:
+    headers, shop_id = _register_and_shop()
+    statements: list[str] = []
+
+    def _count(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    def _post(n: int) -> int:
+        receipts = [
+            {
+                "idempotency_key": uuid4().hex,
+                "lines": [
+                    {"sku": f"N-{uuid4().hex[:8]}", "qty": 1, "unit_price": 1.0},
+                    {"sku": "COCA-500", "qty": 1, "unit_price": 1.2},
+                ],
+            }
+            for _ in range(n)
+        ]
+        statements.clear()
+        event.listen(engine, "before_cursor_execute", _count)
+        try:
+            r = client.post(
+                f"/shops/{shop_id}/receipts:bulk",
+                headers=headers,
+                json={"receipts": receipts},
+            )
+        finally:
+            event.remove(engine, "before_cursor_execute", _count)
+        assert r.status_code == 200, r.text
+        return len(statements)
+
+    _post(1)  # warm the principal cache
+
+    # Product lookups, lines, keys and rollups are batched; only the receipt
+    # INSERT (which must hand back its id) is issued once per receipt.
+    assert _post(50) - _post(5) == 45
@@ -0,0 +1,141 @@
+import itertools
+import json
+from uuid import uuid4
+
+from fastapi.testclient import TestClient
+
+from app import importer
+from app.database import SessionLocal
+from app.main import app
+
+client = TestClient(app)
+
+
+def _register_and_shop() -> tuple[dict, int]:
+    email = f"import_{uuid4().hex[:8]}@example.com"
+    r = client.post("/auth/register", json={"email": email, "password": "ChangeMe123"})
+    assert r.status_code == 201, r.text
+    headers = {"Authorization": f"Bearer {r.json()['access_token']}"}
+
+    r = client.post("/shops", headers=headers, json={"name": "Import Shop"})
+    assert r.status_code == 201, r.text
+    return headers, r.json()["id"]
+
+
+def test_ndjson_import_is_chunked_and_resumable() -> None:
+    headers, shop_id = _register_and_shop()
+    run = uuid4().hex[:6]
+    records = [
+        {
+            "idempotency_key": f"imp-{run}-{i}",
+            "created_at": f"2021-05-0{i + 1}T12:00:00",
+            "lines": [{"sku": f"IMP-{run}", "qty": i + 1, "unit_price": 2.0}],
+        }
+        for i in range(4)
+    ]
+    records.insert(2, {"lines": [{"sku": "X", "qty": 0, "unit_price": 1.0}]})
+    body = "\n".join(json.dumps(r) for r in records) + "\n{not json}\n"
+
+    r = client.post(
+        f"/shops/{shop_id}/receipts:import",
+        headers={**headers, "Content-Type": "application/x-ndjson"},
+        params={"format": "ndjson", "chunk_size": 2},
+        content=body,
+    )
+    assert r.status_code == 200, r.text
+    report = r.json()
+    assert report["processed"] == 6
+    assert report["created"] == 4
+    assert report["rejected"] == 2
+    assert report["next_offset"] == 6
+    assert [e["record"] for e in report["errors"]] == [2, 5]
+    assert report["errors"][0]["detail"] == "Invalid qty or unit_price"
+
+    rk = client.get(
+        f"/shops/{shop_id}/kpis",
+        headers=headers,
+        params={"from": "2021-05-01", "to": "2021-05-31"},
+    )
+    assert rk.json()["total_receipts"] == 4
+    assert rk.json()["total_revenue"] == 20.0
+
+    # Resuming from an offset skips the earlier records; keyed ones replay
+    r = client.post(
+        f"/shops/{shop_id}/receipts:import",
+        headers=headers,
+        params={"offset": 3},
+        content=body,
+    )
+    report = r.json()
+    assert report["processed"] == 3
+    assert report["replayed"] == 2
+    assert report["created"] == 0
+
+
+def test_csv_import_groups_rows_by_receipt_ref() -> None:
+    _, shop_id = _register_and_shop()
+    rows = ["receipt_ref,sku,qty,unit_price,created_at"]
+    for ref in range(5):
+        rows.append(f"r{ref},CSV-A,1,1.5,2022-01-0{ref + 1}T08:00:00")
+        rows.append(f"r{ref},CSV-B,2,0.5,2022-01-0{ref + 1}T08:00:00")
+
+    commits = []
+    report = importer.import_receipts(
+        SessionLocal,
+        shop_id,
+        iter(rows),
+        fmt="csv",
+        chunk_size=2,
+        progress=lambda rep: commits.append(rep.next_offset),
+    )
+
+    assert report.created == 5
+    assert report.rejected == 0
+    assert commits == [2, 4, 5]
+
+
+def test_rows_are_validated_like_the_api() -> None:
+    _, shop_id = _register_and_shop()
+    records = [
+        {"lines": [{"sku": "VAL-A", "qty": 2.7, "unit_price": 1.0}]},
+        {"lines": []},
+        {"lines": [{"sku": "VAL-A", "qty": 2.0, "unit_price": "1.5"}]},
+        {"lines": [{"sku": "VAL-A", "qty": -1, "unit_price": 1.0}]},
+    ]
+    lines = [json.dumps(r) for r in records]
+    lines.insert(1, "")
+    report = importer.import_receipts(SessionLocal, shop_id, iter(lines))
+    assert report.created == 1
+    assert [(e["record"], e["row"]) for e in report.errors] == [
+        (0, 1),
+        (1, 3),
+        (3, 5),
+    ]
+    assert "qty" in report.errors[0]["detail"]
+    assert "fractional" in report.errors[0]["detail"]
+    assert report.errors[1]["detail"] == "Invalid record: receipt has no lines"
+
+    rows = [
+        "receipt_ref,sku,qty,unit_price",
+        "r1,VAL-A,1,1.5",
+        "r1,VAL-B,2.7,0.5",
+        "r2,VAL-A,1,1.5",
+    ]
+    report = importer.import_receipts(SessionLocal, shop_id, iter(rows), fmt="csv")
+    assert report.created == 1
+    assert [(e["record"], e["row"]) for e in report.errors] == [(0, 3)]
+    assert report.errors[0]["detail"].startswith("Invalid record: qty:")
+
+
+def test_parsing_is_lazy() -> None:
+    line = json.dumps({"lines": [{"sku": "LAZY", "qty": 1, "unit_price": 1.0}]})
+    endless = itertools.repeat(line)
+
+    first = list(itertools.islice(importer.iter_records(endless, "ndjson"), 3))
+    assert [r.number for r in first] == [0, 1, 2]
+
+
+def test_iter_lines_handles_split_utf8_chunks() -> None:
+    data = "a\nñ\nlast".encode()
+    chunks = [data[i : i + 1] for i in range(len(data))]
+    assert list(importer.iter_lines(chunks)) == ["a", "ñ", "last"]
@@ -0,0 +1,125 @@
+import csv
+import io
+import json
+from uuid import uuid4
+
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+
+from app.database import engine
+from app.main import app
+
+client = TestClient(app)
+
+
+def _shop_with_receipts(n: int) -> tuple[dict, int]:
+    email = f"listing_{uuid4().hex[:8]}@example.com"
+    r = client.post("/auth/register", json={"email": email, "password": "x1"})
+    assert r.status_code == 201, r.text
+    headers = {"Authorization": f"Bearer {r.json()['access_token']}"}
+    r = client.post("/shops", headers=headers, json={"name": "Listing"})
+    assert r.status_code == 201, r.text
+    shop_id = r.json()["id"]
+
+    receipts = [
+        {
+            "lines": [
+                {"sku": "COCA-500", "qty": i + 1, "unit_price": 1.5},
+                {"sku": "PAN-BARRA", "qty": 1, "unit_price": 0.5},
+            ]
+        }
+        for i in range(n)
+    ]
+    r = client.post(
+        f"/shops/{shop_id}/receipts:bulk", headers=headers, json={"receipts": receipts}
+    )
+    assert r.status_code == 200, r.text
+    return headers, shop_id
+
+
+def _statements(fn) -> list[str]:
+    statements: list[str] = []
+
+    def _count(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", _count)
+    try:
+        fn()
+    finally:
+        event.remove(engine, "before_cursor_execute", _count)
+    return statements
+
+
+def test_keyset_pages_cover_every_receipt_once() -> None:
+    headers, shop_id = _shop_with_receipts(7)
+    seen, pages, cursor = [], [], None
+    while True:
+        params = {"limit": 3, **({"cursor": cursor} if cursor else {})}
+        responses = []
+        statements = _statements(
+            lambda: responses.append(
+                client.get(f"/shops/{shop_id}/receipts", headers=headers, params=params)
+            )
+        )
+        r = responses[0]
+        assert r.status_code == 200, r.text
+        # Lines of the whole page come from one batched query
+        assert sum("FROM receipt_lines" in s for s in statements) == 1
+
+        body = r.json()
+        pages.append(len(body["receipts"]))
+        seen += body["receipts"]
+        cursor = body["next_cursor"]
+        if cursor is None:
+            break
+
+    assert pages == [3, 3, 1]
+    assert len({r["id"] for r in seen}) == 7
+    keys = [(r["created_at"], r["id"]) for r in seen]
+    assert keys == sorted(keys)
+    first = seen[0]
+    assert first["lines"] == [
+        {"sku": "COCA-500", "qty": 1, "unit_price": 1.5},
+        {"sku": "PAN-BARRA", "qty": 1, "unit_price": 0.5},
+    ]
+    assert first["total"] == 2.0
+
+
+def test_exports_stream_the_whole_range() -> None:
+    headers, shop_id = _shop_with_receipts(5)
+    url = f"/shops/{shop_id}/receipts"
+
+    r = client.get(url, headers=headers, params={"format": "ndjson"})
+    assert r.status_code == 200, r.text
+    assert r.headers["content-type"].startswith("application/x-ndjson")
+    receipts = [json.loads(line) for line in r.text.splitlines()]
+    assert len(receipts) == 5
+    assert [len(receipt["lines"]) for receipt in receipts] == [2] * 5
+
+    r = client.get(url, headers=headers, params={"format": "csv"})
+    assert r.status_code == 200, r.text
+    rows = list(csv.DictReader(io.StringIO(r.text)))
+    assert len(rows) == 10
+    assert {row["receipt_ref"] for row in rows} == {str(x["id"]) for x in receipts}
+    assert rows[0]["sku"] == "COCA-500"
+
+    # An empty range still has a header
+    r = client.get(
+        url,
+        headers=headers,
+        params={"format": "csv", "from": "2000-01-01", "to": "2000-01-02"},
+    )
+    assert r.text.splitlines() == ["receipt_ref,created_at,total,sku,qty,unit_price"]
+
+
+def test_invalid_cursor_and_foreign_shop_are_rejected() -> None:
+    headers, shop_id = _shop_with_receipts(1)
+    r = client.get(
+        f"/shops/{shop_id}/receipts", headers=headers, params={"cursor": "nope"}
+    )
+    assert r.status_code == 400
+
+    other_headers, _ = _shop_with_receipts(1)
+    r = client.get(f"/shops/{shop_id}/receipts", headers=other_headers)
+    assert r.status_code == 403
@@ -0,0 +1,123 @@
+from uuid import uuid4
+
+from fastapi.testclient import TestClient
+from jose import jwt
+from sqlalchemy import event
+
+from app import tokens
+from app.database import SessionLocal, engine
+from app.main import app
+from app.models import RevokedToken
+from app.utils.bloom import BloomFilter
+from app.utils.security import ALGORITHM, SECRET_KEY
+
+client = TestClient(app)
+
+
+def _register() -> tuple[dict, dict]:
+    creds = {"email": f"tokens_{uuid4().hex[:8]}@example.com", "password": "x1"}
+    r = client.post("/auth/register", json=creds)
+    assert r.status_code == 201, r.text
+    return creds, r.json()
+
+
+def _auth(access_token: str) -> dict:
+    return {"Authorization": f"Bearer {access_token}"}
+
+
+def _portfolio_status(access_token: str) -> int:
+    return client.get("/kpis", headers=_auth(access_token)).status_code
+
+
+def _refresh(refresh_token: str):
+    return client.post("/auth/refresh", json={"refresh_token": refresh_token})
+
+
+def test_access_token_authenticates_without_queries() -> None:
+    _, issued = _register()
+    claims = jwt.decode(issued["access_token"], SECRET_KEY, algorithms=[ALGORITHM])
+    assert (claims["typ"], claims["act"], claims["ver"]) == ("access", True, 0)
+    assert isinstance(claims["uid"], int) and claims["jti"]
+
+    # Warm the principal cache
+    assert _portfolio_status(issued["access_token"]) == 200
+    statements: list[str] = []
+
+    def _count(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", _count)
+    try:
+        r = client.post(
+            "/shops", headers=_auth(issued["access_token"]), json={"name": "Fast"}
+        )
+    finally:
+        event.remove(engine, "before_cursor_execute", _count)
+    assert r.status_code == 201, r.text
+    assert not any("users" in s or "revoked_tokens" in s for s in statements)
+
+    # A refresh token is not an access token
+    assert _portfolio_status(issued["refresh_token"]) == 401
+
+
+def test_refresh_rotates_and_detects_reuse() -> None:
+    _, issued = _register()
+    r = _refresh(issued["refresh_token"])
+    assert r.status_code == 200, r.text
+    rotated = r.json()
+    assert rotated["refresh_token"] != issued["refresh_token"]
+    assert _portfolio_status(rotated["access_token"]) == 200
+
+    # Replaying the used token revokes the whole family, including the new one
+    assert _refresh(issued["refresh_token"]).status_code == 401
+    assert _refresh(rotated["refresh_token"]).status_code == 401
+    assert _refresh("not-a-token").status_code == 401
+
+
+def test_logout_revokes_the_access_and_refresh_token() -> None:
+    creds, issued = _register()
+    other = client.post("/auth/login", json=creds).json()
+
+    r = client.post(
+        "/auth/logout",
+        headers=_auth(issued["access_token"]),
+        json={"refresh_token": issued["refresh_token"]},
+    )
+    assert r.status_code == 204, r.text
+    assert _portfolio_status(issued["access_token"]) == 401
+    assert _refresh(issued["refresh_token"]).status_code == 401
+
+    # The other session is unaffected
+    assert _portfolio_status(other["access_token"]) == 200
+    assert _refresh(other["refresh_token"]).status_code == 200
+
+    # The revocation list survives a resync (e.g. another process)
+    tokens.revocations.reset()
+    assert _portfolio_status(issued["access_token"]) == 401
+    with SessionLocal() as db:
+        assert db.query(RevokedToken).count() >= 1
+
+
+def test_logout_all_bumps_the_token_version() -> None:
+    creds, issued = _register()
+    r = client.post("/auth/logout-all", headers=_auth(issued["access_token"]))
+    assert r.status_code == 204, r.text
+
+    assert _portfolio_status(issued["access_token"]) == 401
+    assert _refresh(issued["refresh_token"]).status_code == 401
+
+    fresh = client.post("/auth/login", json=creds).json()
+    claims = jwt.decode(fresh["access_token"], SECRET_KEY, algorithms=[ALGORITHM])
+    assert claims["ver"] == 1
+    assert _portfolio_status(fresh["access_token"]) == 200
+
+
+def test_bloom_filter_has_no_false_negatives() -> None:
+    bloom = BloomFilter(capacity=1000, error_rate=0.01)
+    keys = [uuid4().hex for _ in range(1000)]
+    for key in keys:
+        bloom.add(key)
+    assert all(key in bloom for key in keys)
+    false_positives = sum(uuid4().hex in bloom for _ in range(10_000))
+    assert false_positives < 300
+    assert not bloom.saturated
@@ -0,0 +1,127 @@
+import logging
+from collections import Counter
+from uuid import uuid4
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+
+from app import instrumentation
+from app.database import engine
+from app.main import app
+
+client = TestClient(app)
+
+
+def _owner_with_shop() -> tuple[dict, int]:
+    email = f"metrics_{uuid4().hex[:8]}@example.com"
+    r = client.post("/auth/register", json={"email": email, "password": "x1"})
+    assert r.status_code == 201, r.text
+    headers = {"Authorization": f"Bearer {r.json()['access_token']}"}
+    r = client.post("/shops", headers=headers, json={"name": "Metrics"})
+    assert r.status_code == 201, r.text
+    return headers, r.json()["id"]
+
+
+def test_requests_are_recorded_per_route_template() -> None:
+    headers, shop_id = _owner_with_shop()
+    instrumentation.reset()
+
+    r = client.post(
+        f"/shops/{shop_id}/receipts",
+        headers={**headers, "Idempotency-Key": uuid4().hex},
+        json={"lines": [{"sku": f"M-{uuid4().hex[:6]}", "qty": 1, "unit_price": 2}]},
+    )
+    assert r.status_code == 201, r.text
+    timing = r.headers["server-timing"]
+    assert timing.startswith("total;dur=") and "db;dur=" in timing
+    assert "products;dur=" in timing
+
+    r = client.get(f"/shops/{shop_id}/kpis", headers=headers)
+    assert r.status_code == 200, r.text
+    assert "aggregate;dur=" in r.headers["server-timing"]
+
+    routes = instrumentation.route_metrics()
+    post = routes[("POST", "/shops/{shop_id}/receipts")]
+    assert post["requests"] == 1
+    assert post["statements"] >= 3 and post["db_seconds"] > 0
+    assert post["rows_written"] >= 2  # at least the receipt and its line
+    assert "products" in post["spans"]
+    kpis = routes[("GET", "/shops/{shop_id}/kpis")]
+    assert kpis["requests"] == 1
+    assert kpis["rows_written"] == 0
+    assert kpis["rows_returned"] > 0
+
+    r = client.get("/metrics")
+    assert r.status_code == 200
+    assert r.headers["content-type"].startswith("text/plain; version=0.0.4")
+    body = r.text
+    assert (
+        'http_requests_total{method="POST",route="/shops/{shop_id}/receipts",'
+        'status="201"} 1'
+    ) in body
+    assert (
+        'http_request_duration_seconds_count{method="GET",'
+        'route="/shops/{shop_id}/kpis"} 1'
+    ) in body
+    assert "http_request_db_statements_total{" in body
+    assert "http_request_db_rows_returned_total{" in body
+
+
+def test_in_lists_share_a_statement_shape() -> None:
+    shape = instrumentation.statement_shape
+    assert shape("SELECT a FROM t WHERE id IN (?, ?, ?)") == shape(
+        "SELECT a FROM t WHERE id IN (?)"
+    )
+    assert shape("SELECT a FROM t WHERE id = ?") != shape("SELECT b FROM t")
+
+
+def test_n_plus_one_warning_is_opt_in(monkeypatch, caplog) -> None:
+    stats = instrumentation.RequestStats(
+        statements=12,
+        shapes=Counter({"SELECT * FROM products WHERE id = ?": 11, "SELECT 1": 1}),
+    )
+    caplog.set_level(logging.WARNING, logger="sync_kpis.instrumentation")
+
+    instrumentation._record("GET", "/n1", 200, 0.01, stats)
+    assert not caplog.records
+
+    monkeypatch.setattr(instrumentation, "N_PLUS_ONE_THRESHOLD", 10)
+    instrumentation._record("GET", "/n1", 200, 0.01, stats)
+    [record] = caplog.records
+    assert "11 similar statements" in record.getMessage()
+    assert "products" in record.getMessage()
+    assert instrumentation.route_metrics()[("GET", "/n1")]["n_plus_one"] == 1
+
+
+def test_failed_statements_are_timed_and_not_leaked() -> None:
+    stats = instrumentation.RequestStats()
+    token = instrumentation._current.set(stats)
+    try:
+        with engine.connect() as conn:
+            with pytest.raises(OperationalError):
+                conn.execute(text("SELECT * FROM no_such_table"))
+            assert conn.info["query_started"] == []
+    finally:
+        instrumentation._current.reset(token)
+    assert stats.statements == 1 and stats.db_seconds > 0
+
+
+def test_rows_are_counted_as_they_are_fetched() -> None:
+    stats = instrumentation.RequestStats()
+    token = instrumentation._current.set(stats)
+    try:
+        with engine.connect() as conn:
+            rows = "SELECT 1 UNION ALL SELECT 2 UNION ALL SELECT 3"
+            assert len(conn.execute(text(rows)).all()) == 3
+            result = conn.execute(text(rows))
+            result.fetchone()
+            result.close()
+            assert list(conn.execute(text(rows)).scalars().partitions(2)) == [
+                [1, 2],
+                [3],
+            ]
+    finally:
+        instrumentation._current.reset(token)
+    assert (stats.statements, stats.rows_returned, stats.rows_written) == (3, 7, 0)
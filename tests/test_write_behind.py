@@ -0,0 +1,299 @@
+from datetime import timedelta
+from uuid import uuid4
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import func, select
+from sqlalchemy.exc import IntegrityError, OperationalError
+
+from app import ingest, write_behind
+from app.database import SessionLocal
+from app.importer import ImportedLine
+from app.main import app
+from app.models import QueuedReceipt, Receipt
+
+client = TestClient(app)
+
+ASYNC = {"Prefer": "respond-async"}
+
+
+@pytest.fixture()
+def queue(tmp_path, monkeypatch):
+    """The app's write-behind queue on a temporary file, drained by hand."""
+    q = write_behind.WriteBehindQueue(tmp_path / "queue.wal", SessionLocal, fsync=False)
+    q.open()
+    monkeypatch.setattr(write_behind, "queue", q)
+    yield q
+    q.close()
+
+
+def _shop() -> tuple[dict, int]:
+    email = f"queue_{uuid4().hex[:8]}@example.com"
+    r = client.post("/auth/register", json={"email": email, "password": "x1"})
+    headers = {"Authorization": f"Bearer {r.json()['access_token']}"}
+    r = client.post("/shops", headers=headers, json={"name": "Queue"})
+    return headers, r.json()["id"]
+
+
+def _post(headers: dict, shop_id: int, qty: int = 2, **extra):
+    return client.post(
+        f"/shops/{shop_id}/receipts",
+        headers={**headers, **ASYNC, **extra},
+        json={"lines": [{"sku": "COCA-500", "qty": qty, "unit_price": 1.5}]},
+    )
+
+
+def _status(headers: dict, shop_id: int, handle: str) -> dict:
+    r = client.get(f"/shops/{shop_id}/receipts/queued/{handle}", headers=headers)
+    assert r.status_code == 200, r.text
+    return r.json()
+
+
+def _receipts(shop_id: int) -> int:
+    with SessionLocal() as db:
+        return db.scalar(select(func.count()).where(Receipt.shop_id == shop_id))
+
+
+def test_queued_receipt_is_committed_by_the_worker(queue) -> None:
+    headers, shop_id = _shop()
+    r = _post(headers, shop_id)
+    assert r.status_code == 202, r.text
+    handle = r.json()["handle"]
+    assert r.headers["location"] == f"/shops/{shop_id}/receipts/queued/{handle}"
+    assert _status(headers, shop_id, handle)["status"] == "pending"
+    assert _receipts(shop_id) == 0
+
+    assert queue.drain() == 1
+    out = _status(headers, shop_id, handle)
+    assert out["status"] == "created"
+    assert out["receipt"]["total"] == 3.0
+    assert _receipts(shop_id) == 1
+    # Empty queue: the file starts over
+    assert queue.path.stat().st_size == 0
+
+    other_headers, other_id = _shop()
+    r = client.get(f"/shops/{other_id}/receipts/queued/{handle}", headers=other_headers)
+    assert r.status_code == 404
+
+
+def test_invalid_receipt_is_rejected_before_queueing(queue) -> None:
+    headers, shop_id = _shop()
+    r = _post(headers, shop_id, qty=0)
+    assert r.status_code == 400
+    assert queue.stats()["pending"] == 0
+
+
+def test_without_prefer_the_receipt_is_written_directly(queue) -> None:
+    headers, shop_id = _shop()
+    r = client.post(
+        f"/shops/{shop_id}/receipts",
+        headers=headers,
+        json={"lines": [{"sku": "COCA-500", "qty": 1, "unit_price": 1.5}]},
+    )
+    assert r.status_code == 201
+    assert queue.stats()["pending"] == 0
+
+
+def test_idempotency_keys_hold_across_the_queue(queue) -> None:
+    headers, shop_id = _shop()
+    key = {"Idempotency-Key": "wb-1"}
+    first = _post(headers, shop_id, **key)
+    assert first.status_code == 202
+
+    # Still queued: same handle, or a conflict for another payload
+    assert _post(headers, shop_id, **key).json()["handle"] == first.json()["handle"]
+    assert _post(headers, shop_id, qty=3, **key).status_code == 409
+
+    queue.drain()
+    receipt = _status(headers, shop_id, first.json()["handle"])["receipt"]
+
+    # Committed: replayed like any other key, queued or not
+    r = _post(headers, shop_id, **key)
+    assert r.status_code == 201
+    assert r.json() == receipt
+    r = client.post(
+        f"/shops/{shop_id}/receipts",
+        headers={**headers, **key},
+        json={"lines": [{"sku": "COCA-500", "qty": 2, "unit_price": 1.5}]},
+    )
+    assert r.json() == receipt
+    assert _post(headers, shop_id, qty=3, **key).status_code == 409
+    assert _receipts(shop_id) == 1
+
+
+def test_many_receipts_are_committed_in_one_batch(queue) -> None:
+    headers, shop_id = _shop()
+    handles = [_post(headers, shop_id).json()["handle"] for _ in range(20)]
+
+    assert queue.drain() == 20
+    assert queue.stats()["batches"] == 1
+    assert {_status(headers, shop_id, h)["status"] for h in handles} == {"created"}
+    assert _receipts(shop_id) == 20
+
+
+def test_queue_is_recovered_after_a_crash(queue, monkeypatch) -> None:
+    headers, shop_id = _shop()
+    handles = [_post(headers, shop_id).json()["handle"] for _ in range(3)]
+    queue._materialize(list(queue._pending.values())[:2])
+    # Crash after the commit, before the checkpoint; the last write is torn
+    with open(queue.path, "ab") as f:
+        f.write(b'{"handle":"torn')
+    queue.close()
+
+    recovered = write_behind.WriteBehindQueue(queue.path, SessionLocal, fsync=False)
+    recovered.open()
+    monkeypatch.setattr(write_behind, "queue", recovered)
+    try:
+        assert recovered.stats()["pending"] == 1
+        assert recovered.drain() == 1
+    finally:
+        recovered.close()
+    statuses = [_status(headers, shop_id, h)["status"] for h in handles]
+    assert statuses == ["created"] * 3
+    assert _receipts(shop_id) == 3
+
+
+def test_receipts_whose_pending_row_did_not_commit_are_dropped(
+    queue, monkeypatch
+) -> None:
+    headers, shop_id = _shop()
+    handle = _post(headers, shop_id).json()["handle"]
+
+    with SessionLocal() as db:
+
+        def _commit():
+            raise OperationalError("COMMIT", {}, Exception("connection lost"))
+
+        monkeypatch.setattr(db, "commit", _commit)
+        with pytest.raises(OperationalError):
+            queue.enqueue(db, shop_id, [ImportedLine("COCA-500", 5, 1.5)])
+    assert queue.stats()["pending"] == 1
+    queue.close()
+
+    # Its line is still in the file: a restart must not commit it either
+    restarted = write_behind.WriteBehindQueue(queue.path, SessionLocal, fsync=False)
+    restarted.open()
+    monkeypatch.setattr(write_behind, "queue", restarted)
+    try:
+        assert restarted.stats()["pending"] == 1
+        assert restarted.stats()["dropped"] == 1
+        assert restarted.drain() == 1
+    finally:
+        restarted.close()
+    assert _status(headers, shop_id, handle)["status"] == "created"
+    assert _receipts(shop_id) == 1
+
+
+def test_each_process_locks_its_own_queue_file(queue) -> None:
+    other = write_behind.WriteBehindQueue(queue.path, SessionLocal, slots=2)
+    other.open()
+    try:
+        assert other.path == queue.path.with_name("queue.1.wal")
+        with pytest.raises(RuntimeError):
+            write_behind.WriteBehindQueue(queue.path, SessionLocal, slots=2).open()
+    finally:
+        other.close()
+
+
+def test_queued_state_is_shared_between_processes(queue, monkeypatch) -> None:
+    headers, shop_id = _shop()
+    key = {"Idempotency-Key": "wb-shared"}
+    handle = _post(headers, shop_id, **key).json()["handle"]
+
+    # Another worker: its own queue file, nothing of this receipt in memory
+    other = write_behind.WriteBehindQueue(queue.path, SessionLocal, fsync=False)
+    other.open()
+    monkeypatch.setattr(write_behind, "queue", other)
+    try:
+        assert _status(headers, shop_id, handle)["status"] == "pending"
+        assert _post(headers, shop_id, **key).json()["handle"] == handle
+        assert _post(headers, shop_id, qty=3, **key).status_code == 409
+        assert other.stats()["pending"] == 0
+
+        assert queue.drain() == 1
+        assert _status(headers, shop_id, handle)["status"] == "created"
+    finally:
+        other.close()
+    assert _receipts(shop_id) == 1
+
+
+def test_files_of_stopped_processes_are_adopted(queue, monkeypatch) -> None:
+    headers, shop_id = _shop()
+    stopped = write_behind.WriteBehindQueue(queue.path, SessionLocal, fsync=False)
+    stopped.open()
+    monkeypatch.setattr(write_behind, "queue", stopped)
+    handle = _post(headers, shop_id).json()["handle"]
+    stopped.close()
+
+    assert queue.adopt_orphans() == 1
+    assert _status(headers, shop_id, handle)["status"] == "created"
+    assert _receipts(shop_id) == 1
+
+
+def _fail_once(monkeypatch, exc: Exception) -> None:
+    real = ingest.ingest_receipts
+    calls = []
+
+    def _ingest(*args, **kwargs):
+        calls.append(1)
+        if len(calls) == 1:
+            raise exc
+        return real(*args, **kwargs)
+
+    monkeypatch.setattr(ingest, "ingest_receipts", _ingest)
+
+
+def test_transient_errors_keep_the_receipt_queued(queue, monkeypatch) -> None:
+    headers, shop_id = _shop()
+    handle = _post(headers, shop_id).json()["handle"]
+    offset = queue.checkpoint_path.read_text()
+    _fail_once(
+        monkeypatch,
+        OperationalError("INSERT", {}, Exception("database is locked")),
+    )
+
+    assert queue.drain() == 0
+    assert queue.stalled
+    assert queue.checkpoint_path.read_text() == offset
+    assert _status(headers, shop_id, handle)["status"] == "pending"
+
+    # The retry commits it
+    assert queue.drain() == 1
+    assert _status(headers, shop_id, handle)["status"] == "created"
+    assert _receipts(shop_id) == 1
+
+
+def test_permanent_errors_are_recorded_as_failed(queue, monkeypatch) -> None:
+    headers, shop_id = _shop()
+    handle = _post(headers, shop_id).json()["handle"]
+
+    def _ingest(*args, **kwargs):
+        raise IntegrityError("INSERT", {}, Exception("constraint failed"))
+
+    monkeypatch.setattr(ingest, "ingest_receipts", _ingest)
+
+    assert queue.drain() == 1
+    assert _status(headers, shop_id, handle)["status"] == "failed"
+    assert _receipts(shop_id) == 0
+
+
+def test_old_outcomes_are_purged_in_batches(queue) -> None:
+    headers, shop_id = _shop()
+    done = [_post(headers, shop_id).json()["handle"] for _ in range(3)]
+    queue.drain()
+    pending = _post(headers, shop_id).json()["handle"]
+
+    later = ingest.utcnow() + timedelta(hours=write_behind.WRITE_BEHIND_RETENTION_HOURS)
+    assert write_behind.purge_materialized(SessionLocal, now=ingest.utcnow()) == 0
+    assert write_behind.purge_materialized(SessionLocal, batch_size=2, now=later) >= 3
+
+    with SessionLocal() as db:
+        left = db.scalars(
+            select(QueuedReceipt.handle).where(
+                QueuedReceipt.handle.in_([*done, pending])
+            )
+        ).all()
+    assert left == [pending]
+    r = client.get(f"/shops/{shop_id}/receipts/queued/{done[0]}", headers=headers)
+    assert r.status_code == 404
+    assert _receipts(shop_id) == 3